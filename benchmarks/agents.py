@@ -0,0 +1,299 @@
+"""Small agents used by the benchmarks.
+
+Models are small MLPs so that the overhead of agents, not the cost of
+models, dominates when they run on CPU.
+"""
+import collections
+
+import gym
+import numpy as np
+import torch
+from torch import distributions
+from torch import nn
+
+import pfrl
+from pfrl import explorers
+from pfrl import replay_buffers
+from pfrl.agents import iqn
+from pfrl.nn.lmbda import Lambda
+from pfrl.policies import DeterministicHead
+from pfrl.policies import SoftmaxCategoricalHead
+from pfrl.q_functions import DiscreteActionValueHead
+
+HIDDEN_SIZE = 64
+
+AgentSpec = collections.namedtuple(
+    "AgentSpec", ["make_agent", "discrete", "update_methods"]
+)
+
+
+def _mlp(in_size, out_size, activation=nn.ReLU):
+    return nn.Sequential(
+        nn.Linear(in_size, HIDDEN_SIZE),
+        activation(),
+        nn.Linear(HIDDEN_SIZE, HIDDEN_SIZE),
+        activation(),
+        nn.Linear(HIDDEN_SIZE, out_size),
+    )
+
+
+def _dqn_kwargs(env, args):
+    return dict(
+        replay_buffer=replay_buffers.ReplayBuffer(
+            10**6, columnar=args.columnar_replay
+        ),
+        gamma=0.99,
+        explorer=explorers.ConstantEpsilonGreedy(0.1, env.action_space.sample),
+        replay_start_size=args.replay_start_size,
+        minibatch_size=args.minibatch_size,
+        update_interval=args.update_interval,
+        target_update_interval=1000,
+    )
+
+
+def make_dqn(env, args):
+    obs_size = env.observation_space.low.size
+    q_func = nn.Sequential(
+        _mlp(obs_size, env.action_space.n), DiscreteActionValueHead()
+    )
+    opt = torch.optim.Adam(q_func.parameters(), lr=1e-3)
+    return pfrl.agents.DQN(q_func, opt, **_dqn_kwargs(env, args))
+
+
+def make_iqn(env, args):
+    obs_size = env.observation_space.low.size
+    q_func = iqn.ImplicitQuantileQFunction(
+        psi=nn.Sequential(nn.Linear(obs_size, HIDDEN_SIZE), nn.ReLU()),
+        phi=nn.Sequential(iqn.CosineBasisLinear(64, HIDDEN_SIZE), nn.ReLU()),
+        f=nn.Linear(HIDDEN_SIZE, env.action_space.n),
+    )
+    opt = torch.optim.Adam(q_func.parameters(), lr=1e-3)
+    return iqn.IQN(q_func, opt, **_dqn_kwargs(env, args))
+
+
+def make_categorical_dqn(env, args):
+    q_func = pfrl.q_functions.DistributionalFCStateQFunctionWithDiscreteAction(
+        env.observation_space.low.size,
+        env.action_space.n,
+        n_atoms=51,
+        v_min=-1,
+        v_max=1,
+        n_hidden_channels=HIDDEN_SIZE,
+        n_hidden_layers=2,
+    )
+    opt = torch.optim.Adam(q_func.parameters(), lr=1e-3)
+    return pfrl.agents.CategoricalDQN(q_func, opt, **_dqn_kwargs(env, args))
+
+
+def _make_actor_critic(env):
+    obs_size = env.observation_space.low.size
+    return pfrl.nn.Branched(
+        nn.Sequential(
+            _mlp(obs_size, env.action_space.n, activation=nn.Tanh),
+            SoftmaxCategoricalHead(),
+        ),
+        _mlp(obs_size, 1, activation=nn.Tanh),
+    )
+
+
+def make_ppo(env, args):
+    model = _make_actor_critic(env)
+    opt = torch.optim.Adam(model.parameters(), lr=3e-4)
+    return pfrl.agents.PPO(
+        model,
+        opt,
+        update_interval=args.on_policy_update_interval,
+        minibatch_size=args.minibatch_size,
+        epochs=4,
+    )
+
+
+def make_a2c(env, args):
+    model = _make_actor_critic(env)
+    opt = torch.optim.Adam(model.parameters(), lr=3e-4)
+    return pfrl.agents.A2C(
+        model, opt, gamma=0.99, num_processes=env.num_envs, update_steps=5
+    )
+
+
+def make_trpo(env, args):
+    obs_size = env.observation_space.low.size
+    policy = nn.Sequential(
+        _mlp(obs_size, env.action_space.n, activation=nn.Tanh),
+        SoftmaxCategoricalHead(),
+    )
+    vf = _mlp(obs_size, 1, activation=nn.Tanh)
+    vf_opt = torch.optim.Adam(vf.parameters(), lr=1e-3)
+    return pfrl.agents.TRPO(
+        policy=policy,
+        vf=vf,
+        vf_optimizer=vf_opt,
+        update_interval=args.on_policy_update_interval,
+        vf_batch_size=args.minibatch_size,
+    )
+
+
+def _make_q_funcs_and_optimizers(obs_size, action_size):
+    q_funcs = []
+    for _ in range(2):
+        q_func = nn.Sequential(
+            pfrl.nn.ConcatObsAndAction(), _mlp(obs_size + action_size, 1)
+        )
+        q_funcs.append((q_func, torch.optim.Adam(q_func.parameters(), lr=1e-3)))
+    return q_funcs
+
+
+def make_sac(env, args):
+    obs_size = env.observation_space.low.size
+    action_size = env.action_space.low.size
+
+    def squashed_diagonal_gaussian_head(x):
+        mean, log_scale = torch.chunk(x, 2, dim=-1)
+        log_scale = torch.clamp(log_scale, -20.0, 2.0)
+        base_distribution = distributions.Independent(
+            distributions.Normal(loc=mean, scale=torch.exp(log_scale)), 1
+        )
+        return distributions.transformed_distribution.TransformedDistribution(
+            base_distribution,
+            [distributions.transforms.TanhTransform(cache_size=1)],
+        )
+
+    policy = nn.Sequential(
+        _mlp(obs_size, action_size * 2), Lambda(squashed_diagonal_gaussian_head)
+    )
+    policy_opt = torch.optim.Adam(policy.parameters(), lr=3e-4)
+    (q_func1, q_func1_opt), (q_func2, q_func2_opt) = _make_q_funcs_and_optimizers(
+        obs_size, action_size
+    )
+    return pfrl.agents.SoftActorCritic(
+        policy,
+        q_func1,
+        q_func2,
+        policy_opt,
+        q_func1_opt,
+        q_func2_opt,
+        replay_buffers.ReplayBuffer(10**6, columnar=args.columnar_replay),
+        gamma=0.99,
+        replay_start_size=args.replay_start_size,
+        minibatch_size=args.minibatch_size,
+        update_interval=args.update_interval,
+        entropy_target=-action_size,
+        temperature_optimizer_lr=3e-4,
+    )
+
+
+def make_td3(env, args):
+    obs_size = env.observation_space.low.size
+    action_size = env.action_space.low.size
+    policy = nn.Sequential(_mlp(obs_size, action_size), nn.Tanh(), DeterministicHead())
+    policy_opt = torch.optim.Adam(policy.parameters(), lr=3e-4)
+    (q_func1, q_func1_opt), (q_func2, q_func2_opt) = _make_q_funcs_and_optimizers(
+        obs_size, action_size
+    )
+    return pfrl.agents.TD3(
+        policy,
+        q_func1,
+        q_func2,
+        policy_opt,
+        q_func1_opt,
+        q_func2_opt,
+        replay_buffers.ReplayBuffer(10**6, columnar=args.columnar_replay),
+        gamma=0.99,
+        explorer=explorers.AdditiveGaussian(
+            scale=0.1, low=env.action_space.low, high=env.action_space.high
+        ),
+        replay_start_size=args.replay_start_size,
+        minibatch_size=args.minibatch_size,
+        update_interval=args.update_interval,
+    )
+
+
+AGENT_SPECS = collections.OrderedDict(
+    [
+        ("dqn", AgentSpec(make_dqn, True, ["replay_updater.update_func"])),
+        ("iqn", AgentSpec(make_iqn, True, ["replay_updater.update_func"])),
+        (
+            "categorical_dqn",
+            AgentSpec(make_categorical_dqn, True, ["replay_updater.update_func"]),
+        ),
+        ("ppo", AgentSpec(make_ppo, True, ["_update"])),
+        ("a2c", AgentSpec(make_a2c, True, ["update"])),
+        ("trpo", AgentSpec(make_trpo, True, ["_update"])),
+        ("sac", AgentSpec(make_sac, False, ["replay_updater.update_func"])),
+        ("td3", AgentSpec(make_td3, False, ["replay_updater.update_func"])),
+    ]
+)
+
+
+class PointGoalEnv(object):
+    """Synthetic goal-conditioned env that is cheap to step.
+
+    A point mass in 3D is accelerated by actions towards a goal on the plane.
+    Observations are positions and velocities, which is the layout HIRO
+    expects, i.e. subgoals are relative positions in the first dimensions.
+    """
+
+    state_dim = 6
+    action_dim = 3
+    goal_dim = 2
+    subgoal_dim = 3
+
+    def __init__(self, seed=0):
+        self.np_random = np.random.RandomState(seed)
+        self.action_space = gym.spaces.Box(
+            low=-1.0, high=1.0, shape=(self.action_dim,), dtype=np.float32
+        )
+        self.subgoal_space = gym.spaces.Box(
+            low=-10.0, high=10.0, shape=(self.subgoal_dim,), dtype=np.float32
+        )
+        self.action_space.seed(seed)
+        self.subgoal_space.seed(seed)
+
+    def _observe(self):
+        return dict(
+            observation=np.concatenate([self.pos, self.vel]).astype(np.float32),
+            desired_goal=self.goal,
+        )
+
+    def reset(self):
+        self.pos = np.zeros(3, dtype=np.float32)
+        self.vel = np.zeros(3, dtype=np.float32)
+        self.goal = self.np_random.uniform(-10, 10, size=2).astype(np.float32)
+        return self._observe()
+
+    def step(self, action):
+        self.vel = 0.9 * self.vel + 0.1 * np.clip(action, -1, 1)
+        self.pos = self.pos + self.vel
+        reward = -float(np.linalg.norm(self.pos[:2] - self.goal))
+        return self._observe(), reward, False, {}
+
+
+def make_hiro(env, args):
+    from pfrl.agents.hrl.hiro_agent import HIROAgent
+
+    agent = HIROAgent(
+        state_dim=env.state_dim,
+        action_dim=env.action_dim,
+        goal_dim=env.goal_dim,
+        subgoal_dim=env.subgoal_dim,
+        high_level_burnin_action_func=env.subgoal_space.sample,
+        low_level_burnin_action_func=env.action_space.sample,
+        scale_low=env.action_space.high,
+        scale_high=env.subgoal_space.high,
+        buffer_size=10**6,
+        subgoal_freq=10,
+        train_freq=10,
+        reward_scaling=0.1,
+        gpu=None,
+        add_entropy_layer=None,
+        goal_threshold=1.0,
+        soft_subgoal_update=1.0,
+        start_training_steps=args.replay_start_size,
+        columnar_replay_buffer=args.columnar_replay,
+    )
+    # Controllers do not take these as arguments
+    agent.low_con.agent.replay_updater.replay_start_size = args.replay_start_size
+    agent.high_con.agent.replay_updater.replay_start_size = max(
+        args.replay_start_size // agent.train_freq, agent.high_con.minibatch_size
+    )
+    return agent
@@ -0,0 +1,262 @@
+"""Measure the throughput of agents on CPU.
+
+Each agent is trained on `pfrl.envs.vector_abc.VectorABC`, whose simulation
+cost is negligible, or on a synthetic goal-conditioned env for HIRO, so that
+the measured time is dominated by agents. After warm-up steps, which fill
+replay buffers and are not measured, the following are reported as JSON:
+
+- steps_per_sec: env steps per second of wall time
+- updates_per_sec: calls of the update methods of agents per second
+- phases: total and mean wall time and number of calls of each phase, i.e.
+  batch_act, env_step, batch_observe, update, replay_sample, collate,
+  batch_states and optimizer_step. Times are inclusive, e.g. update includes
+  optimizer_step.
+
+Example:
+    python benchmarks/benchmark_agents.py --agents dqn ppo --output base.json
+    python benchmarks/compare.py base.json new.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+
+import pfrl
+from pfrl.agents.hrl import hrl_controllers
+from pfrl.experiments import PhaseTimer
+from pfrl.envs.vector_abc import VectorABC
+
+from agents import AGENT_SPECS
+from agents import make_hiro
+from agents import PointGoalEnv
+from instrument import agent_phases
+from instrument import instrument_agent
+from instrument import patch_phase
+from instrument import summary_since
+
+AGENT_NAMES = list(AGENT_SPECS) + ["hiro"]
+
+
+def run_batch_agent(agent, env, steps, timer):
+    obss = env.reset()
+    resets = np.zeros(env.num_envs, dtype=bool)
+    t = 0
+    while t < steps:
+        with timer.phase("batch_act"):
+            actions = agent.batch_act(obss)
+        with timer.phase("env_step"):
+            obss, rewards, dones, infos = env.step(actions)
+        with timer.phase("batch_observe"):
+            agent.batch_observe(obss, rewards, dones, resets)
+        with timer.phase("env_step"):
+            obss = env.reset(mask=np.logical_not(dones))
+        t += env.num_envs
+    return t
+
+
+def run_hiro_agent(agent, env, steps, timer, max_episode_len=500):
+    # Same as the loop of pfrl.experiments.train_hrl_agent
+    agent.end_episode()
+    obs_dict = env.reset()
+    fg = obs_dict["desired_goal"]
+    obs = obs_dict["observation"]
+    sg = env.subgoal_space.sample()
+    step = 0
+    for t in range(agent.low_con.agent.t, agent.low_con.agent.t + steps):
+        with timer.phase("act"):
+            action = agent.act_low_level(obs, sg)
+        with timer.phase("env_step"):
+            obs_dict, r, done, info = env.step(action)
+        obs = obs_dict["observation"]
+        with timer.phase("act"):
+            n_sg = agent.act_high_level(obs, fg, sg, step, t)
+        reset = step + 1 == max_episode_len
+        with timer.phase("observe"):
+            agent.observe(obs, fg, n_sg, r, done, reset, step, t)
+        sg = n_sg
+        step += 1
+        if done or reset:
+            agent.end_episode()
+            step = 0
+            obs_dict = env.reset()
+            fg = obs_dict["desired_goal"]
+            obs = obs_dict["observation"]
+            sg = agent.sample_subgoal(obs, fg)
+    return steps
+
+
+def benchmark(name, args):
+    pfrl.utils.set_random_seed(args.seed)
+    with contextlib.ExitStack() as stack:
+        if name == "hiro":
+            timer = PhaseTimer(
+                phases=["act", "env_step", "observe", "collate"]
+                + agent_phases("low_level/")
+                + agent_phases("high_level/")
+                + ["high_level/off_policy_corrections"]
+            )
+            env = PointGoalEnv(seed=args.seed)
+            agent = make_hiro(env, args)
+            instrument_agent(
+                stack,
+                timer,
+                agent.low_con.agent,
+                ["replay_updater.update_func"],
+                prefix="low_level/",
+            )
+            instrument_agent(
+                stack,
+                timer,
+                agent.high_con.agent,
+                ["high_level_update_batch"],
+                prefix="high_level/",
+            )
+            patch_phase(
+                stack,
+                timer,
+                hrl_controllers,
+                "high_level_batch_experiences_with_goal",
+                "collate",
+            )
+            patch_phase(
+                stack,
+                timer,
+                agent.high_con,
+                "_off_policy_corrections",
+                "high_level/off_policy_corrections",
+            )
+            update_phases = ["low_level/update", "high_level/update"]
+
+            def run(steps):
+                return run_hiro_agent(agent, env, steps, timer)
+
+        else:
+            timer = PhaseTimer(
+                phases=["batch_act", "env_step", "batch_observe", "collate"]
+                + agent_phases()
+            )
+            spec = AGENT_SPECS[name]
+            env = VectorABC(
+                args.num_envs,
+                size=args.abc_size,
+                discrete=spec.discrete,
+                episodic=True,
+                seed=args.seed,
+            )
+            agent = spec.make_agent(env, args)
+            instrument_agent(stack, timer, agent, spec.update_methods)
+            update_phases = ["update"]
+
+            def run(steps):
+                return run_batch_agent(agent, env, steps, timer)
+
+        run(args.warmup_steps)
+        warmup_summary = timer.summary()
+        start = time.perf_counter()
+        steps = run(args.steps)
+        wall_time = time.perf_counter() - start
+
+    phases = summary_since(timer, warmup_summary)
+    updates = sum(phases[phase]["count"] for phase in update_phases if phase in phases)
+    return dict(
+        agent=name,
+        num_envs=1 if name == "hiro" else args.num_envs,
+        steps=steps,
+        wall_time=wall_time,
+        steps_per_sec=steps / wall_time,
+        updates=updates,
+        updates_per_sec=updates / wall_time,
+        phases=phases,
+    )
+
+
+def get_git_revision():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--agents", type=str, nargs="+", default=AGENT_NAMES, choices=AGENT_NAMES
+    )
+    parser.add_argument("--steps", type=int, default=4000)
+    parser.add_argument("--warmup-steps", type=int, default=1000)
+    parser.add_argument("--num-envs", type=int, default=8)
+    parser.add_argument("--abc-size", type=int, default=5)
+    parser.add_argument("--minibatch-size", type=int, default=100)
+    parser.add_argument("--replay-start-size", type=int, default=1000)
+    parser.add_argument("--update-interval", type=int, default=1)
+    parser.add_argument("--on-policy-update-interval", type=int, default=1000)
+    parser.add_argument(
+        "--columnar-replay",
+        action="store_true",
+        help="Store transitions of replay buffers in NumPy arrays.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads used by torch. Fix it to compare results.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=str, default=None, help="Path to the JSON output."
+    )
+    args = parser.parse_args()
+    # Replay-based agents must be updated during measurement
+    assert args.warmup_steps >= args.replay_start_size >= args.minibatch_size
+
+    torch.set_num_threads(args.threads)
+    results = []
+    for name in args.agents:
+        result = benchmark(name, args)
+        print(
+            "{agent:>16} {steps_per_sec:>12.1f} steps/s"
+            " {updates_per_sec:>10.1f} updates/s".format(**result),
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    output = dict(
+        metadata=dict(
+            date=datetime.datetime.now().isoformat(),
+            git_revision=get_git_revision(),
+            python=platform.python_version(),
+            platform=platform.platform(),
+            processor=platform.processor(),
+            numpy=np.__version__,
+            torch=torch.__version__,
+            torch_threads=torch.get_num_threads(),
+            args=vars(args),
+        ),
+        results=results,
+    )
+    if args.output is None:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare two results of benchmark_agents.py to find throughput regressions.
+
+The exit status is 1 if steps_per_sec or updates_per_sec of any agent
+dropped by more than the threshold, so it can be used in CI.
+
+Example:
+    python benchmarks/compare.py base.json new.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("steps_per_sec", "updates_per_sec")
+
+
+def load_results(filename):
+    with open(filename) as f:
+        data = json.load(f)
+    return data["metadata"], {result["agent"]: result for result in data["results"]}
+
+
+def compare(base, new, threshold):
+    """Compare results of agents.
+
+    Args:
+        base (dict): Results of the baseline indexed by agent names.
+        new (dict): Results to compare indexed by agent names.
+        threshold (float): Relative drop regarded as a regression.
+
+    Returns:
+        list: Tuples of (agent, metric, base value, new value, relative
+            change, whether it is a regression).
+    """
+    rows = []
+    for agent in base:
+        if agent not in new:
+            continue
+        for metric in METRICS:
+            base_value = base[agent][metric]
+            new_value = new[agent][metric]
+            if base_value == 0:
+                continue
+            change = new_value / base_value - 1
+            rows.append(
+                (agent, metric, base_value, new_value, change, change < -threshold)
+            )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base", type=str, help="JSON of the baseline.")
+    parser.add_argument("new", type=str, help="JSON to compare.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative drop of throughput regarded as a regression.",
+    )
+    args = parser.parse_args()
+
+    base_metadata, base = load_results(args.base)
+    new_metadata, new = load_results(args.new)
+    for key in ("processor", "torch", "torch_threads"):
+        if base_metadata.get(key) != new_metadata.get(key):
+            print(
+                "Warning: {} differs: {} vs {}".format(
+                    key, base_metadata.get(key), new_metadata.get(key)
+                )
+            )
+
+    rows = compare(base, new, args.threshold)
+    print(
+        "{:>16} {:>16} {:>12} {:>12} {:>8}".format(
+            "agent", "metric", "base", "new", "change"
+        )
+    )
+    for agent, metric, base_value, new_value, change, regression in rows:
+        print(
+            "{:>16} {:>16} {:>12.1f} {:>12.1f} {:>+7.1%}{}".format(
+                agent,
+                metric,
+                base_value,
+                new_value,
+                change,
+                " REGRESSION" if regression else "",
+            )
+        )
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Timing of the phases of agents, e.g. replay sampling and updates.
+
+Methods of agents and functions of their modules are temporarily replaced by
+wrappers that record into a `pfrl.experiments.PhaseTimer`, so that phases can
+be measured without modifying pfrl. Phases can be nested, e.g. `update`
+includes `collate` and `optimizer_step`, and their times are inclusive.
+"""
+import functools
+import sys
+from unittest import mock
+
+import torch
+
+# Module-level functions used by agents to collate sampled transitions
+COLLATE_FUNCTIONS = (
+    "batch_experiences",
+    "batch_recurrent_experiences",
+    "batch_experiences_with_goal",
+    "high_level_batch_experiences_with_goal",
+)
+
+
+def agent_phases(prefix=""):
+    """Return the names of the phases timed by `instrument_agent`."""
+    return [
+        prefix + name
+        for name in ("update", "batch_states", "replay_sample", "optimizer_step")
+    ]
+
+
+def patch_phase(stack, timer, obj, attr, name):
+    """Time calls of `obj.<attr>` as a phase until the stack is closed.
+
+    Functions already timed by the same timer are left as they are.
+
+    Args:
+        stack (contextlib.ExitStack): Stack the patch is entered into.
+        timer (pfrl.experiments.PhaseTimer): Timer with the phase.
+        obj (object): Object or module that has the function.
+        attr (str): Name of the function.
+        name (str): Name of the phase.
+    """
+    func = getattr(obj, attr)
+    if getattr(func, "phase_timer", None) is timer:
+        return
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with timer.phase(name):
+            return func(*args, **kwargs)
+
+    timed.phase_timer = timer
+    stack.enter_context(mock.patch.object(obj, attr, timed))
+
+
+def instrument_agent(stack, timer, agent, update_methods, prefix=""):
+    """Time replay sampling, collation, updates and optimizer steps of an agent.
+
+    Args:
+        stack (contextlib.ExitStack): Stack the patches are entered into.
+        timer (pfrl.experiments.PhaseTimer): Timer with the phases returned
+            by `agent_phases(prefix)` and "collate".
+        agent (pfrl.agent.Agent): Agent to instrument.
+        update_methods (Sequence of str): Names of the methods of the agent
+            that run a single update. Dotted names are resolved from the
+            agent, e.g. "replay_updater.update_func".
+        prefix (str): Prefix of the names of the phases.
+    """
+    for method in update_methods:
+        obj = agent
+        *path, attr = method.split(".")
+        for name in path:
+            obj = getattr(obj, name)
+        patch_phase(stack, timer, obj, attr, prefix + "update")
+    if hasattr(agent, "batch_states"):
+        patch_phase(stack, timer, agent, "batch_states", prefix + "batch_states")
+    replay_buffer = getattr(agent, "replay_buffer", None)
+    if replay_buffer is not None:
+        patch_phase(stack, timer, replay_buffer, "sample", prefix + "replay_sample")
+    for value in list(vars(agent).values()):
+        if isinstance(value, torch.optim.Optimizer):
+            patch_phase(stack, timer, value, "step", prefix + "optimizer_step")
+    for cls in type(agent).__mro__:
+        module = sys.modules.get(cls.__module__)
+        for name in COLLATE_FUNCTIONS:
+            if callable(getattr(module, name, None)):
+                patch_phase(stack, timer, module, name, "collate")
+
+
+def summary_since(timer, last_summary):
+    """Return the phases entered since `last_summary` was taken.
+
+    Args:
+        timer (pfrl.experiments.PhaseTimer): Timer.
+        last_summary (dict): Earlier return value of `timer.summary()`.
+    Returns:
+        dict: Dict that maps the name of each phase to a dict with "total"
+            in seconds, "count" and "mean" in seconds.
+    """
+    phases = {}
+    for name, stats in timer.summary().items():
+        total = stats["total"] - last_summary[name]["total"]
+        count = stats["count"] - last_summary[name]["count"]
+        if count > 0:
+            phases[name] = dict(total=total, count=count, mean=total / count)
+    return phases
@@ -137,6 +137,13 @@ def parse_rl_args():
     )
 
     parser.add_argument("--num-envs", type=int, default=1, help="Number of envs run in parallel.")
+    parser.add_argument(
+        "--statistics-interval",
+        type=int,
+        default=None,
+        help="Interval in updates of computing diagnostics such as KL divergences of policy updates. "
+             "They are not computed by default.",
+    )
     args = parser.parse_args()
     return args
 
@@ -228,7 +235,8 @@ def main():
                       temperature_high=args.temperature_high,
                       temperature_low=args.temperature_low,
                       optimize_high_temp=args.optimize_high_temp,
-                      optimize_low_temp=args.optimize_low_temp)
+                      optimize_low_temp=args.optimize_low_temp,
+                      statistics_interval=args.statistics_interval)
 
     if args.load:
         # load weights from a file if arg supplied
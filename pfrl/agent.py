@@ -222,7 +222,14 @@ class AsyncAgent(Agent, metaclass=ABCMeta):
 
 
 class BatchAgent(Agent, metaclass=ABCMeta):
-    """Abstract agent class that can interact with a batch of envs."""
+    """Abstract agent class that can interact with a batch of envs.
+
+    Agents that support envs stepped asynchronously, e.g. by
+    `pfrl.env.VectorEnv.step_async`, also accept `env_ids` in `batch_act` and
+    `batch_observe`, i.e. indices of the envs that a batch comes from, so
+    that per-env states such as last observations, N-step transitions and
+    recurrent states are kept for each env.
+    """
 
     def act(self, obs: Any) -> Any:
         return self.batch_act([obs])[0]
@@ -19,4 +19,5 @@ from pfrl.agents.goal_conditioned_td3 import GoalConditionedTD3 # NOQA
 from pfrl.agents.hiro_high_level_goal_conditioned_td3 import HIROHighLevelGoalConditionedTD3 # NOQA
 from pfrl.agents.trpo import TRPO  # NOQA
 from pfrl.agents.hrl.hiro_agent import HIROAgent # NOQA
+from pfrl.agents.hrl.hiro_actor import HIROActor  # NOQA
 from pfrl.agents.state_q_function_actor import StateQFunctionActor  # NOQA
\ No newline at end of file
@@ -10,6 +10,8 @@ import numpy as np
 from pfrl.agent import AttributeSavingMixin
 from pfrl.agent import BatchAgent
 from pfrl.utils.batch_states import batch_states
+from pfrl.utils.env_ids import batch_env_ids
+from pfrl.utils.env_ids import update_at_env_ids
 from pfrl.utils.contexts import evaluating
 from pfrl.utils.copy_param import synchronize_parameters
 from pfrl.replay_buffer import batch_experiences
@@ -125,6 +127,8 @@ class DDPG(AttributeSavingMixin, BatchAgent):
         self.t = 0
         self.last_state = None
         self.last_action = None
+        self.batch_last_obs = []
+        self.batch_last_action = []
         self.target_model = copy.deepcopy(self.model)
         self.target_model.eval()
         self.q_record = collections.deque(maxlen=1000)
@@ -247,15 +251,19 @@ class DDPG(AttributeSavingMixin, BatchAgent):
                 actor_loss += self.compute_actor_loss(batch)
             self.actor_optimizer.update(lambda: actor_loss / max_epi_len)
 
-    def batch_act(self, batch_obs):
+    def batch_act(self, batch_obs, env_ids=None):
         if self.training:
-            return self._batch_act_train(batch_obs)
+            return self._batch_act_train(batch_obs, env_ids)
         else:
             return self._batch_act_eval(batch_obs)
 
-    def batch_observe(self, batch_obs, batch_reward, batch_done, batch_reset):
+    def batch_observe(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
         if self.training:
-            self._batch_observe_train(batch_obs, batch_reward, batch_done, batch_reset)
+            self._batch_observe_train(
+                batch_obs, batch_reward, batch_done, batch_reset, env_ids
+            )
 
     def _batch_select_greedy_actions(self, batch_obs):
         with torch.no_grad(), evaluating(self.policy):
@@ -267,7 +275,7 @@ class DDPG(AttributeSavingMixin, BatchAgent):
         assert not self.training
         return self._batch_select_greedy_actions(batch_obs)
 
-    def _batch_act_train(self, batch_obs):
+    def _batch_act_train(self, batch_obs, env_ids=None):
         assert self.training
         if self.burnin_action_func is not None and self.n_updates == 0:
             batch_action = [self.burnin_action_func() for _ in range(len(batch_obs))]
@@ -278,34 +286,38 @@ class DDPG(AttributeSavingMixin, BatchAgent):
                 for i in range(len(batch_greedy_action))
             ]
 
-        self.batch_last_obs = list(batch_obs)
-        self.batch_last_action = list(batch_action)
+        self.batch_last_obs = update_at_env_ids(self.batch_last_obs, env_ids, batch_obs)
+        self.batch_last_action = update_at_env_ids(
+            self.batch_last_action, env_ids, batch_action
+        )
 
         return batch_action
 
-    def _batch_observe_train(self, batch_obs, batch_reward, batch_done, batch_reset):
+    def _batch_observe_train(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
         assert self.training
-        for i in range(len(batch_obs)):
+        for i, env_id in enumerate(batch_env_ids(env_ids, len(batch_obs))):
             self.t += 1
             # Update the target network
             if self.t % self.target_update_interval == 0:
                 self.sync_target_network()
-            if self.batch_last_obs[i] is not None:
-                assert self.batch_last_action[i] is not None
+            if self.batch_last_obs[env_id] is not None:
+                assert self.batch_last_action[env_id] is not None
                 # Add a transition to the replay buffer
                 self.replay_buffer.append(
-                    state=self.batch_last_obs[i],
-                    action=self.batch_last_action[i],
+                    state=self.batch_last_obs[env_id],
+                    action=self.batch_last_action[env_id],
                     reward=batch_reward[i],
                     next_state=batch_obs[i],
                     next_action=None,
                     is_state_terminal=batch_done[i],
-                    env_id=i,
+                    env_id=env_id,
                 )
                 if batch_reset[i] or batch_done[i]:
-                    self.batch_last_obs[i] = None
-                    self.batch_last_action[i] = None
-                    self.replay_buffer.stop_current_episode(env_id=i)
+                    self.batch_last_obs[env_id] = None
+                    self.batch_last_action[env_id] = None
+                    self.replay_buffer.stop_current_episode(env_id=env_id)
             self.replay_updater.update_if_necessary(self.t)
 
     def get_statistics(self):
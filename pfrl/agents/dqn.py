@@ -14,9 +14,12 @@ from pfrl import agent
 from pfrl.utils.batch_states import batch_states
 from pfrl.utils.contexts import evaluating
 from pfrl.utils.copy_param import synchronize_parameters
+from pfrl.utils.env_ids import batch_env_ids
+from pfrl.utils.env_ids import update_at_env_ids
 from pfrl.replay_buffer import batch_experiences
 from pfrl.replay_buffer import batch_recurrent_experiences
 from pfrl.replay_buffer import ReplayUpdater
+from pfrl.utils.recurrent import concatenate_recurrent_states
 from pfrl.utils.recurrent import get_recurrent_state_at
 from pfrl.utils.recurrent import mask_recurrent_state_at
 from pfrl.utils.recurrent import one_step_forward
@@ -105,6 +108,33 @@ def _batch_reset_recurrent_states_when_episodes_end(
         return recurrent_states
 
 
+def _gather_env_recurrent_states(env_recurrent_states, env_ids):
+    """Make a batched recurrent state from recurrent states of envs.
+
+    Args:
+        env_recurrent_states (list or None): Recurrent state of each env.
+            None means the initial recurrent state.
+        env_ids (Sequence of int): Indices of the envs.
+
+    Returns:
+        object: Batched recurrent state.
+    """
+    env_recurrent_states = env_recurrent_states or []
+    return concatenate_recurrent_states(
+        [
+            env_recurrent_states[i] if i < len(env_recurrent_states) else None
+            for i in env_ids
+        ]
+    )
+
+
+def _split_recurrent_states(recurrent_states, batch_size):
+    return [
+        get_recurrent_state_at(recurrent_states, i, detach=True)
+        for i in range(batch_size)
+    ]
+
+
 class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
     """Deep Q-Network algorithm.
 
@@ -136,6 +166,10 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
             manner.
         max_grad_norm (float or None): Maximum L2 norm of the gradient used for
             gradient clipping. If set to None, the gradient is not clipped.
+        prefetch_size (int): If set to a positive integer, up to this number of
+            minibatches are sampled and converted to tensors ahead on a
+            background thread so that it overlaps with updates. Only
+            supported when recurrent=False.
     """
 
     saved_attributes = ("model", "target_model", "optimizer")
@@ -163,6 +197,7 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
         batch_states=batch_states,
         recurrent=False,
         max_grad_norm=None,
+        prefetch_size=0,
     ):
         self.model = q_function
 
@@ -189,6 +224,7 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
         self.batch_states = batch_states
         self.recurrent = recurrent
         if self.recurrent:
+            assert prefetch_size == 0, "Recurrent DQN does not support prefetching"
             update_func = self.update_from_episodes
         else:
             update_func = self.update
@@ -201,6 +237,8 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
             n_times_update=n_times_update,
             replay_start_size=replay_start_size,
             update_interval=update_interval,
+            prefetch_size=prefetch_size,
+            collate_func=self._batch_experiences,
         )
         self.minibatch_size = minibatch_size
         self.episodic_update_len = episodic_update_len
@@ -217,6 +255,8 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
         self._cumulative_steps = 0
         self.last_state = None
         self.last_action = None
+        self.batch_last_obs = []
+        self.batch_last_action = []
         self.target_model = None
         self.sync_target_network()
 
@@ -228,6 +268,11 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
         self.train_recurrent_states = None
         self.train_prev_recurrent_states = None
         self.test_recurrent_states = None
+        # Recurrent states of each env, used when envs are stepped
+        # asynchronously and batches are specified by env_ids
+        self.train_env_recurrent_states = None
+        self.train_env_prev_recurrent_states = None
+        self.test_env_recurrent_states = None
 
         # Error checking
         if (
@@ -280,7 +325,23 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 tau=self.soft_update_tau,
             )
 
-    def update(self, experiences, errors_out=None):
+    def _batch_experiences(self, experiences):
+        exp_batch = batch_experiences(
+            experiences,
+            device=self.device,
+            phi=self.phi,
+            gamma=self.gamma,
+            batch_states=self.batch_states,
+        )
+        if "weight" in experiences[0][0]:
+            exp_batch["weights"] = torch.tensor(
+                [elem[0]["weight"] for elem in experiences],
+                device=self.device,
+                dtype=torch.float32,
+            )
+        return exp_batch
+
+    def update(self, experiences, errors_out=None, exp_batch=None):
         """Update the model from experiences
 
         Args:
@@ -295,29 +356,20 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                     used for importance sampling.
             errors_out (list or None): If set to a list, then TD-errors
                 computed from the given experiences are appended to the list.
+            exp_batch (dict or None): Batch already made from `experiences`,
+                e.g. by prefetching. If set to None, it is made here.
 
         Returns:
             None
         """
-        has_weight = "weight" in experiences[0][0]
-        exp_batch = batch_experiences(
-            experiences,
-            device=self.device,
-            phi=self.phi,
-            gamma=self.gamma,
-            batch_states=self.batch_states,
-        )
-        if has_weight:
-            exp_batch["weights"] = torch.tensor(
-                [elem[0]["weight"] for elem in experiences],
-                device=self.device,
-                dtype=torch.float32,
-            )
-            if errors_out is None:
-                errors_out = []
+        if exp_batch is None:
+            exp_batch = self._batch_experiences(experiences)
+        has_weight = "weights" in exp_batch
+        if has_weight and errors_out is None:
+            errors_out = []
         loss = self._compute_loss(exp_batch, errors_out=errors_out)
         if has_weight:
-            self.replay_buffer.update_errors(errors_out)
+            self.replay_updater.update_errors(errors_out)
 
         self.loss_record.append(float(loss.detach().cpu().numpy()))
 
@@ -425,8 +477,12 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 batch_accumulator=self.batch_accumulator,
             )
 
-    def _evaluate_model_and_update_recurrent_states(self, batch_obs):
+    def _evaluate_model_and_update_recurrent_states(self, batch_obs, env_ids=None):
         batch_xs = self.batch_states(batch_obs, self.device, self.phi)
+        if self.recurrent and env_ids is not None:
+            return self._evaluate_model_and_update_env_recurrent_states(
+                batch_xs, env_ids
+            )
         if self.recurrent:
             if self.training:
                 self.train_prev_recurrent_states = self.train_recurrent_states
@@ -441,9 +497,59 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
             batch_av = self.model(batch_xs)
         return batch_av
 
-    def batch_act(self, batch_obs):
+    def _evaluate_model_and_update_env_recurrent_states(self, batch_xs, env_ids):
+        batch_size = len(env_ids)
+        if self.training:
+            recurrent_states = _gather_env_recurrent_states(
+                self.train_env_recurrent_states, env_ids
+            )
+            batch_av, new_recurrent_states = one_step_forward(
+                self.model, batch_xs, recurrent_states
+            )
+            self.train_env_prev_recurrent_states = update_at_env_ids(
+                self.train_env_prev_recurrent_states,
+                env_ids,
+                _split_recurrent_states(recurrent_states, batch_size),
+            )
+            self.train_env_recurrent_states = update_at_env_ids(
+                self.train_env_recurrent_states,
+                env_ids,
+                _split_recurrent_states(new_recurrent_states, batch_size),
+            )
+        else:
+            recurrent_states = _gather_env_recurrent_states(
+                self.test_env_recurrent_states, env_ids
+            )
+            batch_av, new_recurrent_states = one_step_forward(
+                self.model, batch_xs, recurrent_states
+            )
+            self.test_env_recurrent_states = update_at_env_ids(
+                self.test_env_recurrent_states,
+                env_ids,
+                _split_recurrent_states(new_recurrent_states, batch_size),
+            )
+        return batch_av
+
+    def batch_act(self, batch_obs, env_ids=None):
+        """Select a batch of actions.
+
+        Args:
+            batch_obs (Sequence of ~object): Observations.
+            env_ids (Sequence of int): Indices of the envs the observations
+                come from. It must be specified when envs are stepped
+                asynchronously so that a batch contains only some of the
+                envs, e.g. by `pfrl.env.VectorEnv.step_async`. If omitted,
+                the batch contains all the envs in order.
+
+        Returns:
+            Sequence of ~object: Actions.
+        """
+        if env_ids is not None:
+            env_ids = batch_env_ids(env_ids, len(batch_obs))
         with torch.no_grad(), evaluating(self.model):
-            batch_av = self._evaluate_model_and_update_recurrent_states(batch_obs)
+            batch_av = self._evaluate_model_and_update_recurrent_states(
+                batch_obs, env_ids
+            )
             batch_argmax = batch_av.greedy_actions.cpu().numpy()
         if self.training:
             batch_action = [
@@ -452,50 +558,70 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 )
                 for i in range(len(batch_obs))
             ]
-            self.batch_last_obs = list(batch_obs)
-            self.batch_last_action = list(batch_action)
+            self.batch_last_obs = update_at_env_ids(
+                self.batch_last_obs, env_ids, batch_obs
+            )
+            self.batch_last_action = update_at_env_ids(
+                self.batch_last_action, env_ids, batch_action
+            )
         else:
             batch_action = batch_argmax
         return batch_action
 
-    def _batch_observe_train(self, batch_obs, batch_reward, batch_done, batch_reset):
+    def _batch_observe_train(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
 
-        for i in range(len(batch_obs)):
+        for i, env_id in enumerate(batch_env_ids(env_ids, len(batch_obs))):
             self.t += 1
             self._cumulative_steps += 1
             # Update the target network
             if self.t % self.target_update_interval == 0:
                 self.sync_target_network()
-            if self.batch_last_obs[i] is not None:
-                assert self.batch_last_action[i] is not None
+            if self.batch_last_obs[env_id] is not None:
+                assert self.batch_last_action[env_id] is not None
                 # Add a transition to the replay buffer
                 transition = {
-                    "state": self.batch_last_obs[i],
-                    "action": self.batch_last_action[i],
+                    "state": self.batch_last_obs[env_id],
+                    "action": self.batch_last_action[env_id],
                     "reward": batch_reward[i],
                     "next_state": batch_obs[i],
                     "next_action": None,
                     "is_state_terminal": batch_done[i],
                 }
                 if self.recurrent:
-                    transition["recurrent_state"] = recurrent_state_as_numpy(
-                        get_recurrent_state_at(
+                    if env_ids is None:
+                        prev_recurrent_state = get_recurrent_state_at(
                             self.train_prev_recurrent_states, i, detach=True
                         )
-                    )
-                    transition["next_recurrent_state"] = recurrent_state_as_numpy(
-                        get_recurrent_state_at(
+                        recurrent_state = get_recurrent_state_at(
                             self.train_recurrent_states, i, detach=True
                         )
+                    else:
+                        prev_recurrent_state = self.train_env_prev_recurrent_states[
+                            env_id
+                        ]
+                        recurrent_state = self.train_env_recurrent_states[env_id]
+                    transition["recurrent_state"] = recurrent_state_as_numpy(
+                        prev_recurrent_state
+                    )
+                    transition["next_recurrent_state"] = recurrent_state_as_numpy(
+                        recurrent_state
                     )
-                self.replay_buffer.append(env_id=i, **transition)
+                with self.replay_updater.lock:
+                    self.replay_buffer.append(env_id=env_id, **transition)
                 if batch_reset[i] or batch_done[i]:
-                    self.batch_last_obs[i] = None
-                    self.batch_last_action[i] = None
-                    self.replay_buffer.stop_current_episode(env_id=i)
+                    self.batch_last_obs[env_id] = None
+                    self.batch_last_action[env_id] = None
+                    if self.recurrent and env_ids is not None:
+                        # Reset recurrent states when episodes end
+                        self.train_env_recurrent_states[env_id] = None
+                        self.train_env_prev_recurrent_states[env_id] = None
+                    with self.replay_updater.lock:
+                        self.replay_buffer.stop_current_episode(env_id=env_id)
             self.replay_updater.update_if_necessary(self.t)
 
-        if self.recurrent:
+        if self.recurrent and env_ids is None:
             # Reset recurrent states when episodes end
             self.train_prev_recurrent_states = None
             self.train_recurrent_states = _batch_reset_recurrent_states_when_episodes_end(  # NOQA
@@ -504,8 +630,15 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 recurrent_states=self.train_recurrent_states,
             )
 
-    def _batch_observe_eval(self, batch_obs, batch_reward, batch_done, batch_reset):
-        if self.recurrent:
+    def _batch_observe_eval(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
+        if self.recurrent and env_ids is not None:
+            # Reset recurrent states when episodes end
+            for i, env_id in enumerate(env_ids):
+                if batch_done[i] or batch_reset[i]:
+                    self.test_env_recurrent_states[env_id] = None
+        elif self.recurrent:
             # Reset recurrent states when episodes end
             self.test_recurrent_states = _batch_reset_recurrent_states_when_episodes_end(  # NOQA
                 batch_done=batch_done,
@@ -513,14 +646,34 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 recurrent_states=self.test_recurrent_states,
             )
 
-    def batch_observe(self, batch_obs, batch_reward, batch_done, batch_reset):
+    def batch_observe(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
+        """Observe a batch of action consequences.
+
+        Args:
+            batch_obs (Sequence of ~object): Observations.
+            batch_reward (Sequence of float): Rewards.
+            batch_done (Sequence of boolean): Boolean values where True
+                indicates the current state is terminal.
+            batch_reset (Sequence of boolean): Boolean values where True
+                indicates the current episode will be reset, even if the
+                current state is not terminal.
+            env_ids (Sequence of int): Indices of the envs the observations
+                come from. See `batch_act`.
+
+        Returns:
+            None
+        """
+        if env_ids is not None:
+            env_ids = batch_env_ids(env_ids, len(batch_obs))
         if self.training:
             return self._batch_observe_train(
-                batch_obs, batch_reward, batch_done, batch_reset
+                batch_obs, batch_reward, batch_done, batch_reset, env_ids
             )
         else:
             return self._batch_observe_eval(
-                batch_obs, batch_reward, batch_done, batch_reset
+                batch_obs, batch_reward, batch_done, batch_reset, env_ids
             )
 
     def _can_start_replay(self):
@@ -530,12 +683,41 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
             return False
         return True
 
-    def _poll_pipe(self, actor_idx, pipe, replay_buffer_lock, exception_event):
+    def _flush_shared_memory_ring(self, actor_idx, ring, replay_buffer_lock):
+        transitions = ring.get_all()
+        if not transitions:
+            return
+        with replay_buffer_lock:
+            for transition in transitions:
+                if "env_id" not in transition:
+                    transition["env_id"] = actor_idx
+                self.replay_buffer.append(**transition)
+            self._cumulative_steps += len(transitions)
+
+    def _poll_pipe(
+        self,
+        actor_idx,
+        pipe,
+        replay_buffer_lock,
+        exception_event,
+        shared_memory_rings=None,
+    ):
+        if shared_memory_rings is None:
+            shared_memory_rings = {}
+        ring = shared_memory_rings.get(actor_idx)
         if pipe.closed:
+            if ring is not None:
+                self._flush_shared_memory_ring(actor_idx, ring, replay_buffer_lock)
             return
         try:
+            if ring is not None:
+                self._flush_shared_memory_ring(actor_idx, ring, replay_buffer_lock)
             while pipe.poll() and not exception_event.is_set():
                 cmd, data = pipe.recv()
+                # Transitions written into the ring before this command was
+                # sent must be added to the replay buffer first
+                if ring is not None:
+                    self._flush_shared_memory_ring(actor_idx, ring, replay_buffer_lock)
                 if cmd == "get_statistics":
                     assert data is None
                     with replay_buffer_lock:
@@ -559,11 +741,15 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                         self.replay_buffer.stop_current_episode(env_id=idx)
                         stats = self.get_statistics()
                     pipe.send(stats)
-
+                elif cmd == "shared_memory_ring":
+                    ring = data
+                    shared_memory_rings[actor_idx] = ring
                 else:
                     raise RuntimeError("Unknown command from actor: {}".format(cmd))
         except EOFError:
             pipe.close()
+            if ring is not None:
+                self._flush_shared_memory_ring(actor_idx, ring, replay_buffer_lock)
         except Exception:
             self.logger.exception("Poller loop failed. Exiting")
             exception_event.set()
@@ -596,10 +782,17 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                             self.minibatch_size, self.episodic_update_len
                         )
                     self.update_from_episodes(episodes)
+                elif self.replay_updater.prefetch_size > 0:
+                    transitions, exp_batch = self.replay_updater.get_prefetched()
+                    self.update(transitions, exp_batch=exp_batch)
                 else:
                     with replay_buffer_lock:
                         transitions = self.replay_buffer.sample(self.minibatch_size)
-                    self.update(transitions)
+                        # The batch is made under the lock since columnar
+                        # samples are views of the replay buffer, which the
+                        # poller keeps appending to
+                        exp_batch = self._batch_experiences(transitions)
+                    self.update(transitions, exp_batch=exp_batch)
 
                 # Update the shared model. This can be expensive if GPU is used
                 # since this is a DtoH copy, so it is updated only at regular
@@ -622,20 +815,60 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
         except Exception:
             self.logger.exception("Learner loop failed. Exiting")
             exception_event.set()
+        finally:
+            self.replay_updater.stop_prefetch()
 
     def _poller_loop(
-        self, shared_model, pipes, replay_buffer_lock, stop_event, exception_event
+        self,
+        shared_model,
+        pipes,
+        replay_buffer_lock,
+        stop_event,
+        exception_event,
+        shared_memory_rings=None,
     ):
         # To stop this loop, call stop_event.set()
         while not stop_event.is_set() and not exception_event.is_set():
             time.sleep(1e-6)
             # Poll actors for messages
             for i, pipe in enumerate(pipes):
-                self._poll_pipe(i, pipe, replay_buffer_lock, exception_event)
+                self._poll_pipe(
+                    i, pipe, replay_buffer_lock, exception_event, shared_memory_rings
+                )
 
     def setup_actor_learner_training(
-        self, n_actors, update_counter=None, n_updates=None, actor_update_interval=8
+        self,
+        n_actors,
+        update_counter=None,
+        n_updates=None,
+        actor_update_interval=8,
+        shared_memory_capacity=None,
     ):
+        """Set up actor-learner training.
+
+        Args:
+            n_actors (int): Number of actors.
+            update_counter (multiprocessing.Value or None): Counter of updates
+                of the shared model.
+            n_updates (int or None): Number of updates after which the learner
+                stops.
+            actor_update_interval (int): Interval of updates of the shared
+                model used by actors.
+            shared_memory_capacity (int or None): If set to an integer, each
+                actor writes transitions into a shared memory ring that can
+                hold this number of transitions instead of pickling them
+                through its pipe. The poller reads all the transitions in the
+                ring at once and appends them under a single acquisition of
+                the lock, but still calls `replay_buffer.append` for each of
+                them. Transitions whose fields do not fit the ring, e.g.
+                float rewards after an int reward, are sent through the pipe.
+
+        Returns:
+            callable: Function that makes an actor from its index.
+            StoppableThread: Learner thread.
+            StoppableThread: Poller thread.
+            multiprocessing.Event: Event set when an exception is raised.
+        """
         if update_counter is None:
             update_counter = mp.Value(ctypes.c_ulong)
 
@@ -653,9 +886,12 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 batch_states=self.batch_states,
                 logger=self.logger,
                 recurrent=self.recurrent,
+                shared_memory_capacity=shared_memory_capacity,
             )
 
         replay_buffer_lock = mp.Lock()
+        # Prefetching and updating errors by the learner use the same lock
+        self.replay_updater.lock = replay_buffer_lock
 
         poller_stop_event = mp.Event()
         poller = pfrl.utils.StoppableThread(
@@ -666,6 +902,7 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
                 replay_buffer_lock=replay_buffer_lock,
                 stop_event=poller_stop_event,
                 exception_event=exception_event,
+                shared_memory_rings={},
             ),
             stop_event=poller_stop_event,
         )
@@ -689,6 +926,7 @@ class DQN(agent.AttributeSavingMixin, agent.BatchAgent):
     def stop_episode(self):
         if self.recurrent:
             self.test_recurrent_states = None
+            self.test_env_recurrent_states = None
 
     def get_statistics(self):
         return [
@@ -5,14 +5,13 @@ import numpy as np
 import torch
 from torch.nn import functional as F
 from torch import nn
-import copy
 
 import pfrl
 from pfrl.agent import GoalConditionedBatchAgent
 from pfrl.agents import TD3
 from pfrl.utils.batch_states import batch_states
 from pfrl.replay_buffer import batch_experiences_with_goal
-from pfrl.utils import clip_l2_grad_norm_, _mean_or_nan
+from pfrl.utils import clip_l2_grad_norm_, _mean_or_nan, RunningVariance
 
 from pfrl.utils.mode_of_distribution import mode_of_distribution
 
@@ -63,6 +62,12 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
         target_policy_smoothing_func (callable): Callable that takes a batch of
             actions as input and outputs a noisy version of it. It is used for
             target policy smoothing when computing target Q-values.
+        recent_variance_size (int): Number of recent predicted Q-values of
+            which the variance is recorded.
+        statistics_interval (int or None): Interval in updates of computing
+            diagnostics, i.e. the variance of recent predicted Q-values and
+            KL divergences of the policy to the target policy and to the
+            policy before the update. If set to None, they are not computed.
     """
 
     saved_attributes = (
@@ -108,11 +113,14 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
         add_entropy=False,
         scale=1,
         entropy_temperature=1.0,
-        optimize_temp=False
+        optimize_temp=False,
+        statistics_interval=None
     ):
+        assert statistics_interval is None or statistics_interval > 0
         self.buffer_freq = buffer_freq
         self.minibatch_size = minibatch_size
         self.recent_variance_size = recent_variance_size
+        self.statistics_interval = statistics_interval
         self.add_entropy = add_entropy
         self.scale = scale
 
@@ -145,6 +153,8 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
 
         self.q_func1_variance_record = collections.deque(maxlen=q_func_grad_variance_record_size)
         self.q_func2_variance_record = collections.deque(maxlen=q_func_grad_variance_record_size)
+        self.q1_running_variance = RunningVariance()
+        self.q2_running_variance = RunningVariance()
 
         self.policy_gradients_variance_record = collections.deque(maxlen=policy_grad_variance_record_size)
         self.policy_gradients_mean_record = collections.deque(maxlen=policy_grad_variance_record_size)
@@ -155,13 +165,6 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
 
         self.kl_divergence = 0.0
         self.one_step_kl_divergence = 0.0
-        self.prior_policy = copy.deepcopy(policy)
-
-        # move prior policy to gpu
-        if gpu is not None and gpu >= 0:
-            assert torch.cuda.is_available()
-            device = torch.device("cuda:{}".format(gpu))
-            self.prior_policy.to(device)
 
         super(GoalConditionedTD3, self).__init__(policy=policy,
                                                  q_func1=q_func1,
@@ -203,6 +206,27 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
             with torch.no_grad():
                 return float(self.temperature_holder())
 
+    def _computes_statistics(self, n_updates):
+        """
+        whether diagnostics are computed at an update, given the number of
+        updates so far.
+        """
+        return self.statistics_interval is not None and n_updates % self.statistics_interval == 0
+
+    def _update_q_variance_statistics(self, predict_q1, predict_q2):
+        """
+        record the variance of recent predicted Q-values once
+        recent_variance_size values are observed.
+        """
+        for values, running_variance, record in (
+            (predict_q1, self.q1_running_variance, self.q_func1_variance_record),
+            (predict_q2, self.q2_running_variance, self.q_func2_variance_record),
+        ):
+            running_variance.update(values)
+            if running_variance.count >= self.recent_variance_size:
+                record.append(running_variance.variance)
+                running_variance.reset()
+
     def update_q_func_with_goal(self, batch):
         """
         Compute loss for a given Q-function, or critics
@@ -253,15 +277,14 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
         loss2 = F.smooth_l1_loss(target_q, predict_q2)
 
         # Update stats
-        self.q1_record.extend(predict_q1.detach().cpu().numpy())
-        self.q2_record.extend(predict_q2.detach().cpu().numpy())
+        q1 = predict_q1.detach().cpu().numpy()
+        q2 = predict_q2.detach().cpu().numpy()
+        self.q1_record.extend(q1)
+        self.q2_record.extend(q2)
         self.q_func1_loss_record.append(float(loss1))
         self.q_func2_loss_record.append(float(loss2))
-
-        q1_recent_variance = np.var(list(self.q1_record)[-self.recent_variance_size:])
-        q2_recent_variance = np.var(list(self.q2_record)[-self.recent_variance_size:])
-        self.q_func1_variance_record.append(q1_recent_variance)
-        self.q_func2_variance_record.append(q2_recent_variance)
+        if self._computes_statistics(self.q_func_n_updates):
+            self._update_q_variance_statistics(q1, q2)
 
         self.q_func1_optimizer.zero_grad()
 
@@ -319,30 +342,33 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
         if self.max_grad_norm is not None:
             clip_l2_grad_norm_(self.policy.parameters(), self.max_grad_norm)
         self.policy_optimizer.step()
+        if self._computes_statistics(self.policy_n_updates):
+            self._update_kl_statistics(action_distrib, batch_state, batch_goal)
         self.policy_n_updates += 1
 
-        self.kl_divergence = self.compute_kl(
-            self.policy, self.target_policy,
-            batch_state, batch_goal)
-
-        self.one_step_kl_divergence = self.compute_kl(
-            self.policy, self.prior_policy,
-            batch_state, batch_goal)
-
-        self.prior_policy = copy.deepcopy(self.policy)
-        # self.prior_policy = self.policy.clone()
-
-        
+    def _update_kl_statistics(self, prior_action_distrib, batch_state, batch_goal):
+        """
+        compute KL divergences of the updated policy to the target policy and
+        to the policy before the update, whose action distributions computed
+        for the update are reused instead of a copy of the policy.
+        """
+        with torch.no_grad():
+            x = torch.cat([batch_state, batch_goal], -1)
+            action_distrib = self.policy(x)
+            self.kl_divergence = self._distribution_kl(action_distrib, self.target_policy(x))
+            self.one_step_kl_divergence = self._distribution_kl(action_distrib, prior_action_distrib)
 
     def compute_kl(self, policy1, policy2,
                    batch_state, batch_goal) -> float:
         action_distrib = policy1(torch.cat([batch_state, batch_goal], -1))
         target_action_distrib = policy2(torch.cat([batch_state, batch_goal], -1))
+        return self._distribution_kl(action_distrib, target_action_distrib)
 
+    def _distribution_kl(self, action_distrib, target_action_distrib) -> float:
         if self.add_entropy:
             kl_divergence = torch.distributions.kl.kl_divergence(
                 action_distrib, target_action_distrib)
-            kl_divergence = float(kl_divergence)
+            kl_divergence = float(kl_divergence.mean())
         else:
             actions = action_distrib.sample()
             target_actions = target_action_distrib.sample()
@@ -352,7 +378,7 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
 
             kl_divergence = torch.distributions.kl.kl_divergence(
                 action_distrib, target_action_distrib)
-            kl_divergence = float(kl_divergence)
+            kl_divergence = float(kl_divergence.mean())
 
         return kl_divergence
 
@@ -370,9 +396,19 @@ class GoalConditionedTD3(TD3, GoalConditionedBatchAgent):
                 gradients = torch.cat((gradients, torch.flatten(param.grad)))
         return gradients
 
-    def update(self, experiences, errors_out=None):
-        """Update the model from experiences"""
-        batch = batch_experiences_with_goal(experiences, self.device, self.phi, self.gamma)
+    def update(self, experiences, errors_out=None, exp_batch=None):
+        """Update the model from experiences
+
+        Args:
+            experiences (list): Experiences sampled from the replay buffer.
+            errors_out (list or None): Unused.
+            exp_batch (dict or None): If set, it is used as the batch of
+                `experiences` made by `batch_experiences_with_goal`.
+        """
+        if exp_batch is None:
+            batch = batch_experiences_with_goal(experiences, self.device, self.phi, self.gamma)
+        else:
+            batch = exp_batch
         self.update_q_func_with_goal(batch)
         if self.q_func_n_updates % self.policy_update_delay == 0:
             self.update_policy_with_goal(batch)
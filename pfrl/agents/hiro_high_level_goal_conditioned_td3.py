@@ -55,6 +55,9 @@ class HIROHighLevelGoalConditionedTD3(GoalConditionedTD3):
         target_policy_smoothing_func (callable): Callable that takes a batch of
             actions as input and outputs a noisy version of it. It is used for
             target policy smoothing when computing target Q-values.
+        statistics_interval (int or None): Interval in updates of computing
+            diagnostics. If set to None, they are not computed. See
+            `GoalConditionedTD3`.
     """
 
     saved_attributes = (
@@ -100,7 +103,8 @@ class HIROHighLevelGoalConditionedTD3(GoalConditionedTD3):
         add_entropy=False,
         scale=1,
         entropy_temperature=1.0,
-        optimize_temp=False
+        optimize_temp=False,
+        statistics_interval=None
     ):
         # determines if we're dealing with a low level controller.
         self.cumulative_reward = False
@@ -133,7 +137,8 @@ class HIROHighLevelGoalConditionedTD3(GoalConditionedTD3):
                                                               add_entropy=add_entropy,
                                                               scale=scale,
                                                               entropy_temperature=entropy_temperature,
-                                                              optimize_temp=optimize_temp)
+                                                              optimize_temp=optimize_temp,
+                                                              statistics_interval=statistics_interval)
 
     def change_temporal_delay(self, new_temporal_delay):
         self.buffer_freq = new_temporal_delay
@@ -196,15 +201,14 @@ class HIROHighLevelGoalConditionedTD3(GoalConditionedTD3):
         loss2 = F.smooth_l1_loss(target_q, predict_q2)
 
         # Update stats
-        self.q1_record.extend(predict_q1.detach().cpu().numpy())
-        self.q2_record.extend(predict_q2.detach().cpu().numpy())
+        q1 = predict_q1.detach().cpu().numpy()
+        q2 = predict_q2.detach().cpu().numpy()
+        self.q1_record.extend(q1)
+        self.q2_record.extend(q2)
         self.q_func1_loss_record.append(float(loss1))
         self.q_func2_loss_record.append(float(loss2))
-
-        q1_recent_variance = np.var(list(self.q1_record)[-self.recent_variance_size:])
-        q2_recent_variance = np.var(list(self.q2_record)[-self.recent_variance_size:])
-        self.q_func1_variance_record.append(q1_recent_variance)
-        self.q_func2_variance_record.append(q2_recent_variance)
+        if self._computes_statistics(self.q_func_n_updates):
+            self._update_q_variance_statistics(q1, q2)
 
         self.q_func1_optimizer.zero_grad()
         loss1.backward()
@@ -0,0 +1,247 @@
+from logging import getLogger
+
+import numpy as np
+import torch
+
+from pfrl.agent import HRLAgent
+from pfrl.utils import evaluating
+from pfrl.utils.mode_of_distribution import mode_of_distribution
+
+
+class _ControllerActor(object):
+    """Selects actions of a controller with a policy shared with the learner.
+
+    Actions are selected as `HRLControllerBase.policy` does: they are scaled,
+    perturbed by the explorer during training and clipped, and burn-in
+    actions are used until the policy is updated by the learner.
+
+    Args:
+        policy (torch.nn.Module): Policy shared with the learner.
+        scale (ndarray): Scale of actions.
+        add_entropy (bool): True iff the policy has the entropy head.
+        explorer (Explorer): Explorer used during training.
+        burnin_action_func (callable or None): Callable that returns burn-in
+            actions.
+        policy_n_updates (multiprocessing.Array): Number of updates of the
+            policies of the learner.
+        level (int): Index of the controller in policy_n_updates.
+    """
+
+    def __init__(
+        self,
+        policy,
+        scale,
+        add_entropy,
+        explorer,
+        burnin_action_func,
+        policy_n_updates,
+        level,
+    ):
+        self.policy = policy
+        self.scale = np.asarray(scale)
+        self.add_entropy = add_entropy
+        self.explorer = explorer
+        self.burnin_action_func = burnin_action_func
+        self.policy_n_updates = policy_n_updates
+        self.level = level
+        self.t = 0
+
+    def select_action(self, obs, goal, training):
+        if (
+            training
+            and self.burnin_action_func is not None
+            and self.policy_n_updates[self.level] == 0
+        ):
+            action = self.burnin_action_func()
+        else:
+            x = torch.as_tensor(
+                np.concatenate([obs, goal], axis=-1)[None], dtype=torch.float32
+            )
+            with torch.no_grad(), evaluating(self.policy):
+                distribution = self.policy(x)
+                if self.add_entropy and not training:
+                    action = mode_of_distribution(distribution)
+                else:
+                    action = distribution.sample()
+            action = action[0].numpy() * self.scale
+            if training:
+                greedy_action = action
+                action = self.explorer.select_action(self.t, lambda: greedy_action)
+        if training:
+            self.t += 1
+        return np.clip(action, a_min=-self.scale, a_max=self.scale)
+
+
+class HIROActor(HRLAgent):
+    """Actor of HIRO that acts with policies shared with the learner.
+
+    It is made by `HIROAgent.setup_actor_learner_training` and acts like
+    `HIROAgent` in a single env, so that it can be trained by
+    `pfrl.experiments.train_hrl_agent_async`. Instead of adding transitions
+    of both levels to replay buffers and updating the controllers, it sends
+    the transitions to the learner through `pipe`.
+
+    Args:
+        pipe (multiprocessing.Connection): Connection to the learner.
+        low_level_actor (_ControllerActor): Actor of the low level controller.
+        high_level_actor (_ControllerActor): Actor of the high level
+            controller.
+        subgoal_freq (int): Interval of subgoals in steps.
+        train_freq (int): Length of windows of high level transitions.
+        buffer_freq (int): Length of windows of high level transitions that
+            are stored in the replay buffer.
+        reward_scaling (float): Scale of rewards of the high level.
+        start_training_steps (int): Number of global steps before which
+            subgoals are smoothed.
+        goal_threshold (float): Distance to the final goal regarded as
+            success.
+        soft_subgoal_update (float): Weight of new subgoals of smoothing.
+        logger (logging.Logger): Logger used.
+    """
+
+    process_idx = None
+    shared_attributes = ()
+
+    def __init__(
+        self,
+        pipe,
+        low_level_actor,
+        high_level_actor,
+        subgoal_freq,
+        train_freq,
+        buffer_freq,
+        reward_scaling,
+        start_training_steps,
+        goal_threshold,
+        soft_subgoal_update,
+        logger=getLogger(__name__),
+    ):
+        self.pipe = pipe
+        self.low_level_actor = low_level_actor
+        self.high_level_actor = high_level_actor
+        self.subgoal_freq = subgoal_freq
+        self.train_freq = train_freq
+        self.buffer_freq = buffer_freq
+        self.reward_scaling = reward_scaling
+        self.start_training_steps = start_training_steps
+        self.goal_threshold = goal_threshold
+        self.soft_subgoal_update = soft_subgoal_update
+        self.logger = logger
+
+        self.sr = 0
+        self.last_obs = None
+        self.last_goal = None
+        self.last_action = None
+        self.last_subgoal = None
+        self.end_episode()
+
+    def act_low_level(self, obs, subgoal):
+        self.last_obs = obs
+        self.last_goal = subgoal
+        self.last_action = self.low_level_actor.select_action(
+            obs, subgoal, self.training
+        )
+        return self.last_action
+
+    def act_high_level(self, obs, goal, last_subgoal, step=0, global_step=0):
+        self.last_subgoal = last_subgoal
+        subgoal_dim = last_subgoal.shape[0]
+        if global_step < self.start_training_steps and self.training:
+            subgoal = self.high_level_actor.select_action(
+                self.last_obs, goal, self.training
+            )
+            subgoal[:3] = (
+                self.soft_subgoal_update * subgoal[:3]
+                + (1 - self.soft_subgoal_update) * last_subgoal[:3]
+            )
+        elif step % self.subgoal_freq == 0:
+            subgoal = self.high_level_actor.select_action(
+                self.last_obs, goal, self.training
+            )
+        else:
+            # subgoal transition
+            subgoal = self.last_obs[:subgoal_dim] + last_subgoal - obs[:subgoal_dim]
+        # reward of the low level controller
+        abs_s = self.last_obs[:subgoal_dim] + last_subgoal
+        self.sr = -np.sqrt(np.sum((abs_s - obs[:subgoal_dim]) ** 2))
+        return subgoal
+
+    def sample_subgoal(self, obs, goal):
+        return self.high_level_actor.select_action(obs, goal, self.training)
+
+    def observe(self, obs, goal, subgoal, reward, done, reset, step=0, global_step=0):
+        if not self.training:
+            return
+        self.pipe.send(
+            (
+                "low_level_transition",
+                dict(
+                    state=np.asarray(self.last_obs, dtype=np.float32),
+                    goal=np.asarray(self.last_goal, dtype=np.float32),
+                    action=self.last_action,
+                    reward=self.sr,
+                    next_state=np.asarray(obs, dtype=np.float32),
+                    next_goal=np.asarray(subgoal, dtype=np.float32),
+                    next_action=None,
+                    is_state_terminal=done,
+                ),
+            )
+        )
+        if step != 0 and step % self.train_freq == 1:
+            if (
+                len(self.action_arr) == self.train_freq == self.buffer_freq
+                and self.last_high_level_obs is not None
+            ):
+                self.pipe.send(
+                    (
+                        "high_level_transition",
+                        dict(
+                            state=self.last_high_level_obs,
+                            goal=self.last_high_level_goal,
+                            action=self.last_high_level_action,
+                            reward=self.cumulative_reward,
+                            next_state=np.asarray(self.last_obs, dtype=np.float32),
+                            next_action=None,
+                            is_state_terminal=done,
+                            state_arr=np.asarray(self.state_arr, dtype=np.float32),
+                            action_arr=np.asarray(self.action_arr, dtype=np.float32),
+                        ),
+                    )
+                )
+            # start a new window of the high level
+            self.action_arr = []
+            self.state_arr = []
+            self.last_high_level_obs = np.asarray(self.last_obs, dtype=np.float32)
+            self.last_high_level_goal = np.asarray(goal, dtype=np.float32)
+            self.last_high_level_action = self.last_subgoal
+            self.cumulative_reward = 0
+
+        self.action_arr.append(self.last_action)
+        self.state_arr.append(self.last_obs)
+        self.cumulative_reward += self.reward_scaling * reward
+        if done or reset:
+            self.pipe.send(("stop_episode", None))
+
+    def end_episode(self):
+        self.action_arr = []
+        self.state_arr = []
+        self.last_high_level_obs = None
+        self.last_high_level_goal = None
+        self.last_high_level_action = None
+        self.cumulative_reward = 0
+
+    def evaluate_final_goal(self, fg, obs):
+        error = np.sqrt(np.sum(np.square(fg - obs[: fg.shape[0]])))
+        return error <= self.goal_threshold
+
+    def save(self, dirname):
+        self.pipe.send(("save", dirname))
+        self.pipe.recv()
+
+    def load(self, dirname):
+        self.pipe.send(("load", dirname))
+        self.pipe.recv()
+
+    def get_statistics(self):
+        self.pipe.send(("get_statistics", None))
+        return self.pipe.recv()
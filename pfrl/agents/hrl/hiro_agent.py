@@ -1,8 +1,14 @@
+import copy
+import ctypes
+import multiprocessing as mp
 import os
+import time
+from logging import getLogger
 
 import numpy as np
 import torch
 
+import pfrl
 from pfrl.agent import HRLAgent
 from pfrl.replay_buffers import (
     LowerControllerReplayBuffer,
@@ -12,10 +18,17 @@ from pfrl.agents.hrl.hrl_controllers import (
     LowerController,
     HigherController
 )
+from pfrl.agents.hrl.hiro_actor import HIROActor, _ControllerActor
+from pfrl.replay_buffer import (
+    batch_experiences_with_goal,
+    high_level_batch_experiences_with_goal
+)
 from pfrl.utils import _mean_or_nan
 
 import sklearn.metrics
 
+logger = getLogger(__name__)
+
 
 class HIROAgent(HRLAgent):
     def __init__(self,
@@ -39,9 +52,25 @@ class HIROAgent(HRLAgent):
                  temperature_high=1.0,
                  temperature_low=0.1,
                  optimize_high_temp=False,
-                 optimize_low_temp=False):
+                 optimize_low_temp=False,
+                 candidate_goals=8,
+                 correction_batch_size=4096,
+                 columnar_replay_buffer=False,
+                 statistics_interval=None):
         """
         Constructor for the HIRO agent.
+
+        candidate_goals is the number of random subgoals sampled for the
+        off policy correction, in addition to the original subgoal and the
+        change of the state. correction_batch_size bounds the number of rows
+        passed to the low level policy at once during the correction.
+        If columnar_replay_buffer is True, replay buffers of both controllers
+        store transitions in preallocated NumPy arrays, see
+        `pfrl.replay_buffers.HigherControllerReplayBuffer`.
+        statistics_interval is the interval in updates of computing
+        diagnostics of both controllers, such as KL divergences of policy
+        updates and the variance of recent Q-values. They are not computed
+        if it is None, see `pfrl.agents.GoalConditionedTD3`.
         """
         # get scale for subgoal
         self.scale_high = scale_high
@@ -51,8 +80,12 @@ class HIROAgent(HRLAgent):
         self.prev_subgoal_position = None
 
         # create replay buffers
-        low_level_replay_buffer = LowerControllerReplayBuffer(buffer_size)
-        high_level_replay_buffer = HigherControllerReplayBuffer(buffer_size)
+        low_level_replay_buffer = LowerControllerReplayBuffer(
+            buffer_size, columnar=columnar_replay_buffer
+        )
+        high_level_replay_buffer = HigherControllerReplayBuffer(
+            buffer_size, columnar=columnar_replay_buffer
+        )
 
         if add_entropy_layer == 'both':
             high_entropy = True
@@ -78,7 +111,10 @@ class HIROAgent(HRLAgent):
             burnin_action_func=high_level_burnin_action_func,
             add_entropy=high_entropy,
             temperature=temperature_high,
-            optimize_high_temp=optimize_high_temp
+            optimize_high_temp=optimize_high_temp,
+            candidate_goals=candidate_goals,
+            correction_batch_size=correction_batch_size,
+            statistics_interval=statistics_interval,
         )
 
         # lower td3 controller
@@ -92,7 +128,8 @@ class HIROAgent(HRLAgent):
             burnin_action_func=low_level_burnin_action_func,
             add_entropy=low_entropy,
             temperature=temperature_low,
-            optimize_low_temp=optimize_low_temp
+            optimize_low_temp=optimize_low_temp,
+            statistics_interval=statistics_interval
         )
 
         self.subgoal_freq = subgoal_freq
@@ -115,6 +152,23 @@ class HIROAgent(HRLAgent):
         self.last_high_level_action = None
         self.last_subgoal = None
 
+        # per env state of batch_act_low_level, batch_act_high_level and
+        # batch_observe
+        self.batch_last_obs = None
+        self.batch_last_action = None
+        self.batch_last_subgoal = None
+        self.batch_sr = None
+        self.batch_action_arr = None
+        self.batch_state_arr = None
+        self.batch_cumulative_reward = None
+        self.batch_last_high_level_obs = None
+        self.batch_last_high_level_goal = None
+        self.batch_last_high_level_action = None
+        # final positions of the last episodes of the envs
+        self.batch_final_pos = None
+        # whether batch_act_low_level was called after batch_act_high_level
+        self.batch_acted_low_level = False
+
         self.ll_performance_dict = {
             'state_reached_diff': 0,
             'state_reached_direction_diff': 0,
@@ -157,12 +211,15 @@ class HIROAgent(HRLAgent):
         self.last_action = self.low_con.policy(obs, subgoal)
         return self.last_action
 
-    def evaluate_current_ll_performance(self, obs, subgoal, last_subgoal):
+    def evaluate_current_ll_performance(self, obs, subgoal, last_subgoal,
+                                        last_obs=None):
         """
         evaluate how the current low level agent
         is doing with following subgoals.
         """
-        desired = np.array(self.last_obs[:3]) + np.array(last_subgoal[:3])
+        if last_obs is None:
+            last_obs = self.last_obs
+        desired = np.array(last_obs[:3]) + np.array(last_subgoal[:3])
         actual = np.array(obs[:3])
         # get difference between where we want to go and what was actually reached
         # this tests the effectiveness of the LL agent
@@ -171,7 +228,7 @@ class HIROAgent(HRLAgent):
         self.ll_performance_dict['state_reached_diff'] = np.linalg.norm(actual - desired)
 
         # get directional diff
-        followed_subgoal = np.array(obs[:3]) - np.array(self.last_obs[:3])
+        followed_subgoal = np.array(obs[:3]) - np.array(last_obs[:3])
 
         reshaped_last_subgoal = np.array(last_subgoal[:3]).reshape(1, -1)
         reshaped_followed_subgoal = followed_subgoal.reshape(1, -1)
@@ -195,6 +252,64 @@ class HIROAgent(HRLAgent):
     def sample_subgoal(self, obs, goal):
         return self.high_con.policy(obs, goal)
 
+    def batch_act_low_level(self, batch_obs, batch_subgoal):
+        """
+        low level actor for a batch of envs, e.g. of a VectorEnv,
+        conditioned on observations and subgoals.
+        at each step, batch_act_low_level, batch_act_high_level and,
+        in training, batch_observe are called in this order, since the
+        later ones use the observations and actions of this step.
+        """
+        self.batch_last_obs = np.asarray(batch_obs)
+        self.batch_acted_low_level = True
+        self.batch_last_action = self.low_con.batch_policy(self.batch_last_obs,
+                                                           np.asarray(batch_subgoal))
+        return self.batch_last_action
+
+    def batch_act_high_level(self, batch_obs, batch_goal, batch_last_subgoal,
+                             batch_step, global_step=0):
+        """
+        high level actor for a batch of envs, where batch_step is
+        the step of the current episode of each env. it must be called
+        after batch_act_low_level of the same step.
+        """
+        assert self.batch_acted_low_level, \
+            "batch_act_low_level must be called before batch_act_high_level"
+        self.batch_acted_low_level = False
+        batch_obs = np.asarray(batch_obs)
+        batch_goal = np.asarray(batch_goal)
+        self.batch_last_subgoal = np.asarray(batch_last_subgoal)
+        subgoal_dim = self.batch_last_subgoal.shape[-1]
+        if global_step < self.start_training_steps and self.training:
+            subgoals = self.high_con.batch_policy(self.batch_last_obs, batch_goal)
+            # Soft Update / First Order System, just for Euclidean subgoals
+            subgoals[:, :3] = self.soft_subgoal_update * subgoals[:, :3] + \
+                (1 - self.soft_subgoal_update) * self.batch_last_subgoal[:, :3]
+        else:
+            # subgoal transition of all the envs
+            subgoals = (self.batch_last_obs[:, :subgoal_dim] + self.batch_last_subgoal
+                        - batch_obs[:, :subgoal_dim])
+            # envs that choose new subgoals
+            new = np.asarray(batch_step) % self.subgoal_freq == 0
+            if new.any():
+                subgoals[new] = self.high_con.batch_policy(self.batch_last_obs[new],
+                                                           batch_goal[new])
+
+        # rewards for the low level controller
+        abs_s = self.batch_last_obs[:, :subgoal_dim] + self.batch_last_subgoal
+        self.batch_sr = -np.sqrt(np.sum((abs_s - batch_obs[:, :subgoal_dim])**2,
+                                        axis=-1))
+
+        # statistics are computed on the first env
+        self.evaluate_current_ll_performance(batch_obs[0], subgoals[0],
+                                             self.batch_last_subgoal[0],
+                                             last_obs=self.batch_last_obs[0])
+
+        return subgoals
+
+    def batch_sample_subgoal(self, batch_obs, batch_goal):
+        return self.high_con.batch_policy(np.asarray(batch_obs), np.asarray(batch_goal))
+
     def observe(self, obs, goal, subgoal, reward, done, reset, step=0, global_step=0):
         """
         after getting feedback from the environment, observe,
@@ -224,6 +339,71 @@ class HIROAgent(HRLAgent):
             self.state_arr.append(self.last_obs)
             self.cumulative_reward += (self.reward_scaling * reward)
 
+    def batch_observe(self, batch_obs, batch_goal, batch_subgoal, batch_reward,
+                      batch_done, batch_reset, batch_step, global_step=0):
+        """
+        observe a batch of transitions of envs acted on by batch_act_low_level
+        and batch_act_high_level, and train both the low and high level
+        controllers. high level transitions are tracked per env.
+        """
+        if not self.training:
+            return
+        num_envs = len(batch_obs)
+        if self.batch_action_arr is None:
+            self.batch_action_arr = [[] for _ in range(num_envs)]
+            self.batch_state_arr = [[] for _ in range(num_envs)]
+            self.batch_cumulative_reward = np.zeros(num_envs)
+            self.batch_last_high_level_obs = [None] * num_envs
+            self.batch_last_high_level_goal = [None] * num_envs
+            self.batch_last_high_level_action = [None] * num_envs
+            self.batch_final_pos = np.full((num_envs, 3), np.nan)
+
+        self.low_con.batch_observe(np.asarray(batch_obs), np.asarray(batch_subgoal),
+                                   self.batch_sr, batch_done, batch_reset)
+        # the high level controller is updated as often as with a single env,
+        # i.e. once every train_freq global steps
+        n_high_level_updates = ((global_step + num_envs - 1) // self.train_freq
+                                - (global_step - 1) // self.train_freq)
+        for _ in range(n_high_level_updates):
+            self.high_con.update(self.low_con)
+
+        for i in range(num_envs):
+            step = batch_step[i]
+            if step != 0 and step % self.train_freq == 1:
+                if len(self.batch_action_arr[i]) == self.train_freq:
+                    # train high level controller every self.train_freq steps
+                    self.high_con.agent.update_high_level_last_results(
+                        self.batch_last_high_level_obs[i],
+                        self.batch_last_high_level_goal[i],
+                        self.batch_last_high_level_action[i])
+                    self.high_con.observe(
+                        self.batch_state_arr[i], self.batch_action_arr[i],
+                        self.batch_cumulative_reward[i], batch_goal[i],
+                        self.batch_last_obs[i], batch_done[i])
+
+                # reset last high level obs, goal, action
+                self.batch_action_arr[i] = []
+                self.batch_state_arr[i] = []
+                self.batch_last_high_level_obs[i] = torch.FloatTensor(
+                    self.batch_last_obs[i])
+                self.batch_last_high_level_goal[i] = torch.FloatTensor(batch_goal[i])
+                self.batch_last_high_level_action[i] = self.batch_last_subgoal[i]
+                self.batch_cumulative_reward[i] = 0
+
+            self.batch_action_arr[i].append(self.batch_last_action[i])
+            self.batch_state_arr[i].append(self.batch_last_obs[i])
+            self.batch_cumulative_reward[i] += (self.reward_scaling * batch_reward[i])
+
+            if batch_done[i] or batch_reset[i]:
+                # start a new episode of the env
+                self.batch_action_arr[i] = []
+                self.batch_state_arr[i] = []
+                self.batch_last_high_level_obs[i] = None
+                self.batch_last_high_level_goal[i] = None
+                self.batch_last_high_level_action[i] = None
+                self.batch_cumulative_reward[i] = 0
+                self.batch_final_pos[i] = batch_obs[i][:3]
+
     def end_episode(self):
         self.action_arr = []
         self.state_arr = []
@@ -260,6 +440,211 @@ class HIROAgent(HRLAgent):
         abs_s = s[:sg.shape[0]] + sg
         return -np.sqrt(np.sum((abs_s - n_s[:sg.shape[0]])**2))
 
+    def setup_actor_learner_training(self, n_actors, update_counter=None,
+                                     n_updates=None, actor_update_interval=8):
+        """
+        set up actor-learner training, used by
+        pfrl.experiments.train_hrl_agent_async.
+
+        actors (HIROActor) step envs in their own processes with copies of
+        the policies of both controllers in shared memory, and send
+        transitions of both levels to the learner through pipes. the poller
+        thread adds them to the replay buffers, and the learner thread updates
+        the low level controller continuously and the high level controller
+        once every train_freq updates of the low level controller.
+        the shared policies are synchronized every actor_update_interval
+        updates, and the learner stops after n_updates updates of the low
+        level controller if n_updates is set.
+
+        returns a function that makes an actor from its index, the learner
+        thread, the poller thread and an event set when an exception is raised.
+        """
+        if update_counter is None:
+            update_counter = mp.Value(ctypes.c_ulong)
+        self.update_counter = update_counter
+        self.actor_update_interval = actor_update_interval
+
+        controllers = (self.low_con, self.high_con)
+        shared_policies = []
+        for controller in controllers:
+            shared_policy = copy.deepcopy(controller.agent.policy).cpu()
+            shared_policy.share_memory()
+            shared_policies.append(shared_policy)
+        # number of updates of the policies, used by actors to decide whether
+        # to use burn-in actions
+        shared_policy_n_updates = mp.Array(ctypes.c_ulong, len(controllers))
+        self._sync_shared_policies(shared_policies, shared_policy_n_updates)
+
+        pipes = [mp.Pipe() for _ in range(n_actors)]
+        learner_pipes, actor_pipes = list(zip(*pipes))
+        exception_event = mp.Event()
+
+        def make_actor(i):
+            controller_actors = [
+                _ControllerActor(
+                    policy=shared_policy,
+                    scale=controller.scale,
+                    add_entropy=controller.agent.add_entropy,
+                    explorer=controller.agent.explorer,
+                    burnin_action_func=controller.agent.burnin_action_func,
+                    policy_n_updates=shared_policy_n_updates,
+                    level=level,
+                )
+                for level, (controller, shared_policy)
+                in enumerate(zip(controllers, shared_policies))
+            ]
+            return HIROActor(
+                pipe=actor_pipes[i],
+                low_level_actor=controller_actors[0],
+                high_level_actor=controller_actors[1],
+                subgoal_freq=self.subgoal_freq,
+                train_freq=self.train_freq,
+                buffer_freq=self.high_con.agent.buffer_freq,
+                reward_scaling=self.reward_scaling,
+                start_training_steps=self.start_training_steps,
+                goal_threshold=self.goal_threshold,
+                soft_subgoal_update=self.soft_subgoal_update,
+            )
+
+        replay_buffer_lock = mp.Lock()
+
+        poller_stop_event = mp.Event()
+        poller = pfrl.utils.StoppableThread(
+            target=self._poller_loop,
+            kwargs=dict(
+                pipes=learner_pipes,
+                replay_buffer_lock=replay_buffer_lock,
+                stop_event=poller_stop_event,
+                exception_event=exception_event,
+            ),
+            stop_event=poller_stop_event,
+        )
+
+        learner_stop_event = mp.Event()
+        learner = pfrl.utils.StoppableThread(
+            target=self._learner_loop,
+            kwargs=dict(
+                shared_policies=shared_policies,
+                shared_policy_n_updates=shared_policy_n_updates,
+                replay_buffer_lock=replay_buffer_lock,
+                stop_event=learner_stop_event,
+                exception_event=exception_event,
+                n_updates=n_updates,
+            ),
+            stop_event=learner_stop_event,
+        )
+
+        return make_actor, learner, poller, exception_event
+
+    def _sync_shared_policies(self, shared_policies, shared_policy_n_updates):
+        controllers = (self.low_con, self.high_con)
+        for level, (controller, shared_policy) in enumerate(
+                zip(controllers, shared_policies)):
+            shared_policy.load_state_dict(controller.agent.policy.state_dict())
+            shared_policy_n_updates[level] = controller.agent.policy_n_updates
+
+    def _can_sample(self, controller):
+        """
+        whether a minibatch can be sampled from the replay buffer of a controller.
+        """
+        agent = controller.agent
+        return len(agent.replay_buffer) >= max(agent.replay_updater.replay_start_size,
+                                               agent.minibatch_size)
+
+    def _poller_loop(self, pipes, replay_buffer_lock, stop_event, exception_event):
+        # To stop this loop, call stop_event.set()
+        while not stop_event.is_set() and not exception_event.is_set():
+            time.sleep(1e-6)
+            # Poll actors for messages
+            for i, pipe in enumerate(pipes):
+                self._poll_pipe(i, pipe, replay_buffer_lock, exception_event)
+
+    def _poll_pipe(self, actor_idx, pipe, replay_buffer_lock, exception_event):
+        if pipe.closed:
+            return
+        low_level_replay_buffer = self.low_con.agent.replay_buffer
+        high_level_replay_buffer = self.high_con.agent.replay_buffer
+        try:
+            while pipe.poll() and not exception_event.is_set():
+                cmd, data = pipe.recv()
+                if cmd == "get_statistics":
+                    assert data is None
+                    with replay_buffer_lock:
+                        stats = self.get_statistics()
+                    pipe.send(stats)
+                elif cmd == "load":
+                    self.load(data)
+                    pipe.send(None)
+                elif cmd == "save":
+                    self.save(data)
+                    pipe.send(None)
+                elif cmd == "low_level_transition":
+                    with replay_buffer_lock:
+                        low_level_replay_buffer.append(env_id=actor_idx, **data)
+                elif cmd == "high_level_transition":
+                    with replay_buffer_lock:
+                        high_level_replay_buffer.append(env_id=actor_idx, **data)
+                elif cmd == "stop_episode":
+                    with replay_buffer_lock:
+                        low_level_replay_buffer.stop_current_episode(env_id=actor_idx)
+                        high_level_replay_buffer.stop_current_episode(env_id=actor_idx)
+                else:
+                    raise RuntimeError("Unknown command from actor: {}".format(cmd))
+        except EOFError:
+            pipe.close()
+        except Exception:
+            logger.exception("Poller loop failed. Exiting")
+            exception_event.set()
+
+    def _learner_loop(self, shared_policies, shared_policy_n_updates,
+                      replay_buffer_lock, stop_event, exception_event,
+                      n_updates=None):
+        try:
+            low_agent = self.low_con.agent
+            high_agent = self.high_con.agent
+            n_low_level_updates = 0
+            # To stop this loop, call stop_event.set()
+            while not stop_event.is_set():
+                if not self._can_sample(self.low_con):
+                    time.sleep(1e-3)
+                    continue
+                if n_updates is not None and n_low_level_updates >= n_updates:
+                    stop_event.set()
+                    break
+
+                # batches are made under the lock since columnar samples are
+                # views of the replay buffers
+                with replay_buffer_lock:
+                    transitions = low_agent.replay_buffer.sample(
+                        low_agent.minibatch_size)
+                    exp_batch = batch_experiences_with_goal(
+                        transitions, low_agent.device, low_agent.phi, low_agent.gamma)
+                low_agent.update(transitions, exp_batch=exp_batch)
+                n_low_level_updates += 1
+
+                # the high level controller is updated as often as in observe,
+                # i.e. once every train_freq updates of the low level controller
+                if (n_low_level_updates % self.train_freq == 0
+                        and self._can_sample(self.high_con)):
+                    with replay_buffer_lock:
+                        transitions = high_agent.replay_buffer.sample(
+                            high_agent.minibatch_size)
+                        exp_batch = high_level_batch_experiences_with_goal(
+                            transitions, high_agent.device, lambda x: x,
+                            high_agent.gamma)
+                    self.high_con.update_with_batch(exp_batch, self.low_con)
+
+                # the shared policies are updated at regular intervals since
+                # it is a DtoH copy if GPU is used
+                if n_low_level_updates % self.actor_update_interval == 0:
+                    with self.update_counter.get_lock():
+                        self.update_counter.value += 1
+                        self._sync_shared_policies(shared_policies,
+                                                   shared_policy_n_updates)
+        except Exception:
+            logger.exception("Learner loop failed. Exiting")
+            exception_event.set()
+
     def save(self, outdir):
         """
         saves the model, aka the lower and higher controllers' parameters.
@@ -329,6 +714,18 @@ class HIROAgent(HRLAgent):
     def check_subgoal_pos_or_zeros(self, subgoal_pos):
         return subgoal_pos if subgoal_pos is not None else np.zeros(3)
 
+    def get_final_pos(self):
+        """
+        gets the final position of the last episode. in batch training,
+        final positions of the last episodes of the envs are averaged.
+        """
+        if self.batch_final_pos is None:
+            return self.last_x, self.last_y, self.last_z
+        ended = ~np.isnan(self.batch_final_pos).any(axis=1)
+        if not ended.any():
+            return float('NaN'), float('NaN'), float('NaN')
+        return tuple(self.batch_final_pos[ended].mean(axis=0))
+
     def get_statistics(self):
         """
         gets the statistics of all of the actors and critics for the high
@@ -336,6 +733,7 @@ class HIROAgent(HRLAgent):
         """
         cur_subgoal_pos = self.check_subgoal_pos_or_zeros(self.subgoal_position)
         prev_subgoal_pos = self.check_subgoal_pos_or_zeros(self.prev_subgoal_position)
+        final_x, final_y, final_z = self.get_final_pos()
 
         return [
             ("low_con_average_q1", _mean_or_nan(self.low_con.agent.q1_record)),
@@ -371,9 +769,9 @@ class HIROAgent(HRLAgent):
             ("low_con_temperature_mean", _mean_or_nan(self.low_con.agent.temperature_record)),
             ("low_con_entropy_mean", _mean_or_nan(self.low_con.agent.entropy_record)),
 
-            ("final_x", self.last_x),
-            ('final_y', self.last_y),
-            ('final_z', self.last_z),
+            ("final_x", final_x),
+            ('final_y', final_y),
+            ('final_z', final_z),
 
             ('prev_subgoal_x', prev_subgoal_pos[0]),
             ('prev_subgoal_y', prev_subgoal_pos[1]),
@@ -10,6 +10,7 @@ from pfrl.replay_buffer import high_level_batch_experiences_with_goal
 from pfrl.agents import HIROHighLevelGoalConditionedTD3, GoalConditionedTD3
 from pfrl.nn import ConstantsMult
 from pfrl.nn.lmbda import Lambda
+from pfrl.utils.mode_of_distribution import mode_of_distribution
 
 
 class HRLControllerBase():
@@ -36,7 +37,8 @@ class HRLControllerBase():
             burnin_action_func=None,
             replay_start_size=2500,
             temperature=1.0,
-            optimize_temp=False):
+            optimize_temp=False,
+            statistics_interval=None):
         self.scale = scale
 
         if gpu is not None and gpu >= 0:
@@ -164,7 +166,8 @@ class HRLControllerBase():
                 burnin_action_func=burnin_action_func,
                 target_policy_smoothing_func=default_target_policy_smoothing_func,
                 entropy_temperature=temperature,
-                optimize_temp=optimize_temp
+                optimize_temp=optimize_temp,
+                statistics_interval=statistics_interval
                 )
         else:
             self.agent = HIROHighLevelGoalConditionedTD3(
@@ -189,7 +192,8 @@ class HRLControllerBase():
                 burnin_action_func=burnin_action_func,
                 target_policy_smoothing_func=default_target_policy_smoothing_func,
                 entropy_temperature=temperature,
-                optimize_temp=optimize_temp
+                optimize_temp=optimize_temp,
+                statistics_interval=statistics_interval
                 )
 
         self.device = self.agent.device
@@ -213,6 +217,39 @@ class HRLControllerBase():
         action = self.agent.act_with_goal(torch.FloatTensor(state), torch.FloatTensor(goal))
         return np.clip(action, a_min=-self.scale, a_max=self.scale)
 
+    def batch_policy(self, states, goals):
+        """
+        run the policy (actor) on a batch of states and goals,
+        given as arrays whose first axis is the batch.
+        """
+        actions = self.agent.batch_act_with_goal(torch.FloatTensor(states),
+                                                 torch.FloatTensor(goals))
+        return np.clip(np.asarray(actions), a_min=-self.scale, a_max=self.scale)
+
+    def deterministic_policy(self, inputs):
+        """
+        run the policy (actor) without exploration on a tensor of
+        concatenated states and goals, on the device of the agent.
+        """
+        agent = self.agent
+        with torch.no_grad(), pfrl.utils.evaluating(agent.policy):
+            distribution = agent.policy(inputs)
+            if agent.add_entropy:
+                actions = mode_of_distribution(distribution)
+            else:
+                actions = distribution.sample()
+            actions = agent.scale * actions
+        return torch.max(torch.min(actions, self.scale_tensor), -self.scale_tensor)
+
+    def batch_observe(self, states, goals, rewards, dones, resets):
+        """
+        observe a batch of transitions, and train
+        (if we can sample from the replay buffer)
+        """
+        self.agent.batch_observe_with_goal(torch.FloatTensor(states),
+                                           torch.FloatTensor(goals),
+                                           rewards, dones, resets)
+
     def _observe(self, states, goals, rewards, done, state_arr=None, action_arr=None):
         """
         observe, and train (if we can sample from the replay buffer)
@@ -250,7 +287,8 @@ class LowerController(HRLControllerBase):
             gpu=None,
             burnin_action_func=None,
             temperature=1.0,
-            optimize_low_temp=False):
+            optimize_low_temp=False,
+            statistics_interval=None):
         super(LowerController, self).__init__(
                                             state_dim=state_dim,
                                             goal_dim=goal_dim,
@@ -272,7 +310,8 @@ class LowerController(HRLControllerBase):
                                             add_entropy=add_entropy,
                                             burnin_action_func=burnin_action_func,
                                             temperature=temperature,
-                                            optimize_temp=optimize_low_temp)
+                                            optimize_temp=optimize_low_temp,
+                                            statistics_interval=statistics_interval)
 
     def observe(self, n_s, g, r, done):
 
@@ -304,7 +343,10 @@ class HigherController(HRLControllerBase):
             gpu=None,
             burnin_action_func=None,
             temperature=1.0,
-            optimize_high_temp=False):
+            optimize_high_temp=False,
+            candidate_goals=8,
+            correction_batch_size=4096,
+            statistics_interval=None):
         super(HigherController, self).__init__(
                                                 state_dim=state_dim,
                                                 goal_dim=goal_dim,
@@ -326,88 +368,88 @@ class HigherController(HRLControllerBase):
                                                 add_entropy=add_entropy,
                                                 burnin_action_func=burnin_action_func,
                                                 temperature=temperature,
-                                                optimize_temp=optimize_high_temp)
+                                                optimize_temp=optimize_high_temp,
+                                                statistics_interval=statistics_interval)
         self.action_dim = action_dim
+        self.candidate_goals = candidate_goals
+        self.correction_batch_size = correction_batch_size
 
-    def _off_policy_corrections(self,
-        low_con,
-        batch_size,
-        states,
-        actions,
-        next_states,
-        low_states,
-        low_actions,
-        candidate_goals=8):
-        # Scale
+    def _off_policy_corrections(
+        self, low_con, states, actions, next_states, low_states, low_actions
+    ):
+        """
+        relabel subgoals with the candidates that maximize the likelihood
+        of the low level actions. predicted actions of all the candidates
+        are computed in batches of at most correction_batch_size rows.
+
+        Args:
+            low_con (LowerController): controller whose policy is used.
+            states (torch.Tensor): states of shape (batch, state_dim).
+            actions (torch.Tensor): subgoals of shape (batch, goal_dim).
+            next_states (torch.Tensor): next states of shape (batch, state_dim).
+            low_states (torch.Tensor): low level states of shape
+                (batch, seq_len, state_dim).
+            low_actions (torch.Tensor): low level actions of shape
+                (batch, seq_len, action_dim).
+        Returns:
+            torch.Tensor: relabeled subgoals of shape (batch, goal_dim).
+        """
         goal_dim = self.action_dim
-        spec_range = low_con.scale
+        batch_size, seq_len = low_states.shape[:2]
+        scale = self.scale_tensor
         # Sample from normal distribution
-        loc = (next_states - states)[:, np.newaxis, :goal_dim]
-        scale = 0.5 * self.scale[None, None, :]
-        original_goal = np.array(actions[:, np.newaxis, :])
-        random_goals = np.random.normal(loc=loc, scale=scale, size=(batch_size, candidate_goals, original_goal.shape[-1]))
-
-        candidates = np.concatenate([original_goal, loc, random_goals], axis=1)
-        candidates = candidates.clip(-self.scale, self.scale)
-
-        # For ease
-        low_actions = np.array(low_actions)
-        seq_len = len(low_states[0])
-        new_batch_sz = seq_len * batch_size
-        low_action_dim = low_actions[0][0].shape
-        low_obs_dim = low_states[0][0].shape
+        loc = (next_states - states)[:, None, :goal_dim]
+        random_goals = loc + 0.5 * scale * torch.randn(
+            batch_size, self.candidate_goals, goal_dim, device=loc.device
+        )
+        candidates = torch.cat([actions[:, None], loc, random_goals], dim=1)
+        candidates = torch.max(torch.min(candidates, scale), -scale)
         ncands = candidates.shape[1]
 
-        true_low_actions = low_actions.reshape((new_batch_sz,) + low_action_dim)
-        observations = low_states.reshape((new_batch_sz,) + low_obs_dim)
-        goal_shape = (new_batch_sz, self.action_dim)
-
-        pred_actions = np.zeros((ncands, new_batch_sz) + low_action_dim)
-
-        low_con.agent.training = False
-        for c in range(ncands):
-            subgoal = candidates[:, c]
-            candidate = (subgoal + low_states[:, 0, :self.action_dim])[:, None] - low_states[:, :, :self.action_dim]
-            candidate = candidate.reshape(*goal_shape)
-            pred_actions[c] = low_con.policy(torch.tensor(observations).float(), torch.tensor(candidate).float())
-        low_con.agent.training = True
-
-        difference = (pred_actions - true_low_actions)
-        # difference = np.where(difference != -np.inf, difference, 0)
-        difference = difference.reshape((ncands, batch_size, seq_len) + low_action_dim).transpose(1, 0, 2, 3)
-
-        normalized_error = - np.square(difference) / np.square(spec_range)
-        fitness = np.sum(normalized_error, axis=(2, 3))
-        best_actions = np.argmax(fitness, axis=-1)
-
-        return candidates[np.arange(batch_size), best_actions]
-
+        # subgoals relative to each low level state of shape
+        # (batch, ncands, seq_len, goal_dim)
+        low_goal_states = low_states[:, None, :, :goal_dim]
+        subgoals = candidates[:, :, None] + low_goal_states[:, :, :1] - low_goal_states
+        observations = low_states[:, None].expand(-1, ncands, -1, -1)
+        inputs = torch.cat([observations, subgoals], dim=-1)
+        inputs = inputs.reshape(batch_size * ncands * seq_len, -1)
+        pred_actions = torch.cat(
+            [
+                low_con.deterministic_policy(chunk)
+                for chunk in torch.split(inputs, self.correction_batch_size)
+            ]
+        ).reshape(batch_size, ncands, seq_len, -1)
+
+        difference = pred_actions - low_actions[:, None]
+        normalized_error = -((difference / low_con.scale_tensor) ** 2)
+        fitness = normalized_error.sum(dim=(2, 3))
+        best_actions = fitness.argmax(dim=1)
+
+        return candidates[torch.arange(batch_size), best_actions]
 
     def update(self, low_con):
         batch = self.agent.sample_if_possible()
         if batch:
             experience = high_level_batch_experiences_with_goal(batch, self.device,
                 lambda x: x, self.gamma)
-            states = experience['state']
-            actions = experience['action']
-            next_states = experience['next_state']
-            action_arr = experience['action_arr']
-            state_arr = experience['state_arr']
-
-            actions = self._off_policy_corrections(
-                low_con,
-                self.minibatch_size,
-                states.cpu().data.numpy(),
-                actions.cpu().data.numpy(),
-                next_states.cpu().data.numpy(),
-                state_arr.cpu().data.numpy(),
-                action_arr.cpu().data.numpy())
-
-            tensor_actions = torch.FloatTensor(actions).to(self.agent.device)
-            # relabel actions
-            experience['action'] = tensor_actions
-
-            self.agent.high_level_update_batch(experience)
+            self.update_with_batch(experience, low_con)
+
+    def update_with_batch(self, batch, low_con):
+        """
+        relabel subgoals of a batch made by high_level_batch_experiences_with_goal
+        with the off policy correction, and train on it.
+        """
+        # relabel actions
+        batch["action"] = self._off_policy_corrections(
+            low_con,
+            batch["state"],
+            batch["action"],
+            batch["next_state"],
+            batch["state_arr"],
+            batch["action_arr"],
+        )
+
+        self.agent.high_level_update_batch(batch)
 
     def observe(self, state_arr, action_arr, r, g, n_s, done):
         """
@@ -396,9 +396,13 @@ class IQN(dqn.DQN):
                 eltwise_loss, batch_accumulator=self.batch_accumulator
             )
 
-    def _evaluate_model_and_update_recurrent_states(self, batch_obs):
+    def _evaluate_model_and_update_recurrent_states(self, batch_obs, env_ids=None):
         batch_xs = self.batch_states(batch_obs, self.device, self.phi)
-        if self.recurrent:
+        if self.recurrent and env_ids is not None:
+            tau2av = self._evaluate_model_and_update_env_recurrent_states(
+                batch_xs, env_ids
+            )
+        elif self.recurrent:
             if self.training:
                 self.train_prev_recurrent_states = self.train_recurrent_states
                 tau2av, self.train_recurrent_states = one_step_forward(
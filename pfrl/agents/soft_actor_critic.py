@@ -11,6 +11,8 @@ import pfrl
 from pfrl.agent import AttributeSavingMixin
 from pfrl.agent import BatchAgent
 from pfrl.utils.batch_states import batch_states
+from pfrl.utils.env_ids import batch_env_ids
+from pfrl.utils.env_ids import update_at_env_ids
 from pfrl.utils.copy_param import synchronize_parameters
 from pfrl.utils.mode_of_distribution import mode_of_distribution
 from pfrl.replay_buffer import batch_experiences
@@ -180,6 +182,8 @@ class SoftActorCritic(AttributeSavingMixin, BatchAgent):
         self.scale = scale
         self.t = 0
         self.goal_threshold = 5
+        self.batch_last_obs = []
+        self.batch_last_action = []
 
         # Target model
         self.target_q_func1 = copy.deepcopy(self.q_func1).eval().requires_grad_(False)
@@ -354,15 +358,19 @@ class SoftActorCritic(AttributeSavingMixin, BatchAgent):
 
         return batch_action
 
-    def batch_act(self, batch_obs):
+    def batch_act(self, batch_obs, env_ids=None):
         if self.training:
-            return self._batch_act_train(batch_obs)
+            return self._batch_act_train(batch_obs, env_ids)
         else:
             return self._batch_act_eval(batch_obs)
 
-    def batch_observe(self, batch_obs, batch_reward, batch_done, batch_reset):
+    def batch_observe(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
         if self.training:
-            self._batch_observe_train(batch_obs, batch_reward, batch_done, batch_reset)
+            self._batch_observe_train(
+                batch_obs, batch_reward, batch_done, batch_reset, env_ids
+            )
 
     def _batch_act_eval(self, batch_obs):
         assert not self.training
@@ -370,37 +378,41 @@ class SoftActorCritic(AttributeSavingMixin, BatchAgent):
             batch_obs, deterministic=self.act_deterministically
         )
 
-    def _batch_act_train(self, batch_obs):
+    def _batch_act_train(self, batch_obs, env_ids=None):
         assert self.training
         if self.burnin_action_func is not None and self.n_policy_updates == 0:
             batch_action = [self.burnin_action_func() for _ in range(len(batch_obs))]
         else:
             batch_action = self.batch_select_greedy_action(batch_obs)
-        self.batch_last_obs = list(batch_obs)
-        self.batch_last_action = list(batch_action)
+        self.batch_last_obs = update_at_env_ids(self.batch_last_obs, env_ids, batch_obs)
+        self.batch_last_action = update_at_env_ids(
+            self.batch_last_action, env_ids, batch_action
+        )
 
         return batch_action
 
-    def _batch_observe_train(self, batch_obs, batch_reward, batch_done, batch_reset):
+    def _batch_observe_train(
+        self, batch_obs, batch_reward, batch_done, batch_reset, env_ids=None
+    ):
         assert self.training
-        for i in range(len(batch_obs)):
+        for i, env_id in enumerate(batch_env_ids(env_ids, len(batch_obs))):
             self.t += 1
-            if self.batch_last_obs[i] is not None:
-                assert self.batch_last_action[i] is not None
+            if self.batch_last_obs[env_id] is not None:
+                assert self.batch_last_action[env_id] is not None
                 # Add a transition to the replay buffer
                 self.replay_buffer.append(
-                    state=self.batch_last_obs[i],
-                    action=self.batch_last_action[i],
+                    state=self.batch_last_obs[env_id],
+                    action=self.batch_last_action[env_id],
                     reward=batch_reward[i],
                     next_state=batch_obs[i],
                     next_action=None,
                     is_state_terminal=batch_done[i],
-                    env_id=i,
+                    env_id=env_id,
                 )
                 if batch_reset[i] or batch_done[i]:
-                    self.batch_last_obs[i] = None
-                    self.batch_last_action[i] = None
-                    self.replay_buffer.stop_current_episode(env_id=i)
+                    self.batch_last_obs[env_id] = None
+                    self.batch_last_action[env_id] = None
+                    self.replay_buffer.stop_current_episode(env_id=env_id)
             self.replay_updater.update_if_necessary(self.t)
 
     def get_statistics(self):
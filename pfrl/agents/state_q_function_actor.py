@@ -3,6 +3,7 @@ from logging import getLogger
 import torch
 
 from pfrl import agent
+from pfrl.collections.shared_memory_ring import SharedMemoryRing
 from pfrl.utils.batch_states import batch_states
 from pfrl.utils import evaluating
 from pfrl.utils.recurrent import one_step_forward
@@ -11,7 +12,14 @@ from pfrl.utils.recurrent import recurrent_state_as_numpy
 
 
 class StateQFunctionActor(agent.AsyncAgent):
-    """Actor that acts according to the Q-function."""
+    """Actor that acts according to the Q-function.
+
+    Transitions are sent to the learner through `pipe` unless
+    `shared_memory_capacity` is given, in which case they are written into a
+    `SharedMemoryRing` of that capacity that is sent to the learner once.
+    Transitions that do not fit the ring, e.g. ones with recurrent states, are
+    still sent through `pipe`.
+    """
 
     process_idx = None
     shared_attributes = ()
@@ -25,6 +33,7 @@ class StateQFunctionActor(agent.AsyncAgent):
         recurrent=False,
         logger=getLogger(__name__),
         batch_states=batch_states,
+        shared_memory_capacity=None,
     ):
         self.pipe = pipe
         self.model = model
@@ -33,6 +42,8 @@ class StateQFunctionActor(agent.AsyncAgent):
         self.recurrent = recurrent
         self.logger = logger
         self.batch_states = batch_states
+        self.shared_memory_capacity = shared_memory_capacity
+        self.shared_memory_ring = None
 
         self.t = 0
         self.last_state = None
@@ -68,7 +79,25 @@ class StateQFunctionActor(agent.AsyncAgent):
         return batch_av
 
     def _send_to_learner(self, transition, stop_episode=False):
-        self.pipe.send(("transition", transition))
+        if self.shared_memory_capacity is not None and self.shared_memory_ring is None:
+            try:
+                self.shared_memory_ring = SharedMemoryRing(
+                    transition, self.shared_memory_capacity
+                )
+                self.pipe.send(("shared_memory_ring", self.shared_memory_ring))
+            except ValueError:
+                self.logger.warning(
+                    "Transitions cannot be stored in shared memory. "
+                    "They are sent through the pipe instead."
+                )
+                self.shared_memory_capacity = None
+        if (
+            self.shared_memory_ring is not None
+            and self.shared_memory_ring.can_store(transition)
+        ):
+            self.shared_memory_ring.put(transition)
+        else:
+            self.pipe.send(("transition", transition))
         if stop_episode:
             self.pipe.send(("stop_episode", None))
             return self.pipe.recv()
@@ -0,0 +1,92 @@
+import itertools
+import pickle
+
+# Magic bytes followed by a version number
+_MAGIC = b"PFRLCHK\x01"
+
+
+def dump_chunks(f, items, header=None, chunk_size=1024, shared=False):
+    """Write items to a file as a sequence of pickled chunks.
+
+    Unlike pickling a whole collection at once, only one chunk of items is
+    serialized in memory at a time.
+
+    Args:
+        f: File object opened in binary mode.
+        items (iterable): Items to write.
+        header (object): Picklable object stored before the items.
+        chunk_size (int): Number of items per chunk.
+        shared (bool): If set to True, items are lists of objects that may
+            be shared by other items, e.g. N-step experiences that share
+            transitions. Each object is then written only once, in the chunk
+            of the first item that has it, and items refer to objects by
+            index, so that objects are still shared by items of different
+            chunks when loaded.
+    """
+    assert chunk_size > 0
+    f.write(_MAGIC)
+    pickle.dump(dict(header=header, shared=shared), f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Indices of the objects written so far
+    indices = {}
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, chunk_size))
+        if not chunk:
+            break
+        if shared:
+            objects = []
+            links = []
+            for item in chunk:
+                link = []
+                for x in item:
+                    index = indices.get(id(x))
+                    if index is None:
+                        index = indices[id(x)] = len(indices)
+                        objects.append(x)
+                    link.append(index)
+                links.append(link)
+            chunk = (objects, links)
+        pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # End of the stream
+    pickle.dump(None, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def is_chunk_stream(f):
+    """Return True if a file starts with a stream written by `dump_chunks`.
+
+    The position of the file is restored.
+    """
+    pos = f.tell()
+    magic = f.read(len(_MAGIC))
+    f.seek(pos)
+    return magic == _MAGIC
+
+
+def load_chunks(f):
+    """Read a stream written by `dump_chunks`.
+
+    Args:
+        f: File object opened in binary mode.
+    Returns:
+        tuple: The header and an iterator of the chunks, i.e. lists of items,
+            which reads the file chunk by chunk.
+    """
+    magic = f.read(len(_MAGIC))
+    if magic != _MAGIC:
+        raise ValueError("Not a chunk stream")
+    meta = pickle.load(f)
+
+    def chunks():
+        # Objects shared by items, in the order they were written
+        objects = []
+        while True:
+            chunk = pickle.load(f)
+            if chunk is None:
+                return
+            if meta["shared"]:
+                new_objects, links = chunk
+                objects.extend(new_objects)
+                chunk = [[objects[i] for i in link] for link in links]
+            yield chunk
+
+    return meta["header"], chunks()
@@ -0,0 +1,196 @@
+import zlib
+
+import numpy as np
+
+
+class Codec(object):
+    """Lossless compression of bytes.
+
+    Subclasses are registered by their `name`, which is stored with
+    compressed data so that they can be decompressed by name.
+    """
+
+    name = None
+
+    def encode(self, data):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    """Codec using `zlib` of the standard library.
+
+    Args:
+        level (int): Compression level from 0 to 9. Lower levels are faster.
+    """
+
+    name = "zlib"
+
+    def __init__(self, level=1):
+        assert 0 <= level <= 9
+        self.level = level
+
+    def encode(self, data):
+        return zlib.compress(data, self.level)
+
+    def decode(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Codec(Codec):
+    """Codec using the LZ4 frame format of the optional `lz4` package.
+
+    LZ4 compresses less than zlib but decompresses several times faster.
+
+    Args:
+        level (int): Compression level. 0 is the fastest.
+    """
+
+    name = "lz4"
+
+    def __init__(self, level=0):
+        try:
+            import lz4.frame
+        except ImportError:
+            raise RuntimeError("`lz4` package is required to use LZ4Codec.")
+        self._lz4 = lz4.frame
+        self.level = level
+
+    def encode(self, data):
+        return self._lz4.compress(data, compression_level=self.level)
+
+    def decode(self, data):
+        return self._lz4.decompress(data)
+
+
+_CODEC_CLASSES = {cls.name: cls for cls in [ZlibCodec, LZ4Codec]}
+_default_codecs = {}
+
+
+def get_codec(codec):
+    """Return a codec from a codec or its name.
+
+    Args:
+        codec (Codec or str): Codec, or name of a codec, i.e. "zlib" or "lz4".
+    Returns:
+        Codec: Codec. Codecs specified by name use their default settings.
+    """
+    if isinstance(codec, Codec):
+        return codec
+    if codec not in _default_codecs:
+        if codec not in _CODEC_CLASSES:
+            raise ValueError("Unknown codec: {}".format(codec))
+        _default_codecs[codec] = _CODEC_CLASSES[codec]()
+    return _default_codecs[codec]
+
+
+class CompressedArray(object):
+    """Compressed ndarray that remembers its dtype and shape.
+
+    Args:
+        codec (str): Name of the codec that compressed `data`.
+        dtype (str): Dtype of the array.
+        shape (tuple): Shape of the array.
+        data (bytes): Compressed contents of the array.
+    """
+
+    __slots__ = ("codec", "dtype", "shape", "data")
+
+    def __init__(self, codec, dtype, shape, data):
+        self.codec = codec
+        self.dtype = dtype
+        self.shape = shape
+        self.data = data
+
+    @classmethod
+    def compress(cls, array, codec):
+        """Compress an ndarray.
+
+        Args:
+            array (numpy.ndarray): Array to compress.
+            codec (Codec or str): Codec to use.
+        Returns:
+            CompressedArray: Compressed array.
+        """
+        codec = get_codec(codec)
+        array = np.ascontiguousarray(array)
+        return cls(codec.name, array.dtype.str, array.shape, codec.encode(array))
+
+    def decompress(self):
+        """Return the original ndarray as a new writable array."""
+        data = bytearray(get_codec(self.codec).decode(self.data))
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.shape)
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def __reduce__(self):
+        return (CompressedArray, (self.codec, self.dtype, self.shape, self.data))
+
+
+class FieldCodec(object):
+    """Compression of transitions with a codec chosen for each field.
+
+    Values of the chosen fields that can be converted to numeric ndarrays,
+    e.g. ndarrays and `pfrl.wrappers.atari_wrappers.LazyFrames`, are replaced
+    with `CompressedArray` by `encode` and restored as ndarrays by `decode`.
+    Other values are kept as they are.
+
+    Images compress well, while compressing low-dimensional float vectors
+    usually saves little and only costs time, so only the fields that are
+    worth compressing should be chosen.
+
+    Args:
+        codecs (dict): Codec or codec name for each field name to compress,
+            e.g. ``{"state": "lz4", "next_state": "lz4"}``.
+        min_nbytes (int): Arrays smaller than this number of bytes are kept
+            uncompressed.
+    """
+
+    def __init__(self, codecs, min_nbytes=64):
+        self.codecs = {key: get_codec(codec) for key, codec in codecs.items()}
+        self.min_nbytes = min_nbytes
+
+    def _encode_value(self, value, codec):
+        if value is None or not hasattr(value, "__array__"):
+            return value
+        array = np.asarray(value)
+        if array.dtype.hasobject or array.nbytes < self.min_nbytes:
+            return value
+        return CompressedArray.compress(array, codec)
+
+    def encode(self, transition):
+        """Return a copy of a transition dict with its fields compressed."""
+        encoded = dict(transition)
+        for key, codec in self.codecs.items():
+            if key in encoded:
+                encoded[key] = self._encode_value(encoded[key], codec)
+        return encoded
+
+    def decode(self, transition):
+        """Return a copy of a transition dict with its fields decompressed."""
+        decoded = dict(transition)
+        for key in self.codecs:
+            value = decoded.get(key)
+            if isinstance(value, CompressedArray):
+                decoded[key] = value.decompress()
+        return decoded
+
+    def decode_experiences(self, experiences):
+        """Decompress sampled experiences, i.e. lists of transitions.
+
+        Transitions shared by multiple experiences, e.g. overlapping N-step
+        experiences, are decompressed only once.
+        """
+        decoded = {}
+
+        def decode(transition):
+            key = id(transition)
+            if key not in decoded:
+                decoded[key] = self.decode(transition)
+            return decoded[key]
+
+        return [[decode(t) for t in experience] for experience in experiences]
@@ -0,0 +1,284 @@
+import numpy as np
+
+from pfrl.utils.random import sample_n_k
+
+
+def _allocate_column(value, size):
+    """Allocate an array that can hold `size` values like `value`."""
+    if value is not None:
+        arr = np.asarray(value)
+        if arr.dtype != object:
+            return np.zeros((size,) + arr.shape, dtype=arr.dtype)
+    return np.empty((size,), dtype=object)
+
+
+def _resize_column(column, size):
+    new_column = np.zeros((size,) + column.shape[1:], dtype=column.dtype)
+    new_column[: len(column)] = column
+    return new_column
+
+
+def _object_column(column):
+    new_column = np.empty(len(column), dtype=object)
+    for i in range(len(column)):
+        new_column[i] = column[i]
+    return new_column
+
+
+def _experience(columns, slots):
+    experience = []
+    for slot in slots:
+        transition = {}
+        for key, column in columns.items():
+            value = column[slot]
+            if isinstance(value, np.ndarray):
+                value = value.copy()
+            elif isinstance(value, np.generic):
+                value = value.item()
+            transition[key] = value
+        experience.append(transition)
+    return experience
+
+
+class ColumnarQueue(object):
+    """FIFO queue of n-step experiences stored as NumPy columns.
+
+    Each item of the queue is an experience, i.e. a list of between 1 and
+    n consecutive transition dicts, which is the format used by
+    `pfrl.replay_buffers.ReplayBuffer`. Instead of keeping these dicts, every
+    field of a transition is written into a preallocated array whose dtype and
+    shape are inferred from the first appended transition. The array is
+    promoted when a later value cannot be cast to its dtype without losing
+    its kind, e.g. a float after an int. Values that cannot be represented by
+    the array (e.g. None or values of other shapes) are kept in object arrays.
+
+    Transitions shared by overlapping n-step experiences are stored only
+    once; an experience is a row of indices into the transition columns.
+
+    `sample` returns a `ColumnarSample`, which holds the sampled indices so
+    that a whole minibatch can be gathered with one fancy-indexing per field.
+
+    Args:
+        maxlen (int or None): Maximum number of experiences.
+        num_steps (int): Maximum number of transitions per experience.
+    """
+
+    def __init__(self, maxlen=None, num_steps=1):
+        assert maxlen is None or maxlen > 0
+        assert num_steps > 0
+        self.maxlen = maxlen
+        self.num_steps = num_steps
+        self._size = maxlen if maxlen is not None else 1024
+        self._head = 0
+        self._len = 0
+        self._links = np.zeros((self._size, num_steps), dtype=np.int64)
+        self._lengths = np.zeros(self._size, dtype=np.int64)
+        self.columns = None
+        self._slot_size = 0
+        self._free_slots = []
+        # Number of stored experiences that refer to each slot
+        self._refcounts = None
+        # Slots of transitions that can still appear in future experiences
+        self._open_slots = {}
+        self._is_open = None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self[i]
+
+    def __repr__(self):
+        return "ColumnarQueue(maxlen={}, num_steps={}, len={})".format(
+            self.maxlen, self.num_steps, self._len
+        )
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("ColumnarQueue index out of range")
+        row = (self._head + i) % self._size
+        return _experience(self.columns, self._links[row, : self._lengths[row]])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Transitions that are not yet stored as the first one of an
+        # experience are owned by the replay buffer, which does not persist
+        # them, so their slots are released here.
+        state["_open_slots"] = {}
+        if self._refcounts is not None:
+            unused = np.flatnonzero(self._is_open & (self._refcounts == 0))
+            state["_free_slots"] = self._free_slots + unused.tolist()
+            state["_is_open"] = np.zeros_like(self._is_open)
+        return state
+
+    def _init_columns(self, transition):
+        self._slot_size = self._size + self.num_steps
+        self.columns = {
+            key: _allocate_column(value, self._slot_size)
+            for key, value in transition.items()
+        }
+        self._refcounts = np.zeros(self._slot_size, dtype=np.int64)
+        self._is_open = np.zeros(self._slot_size, dtype=bool)
+        self._free_slots = list(reversed(range(self._slot_size)))
+
+    def _grow_slots(self):
+        size = self._slot_size + max(self._slot_size // 8, self.num_steps)
+        for key, column in self.columns.items():
+            self.columns[key] = _resize_column(column, size)
+        self._refcounts = _resize_column(self._refcounts, size)
+        self._is_open = _resize_column(self._is_open, size)
+        self._free_slots.extend(reversed(range(self._slot_size, size)))
+        self._slot_size = size
+
+    def _grow_rows(self):
+        # Unroll the ring so that the oldest experience is at row zero
+        order = (self._head + np.arange(self._len)) % self._size
+        size = self._size * 2
+        links = np.zeros((size, self.num_steps), dtype=np.int64)
+        lengths = np.zeros(size, dtype=np.int64)
+        links[: self._len] = self._links[order]
+        lengths[: self._len] = self._lengths[order]
+        self._links = links
+        self._lengths = lengths
+        self._head = 0
+        self._size = size
+
+    def _write(self, slot, transition):
+        if transition.keys() != self.columns.keys():
+            raise ValueError(
+                "Transitions must have the same keys: expected {}, got {}".format(
+                    sorted(self.columns.keys()), sorted(transition.keys())
+                )
+            )
+        for key, value in transition.items():
+            column = self.columns[key]
+            if column.dtype != object:
+                arr = None if value is None else np.asarray(value)
+                if (
+                    arr is None
+                    or arr.dtype == object
+                    or arr.shape != column.shape[1:]
+                    or (column.dtype.kind in "USV" and arr.dtype != column.dtype)
+                ):
+                    # Fall back to an object column for this field
+                    column = _object_column(column)
+                    self.columns[key] = column
+                elif not np.can_cast(arr.dtype, column.dtype, "same_kind"):
+                    # Promote the column so that values are not truncated,
+                    # e.g. float rewards after an int reward
+                    column = column.astype(np.result_type(column.dtype, arr.dtype))
+                    self.columns[key] = column
+            column[slot] = value
+
+    def _slot_of(self, transition):
+        slot = self._open_slots.get(id(transition))
+        if slot is None:
+            if self.columns is None:
+                self._init_columns(transition)
+            if not self._free_slots:
+                self._grow_slots()
+            slot = self._free_slots.pop()
+            self._write(slot, transition)
+            self._open_slots[id(transition)] = slot
+            self._is_open[slot] = True
+        return slot
+
+    def append(self, experience):
+        """Append an experience, i.e. a list of transition dicts."""
+        assert 0 < len(experience) <= self.num_steps
+        if self.maxlen is not None and self._len == self.maxlen:
+            self._discard_first()
+        elif self._len == self._size:
+            self._grow_rows()
+        slots = [self._slot_of(transition) for transition in experience]
+        # The first transition of an experience never appears again in later
+        # experiences, so it no longer needs to be tracked.
+        self._is_open[self._open_slots.pop(id(experience[0]))] = False
+        row = (self._head + self._len) % self._size
+        self._links[row, : len(slots)] = slots
+        self._links[row, len(slots) :] = slots[0]
+        self._lengths[row] = len(slots)
+        self._refcounts[slots] += 1
+        self._len += 1
+
+    def popleft(self):
+        if self._len == 0:
+            raise IndexError("pop from empty ColumnarQueue")
+        ret = self[0]
+        self._discard_first()
+        return ret
+
+    def _discard_first(self):
+        slots = self._links[self._head, : self._lengths[self._head]]
+        self._refcounts[slots] -= 1
+        unused = slots[(self._refcounts[slots] == 0) & ~self._is_open[slots]]
+        self._free_slots.extend(unused.tolist())
+        self._head = (self._head + 1) % self._size
+        self._len -= 1
+
+    def sample(self, k):
+        rows = (self._head + sample_n_k(self._len, k)) % self._size
+        return ColumnarSample(
+            self.columns, self._links[rows], self._lengths[rows].copy()
+        )
+
+
+class ColumnarSample(object):
+    """Experiences sampled from a `ColumnarQueue`.
+
+    This object behaves like a list of experiences, each of which is a list
+    of transition dicts, so it can be used wherever a sample of
+    `pfrl.replay_buffers.ReplayBuffer` is expected. `gather_first`,
+    `gather_last` and `gather_steps` retrieve a field of all the experiences
+    at once as an array.
+
+    The sampled indices refer to the storage of the queue, so the sample
+    should be consumed before more experiences are appended to the queue.
+
+    Args:
+        columns (dict): Transition columns of the queue.
+        links (ndarray): Slots of transitions of each experience.
+        lengths (ndarray): Number of transitions of each experience.
+    """
+
+    def __init__(self, columns, links, lengths):
+        self.columns = columns
+        self.links = links
+        self.lengths = lengths
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if i not in self._cache:
+            if not -len(self) <= i < len(self):
+                raise IndexError("ColumnarSample index out of range")
+            slots = self.links[i, : self.lengths[i]]
+            self._cache[i] = _experience(self.columns, slots)
+        return self._cache[i]
+
+    def gather_first(self, key):
+        """Return the values of the first transitions of the experiences."""
+        return self.columns[key][self.links[:, 0]]
+
+    def gather_last(self, key):
+        """Return the values of the last transitions of the experiences."""
+        return self.columns[key][self.links[np.arange(len(self)), self.lengths - 1]]
+
+    def gather_steps(self, key):
+        """Return the values of all the transitions as a (batch, n) array.
+
+        Returns:
+            ndarray: Gathered values.
+            ndarray: Boolean mask that is True for valid transitions.
+        """
+        mask = np.arange(self.links.shape[1]) < self.lengths[:, None]
+        return self.columns[key][self.links], mask
@@ -1,11 +1,17 @@
 import binascii
 import collections
 from datetime import datetime
+import io
+import itertools
+import mmap
 from struct import pack, unpack, calcsize
 import os
 import pickle
 
+import numpy as np
+
 from pfrl.collections.random_access_queue import RandomAccessQueue
+from pfrl.utils.random import sample_n_k
 
 
 # code for future extension. `_VanillaFS` is a dummy of chainerio's
@@ -18,11 +24,42 @@ _INDEX_FILENAME_FORMAT = "chunk.{}.idx"
 _DATA_FILENAME_FORMAT = "chunk.{}.data"
 
 
+# NumPy equivalent of `_ChunkWriter.index_format`
+_INDEX_DTYPE = np.dtype(
+    [
+        ("gen", np.uint64),
+        ("offset", np.uint64),
+        ("length", np.uint64),
+        ("crc", np.uint32),
+        ("status", np.int32),
+    ]
+)
+
+
 class _ChunkReader(object):
     def __init__(self, datadir, fs):
         self.datadir = datadir
         self.fs = fs
 
+    def read_chunk_index_array(self, gen):
+        """Read the index file of a chunk as a structured array."""
+        indexfile = os.path.join(self.datadir, _INDEX_FILENAME_FORMAT.format(gen))
+        with self.fs.open(indexfile, "rb") as ifp:
+            idata = ifp.read()
+        # Ignore a partially written entry at the end
+        n = len(idata) // _INDEX_DTYPE.itemsize
+        return np.frombuffer(idata, dtype=_INDEX_DTYPE, count=n)
+
+    def map_chunk(self, gen):
+        """Map the data file of a chunk into memory without reading it."""
+        datafile = os.path.join(self.datadir, _DATA_FILENAME_FORMAT.format(gen))
+        with self.fs.open(datafile, "rb") as dfp:
+            try:
+                return mmap.mmap(dfp.fileno(), 0, access=mmap.ACCESS_READ)
+            except (io.UnsupportedOperation, OSError, ValueError):
+                # Files that cannot be mapped, e.g. empty ones, are read
+                return dfp.read()
+
     def read_chunk_index(self, gen):
         index_format = _ChunkWriter.index_format
         index_format_size = _ChunkWriter.index_format_size
@@ -63,14 +100,13 @@ class _ChunkReader(object):
             indexfile = os.path.join(self.datadir, _INDEX_FILENAME_FORMAT.format(gen))
             datafile = os.path.join(self.datadir, _DATA_FILENAME_FORMAT.format(gen))
             if self.fs.exists(indexfile) and self.fs.exists(datafile):
-                count = len(list(self.read_chunk_index(gen)))
+                count = len(self.read_chunk_index_array(gen))
                 yield gen, count
                 gen += 1
                 continue
             break
 
-    def read_chunks(self, maxlen, buf):
-        """Efficiently read all data needed (but scans all index)"""
+    def _select_chunks(self, maxlen):
         gens = []
         chunks = list(self._count_all_chunks())
         # chunks: [(0, 1024), (1, 1024), ..., (n, 1024)]
@@ -86,18 +122,155 @@ class _ChunkReader(object):
                 break
         # gens: [n, n-1, ..., m]
         gens.reverse()
+        next_gen = len(chunks)
+        return gens, next_gen
+
+    def read_chunks(self, maxlen, buf):
+        """Efficiently read all data needed (but scans all index)"""
+        gens, next_gen = self._select_chunks(maxlen)
         for gen in gens:
             buf.extend(obj for obj in self.read_chunk(gen))
+        return next_gen
+
+    def map_chunks(self, maxlen, entries):
+        """Map all data needed into `_MappedEntries` without reading them"""
+        gens, next_gen = self._select_chunks(maxlen)
+        for gen in gens:
+            entries.add_chunk(self.map_chunk(gen), self.read_chunk_index_array(gen))
+        return next_gen
+
+
+class _MappedEntries(object):
+    """Queue of entries of mapped chunks that are unpickled on access.
+
+    Only the offset, length and CRC of each entry are kept in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.chunk_ids = np.zeros(0, dtype=np.int32)
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.lengths = np.zeros(0, dtype=np.int64)
+        self.crcs = np.zeros(0, dtype=np.uint32)
+        self.head = 0
+
+    def __len__(self):
+        return len(self.offsets) - self.head
+
+    def add_chunk(self, data, index):
+        # Entries before the head are not needed anymore
+        chunk_ids = np.full(len(index), len(self.chunks), dtype=np.int32)
+        self.chunk_ids = np.concatenate([self.chunk_ids[self.head :], chunk_ids])
+        self.offsets = np.concatenate(
+            [self.offsets[self.head :], index["offset"].astype(np.int64)]
+        )
+        self.lengths = np.concatenate(
+            [self.lengths[self.head :], index["length"].astype(np.int64)]
+        )
+        self.crcs = np.concatenate([self.crcs[self.head :], index["crc"]])
+        self.head = 0
+        self.chunks.append(data)
+
+    def __getitem__(self, i):
+        j = self.head + i
+        offset = self.offsets[j]
+        data = self.chunks[self.chunk_ids[j]][offset : offset + self.lengths[j]]
+        crc = binascii.crc32(data)
+        assert crc == self.crcs[j]
+        return pickle.loads(data)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def popleft(self):
+        assert len(self) > 0
+        self.head += 1
+
+    def truncate(self, maxlen):
+        """Drop the oldest entries so that at most maxlen entries remain."""
+        if maxlen is not None and len(self) > maxlen:
+            self.head += len(self) - maxlen
+
+
+class MappedRandomAccessQueue(object):
+    """RandomAccessQueue whose oldest data can be mapped from storage.
+
+    Data mapped into `mapped`, e.g. by `_ChunkReader.map_chunks`, are older
+    than the data appended to this queue, which are kept in memory in
+    `buffer`. A mapped datum is unpickled every time it is accessed. Mapped
+    data are removed first when `maxlen` is reached.
+
+    Args:
+        maxlen (int): Max length of queue.
+    """
+
+    def __init__(self, maxlen=None):
+        self.buffer = RandomAccessQueue(maxlen=maxlen)
+        self.mapped = _MappedEntries()
+        # Number of data appended before the ones appended to `buffer`
+        self.n_appended_before = 0
+
+    @property
+    def maxlen(self):
+        return self.buffer.maxlen
+
+    @property
+    def n_appended(self):
+        return self.n_appended_before + self.buffer.n_appended
+
+    def _make_room(self):
+        if len(self.mapped) > 0 and len(self) == self.buffer.maxlen:
+            self.mapped.popleft()
+
+    def append(self, value):
+        self._make_room()
+        self.buffer.append(value)
+
+    def extend(self, xs):
+        for x in xs:
+            self.append(x)
+
+    def __iter__(self):
+        if len(self.mapped) > 0:
+            return itertools.chain(self.mapped, self.buffer)
+        return iter(self.buffer)
+
+    def __repr__(self):
+        return "MappedRandomAccessQueue({})".format(str(self.buffer))
+
+    def __getitem__(self, i):
+        n_mapped = len(self.mapped)
+        if n_mapped == 0:
+            return self.buffer[i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("{} index out of range".format(type(self).__name__))
+        if i < n_mapped:
+            return self.mapped[i]
+        return self.buffer[i - n_mapped]
+
+    def sample(self, n):
+        if len(self.mapped) == 0:
+            return self.buffer.sample(n)
+        return [self[i] for i in sample_n_k(len(self), n)]
+
+    def popleft(self):
+        if len(self.mapped) > 0:
+            self.mapped.popleft()
+        else:
+            self.buffer.popleft()
 
-        gen = max(gens) + 1 if gens else 0
-        return gen
+    def __len__(self):
+        return len(self.mapped) + len(self.buffer)
 
 
 class _ChunkWriter(object):
     index_format = "QQQIi"
     index_format_size = calcsize(index_format)
 
-    def __init__(self, datadir, gen, chunksize, fs, do_pickle=True):
+    def __init__(self, datadir, gen, chunksize, fs, do_pickle=True, flush_interval=1):
         self.datadir = datadir
         self.gen = gen
         assert gen >= 0
@@ -106,6 +279,11 @@ class _ChunkWriter(object):
         assert chunksize > 0
         self.do_pickle = do_pickle
         self.fs = fs
+        assert flush_interval > 0
+        self.flush_interval = flush_interval
+        # Index entries not written yet, which are written after their data
+        # are flushed so that the index never refers to missing data
+        self.pending_indices = []
 
         # AppendOnly
         self.indexfile = os.path.join(datadir, _INDEX_FILENAME_FORMAT.format(gen))
@@ -130,6 +308,8 @@ class _ChunkWriter(object):
         +-------+-------+-------+---+---+
         Indices are appended to index files. Number of max entries per index
         file is to be preset.
+
+        Data and indices are flushed every `flush_interval` appends.
         """
         if self.is_full():
             raise RuntimeError("Already chunk written full")
@@ -138,29 +318,39 @@ class _ChunkWriter(object):
             data = pickle.dumps(data)
 
         self.dfp.write(data)
-        self.dfp.flush()
         crc = binascii.crc32(data)
         length = len(data)
         index = pack(self.index_format, self.gen, self.offset, length, crc, 0)
-        self.ifp.write(index)
-        self.ifp.flush()
+        self.pending_indices.append(index)
+        if len(self.pending_indices) >= self.flush_interval:
+            self.flush()
 
         self.offset += length
         self.full = self.chunksize < self.offset
         if self.is_full():
             self.close()
 
+    def flush(self):
+        """Write data and indices appended so far to the files."""
+        self.dfp.flush()
+        if self.pending_indices:
+            self.ifp.write(b"".join(self.pending_indices))
+            self.pending_indices = []
+        self.ifp.flush()
+
     def __del__(self):
         if not self.full:
             self.close()
 
     def close(self):
         self.full = True
+        if not self.dfp.closed:
+            self.flush()
         self.dfp.close()
         self.ifp.close()
 
 
-class PersistentRandomAccessQueue(object):
+class PersistentRandomAccessQueue(MappedRandomAccessQueue):
     """Persistent data structure for replay buffer
 
     Features:
@@ -181,16 +371,35 @@ class PersistentRandomAccessQueue(object):
             this limit is only removed from memory, not from storage.
         ancestor (str): Path to pre-generated replay buffer.
         logger: logger
+        lazy_load (bool): If set to True, data stored on storage, i.e. data of
+            the ancestors and of a previous run with the same `basedir`, are
+            not loaded at initialization. Their files are memory-mapped
+            instead, and each datum is unpickled every time it is accessed,
+            e.g. sampled. Only the indices of the data are kept in memory.
+        flush_interval (int): Number of appended data after which data and
+            indices are flushed to storage. Data appended after the last flush
+            can be lost when the process crashes.
 
     """
 
-    def __init__(self, basedir, maxlen, *, ancestor=None, logger=None):
+    def __init__(
+        self,
+        basedir,
+        maxlen,
+        *,
+        ancestor=None,
+        logger=None,
+        lazy_load=False,
+        flush_interval=1,
+    ):
         assert maxlen is None or maxlen > 0
         self.basedir = basedir
         self._setup_fs(None)
         self._setup_datadir()
         self.meta = None
-        self.buffer = RandomAccessQueue(maxlen=maxlen)
+        super().__init__(maxlen=maxlen)
+        self.lazy_load = lazy_load
+        self.flush_interval = flush_interval
         self.logger = logger
         self.ancestor_meta = None
         if ancestor is not None:
@@ -204,22 +413,34 @@ class PersistentRandomAccessQueue(object):
 
         if self.fs.exists(self.datadir):
             reader = _ChunkReader(self.datadir, self.fs)
-            self.gen = reader.read_chunks(maxlen, self.buffer)
+            if self.lazy_load:
+                self.gen = reader.map_chunks(maxlen, self.mapped)
+                self.mapped.truncate(maxlen)
+            else:
+                self.gen = reader.read_chunks(maxlen, self.buffer)
 
         else:
             self.gen = 0
             self.fs.makedirs(self.datadir, exist_ok=True)
 
-        self.tail = _ChunkWriter(
-            self.datadir, self.gen, self.chunk_size, self.fs, do_pickle=True
-        )  # Last chunk to be appended
+        self.tail = self._make_writer()  # Last chunk to be appended
         self.gen += 1
 
         if self.logger:
             self.logger.info(
-                "Initial buffer size=%d, next gen=%d", len(self.buffer), self.gen
+                "Initial buffer size=%d, next gen=%d", len(self), self.gen
             )
 
+    def _make_writer(self):
+        return _ChunkWriter(
+            self.datadir,
+            self.gen,
+            self.chunk_size,
+            self.fs,
+            do_pickle=True,
+            flush_interval=self.flush_interval,
+        )
+
     def _load_meta(self, ancestor, maxlen):
         # This must be checked by single process to avoid race
         # condition where one creates and the other may detect it
@@ -268,11 +489,13 @@ class PersistentRandomAccessQueue(object):
         self.tail.close()
         self.tail = None
 
+    def flush(self):
+        """Flush appended data to storage."""
+        self.tail.flush()
+
     def _append(self, value):
         if self.tail.is_full():
-            self.tail = _ChunkWriter(
-                self.datadir, self.gen, self.chunk_size, self.fs, do_pickle=True
-            )
+            self.tail = self._make_writer()
             if self.logger:
                 self.logger.info("Chunk rotated. New gen=%d", self.gen)
             self.gen += 1
@@ -282,15 +505,7 @@ class PersistentRandomAccessQueue(object):
     # RandomAccessQueue-compat methods
     def append(self, value):
         self._append(value)
-        self.buffer.append(value)
-
-    def extend(self, xs):
-        for x in xs:
-            self._append(x)
-        self.buffer.extend(xs)
-
-    def __iter__(self):
-        return iter(self.buffer)
+        super().append(value)
 
     def __repr__(self):
         return "PersistentRandomAccessQueue({})".format(str(self.buffer))
@@ -298,18 +513,6 @@ class PersistentRandomAccessQueue(object):
     def __setitem__(self, i, x):
         raise NotImplementedError()
 
-    def __getitem__(self, i):
-        return self.buffer[i]
-
-    def sample(self, n):
-        return self.buffer.sample(n)
-
-    def popleft(self):
-        self.buffer.popleft()
-
-    def __len__(self):
-        return len(self.buffer)
-
     @property
     def maxlen(self):
         return self.meta["maxlen"]
@@ -389,14 +592,162 @@ class PersistentRandomAccessQueue(object):
 
         for datadir in datadirs:
             reader = _ChunkReader(datadir, self.fs)
-            rank_data = []
-            maxlen = num_data_needed - len(self.buffer)
+            maxlen = num_data_needed - len(self)
             if maxlen <= 0:
                 break
-            _ = reader.read_chunks(maxlen, rank_data)
+            if self.lazy_load:
+                n_mapped = len(self.mapped)
+                _ = reader.map_chunks(maxlen, self.mapped)
+                n_loaded = len(self.mapped) - n_mapped
+                self.mapped.truncate(self.buffer.maxlen)
+            else:
+                rank_data = []
+                _ = reader.read_chunks(maxlen, rank_data)
+                n_loaded = len(rank_data)
+                self.buffer.extend(rank_data)
             if self.logger:
                 self.logger.info(
-                    "%d data loaded to buffer (rank=%d)", len(rank_data), self.comm_rank
+                    "%d data loaded to buffer (rank=%d)", n_loaded, self.comm_rank
                 )
-            self.buffer.extend(rank_data)
         return meta
+
+
+_SNAPSHOT_META_FILENAME = "snapshot.pkl"
+
+
+class IncrementalSnapshot(object):
+    """Snapshot of a queue on storage that is updated incrementally.
+
+    `save` writes only the data appended to a queue after the last `save` of
+    the same queue, in chunk files of the same format as
+    `PersistentRandomAccessQueue`, and deletes the chunk files whose data have
+    all been removed from the queue. The list of chunks is kept in a meta
+    file, which is replaced only after new chunks are written, so an
+    interrupted `save` leaves the previous snapshot intact.
+
+    Data are identified by `n_appended` of `RandomAccessQueue` or
+    `MappedRandomAccessQueue`. A queue is saved incrementally only if it is
+    the queue last saved to or loaded from this object; other queues are
+    saved from scratch. In-place modifications of saved data are not saved.
+
+    Args:
+        dirname (str): Path to the directory of the snapshot.
+        chunk_size (int): Size of a chunk file in bytes after which the next
+            chunk file is started.
+    """
+
+    def __init__(self, dirname, chunk_size=64 * 1024 * 1024):
+        assert chunk_size > 0
+        self.dirname = dirname
+        self.chunk_size = chunk_size
+        self.fs = _VanillaFS(open=open, exists=os.path.exists, makedirs=os.makedirs)
+        self.meta_file = os.path.join(dirname, _SNAPSHOT_META_FILENAME)
+        self.meta = None
+        if self.fs.exists(self.meta_file):
+            with self.fs.open(self.meta_file, "rb") as fp:
+                self.meta = pickle.load(fp)
+        # Queue whose data up to meta["n_appended"] are in the snapshot
+        self.queue = None
+
+    def save(self, queue):
+        """Save the data of a queue that are not in the snapshot yet.
+
+        Args:
+            queue (RandomAccessQueue or MappedRandomAccessQueue): Queue.
+        """
+        n_appended = queue.n_appended
+        start = n_appended - len(queue)
+        meta = self.meta
+        if (
+            meta is not None
+            and queue is self.queue
+            and meta["n_appended"] <= n_appended
+        ):
+            # Chunks that still have data of the queue are kept
+            chunks = [
+                dict(chunk)
+                for chunk in meta["chunks"]
+                if chunk["start"] + chunk["count"] > start
+            ]
+            write_from = max(meta["n_appended"], start)
+        else:
+            chunks = []
+            write_from = start
+        gen = meta["next_gen"] if meta is not None else 0
+
+        self.fs.makedirs(self.dirname, exist_ok=True)
+        writer = None
+        for i in range(write_from, n_appended):
+            if writer is None or writer.is_full():
+                if writer is not None:
+                    writer.close()
+                writer = _ChunkWriter(
+                    self.dirname, gen, self.chunk_size, self.fs, flush_interval=1024
+                )
+                chunks.append(dict(gen=gen, start=i, count=0))
+                gen += 1
+            writer.append(queue[i - start])
+            chunks[-1]["count"] += 1
+        if writer is not None:
+            writer.close()
+
+        new_meta = dict(
+            n_appended=n_appended,
+            start=start,
+            maxlen=queue.maxlen,
+            chunks=chunks,
+            next_gen=gen,
+        )
+        tmp_file = self.meta_file + ".tmp"
+        with self.fs.open(tmp_file, "wb") as fp:
+            pickle.dump(new_meta, fp)
+        os.replace(tmp_file, self.meta_file)
+
+        if meta is not None:
+            kept_gens = set(chunk["gen"] for chunk in chunks)
+            for chunk in meta["chunks"]:
+                if chunk["gen"] not in kept_gens:
+                    self._remove_chunk(chunk["gen"])
+        self.meta = new_meta
+        self.queue = queue
+
+    def _remove_chunk(self, gen):
+        for filename_format in [_INDEX_FILENAME_FORMAT, _DATA_FILENAME_FORMAT]:
+            os.remove(os.path.join(self.dirname, filename_format.format(gen)))
+
+    def load(self, lazy=False):
+        """Load the data of the snapshot into a new queue.
+
+        Args:
+            lazy (bool): If set to True, chunk files are memory-mapped instead
+                of being read, and data are unpickled every time they are
+                accessed.
+        Returns:
+            RandomAccessQueue or MappedRandomAccessQueue: Queue with the same
+                data, `maxlen` and `n_appended` as the saved queue. It can be
+                saved to this object incrementally.
+        """
+        if self.meta is None:
+            raise FileNotFoundError("No snapshot in {}".format(self.dirname))
+        meta = self.meta
+        reader = _ChunkReader(self.dirname, self.fs)
+        if lazy:
+            queue = MappedRandomAccessQueue(maxlen=meta["maxlen"])
+            for chunk in meta["chunks"]:
+                index = reader.read_chunk_index_array(chunk["gen"])
+                queue.mapped.add_chunk(
+                    reader.map_chunk(chunk["gen"]), index[: chunk["count"]]
+                )
+            queue.n_appended_before = meta["n_appended"]
+        else:
+            queue = RandomAccessQueue(maxlen=meta["maxlen"])
+            for chunk in meta["chunks"]:
+                queue.extend(
+                    itertools.islice(reader.read_chunk(chunk["gen"]), chunk["count"])
+                )
+            queue.n_appended = meta["n_appended"]
+        # Data of the first chunk may have been removed before saving
+        for _ in range(len(queue) - (meta["n_appended"] - meta["start"])):
+            queue.popleft()
+        self.queue = queue
+        return queue
@@ -6,16 +6,45 @@ from pfrl.utils.random import sample_n_k
 
 
 class PrioritizedBuffer(object):
+    """Queue of data with priorities for prioritized sampling.
+
+    Args:
+        capacity (int or None): Maximum number of data.
+        wait_priority_after_sampling (bool): If set to True, sampled data
+            are not sampled again until their priorities are set by
+            `set_last_priority`.
+        initial_max_priority (float): Priority of data appended without
+            priority until a larger priority is set.
+        tree_backend (str): Implementation of trees of priorities.
+            ``'nested'`` (default): trees of nested lists, i.e.
+            `SumTreeQueue` and `MinTreeQueue`. ``'flat'``: segment trees
+            stored in flat NumPy arrays, i.e. `FlatSumTreeQueue` and
+            `FlatMinTreeQueue`, which sample and update priorities of a
+            minibatch with vectorized operations.
+    """
+
     def __init__(
-        self, capacity=None, wait_priority_after_sampling=True, initial_max_priority=1.0
+        self,
+        capacity=None,
+        wait_priority_after_sampling=True,
+        initial_max_priority=1.0,
+        tree_backend="nested",
     ):
+        assert tree_backend in ["nested", "flat"]
         self.capacity = capacity
         self.data = collections.deque()
-        self.priority_sums = SumTreeQueue()
-        self.priority_mins = MinTreeQueue()
+        if tree_backend == "flat":
+            self.priority_sums = FlatSumTreeQueue(capacity=capacity)
+            self.priority_mins = FlatMinTreeQueue(capacity=capacity)
+        else:
+            self.priority_sums = SumTreeQueue()
+            self.priority_mins = MinTreeQueue()
         self.max_priority = initial_max_priority
         self.wait_priority_after_sampling = wait_priority_after_sampling
         self.flag_wait_priority = False
+        # Number of popped data, which converts indices into ids that do not
+        # change when data are popped
+        self.n_popped = 0
 
     def __len__(self):
         return len(self.data)
@@ -35,9 +64,10 @@ class PrioritizedBuffer(object):
         assert len(self) > 0
         self.priority_sums.popleft()
         self.priority_mins.popleft()
+        self.n_popped += 1
         return self.data.popleft()
 
-    def _sample_indices_and_probabilities(self, n, uniform_ratio):
+    def _sample_indices_and_probabilities(self, n, uniform_ratio, stratified=False):
         total_priority = self.priority_sums.sum()
         min_prob = self.priority_mins.min() / total_priority
         indices = []
@@ -53,17 +83,22 @@ class PrioritizedBuffer(object):
             n -= n_uniform
             min_prob = uniform_ratio / len(self) + (1 - uniform_ratio) * min_prob
 
-        pr_indices, pr_priorities = self.priority_sums.prioritized_sample(
-            n, remove=self.wait_priority_after_sampling
-        )
+        if stratified:
+            pr_indices, pr_priorities = self.priority_sums.stratified_sample(
+                n, remove=self.wait_priority_after_sampling
+            )
+        else:
+            pr_indices, pr_priorities = self.priority_sums.prioritized_sample(
+                n, remove=self.wait_priority_after_sampling
+            )
         indices.extend(pr_indices)
         priorities.extend(pr_priorities)
 
-        probs = [
-            uniform_ratio / len(self) + (1 - uniform_ratio) * pri / total_priority
-            for pri in priorities
-        ]
-        return indices, probs, min_prob
+        priorities = np.asarray(priorities, dtype=np.float64)
+        probs = uniform_ratio / len(self) + (1 - uniform_ratio) * (
+            priorities / total_priority
+        )
+        return np.asarray(indices, dtype=np.int64), probs, min_prob
 
     def sample(self, n, uniform_ratio=0):
         """Sample data along with their corresponding probabilities.
@@ -82,19 +117,96 @@ class PrioritizedBuffer(object):
         sampled = [self.data[i] for i in indices]
         self.sampled_indices = indices
         self.flag_wait_priority = True
-        return sampled, probabilities, min_prob
+        return sampled, list(probabilities), min_prob
+
+    def sample_stratified(self, n, uniform_ratio=0):
+        """Sample data by stratified sampling over priorities.
+
+        The total priority is split into n segments of equal size and a datum
+        is sampled from each segment, which gives batches of lower variance
+        than independent samples. All the samples are found at once.
+
+        Unlike `sample`, the same datum can be sampled more than once when its
+        priority spans multiple segments.
+
+        Args:
+            n (int): Number of data to sample.
+            uniform_ratio (float): Ratio of uniformly sampled data.
+        Returns:
+            sampled data (list)
+            indices (ndarray)
+            probabilities (ndarray)
+            minimum probability (float)
+        """
+        assert not self.wait_priority_after_sampling or not self.flag_wait_priority
+        indices, probabilities, min_prob = self._sample_indices_and_probabilities(
+            n, uniform_ratio=uniform_ratio, stratified=True
+        )
+        sampled = [self.data[i] for i in indices]
+        self.sampled_indices = indices
+        self.flag_wait_priority = True
+        return sampled, indices, probabilities, min_prob
 
     def set_last_priority(self, priority):
         assert not self.wait_priority_after_sampling or self.flag_wait_priority
-        assert all([p > 0.0 for p in priority])
+        priority = np.asarray(priority, dtype=np.float64)
+        assert np.all(priority > 0.0)
         assert len(self.sampled_indices) == len(priority)
-        for i, p in zip(self.sampled_indices, priority):
-            self.priority_sums[i] = p
-            self.priority_mins[i] = p
-            self.max_priority = max(self.max_priority, p)
+        indices = np.asarray(self.sampled_indices, dtype=np.int64)
+        # Data popped after they were sampled are skipped
+        alive = indices >= 0
+        if not alive.all():
+            indices, priority = indices[alive], priority[alive]
+        if len(priority) > 0:
+            self.priority_sums.update(indices, priority)
+            self.priority_mins.update(indices, priority)
+            self.max_priority = max(self.max_priority, float(priority.max()))
         self.flag_wait_priority = False
         self.sampled_indices = []
 
+    def detach_last_sample(self):
+        """Detach the last sample from this buffer.
+
+        This allows the buffer to be sampled again before the priorities of
+        the last sample are set. The priorities can be set later by
+        reattaching the sample by `attach_sample` and then calling
+        `set_last_priority`.
+
+        Returns:
+            ndarray: Ids of the sampled data, which remain valid after data
+                are popped.
+        """
+        assert self.flag_wait_priority
+        ids = np.asarray(self.sampled_indices, dtype=np.int64) + self.n_popped
+        self.flag_wait_priority = False
+        self.sampled_indices = []
+        return ids
+
+    def attach_sample(self, ids):
+        """Make a sample detached by `detach_last_sample` the last sample.
+
+        Args:
+            ids (ndarray): Ids returned by `detach_last_sample`.
+        """
+        assert not self.wait_priority_after_sampling or not self.flag_wait_priority
+        # Ids of popped data become negative indices
+        self.sampled_indices = ids - self.n_popped
+        self.flag_wait_priority = True
+
+    def discard_sample(self, ids):
+        """Give up setting priorities of a sample detached by `detach_last_sample`.
+
+        The sampled data get the current maximum priority.
+
+        Args:
+            ids (ndarray): Ids returned by `detach_last_sample`.
+        """
+        indices = ids - self.n_popped
+        indices = indices[indices >= 0]
+        priority = np.full(len(indices), self.max_priority)
+        self.priority_sums.update(indices, priority)
+        self.priority_mins.update(indices, priority)
+
     def _uniform_sample_indices_and_probabilities(self, n):
         indices = list(sample_n_k(len(self.data), n))
         probabilities = [1 / len(self)] * len(indices)
@@ -145,6 +257,17 @@ def _write(index_left, index_right, node, key, value, op):
     return ret
 
 
+def _read(index_left, index_right, node, key):
+    while index_right - index_left > 1:
+        node_left, node_right, _ = node
+        index_center = (index_left + index_right) // 2
+        if key < index_center:
+            node, index_right = node_left, index_center
+        else:
+            node, index_left = node_right, index_center
+    return node[2]
+
+
 class TreeQueue(object):
     """Queue with Binary Indexed Tree cache
 
@@ -159,11 +282,21 @@ class TreeQueue(object):
         self.length = 0
         self.op = op
 
+    def __getitem__(self, ix):
+        assert 0 <= ix < self.length
+        ixl, ixr = self.bounds
+        return _read(ixl, ixr, self.root, ix)
+
     def __setitem__(self, ix, val):
         assert 0 <= ix < self.length
         assert val is not None
         self._write(ix, val)
 
+    def update(self, ixs, vals):
+        """Set values at multiple indices."""
+        for ix, val in zip(ixs, vals):
+            self[ix] = val
+
     def _write(self, ix, val):
         ixl, ixr = self.bounds
         return _write(ixl, ixr, self.root, ix, val, self.op)
@@ -254,6 +387,26 @@ class SumTreeQueue(TreeQueue):
 
         return ixs, vals
 
+    def stratified_sample(self, n, remove):
+        assert n >= 0
+        ixs = []
+        vals = []
+        if n > 0:
+            root = self.root
+            ixl, ixr = self.bounds
+            positions = (np.arange(n) + np.random.uniform(size=n)) * (root[2] / n)
+            ixs = [_find(ixl, ixr, root, pos) for pos in positions]
+            removed = {}
+            for ix in ixs:
+                if ix not in removed:
+                    removed[ix] = self._write(ix, 0.0)
+            vals = [removed[ix] for ix in ixs]
+            if not remove:
+                for ix, val in removed.items():
+                    self._write(ix, val)
+
+        return ixs, vals
+
     def prioritized_sample(self, n, remove):
         assert n >= 0
         ixs = []
@@ -285,6 +438,189 @@ class MinTreeQueue(TreeQueue):
             return self.root[2]
 
 
+class FlatTreeQueue(object):
+    """Queue with a segment tree stored in a flat array
+
+    queue-like data structure whose values are the leaves of a complete
+    binary tree kept in a NumPy array of size 2 * size, where size is a power
+    of two. Node i has children 2 * i and 2 * i + 1, and the root is node 1.
+    Leaves are used as a ring buffer starting at `head`, and the array is
+    doubled when it is full.
+
+    append, popleft, update are O(log n)
+    update of k values is vectorized level by level
+
+    Args:
+        op (numpy.ufunc): Binary reduction, e.g. np.add.
+        identity (float): Identity element of op, used for empty leaves.
+        capacity (int or None): Expected maximum length, used to preallocate
+            the array.
+    """
+
+    def __init__(self, op, identity, capacity=None):
+        self.op = op
+        self.identity = identity
+        self.size = 1
+        while self.size < (capacity or 1024):
+            self.size *= 2
+        self.tree = np.full(2 * self.size, identity, dtype=np.float64)
+        self.head = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def _leaves(self, ixs):
+        return self.size + (self.head + np.asarray(ixs, dtype=np.int64)) % self.size
+
+    def _logical_indices(self, leaves):
+        return (leaves - self.size - self.head) % self.size
+
+    def __getitem__(self, ix):
+        assert 0 <= ix < self.length
+        return self.tree[self.size + (self.head + ix) % self.size]
+
+    def __setitem__(self, ix, val):
+        assert 0 <= ix < self.length
+        assert val is not None
+        self._write_leaves(self._leaves([ix]), val)
+
+    def update(self, ixs, vals):
+        """Set values at multiple indices."""
+        ixs = np.asarray(ixs, dtype=np.int64)
+        assert np.all((0 <= ixs) & (ixs < self.length))
+        self._write_leaves(self._leaves(ixs), vals)
+
+    def _write_leaves(self, leaves, vals):
+        if len(leaves) == 0:
+            return
+        tree = self.tree
+        tree[leaves] = vals
+        # All the leaves are at the same depth, so ancestors can be updated
+        # level by level. Duplicate nodes are harmless since they get the same
+        # value.
+        nodes = np.asarray(leaves)
+        while nodes[0] > 1:
+            nodes = nodes // 2
+            tree[nodes] = self.op(tree[2 * nodes], tree[2 * nodes + 1])
+
+    def _grow(self):
+        values = self.tree[self._leaves(np.arange(self.length))]
+        self.size *= 2
+        self.tree = np.full(2 * self.size, self.identity, dtype=np.float64)
+        self.tree[self.size : self.size + self.length] = values
+        self.head = 0
+        # Build all the internal nodes level by level
+        level = self.size // 2
+        while level >= 1:
+            nodes = np.arange(level, 2 * level)
+            self.tree[nodes] = self.op(self.tree[2 * nodes], self.tree[2 * nodes + 1])
+            level //= 2
+
+    def append(self, value):
+        if self.length == self.size:
+            self._grow()
+        self.length += 1
+        self._write_leaves(self._leaves([self.length - 1]), value)
+
+    def popleft(self):
+        assert self.length > 0
+        leaf = self.size + self.head
+        ret = self.tree[leaf]
+        self._write_leaves(np.asarray([leaf]), self.identity)
+        self.head = (self.head + 1) % self.size
+        self.length -= 1
+        return ret
+
+
+class FlatSumTreeQueue(FlatTreeQueue):
+    """Fast weighted sampling with a flat array.
+
+    Same interface as SumTreeQueue, but multiple samples are found with one
+    vectorized descent of the tree.
+    """
+
+    def __init__(self, capacity=None):
+        super().__init__(op=np.add, identity=0.0, capacity=capacity)
+
+    def sum(self):
+        return self.tree[1]
+
+    def find(self, values):
+        """Find leaves by prefix sums, for multiple values at once.
+
+        Prefix sums are taken in the order of leaves in the array, which
+        differs from the order of the queue once the head has moved. Mapping
+        values drawn uniformly from [0, sum()) still samples each index with
+        probability proportional to its value.
+
+        Args:
+            values (ndarray): Values in [0, sum()).
+        Returns:
+            ndarray: Indices of the queue, one for each value.
+        """
+        tree = self.tree
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.size:
+            left = 2 * nodes
+            left_sums = tree[left]
+            # Never descend into empty subtrees, which can happen only due to
+            # rounding errors
+            go_right = (values >= left_sums) & (tree[left + 1] > 0)
+            values -= np.where(go_right, left_sums, 0.0)
+            nodes = left + go_right
+        return self._logical_indices(nodes)
+
+    def uniform_sample(self, n, remove):
+        assert n >= 0
+        ixs = sample_n_k(self.length, n)
+        vals = self.tree[self._leaves(ixs)]
+        if remove and n > 0:
+            self._write_leaves(self._leaves(ixs), 0.0)
+        return list(ixs), list(vals)
+
+    def stratified_sample(self, n, remove):
+        assert n >= 0
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        # One value from each of n segments of equal size
+        positions = (np.arange(n) + np.random.uniform(size=n)) * (self.sum() / n)
+        ixs = self.find(positions)
+        leaves = self._leaves(ixs)
+        vals = self.tree[leaves]
+        if remove:
+            self._write_leaves(leaves, 0.0)
+        return ixs, vals
+
+    def prioritized_sample(self, n, remove):
+        assert n >= 0
+        ixs = np.empty(0, dtype=np.int64)
+        vals = np.empty(0, dtype=np.float64)
+        # Sampling without replacement: all the remaining samples are drawn
+        # at once, then duplicates of already sampled indices are rejected.
+        while len(ixs) < n:
+            total = self.sum()
+            assert total > 0
+            found = self.find(np.random.uniform(0.0, total, size=n - len(ixs)))
+            found_unique, first = np.unique(found, return_index=True)
+            found_unique = found_unique[np.argsort(first)]
+            ixs = np.concatenate([ixs, found_unique])
+            vals = np.concatenate([vals, self.tree[self._leaves(found_unique)]])
+            self._write_leaves(self._leaves(found_unique), 0.0)
+        if not remove and n > 0:
+            self._write_leaves(self._leaves(ixs), vals)
+        return list(ixs), list(vals)
+
+
+class FlatMinTreeQueue(FlatTreeQueue):
+    def __init__(self, capacity=None):
+        super().__init__(op=np.minimum, identity=np.inf, capacity=capacity)
+
+    def min(self):
+        return self.tree[1]
+
+
 # Deprecated
 class SumTree(object):
     """Fast weighted sampling.
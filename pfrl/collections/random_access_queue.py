@@ -8,6 +8,10 @@ class RandomAccessQueue(object):
 
     Operations getitem, setitem, append, popleft, and len
     are amortized O(1)-time, if this data structure is used ephemerally.
+
+    `n_appended` counts the data appended so far, including the ones already
+    removed, so that the i-th datum from the left is the
+    `n_appended - len(self) + i`-th appended one.
     """
 
     def __init__(self, *args, **kwargs):
@@ -15,8 +19,15 @@ class RandomAccessQueue(object):
         assert self.maxlen is None or self.maxlen >= 0
         self._queue_front = []
         self._queue_back = list(*args, **kwargs)
+        self.n_appended = len(self._queue_back)
         self._apply_maxlen()
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "n_appended" not in state:
+            # Pickled by an older version
+            self.n_appended = len(self)
+
     def _apply_maxlen(self):
         if self.maxlen is not None:
             while len(self) > self.maxlen:
@@ -79,11 +90,14 @@ class RandomAccessQueue(object):
 
     def append(self, x):
         self._queue_back.append(x)
+        self.n_appended += 1
         if self.maxlen is not None and len(self) > self.maxlen:
             self.popleft()
 
     def extend(self, xs):
+        n = len(self._queue_back)
         self._queue_back.extend(xs)
+        self.n_appended += len(self._queue_back) - n
         self._apply_maxlen()
 
     def popleft(self):
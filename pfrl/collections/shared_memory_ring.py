@@ -0,0 +1,142 @@
+import time
+
+import numpy as np
+import torch
+
+
+def _field_spec(value):
+    """Return (shape, dtype) of a value, or None if it is not numeric."""
+    if value is None:
+        return None
+    arr = np.asarray(value)
+    if arr.dtype.hasobject or arr.dtype.kind not in "biufc":
+        return None
+    return arr.shape, arr.dtype
+
+
+def _nbytes(shape, dtype, size):
+    return size * int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+
+
+class SharedMemoryRing(object):
+    """Ring buffer of transitions on shared memory.
+
+    A ring is written by a single producer process, e.g. an actor, and read by
+    a single consumer process, e.g. the learner. Every field of a transition
+    is stored in a preallocated array whose shape and dtype are inferred from
+    the first transition, so writing and reading a transition needs no
+    pickling. The producer and the consumer only synchronize through two
+    counters on shared memory: the number of written transitions and the
+    number of read transitions.
+
+    The whole ring is a single shared memory tensor, so it can be sent to
+    another process through a `multiprocessing` pipe, which transfers only its
+    handle.
+
+    The ring only saves the cost of transferring transitions. The consumer
+    still gets a dict per transition from `get_all`, e.g. to be appended to a
+    replay buffer one by one.
+
+    Args:
+        transition (dict): Example transition to infer the fields from.
+        capacity (int): Maximum number of transitions written but not read.
+    """
+
+    def __init__(self, transition, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.specs = {}
+        offset = 0
+        for key, value in transition.items():
+            spec = _field_spec(value)
+            if spec is None:
+                raise ValueError("Field {} cannot be stored in a ring".format(key))
+            shape, dtype = spec
+            # Align each field to 8 bytes
+            offset = (offset + 7) // 8 * 8
+            self.specs[key] = (shape, dtype, offset)
+            offset += _nbytes(shape, dtype, capacity)
+        self._buffer = torch.zeros(offset, dtype=torch.uint8).share_memory_()
+        # Numbers of written and read transitions
+        self._cursors = torch.zeros(2, dtype=torch.int64).share_memory_()
+        self._setup_views()
+
+    def _setup_views(self):
+        buf = self._buffer.numpy()
+        self.columns = {}
+        for key, (shape, dtype, offset) in self.specs.items():
+            nbytes = _nbytes(shape, dtype, self.capacity)
+            column = buf[offset : offset + nbytes].view(dtype)
+            self.columns[key] = column.reshape((self.capacity,) + shape)
+        self._cursor_view = self._cursors.numpy()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["columns"]
+        del state["_cursor_view"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup_views()
+
+    def __len__(self):
+        return int(self._cursor_view[0] - self._cursor_view[1])
+
+    def can_store(self, transition):
+        """Return True if a transition has the fields of this ring.
+
+        Values must have the shapes of the fields and dtypes that can be
+        safely cast to theirs, e.g. a float reward cannot be stored in a ring
+        made from an int reward, since it would be truncated.
+        """
+        if transition.keys() != self.specs.keys():
+            return False
+        for key, value in transition.items():
+            spec = _field_spec(value)
+            if spec is None:
+                return False
+            shape, dtype, _ = self.specs[key]
+            if spec[0] != shape or not np.can_cast(spec[1], dtype, "safe"):
+                return False
+        return True
+
+    def put(self, transition, poll_interval=1e-6):
+        """Write a transition, waiting while the ring is full.
+
+        Args:
+            transition (dict): Transition whose fields match the ring.
+            poll_interval (float): Seconds to sleep while the ring is full.
+        """
+        written = int(self._cursor_view[0])
+        while written - int(self._cursor_view[1]) >= self.capacity:
+            time.sleep(poll_interval)
+        slot = written % self.capacity
+        for key, value in transition.items():
+            self.columns[key][slot] = value
+        # Publish the transition only after all its fields are written
+        self._cursor_view[0] = written + 1
+
+    def get_all(self):
+        """Read all the written transitions that have not been read yet.
+
+        Returns:
+            list: Transition dicts that own copies of their values.
+        """
+        read = int(self._cursor_view[1])
+        written = int(self._cursor_view[0])
+        if written == read:
+            return []
+        slots = np.arange(read, written) % self.capacity
+        values = {key: column[slots] for key, column in self.columns.items()}
+        self._cursor_view[1] = written
+        transitions = []
+        for i in range(written - read):
+            transition = {}
+            for key, column in values.items():
+                value = column[i]
+                if column.ndim == 1:
+                    value = value.item()
+                transition[key] = value
+            transitions.append(transition)
+        return transitions
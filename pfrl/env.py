@@ -22,7 +22,12 @@ class Env(object, metaclass=ABCMeta):
 
 
 class VectorEnv(object, metaclass=ABCMeta):
-    """Parallel RL learning environments."""
+    """Parallel RL learning environments.
+
+    VectorEnvs whose `auto_reset` attribute is True reset envs by themselves
+    when episodes end, returning the first observations of the new episodes
+    from `step` and the last ones as `info["terminal_observation"]`.
+    """
 
     @abstractmethod
     def step(self, action):
@@ -46,6 +51,34 @@ class VectorEnv(object, metaclass=ABCMeta):
     def close(self):
         raise NotImplementedError()
 
+    def step_async(self, actions, env_ids=None):
+        """Start stepping envs without waiting for the results.
+
+        Results are received by `step_wait`. Envs that are being stepped
+        must not be stepped, reset or seeded again until their results are
+        returned by `step_wait`.
+
+        Args:
+            actions (Sequence): Actions for the envs.
+            env_ids (Sequence of int): Indices of the envs to step. If
+                omitted, all the envs are stepped.
+        """
+        raise NotImplementedError()
+
+    def step_wait(self, batch_size=None):
+        """Wait for the results of envs stepped by `step_async`.
+
+        Args:
+            batch_size (int): Number of results to return. Results of the
+                envs that finish stepping first are returned. If omitted,
+                it waits for all the envs being stepped.
+
+        Returns:
+            tuple: Indices of the envs, observations, rewards, dones and
+                infos, each of which is a sequence of length `batch_size`.
+        """
+        raise NotImplementedError()
+
     @property
     def unwrapped(self):
         """Completely unwrap this env.
@@ -1,51 +1,112 @@
+import collections
 from multiprocessing import Pipe
 from multiprocessing import Process
+from multiprocessing.connection import wait
 import signal
 import warnings
 
+import gym
 import numpy as np
+import torch
 from torch.distributions.utils import lazy_property
 
 import pfrl
 
 
-def worker(remote, env_fn):
+def worker(remote, env_fns, auto_reset=False):
     # Ignore CTRL+C in the worker process
     signal.signal(signal.SIGINT, signal.SIG_IGN)
-    env = env_fn()
+    # Envs of a worker are stepped serially and their results are sent as
+    # a single message.
+    envs = [env_fn() for env_fn in env_fns]
+    # If set, observations are written to it instead of being sent
+    obs_buffer = None
+
+    def send_ob(i, ob):
+        if obs_buffer is not None:
+            obs_buffer[i] = ob
+            ob = None
+        return ob
+
+    def step_env(i, action):
+        ob, reward, done, info = envs[i].step(action)
+        if auto_reset and (done or info.get("needs_reset", False)):
+            # The first observation of the next episode is sent instead
+            info = dict(info, terminal_observation=ob)
+            ob = envs[i].reset()
+        return send_ob(i, ob), reward, done, info
+
     try:
         while True:
             cmd, data = remote.recv()
             if cmd == "step":
-                ob, reward, done, info = env.step(data)
-                remote.send((ob, reward, done, info))
+                remote.send([step_env(i, action) for i, action in enumerate(data)])
+            elif cmd == "step_envs":
+                # Step only some of the envs
+                indices, actions = data
+                remote.send([step_env(i, a) for i, a in zip(indices, actions)])
             elif cmd == "reset":
-                ob = env.reset()
-                remote.send(ob)
+                # data is a list of flags telling which envs to reset
+                remote.send(
+                    [
+                        send_ob(i, env.reset())
+                        for i, (env, m) in enumerate(zip(envs, data))
+                        if m
+                    ]
+                )
+            elif cmd == "set_obs_buffer":
+                buffer, index = data
+                obs_buffer = buffer.numpy()[index]
             elif cmd == "close":
                 remote.close()
                 break
             elif cmd == "get_spaces":
-                remote.send((env.action_space, env.observation_space))
+                remote.send((envs[0].action_space, envs[0].observation_space))
             elif cmd == "spec":
-                remote.send(env.spec)
+                remote.send(envs[0].spec)
             elif cmd == "seed":
-                remote.send(env.seed(data))
+                remote.send([env.seed(seed) for env, seed in zip(envs, data)])
             else:
                 raise NotImplementedError
     finally:
-        env.close()
+        for env in envs:
+            env.close()
 
 
 class MultiprocessVectorEnv(pfrl.env.VectorEnv):
-    """VectorEnv where each env is run in its own subprocess.
+    """VectorEnv where envs are run in subprocesses.
 
     Args:
         env_fns (list of callable): List of callables, each of which
-            returns gym.Env that is run in its own subprocess.
+            returns gym.Env that is run in a subprocess.
+        shared_memory (bool): If set to True, observations are not sent
+            through pipes but written by subprocesses to an array of shape
+            `(num_envs,) + observation_space.shape` on shared memory, and
+            `step` and `reset` return a copy of it as a single ndarray.
+            Observations are cast to the dtype of the observation space,
+            which must be a `gym.spaces.Box`. Only rewards, dones and infos
+            are pickled, which makes stepping envs with large observations,
+            e.g. images, faster.
+        envs_per_worker (int): Maximum number of envs run by each
+            subprocess. Envs are assigned to `ceil(num_envs / envs_per_worker)`
+            subprocesses in order, and each subprocess steps its envs
+            serially. Larger values reduce the number of processes and of
+            messages per step, which pays off for envs that are cheap to step.
+        auto_reset (bool): If set to True, subprocesses reset envs as soon as
+            their episodes end, i.e. `done` is True or `info["needs_reset"]`
+            is True. The first observation of the new episode is returned
+            as the observation and the last observation of the episode is
+            stored in `info["terminal_observation"]`, so that envs do not
+            need to be reset by `reset` after each episode.
+
+    Besides `step`, envs can be stepped asynchronously by `step_async` and
+    `step_wait`, which returns the results of the envs that finish first so
+    that slow envs do not block the others.
     """
 
-    def __init__(self, env_fns):
+    def __init__(
+        self, env_fns, shared_memory=False, envs_per_worker=1, auto_reset=False
+    ):
         if np.__version__ == "1.16.0":
             warnings.warn(
                 """
@@ -55,18 +116,54 @@ See https://github.com/numpy/numpy/issues/12793 for details.
 """
             )  # NOQA
 
+        assert envs_per_worker > 0
         nenvs = len(env_fns)
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
+        # Slice of envs run by each worker
+        self.worker_slices = [
+            slice(start, min(start + envs_per_worker, nenvs))
+            for start in range(0, nenvs, envs_per_worker)
+        ]
+        self.remotes, self.work_remotes = zip(
+            *[Pipe() for _ in range(len(self.worker_slices))]
+        )
         self.ps = [
-            Process(target=worker, args=(work_remote, env_fn))
-            for (work_remote, env_fn) in zip(self.work_remotes, env_fns)
+            Process(target=worker, args=(work_remote, env_fns[s], auto_reset))
+            for (work_remote, s) in zip(self.work_remotes, self.worker_slices)
         ]
+        self._num_envs = nenvs
+        self.auto_reset = auto_reset
+        # Env ids of the step_envs messages each worker has not replied to
+        self.waiting = [collections.deque() for _ in self.worker_slices]
+        # Results received but not returned by step_wait yet
+        self.ready = collections.deque()
+        # Envs being stepped by step_async
+        self.pending = set()
         for p in self.ps:
             p.start()
         self.last_obs = [None] * self.num_envs
         self.remotes[0].send(("get_spaces", None))
         self.action_space, self.observation_space = self.remotes[0].recv()
         self.closed = False
+        self.obs_buffer = None
+        if shared_memory:
+            try:
+                self._setup_obs_buffer()
+            except Exception:
+                self.close()
+                raise
+
+    def _setup_obs_buffer(self):
+        space = self.observation_space
+        if not isinstance(space, gym.spaces.Box):
+            raise ValueError("shared_memory=True requires a Box observation space")
+        buffer = torch.from_numpy(
+            np.zeros((self.num_envs,) + space.shape, dtype=space.dtype)
+        ).share_memory_()
+        for s, remote in zip(self.worker_slices, self.remotes):
+            remote.send(("set_obs_buffer", (buffer, s)))
+        # The tensor owns the shared memory
+        self._obs_buffer_tensor = buffer
+        self.obs_buffer = buffer.numpy()
 
     def __del__(self):
         if not self.closed:
@@ -81,30 +178,112 @@ See https://github.com/numpy/numpy/issues/12793 for details.
 
     def step(self, actions):
         self._assert_not_closed()
-        for remote, action in zip(self.remotes, actions):
-            remote.send(("step", action))
-        results = [remote.recv() for remote in self.remotes]
+        self._assert_not_pending(range(self.num_envs))
+        actions = list(actions)
+        for remote, s in zip(self.remotes, self.worker_slices):
+            remote.send(("step", actions[s]))
+        results = [result for remote in self.remotes for result in remote.recv()]
         self.last_obs, rews, dones, infos = zip(*results)
+        if self.obs_buffer is not None:
+            # Copied because callers, e.g. replay buffers, keep observations
+            self.last_obs = self.obs_buffer.copy()
         return self.last_obs, rews, dones, infos
 
+    def step_async(self, actions, env_ids=None):
+        self._assert_not_closed()
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        env_ids = [int(i) for i in env_ids]
+        self._assert_not_pending(env_ids)
+        actions = list(actions)
+        assert len(actions) == len(env_ids)
+        for w, s in enumerate(self.worker_slices):
+            indices = [k for k, i in enumerate(env_ids) if s.start <= i < s.stop]
+            if not indices:
+                continue
+            self.remotes[w].send(
+                (
+                    "step_envs",
+                    (
+                        [env_ids[k] - s.start for k in indices],
+                        [actions[k] for k in indices],
+                    ),
+                )
+            )
+            self.waiting[w].append([env_ids[k] for k in indices])
+        self.pending.update(env_ids)
+
+    def step_wait(self, batch_size=None):
+        self._assert_not_closed()
+        if batch_size is None:
+            batch_size = len(self.pending)
+        assert 0 < batch_size <= len(self.pending)
+        while len(self.ready) < batch_size:
+            remotes = {
+                self.remotes[w]: w for w in range(self.num_workers) if self.waiting[w]
+            }
+            for remote in wait(list(remotes)):
+                self._recv_step(remotes[remote])
+        results = [self.ready.popleft() for _ in range(batch_size)]
+        env_ids, obs, rews, dones, infos = zip(*results)
+        self.pending.difference_update(env_ids)
+        if self.obs_buffer is not None:
+            obs = np.stack(obs)
+            self.last_obs[list(env_ids)] = obs
+        else:
+            self.last_obs = list(self.last_obs)
+            for i, ob in zip(env_ids, obs):
+                self.last_obs[i] = ob
+        return env_ids, obs, rews, dones, infos
+
+    def _recv_step(self, w):
+        env_ids = self.waiting[w].popleft()
+        for i, (ob, reward, done, info) in zip(env_ids, self.remotes[w].recv()):
+            if self.obs_buffer is not None:
+                # The worker does not write to it until the env is stepped again
+                ob = self.obs_buffer[i].copy()
+            self.ready.append((i, ob, reward, done, info))
+
     def reset(self, mask=None):
         self._assert_not_closed()
         if mask is None:
             mask = np.zeros(self.num_envs)
-        for m, remote in zip(mask, self.remotes):
-            if not m:
-                remote.send(("reset", None))
+        to_reset = [not m for m in mask]
+        self._assert_not_pending(i for i, r in enumerate(to_reset) if r)
+        # Only workers with envs to reset are asked to reply
+        remotes = []
+        for w, (remote, s) in enumerate(zip(self.remotes, self.worker_slices)):
+            if any(to_reset[s]):
+                # Replies to step_async come first
+                while self.waiting[w]:
+                    self._recv_step(w)
+                remote.send(("reset", to_reset[s]))
+                remotes.append(remote)
+        new_obs = [ob for remote in remotes for ob in remote.recv()]
 
-        obs = [
-            remote.recv() if not m else o
-            for m, remote, o in zip(mask, self.remotes, self.last_obs)
-        ]
+        if self.obs_buffer is not None:
+            # Observations of the envs that are not reset are left as they are
+            last_obs = self.obs_buffer.copy()
+            if self.pending:
+                # Rows of envs being stepped may be overwritten at any time
+                pending = list(self.pending)
+                last_obs[pending] = self.last_obs[pending]
+            self.last_obs = last_obs
+            return self.last_obs
+
+        new_obs = iter(new_obs)
+        obs = [next(new_obs) if r else o for r, o in zip(to_reset, self.last_obs)]
         self.last_obs = obs
         return obs
 
     def close(self):
         self._assert_not_closed()
         self.closed = True
+        # Receive replies to step_async so that workers are not blocked
+        for w in range(self.num_workers):
+            while self.waiting[w]:
+                self.remotes[w].recv()
+                self.waiting[w].popleft()
         for remote in self.remotes:
             remote.send(("close", None))
         for p in self.ps:
@@ -112,6 +291,7 @@ See https://github.com/numpy/numpy/issues/12793 for details.
 
     def seed(self, seeds=None):
         self._assert_not_closed()
+        self._assert_not_pending(range(self.num_envs))
         if seeds is not None:
             if isinstance(seeds, int):
                 seeds = [seeds] * self.num_envs
@@ -129,14 +309,23 @@ See https://github.com/numpy/numpy/issues/12793 for details.
         else:
             seeds = [None] * self.num_envs
 
-        for remote, seed in zip(self.remotes, seeds):
-            remote.send(("seed", seed))
-        results = [remote.recv() for remote in self.remotes]
+        for remote, s in zip(self.remotes, self.worker_slices):
+            remote.send(("seed", seeds[s]))
+        results = [result for remote in self.remotes for result in remote.recv()]
         return results
 
     @property
     def num_envs(self):
+        return self._num_envs
+
+    @property
+    def num_workers(self):
         return len(self.remotes)
 
     def _assert_not_closed(self):
         assert not self.closed, "This env is already closed"
+
+    def _assert_not_pending(self, env_ids):
+        assert self.pending.isdisjoint(
+            env_ids
+        ), "Envs being stepped by step_async must be received by step_wait first"
@@ -1,3 +1,5 @@
+import collections
+
 import numpy as np
 
 import pfrl
@@ -11,20 +13,52 @@ class SerialVectorEnv(pfrl.env.VectorEnv):
 
     Args:
         env_fns (list of gym.Env): List of gym.Env.
+        auto_reset (bool): If set to True, envs are reset as soon as their
+            episodes end. See `pfrl.envs.MultiprocessVectorEnv`.
     """
 
-    def __init__(self, envs):
+    def __init__(self, envs, auto_reset=False):
         self.envs = envs
+        self.auto_reset = auto_reset
         self.last_obs = [None] * self.num_envs
         self.action_space = envs[0].action_space
         self.observation_space = envs[0].observation_space
         self.spec = envs[0].observation_space
+        # Results of envs stepped by step_async
+        self.ready = collections.deque()
 
     def step(self, actions):
-        results = [env.step(a) for env, a in zip(self.envs, actions)]
+        assert not self.ready, "Results of step_async are not received"
+        results = [self._step_env(i, a) for i, a in enumerate(actions)]
         self.last_obs, rews, dones, infos = zip(*results)
         return self.last_obs, rews, dones, infos
 
+    def _step_env(self, i, action):
+        ob, reward, done, info = self.envs[i].step(action)
+        if self.auto_reset and (done or info.get("needs_reset", False)):
+            info = dict(info, terminal_observation=ob)
+            ob = self.envs[i].reset()
+        return ob, reward, done, info
+
+    def step_async(self, actions, env_ids=None):
+        # Envs are stepped here and results are returned in order
+        if env_ids is None:
+            env_ids = range(self.num_envs)
+        for i, action in zip(env_ids, actions):
+            self.ready.append((i,) + self._step_env(i, action))
+
+    def step_wait(self, batch_size=None):
+        if batch_size is None:
+            batch_size = len(self.ready)
+        assert 0 < batch_size <= len(self.ready)
+        results = [self.ready.popleft() for _ in range(batch_size)]
+        last_obs = list(self.last_obs)
+        for i, ob, _, _, _ in results:
+            last_obs[i] = ob
+        self.last_obs = last_obs
+        env_ids, obs, rews, dones, infos = zip(*results)
+        return env_ids, obs, rews, dones, infos
+
     def reset(self, mask=None):
         if mask is None:
             mask = np.zeros(self.num_envs)
@@ -0,0 +1,139 @@
+from gym import spaces
+import numpy as np
+
+from pfrl import env
+
+
+class VectorABC(env.VectorEnv):
+    """Vectorized version of `pfrl.envs.abc.ABC`.
+
+    All the envs are stepped at once by NumPy array operations, so that
+    thousands of envs can be stepped at a negligible cost. It is useful to
+    measure the overhead of agents separately from the cost of simulators.
+
+    Observations, rewards and dones are returned as ndarrays of shape
+    `(num_envs, size + 2)`, `(num_envs,)` and `(num_envs,)`, respectively.
+    See `pfrl.envs.abc.ABC` for the dynamics and the other arguments.
+
+    Args:
+        num_envs (int): Number of envs.
+        size (int): Size of the problem.
+        discrete (bool): If set to True, use the discrete action space.
+        partially_observable (bool): If set to True, observations are shifted
+            for some random episodes.
+        episodic (bool): If set to True, use episodic settings.
+        deterministic (bool): If set to True, everything will be deterministic.
+        auto_reset (bool): If set to True, envs are reset as soon as their
+            episodes end. See `pfrl.envs.MultiprocessVectorEnv`.
+        seed (int or None): Seed of the random number generator shared by the
+            envs.
+    """
+
+    def __init__(
+        self,
+        num_envs,
+        size=2,
+        discrete=True,
+        partially_observable=False,
+        episodic=True,
+        deterministic=False,
+        auto_reset=False,
+        seed=None,
+    ):
+        assert num_envs > 0
+        self._num_envs = num_envs
+        self.size = size
+        self.terminal_state = size
+        self.episodic = episodic
+        self.partially_observable = partially_observable
+        self.deterministic = deterministic
+        self.auto_reset = auto_reset
+        self.n_max_offset = 1
+        # (s_0, ..., s_N) + terminal state + offset
+        self.n_dim_obs = self.size + 1 + self.n_max_offset
+        self.observation_space = spaces.Box(
+            low=-np.inf, high=np.inf, shape=(self.n_dim_obs,), dtype=np.float32
+        )
+        if discrete:
+            self.action_space = spaces.Discrete(self.size)
+        else:
+            self.action_space = spaces.Box(
+                low=-1.0, high=1.0, shape=(self.size,), dtype=np.float32
+            )
+        self.np_random = np.random.RandomState(seed)
+        self._state = np.zeros(num_envs, dtype=np.int64)
+        self._offset = np.zeros(num_envs, dtype=np.int64)
+
+    @property
+    def num_envs(self):
+        return self._num_envs
+
+    def observe(self):
+        obs = np.zeros((self.num_envs, self.n_dim_obs), dtype=np.float32)
+        obs[np.arange(self.num_envs), self._state + self._offset] = 1.0
+        return obs
+
+    def _reset_envs(self, to_reset):
+        self._state[to_reset] = 0
+        if self.partially_observable:
+            if self.deterministic:
+                self._offset[to_reset] = (self._offset[to_reset] + 1) % (
+                    self.n_max_offset + 1
+                )
+            else:
+                self._offset[to_reset] = self.np_random.randint(
+                    self.n_max_offset + 1, size=np.count_nonzero(to_reset)
+                )
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.zeros(self.num_envs, dtype=bool)
+        self._reset_envs(np.logical_not(mask))
+        return self.observe()
+
+    def _discretize(self, actions):
+        actions = np.clip(actions, self.action_space.low, self.action_space.high)
+        if self.deterministic:
+            return np.argmax(actions, axis=1)
+        prob = np.exp(actions) / np.exp(actions).sum(axis=1, keepdims=True)
+        # Sample from the categorical distribution of each row
+        u = self.np_random.rand(self.num_envs, 1)
+        sampled = (np.cumsum(prob, axis=1) < u).sum(axis=1)
+        return np.minimum(sampled, self.size - 1)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        if isinstance(self.action_space, spaces.Box):
+            actions = self._discretize(actions)
+        assert actions.shape == (self.num_envs,)
+        correct = actions == self._state
+        goal = correct & (self._state == self.size - 1)
+        rewards = goal.astype(np.float64)
+        if self.episodic:
+            dones = ~correct | goal
+            self._state = np.where(dones, self.terminal_state, self._state + 1)
+        else:
+            dones = np.zeros(self.num_envs, dtype=bool)
+            self._state = np.where(
+                goal, 0, np.where(correct, self._state + 1, self._state)
+            )
+        obs = self.observe()
+        infos = tuple({} for _ in range(self.num_envs))
+        if self.auto_reset and dones.any():
+            for i in np.flatnonzero(dones):
+                infos[i]["terminal_observation"] = obs[i].copy()
+            self._reset_envs(dones)
+            obs = self.observe()
+        return obs, rewards, dones, infos
+
+    def seed(self, seeds=None):
+        """Seed the random number generator shared by the envs.
+
+        Args:
+            seeds (int, list of int or None): Seed. If a list is given, its
+                elements are combined into a single seed.
+        """
+        self.np_random.seed(seeds)
+
+    def close(self):
+        pass
@@ -1,8 +1,11 @@
+from pfrl.experiments.evaluator import BackgroundEvaluator  # NOQA
 from pfrl.experiments.evaluator import eval_performance  # NOQA
 
 from pfrl.experiments.hooks import LinearInterpolationHook  # NOQA
 from pfrl.experiments.hooks import StepHook  # NOQA
 
+from pfrl.experiments.phase_timer import PhaseTimer  # NOQA
+
 from pfrl.experiments.prepare_output_dir import is_under_git_control  # NOQA
 from pfrl.experiments.prepare_output_dir import generate_exp_id  # NOQA
 from pfrl.experiments.prepare_output_dir import prepare_output_dir  # NOQA
@@ -17,3 +20,6 @@ from pfrl.experiments.train_agent_batch import train_agent_batch  # NOQA
 from pfrl.experiments.train_agent_batch import train_agent_batch_with_evaluation  # NOQA
 from pfrl.experiments.train_hrl_agent import train_hrl_agent # NOQA
 from pfrl.experiments.train_hrl_agent import train_hrl_agent_with_evaluation # NOQA
+from pfrl.experiments.train_hrl_agent import train_hrl_agent_batch  # NOQA
+from pfrl.experiments.train_hrl_agent import train_hrl_agent_batch_with_evaluation  # NOQA
+from pfrl.experiments.train_hrl_agent_async import train_hrl_agent_async  # NOQA
@@ -1,11 +1,14 @@
 import logging
 import multiprocessing as mp
 import os
+import queue
 from pfrl.agent import HRLAgent
 from pfrl.agents import HIROAgent, goal_conditioned_td3
 import statistics
 import time
+import traceback
 import numpy as np
+import torch
 
 import pfrl
 
@@ -229,6 +232,35 @@ def run_evaluation_episodes(
             )
 
 
+def split_terminal_observations(obss, infos):
+    """Get observations to observe from a VectorEnv that resets envs itself.
+
+    When a VectorEnv resets envs automatically, observations of the envs
+    whose episodes ended are the first ones of the next episodes, and the
+    last ones are stored in `info["terminal_observation"]`.
+
+    Args:
+        obss (Sequence): Observations returned by `step`.
+        infos (Sequence of dict): Infos returned by `step`.
+
+    Returns:
+        tuple: Observations to be observed by agents, where the ones of the
+            envs reset automatically are replaced with the terminal ones,
+            and a boolean ndarray that is True for the envs reset
+            automatically.
+    """
+    auto_reset = np.array(
+        ["terminal_observation" in info for info in infos], dtype=bool
+    )
+    if not auto_reset.any():
+        return obss, auto_reset
+    terminal_obss = [
+        info["terminal_observation"] if r else ob
+        for ob, info, r in zip(obss, infos, auto_reset)
+    ]
+    return terminal_obss, auto_reset
+
+
 def _batch_run_episodes(
     env, agent, n_steps, n_episodes, max_episode_len=None, logger=None,
 ):
@@ -258,6 +290,7 @@ def _batch_run_episodes(
         timestep += 1
         # o_{t+1}, r_{t+1}
         obss, rs, dones, infos = env.step(actions)
+        terminal_obss, auto_reset = split_terminal_observations(obss, infos)
         episode_r += rs
         episode_len += 1
         # Compute mask for done and reset
@@ -269,9 +302,8 @@ def _batch_run_episodes(
             resets, [info.get("needs_reset", False) for info in infos]
         )
 
-        # Make mask. 0 if done/reset, 1 if pass
+        # True if done/reset
         end = np.logical_or(resets, dones)
-        not_end = np.logical_not(end)
 
         for index in range(len(end)):
             if end[index]:
@@ -326,12 +358,14 @@ def _batch_run_episodes(
             resets.fill(True)
 
         # Agent observes the consequences.
-        agent.batch_observe(obss, rs, dones, resets)
+        agent.batch_observe(terminal_obss, rs, dones, resets)
 
         if termination_conditions:
             break
-        else:
-            obss = env.reset(not_end)
+        # Envs reset automatically by env need not be reset
+        to_reset = np.logical_and(end, np.logical_not(auto_reset))
+        if to_reset.any() or not getattr(env, "auto_reset", False):
+            obss = env.reset(np.logical_not(to_reset))
 
     for i, (epi_len, epi_ret) in enumerate(
         zip(eval_episode_lens, eval_episode_returns)
@@ -340,6 +374,103 @@ def _batch_run_episodes(
     return [float(r) for r in eval_episode_returns]
 
 
+def split_goal_observations(obs_dicts):
+    """Split observations of a VectorEnv of goal-conditioned envs.
+
+    Args:
+        obs_dicts (Sequence of dict): Observations of the envs, each of which
+            has "observation" and "desired_goal".
+
+    Returns:
+        tuple: ndarrays of observations and goals stacked along the first
+            axis.
+    """
+    obss = np.asarray([obs_dict["observation"] for obs_dict in obs_dicts])
+    goals = np.asarray([obs_dict["desired_goal"] for obs_dict in obs_dicts])
+    return obss, goals
+
+
+def _hrl_batch_run_episodes(
+    env, agent, n_steps, n_episodes, max_episode_len=None, logger=None,
+):
+    """Run multiple episodes of an HRL agent and return returns in a batch manner.
+
+    Episodes are indexed in the order they start, and the first `n_episodes`
+    ones are used so that scores do not depend on which envs are faster.
+    """
+    assert (
+        n_steps is None and n_episodes is not None
+    ), "HRL agents are evaluated for a specified number of episodes"
+
+    logger = logger or logging.getLogger(__name__)
+    num_envs = env.num_envs
+    episode_returns = dict()
+    episode_lengths = dict()
+    episode_successes = dict()
+    episode_indices = np.arange(num_envs)
+    episode_idx = num_envs
+    episode_r = np.zeros(num_envs, dtype=np.float64)
+    episode_len = np.zeros(num_envs, dtype="i")
+
+    obss, fgs = split_goal_observations(env.reset())
+    sgs = np.asarray(agent.batch_sample_subgoal(obss, fgs))
+    while True:
+        actions = agent.batch_act_low_level(obss, sgs)
+        obs_dicts, rs, dones, infos = env.step(actions)
+        terminal_obs_dicts, auto_reset = split_terminal_observations(obs_dicts, infos)
+        obss, _ = split_goal_observations(terminal_obs_dicts)
+        # episode_len is the step of the current episode before this step
+        sgs = agent.batch_act_high_level(obss, fgs, sgs, episode_len.copy())
+        episode_r += rs
+        episode_len += 1
+        if max_episode_len is None:
+            resets = np.zeros(num_envs, dtype=bool)
+        else:
+            resets = episode_len == max_episode_len
+        resets = np.logical_or(
+            resets, [info.get("needs_reset", False) for info in infos]
+        )
+        end = np.logical_or(resets, dones)
+
+        for index in np.flatnonzero(end):
+            idx = episode_indices[index]
+            episode_returns[idx] = episode_r[index]
+            episode_lengths[idx] = episode_len[index]
+            episode_successes[idx] = bool(
+                agent.evaluate_final_goal(fgs[index], obss[index])
+            )
+            episode_indices[index] = episode_idx
+            episode_idx += 1
+        episode_r[end] = 0
+        episode_len[end] = 0
+
+        if all(idx in episode_returns for idx in range(n_episodes)):
+            break
+
+        # Envs reset automatically by env need not be reset
+        to_reset = np.logical_and(end, np.logical_not(auto_reset))
+        if to_reset.any() or not getattr(env, "auto_reset", False):
+            obs_dicts = env.reset(np.logical_not(to_reset))
+        obss, fgs = split_goal_observations(obs_dicts)
+        if end.any():
+            sgs[end] = agent.batch_sample_subgoal(obss[end], fgs[end])
+
+    scores = []
+    successes = 0
+    for idx in range(n_episodes):
+        logger.info(
+            "evaluation episode %s length: %s R: %s",
+            idx,
+            episode_lengths[idx],
+            episode_returns[idx],
+        )
+        scores.append(float(episode_returns[idx]))
+        successes += episode_successes[idx]
+    success_rate = successes / n_episodes
+    logger.info(f"Success Rate: {success_rate}")
+    return scores, success_rate
+
+
 def batch_run_evaluation_episodes(
     env, agent, n_steps, n_episodes, max_episode_len=None, logger=None,
 ):
@@ -358,9 +489,19 @@ def batch_run_evaluation_episodes(
             be used.
 
     Returns:
-        List of returns of evaluation runs.
+        List of returns of evaluation runs. For HRL agents, a tuple of it and
+        the success rate.
     """
     with agent.eval_mode():
+        if isinstance(agent, HRLAgent):
+            return _hrl_batch_run_episodes(
+                env=env,
+                agent=agent,
+                n_steps=n_steps,
+                n_episodes=n_episodes,
+                max_episode_len=max_episode_len,
+                logger=logger,
+            )
         return _batch_run_episodes(
             env=env,
             agent=agent,
@@ -462,12 +603,15 @@ def create_tb_writer(outdir):
     return tb_writer
 
 
-def record_tb_stats(summary_writer, agent_stats, eval_stats, t):
+def record_tb_stats(summary_writer, agent_stats, eval_stats, t, timer_stats=()):
     cur_time = time.time()
 
     for stat, value in agent_stats:
         summary_writer.add_scalar("agent/" + stat, value, t, cur_time)
 
+    for stat, value in timer_stats:
+        summary_writer.add_scalar("timer/" + stat, value, t, cur_time)
+
     for stat in ("mean", "median", "max", "min", "stdev"):
         value = eval_stats[stat]
         summary_writer.add_scalar("eval/" + stat, value, t, cur_time)
@@ -509,6 +653,9 @@ class Evaluator(object):
             if the score (= mean of returns in evaluation episodes) exceeds
             the best-so-far score, the current agent is saved.
         use_tensorboard (bool): Additionally log eval stats to tensorboard
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, its
+            cumulative wall time of each phase of training is recorded after
+            the agent statistics.
     """
 
     def __init__(
@@ -525,7 +672,8 @@ class Evaluator(object):
         logger=None,
         use_tensorboard=False,
         record=False,
-        record_freq=500000
+        record_freq=500000,
+        phase_timer=None,
     ):
         assert (n_steps is None) != (n_episodes is None), (
             "One of n_steps or n_episodes must be None. "
@@ -549,9 +697,11 @@ class Evaluator(object):
 
         self.record = record
         self.record_freq = record_freq
+        self.phase_timer = phase_timer
         # Write a header line first
         with open(os.path.join(self.outdir, "scores.txt"), "w") as f:
             custom_columns = tuple(t[0] for t in self.agent.get_statistics())
+            custom_columns += tuple(t[0] for t in self._get_timer_statistics())
             column_names = _basic_columns + custom_columns
             print("\t".join(column_names), file=f)
 
@@ -573,13 +723,26 @@ class Evaluator(object):
         )
         elapsed = time.time() - self.start_time
         agent_stats = self.agent.get_statistics()
-        custom_values = tuple(tup[1] for tup in agent_stats)
+        timer_stats = self._get_timer_statistics()
+        self._record(t, episodes, elapsed, eval_stats, agent_stats, timer_stats)
+
         mean = eval_stats["mean"]
+        if mean > self.max_score:
+            self.logger.info("The best score is updated %s -> %s", self.max_score, mean)
+            self.max_score = mean
+            if self.save_best_so_far_agent:
+                save_agent(self.agent, "best", self.outdir, self.logger)
+
+        return mean
+
+    def _record(self, t, episodes, elapsed, eval_stats, agent_stats, timer_stats):
+        custom_values = tuple(tup[1] for tup in agent_stats)
+        custom_values += tuple(tup[1] for tup in timer_stats)
         values = (
             t,
             episodes,
             elapsed,
-            mean,
+            eval_stats["mean"],
             eval_stats["median"],
             eval_stats["stdev"],
             eval_stats["max"],
@@ -587,15 +750,12 @@ class Evaluator(object):
         ) + custom_values
         record_stats(self.outdir, values)
         if self.use_tensorboard:
-            record_tb_stats(self.tb_writer, agent_stats, eval_stats, t)
+            record_tb_stats(self.tb_writer, agent_stats, eval_stats, t, timer_stats)
 
-        if mean > self.max_score:
-            self.logger.info("The best score is updated %s -> %s", self.max_score, mean)
-            self.max_score = mean
-            if self.save_best_so_far_agent:
-                save_agent(self.agent, "best", self.outdir, self.logger)
-
-        return mean
+    def _get_timer_statistics(self):
+        if self.phase_timer is None:
+            return []
+        return self.phase_timer.get_statistics()
 
     def evaluate_if_necessary(self, t, episodes):
         if t >= self.prev_eval_t + self.eval_interval:
@@ -677,6 +837,7 @@ class AsyncEvaluator(object):
             self.n_episodes,
             max_episode_len=self.max_episode_len,
             logger=self.logger,
+            video_outdir=self.outdir,
         )
         elapsed = time.time() - self.start_time
         agent_stats = agent.get_statistics()
@@ -726,3 +887,272 @@ class AsyncEvaluator(object):
                     self.wrote_header.value = True
             return self.evaluate_and_update_max_score(t, episodes, env, agent)
         return None
+
+
+def _snapshot_state_dicts(agent):
+    """Copy state_dicts of the saved attributes of an agent to CPU."""
+    if isinstance(agent, HIROAgent):
+        return dict(
+            low_con=_snapshot_state_dicts(agent.low_con.agent),
+            high_con=_snapshot_state_dicts(agent.high_con.agent),
+        )
+
+    def copy_to_cpu(value):
+        if isinstance(value, torch.Tensor):
+            return value.detach().cpu().clone()
+        if isinstance(value, dict):
+            return {k: copy_to_cpu(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(copy_to_cpu(v) for v in value)
+        return value
+
+    return {
+        name: copy_to_cpu(getattr(agent, name).state_dict())
+        for name in agent.saved_attributes
+    }
+
+
+def _load_state_dicts(agent, state_dicts):
+    if isinstance(agent, HIROAgent):
+        _load_state_dicts(agent.low_con.agent, state_dicts["low_con"])
+        _load_state_dicts(agent.high_con.agent, state_dicts["high_con"])
+        return
+    for name, state_dict in state_dicts.items():
+        getattr(agent, name).load_state_dict(state_dict)
+
+
+def _background_evaluation_worker(
+    process_idx,
+    agent,
+    make_env,
+    task_queue,
+    result_queue,
+    max_score,
+    n_steps,
+    n_episodes,
+    max_episode_len,
+    save_best_so_far_agent,
+    outdir,
+    logger,
+):
+    env = None
+    try:
+        env = make_env(process_idx)
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            t, state_dicts = task
+            _load_state_dicts(agent, state_dicts)
+            eval_stats = eval_performance(
+                env,
+                agent,
+                n_steps,
+                n_episodes,
+                max_episode_len=max_episode_len,
+                logger=logger,
+            )
+            mean = eval_stats["mean"]
+            # The evaluated snapshot is saved here since the agent being
+            # trained has been updated since then
+            with max_score.get_lock():
+                if mean > max_score.value:
+                    logger.info(
+                        "The best score is updated %s -> %s", max_score.value, mean
+                    )
+                    max_score.value = mean
+                    if save_best_so_far_agent:
+                        save_agent(agent, "best", outdir, logger)
+            result_queue.put((t, eval_stats, None))
+    except Exception:
+        # Errors are raised again by the training process
+        result_queue.put((None, None, traceback.format_exc()))
+    finally:
+        if env is not None:
+            env.close()
+
+
+class BackgroundEvaluator(Evaluator):
+    """Evaluator that evaluates snapshots of an agent in other processes.
+
+    When evaluation is necessary, state_dicts of the saved attributes of the
+    agent are copied and sent to evaluation processes, each of which has
+    its own copy of the agent and env, and the training loop goes on without
+    waiting for the results. Results are recorded to scores.txt and
+    TensorBoard when they are received by `evaluate_if_necessary` or
+    `close`, and the best-so-far agent is saved by the evaluation process.
+
+    Copies of the agent are inherited by subprocesses, so the agent must be
+    picklable unless the "fork" start method is used, and models on GPUs
+    require the "spawn" start method. Evaluation processes are not daemonic
+    so that envs can start their own processes, e.g. `MultiprocessVectorEnv`,
+    hence `close` must be called to stop them. Errors raised in evaluation
+    processes are raised again by `receive_results`.
+
+    Args:
+        agent (Agent): Agent to evaluate.
+        make_env (callable): Callable that accepts the index of an evaluation
+            process and returns an env, which can be a VectorEnv.
+        n_steps (int): Number of timesteps used in each evaluation.
+        n_episodes (int): Number of episodes used in each evaluation.
+        eval_interval (int): Interval of evaluations in steps.
+        outdir (str): Path to a directory to save things.
+        max_episode_len (int): Maximum length of episodes used in evaluations.
+        step_offset (int): Offset of steps used to schedule evaluations.
+        save_best_so_far_agent (bool): If set to True, after each evaluation,
+            if the score (= mean of returns in evaluation episodes) exceeds
+            the best-so-far score, the evaluated snapshot is saved.
+        use_tensorboard (bool): Additionally log eval stats to tensorboard
+        n_workers (int): Number of evaluation processes. Evaluations are
+            skipped while all of them are busy so that snapshots do not
+            pile up.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, its
+            cumulative wall time of each phase of training is recorded after
+            the agent statistics.
+    """
+
+    def __init__(
+        self,
+        agent,
+        make_env,
+        n_steps,
+        n_episodes,
+        eval_interval,
+        outdir,
+        max_episode_len=None,
+        step_offset=0,
+        save_best_so_far_agent=True,
+        logger=None,
+        use_tensorboard=False,
+        n_workers=1,
+        phase_timer=None,
+    ):
+        assert n_workers > 0
+        self._max_score = mp.Value("d", np.finfo(np.float32).min)
+        super().__init__(
+            agent=agent,
+            env=None,
+            n_steps=n_steps,
+            n_episodes=n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=max_episode_len,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            logger=logger,
+            use_tensorboard=use_tensorboard,
+            phase_timer=phase_timer,
+        )
+        self.n_workers = n_workers
+        self.task_queue = mp.Queue()
+        self.result_queue = mp.Queue()
+        # Stats of the training at the steps being evaluated
+        self._pending = dict()
+        self.processes = [
+            mp.Process(
+                target=_background_evaluation_worker,
+                args=(
+                    process_idx,
+                    agent,
+                    make_env,
+                    self.task_queue,
+                    self.result_queue,
+                    self._max_score,
+                    n_steps,
+                    n_episodes,
+                    max_episode_len,
+                    save_best_so_far_agent,
+                    outdir,
+                    self.logger,
+                ),
+            )
+            for process_idx in range(n_workers)
+        ]
+        for p in self.processes:
+            p.start()
+
+    @property
+    def max_score(self):
+        with self._max_score.get_lock():
+            return self._max_score.value
+
+    @max_score.setter
+    def max_score(self, value):
+        with self._max_score.get_lock():
+            self._max_score.value = value
+
+    def evaluate_and_update_max_score(self, t, episodes):
+        """Send a snapshot of the agent to evaluation processes.
+
+        Returns:
+            bool: True if the snapshot is sent, or False if evaluation is
+                skipped since all the evaluation processes are busy.
+        """
+        if len(self._pending) >= self.n_workers:
+            self.logger.warning(
+                "Skipped evaluation at step %s since evaluation processes are busy",
+                t,
+            )
+            return False
+        self._pending[t] = (
+            episodes,
+            time.time() - self.start_time,
+            self.agent.get_statistics(),
+            self._get_timer_statistics(),
+        )
+        self.task_queue.put((t, _snapshot_state_dicts(self.agent)))
+        return True
+
+    def receive_results(self, block=False):
+        """Record results of evaluations that have finished.
+
+        Args:
+            block (bool): If set to True, wait for all the evaluations being
+                run to finish.
+
+        Returns:
+            float or None: Mean return of the latest evaluation received, or
+                None if no evaluation has finished.
+        """
+        score = None
+        while self._pending:
+            try:
+                t, eval_stats, error = self.result_queue.get(block=block, timeout=1)
+            except queue.Empty:
+                if any(p.exitcode is not None for p in self.processes):
+                    raise RuntimeError("Evaluation processes exited unexpectedly")
+                if not block:
+                    break
+                continue
+            if error is not None:
+                raise RuntimeError("Evaluation process failed:\n" + error)
+            episodes, elapsed, agent_stats, timer_stats = self._pending.pop(t)
+            self._record(t, episodes, elapsed, eval_stats, agent_stats, timer_stats)
+            score = eval_stats["mean"]
+        return score
+
+    def evaluate_if_necessary(self, t, episodes):
+        score = self.receive_results()
+        if t >= self.prev_eval_t + self.eval_interval:
+            self.evaluate_and_update_max_score(t, episodes)
+            self.prev_eval_t = t - t % self.eval_interval
+        return score
+
+    def close(self, wait=True):
+        """Stop evaluation processes.
+
+        Args:
+            wait (bool): If set to True, results of the evaluations being run
+                are received before stopping. Otherwise, evaluation processes
+                are terminated.
+        """
+        if wait:
+            self.receive_results(block=True)
+            for _ in self.processes:
+                self.task_queue.put(None)
+            for p in self.processes:
+                p.join()
+        else:
+            for p in self.processes:
+                p.terminate()
+                p.join()
@@ -0,0 +1,255 @@
+import contextlib
+import logging
+import os
+import time
+
+PHASES = (
+    "act",
+    "env_step",
+    "env_reset",
+    "observe",
+    "hooks",
+    "evaluation",
+    "checkpoint",
+)
+
+
+class _Phase(object):
+    """Context manager accumulating wall time spent inside it.
+
+    Entries nested in another entry, e.g. by recursive calls, are neither
+    timed nor counted again.
+    """
+
+    __slots__ = ("total", "count", "_start", "_depth")
+
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self._start = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._start = time.perf_counter()
+            self.count += 1
+        self._depth += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            self.total += time.perf_counter() - self._start
+
+
+class PhaseTimer(object):
+    """Timer of the phases of training loops.
+
+    Training functions such as `pfrl.experiments.train_agent` accept it as
+    `phase_timer` to measure wall time spent acting, stepping and resetting
+    envs, observing (which includes updates of the model), running step
+    hooks, evaluating and checkpointing. Cumulative times are also recorded
+    to scores.txt and TensorBoard by `pfrl.experiments.Evaluator`.
+
+    Args:
+        phases (Sequence of str): Names of phases. They are fixed so that
+            columns of scores.txt do not change during training.
+        report_interval (int or None): Interval of reports in steps. If set,
+            sinks are called with wall time spent in each phase since the
+            last report.
+        sinks (Sequence of callable or None): Callables that accept (t,
+            stats) as arguments, where stats is a list of (name, value) of
+            the last interval, e.g. ("act_time", 1.2) and ("wall_time", 10).
+            If set to None, stats are logged.
+        logger (logging.Logger): Logger used to log reports and profiles.
+        profile_steps (tuple of int or None): Range (start, stop) of steps
+            to profile. Profiling starts once the step reaches `start` and
+            stops once it reaches `stop`.
+        profiler (str): "cprofile" to use cProfile or "torch" to use
+            torch.profiler.
+        outdir (str or None): Directory to save profiles to. Profiles are
+            saved to `profile_<start>-<stop>.prof` for cProfile, which can be
+            read by pstats, or `profile_<start>-<stop>.json` for
+            torch.profiler, which can be read by chrome://tracing.
+    """
+
+    def __init__(
+        self,
+        phases=PHASES,
+        report_interval=None,
+        sinks=None,
+        logger=None,
+        profile_steps=None,
+        profiler="cprofile",
+        outdir=None,
+    ):
+        assert profiler in ("cprofile", "torch")
+        if profile_steps is not None:
+            assert outdir is not None, "outdir is required to save profiles"
+            assert profile_steps[0] < profile_steps[1]
+        self.phases = tuple(phases)
+        self._phases = {name: _Phase() for name in self.phases}
+        self.report_interval = report_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.sinks = [self.log_stats] if sinks is None else list(sinks)
+        self.profile_steps = profile_steps
+        self.profiler = profiler
+        self.outdir = outdir
+        self._profile = None
+        self._profiled = False
+        self._last_report_t = None
+        self._last_report_time = None
+        self._last_report_totals = None
+
+    def phase(self, name):
+        """Return a context manager that measures time spent in a phase.
+
+        Args:
+            name (str): Name of the phase.
+
+        Returns:
+            Context manager.
+        """
+        return self._phases[name]
+
+    def get_statistics(self):
+        """Return cumulative wall time spent in each phase.
+
+        Returns:
+            list: List of (name, seconds) tuples.
+        """
+        return [(name + "_time", self._phases[name].total) for name in self.phases]
+
+    def summary(self):
+        """Return cumulative wall time and number of entries of each phase.
+
+        Returns:
+            dict: Dict that maps the name of each phase to a dict with
+                "total" in seconds and "count".
+        """
+        return {
+            name: dict(total=self._phases[name].total, count=self._phases[name].count)
+            for name in self.phases
+        }
+
+    def step(self, t):
+        """Notify the timer of the current step.
+
+        It is called by training loops after each iteration to report stats
+        and to start and stop profiling.
+
+        Args:
+            t (int): Current step.
+        """
+        if self.report_interval is not None:
+            if self._last_report_t is None:
+                self._start_interval(t)
+            elif t - self._last_report_t >= self.report_interval:
+                self.report(t)
+        if self.profile_steps is not None and not self._profiled:
+            start, stop = self.profile_steps
+            if self._profile is None and start <= t < stop:
+                self._start_profile()
+            elif self._profile is not None and t >= stop:
+                self._stop_profile()
+
+    def _start_interval(self, t):
+        self._last_report_t = t
+        self._last_report_time = time.perf_counter()
+        self._last_report_totals = [self._phases[name].total for name in self.phases]
+
+    def report(self, t):
+        """Call sinks with stats since the last report.
+
+        Args:
+            t (int): Current step.
+        """
+        wall_time = time.perf_counter() - self._last_report_time
+        stats = [
+            (name + "_time", self._phases[name].total - last_total)
+            for name, last_total in zip(self.phases, self._last_report_totals)
+        ]
+        stats.append(("wall_time", wall_time))
+        for sink in self.sinks:
+            sink(t, stats)
+        self._start_interval(t)
+
+    def log_stats(self, t, stats):
+        """Sink that logs stats with the share of each phase."""
+        wall_time = dict(stats)["wall_time"]
+        self.logger.info(
+            "step:%s phase_times: %s",
+            t,
+            " ".join(
+                "{}:{:.3f}s({:.1%})".format(name, value, value / max(wall_time, 1e-8))
+                for name, value in stats
+                if name != "wall_time"
+            )
+            + " wall_time:{:.3f}s".format(wall_time),
+        )
+
+    def _profile_filename(self, ext):
+        start, stop = self.profile_steps
+        return os.path.join(self.outdir, "profile_{}-{}.{}".format(start, stop, ext))
+
+    def _start_profile(self):
+        if self.profiler == "cprofile":
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            import torch
+
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profile = torch.profiler.profile(activities=activities)
+            self._profile.start()
+
+    def _stop_profile(self):
+        if self.profiler == "cprofile":
+            self._profile.disable()
+            filename = self._profile_filename("prof")
+            self._profile.dump_stats(filename)
+        else:
+            self._profile.stop()
+            filename = self._profile_filename("json")
+            self._profile.export_chrome_trace(filename)
+            self.logger.info(
+                "profile:\n%s",
+                self._profile.key_averages().table(
+                    sort_by="self_cpu_time_total", row_limit=20
+                ),
+            )
+        self.logger.info("Saved the profile to %s", filename)
+        self._profile = None
+        self._profiled = True
+
+    def close(self):
+        """Stop and save the profile if it is running."""
+        if self._profile is not None:
+            self._stop_profile()
+
+
+class NullPhaseTimer(object):
+    """Phase timer that measures nothing, used when timing is disabled."""
+
+    phases = ()
+
+    def __init__(self):
+        self._null_context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null_context
+
+    def get_statistics(self):
+        return []
+
+    def summary(self):
+        return {}
+
+    def step(self, t):
+        pass
+
+    def close(self):
+        pass
@@ -1,19 +1,49 @@
 import logging
 import os
 
+from pfrl.experiments.evaluator import BackgroundEvaluator
 from pfrl.experiments.evaluator import Evaluator
 from pfrl.experiments.evaluator import save_agent
+from pfrl.experiments.phase_timer import NullPhaseTimer
 from pfrl.utils.ask_yes_no import ask_yes_no
 import numpy as np
 
 
+def stop_replay_prefetch(agent):
+    # Minibatches prefetched on a background thread are detached from
+    # prioritized replay buffers until their errors are updated, so the
+    # thread is stopped, which reattaches them, before the buffer is saved.
+    # It is started again by the next update.
+    replay_updater = getattr(agent, "replay_updater", None)
+    if replay_updater is not None:
+        replay_updater.stop_prefetch()
+
+
 def save_agent_replay_buffer(agent, t, outdir, suffix="", logger=None):
     logger = logger or logging.getLogger(__name__)
     filename = os.path.join(outdir, "{}{}.replay.pkl".format(t, suffix))
+    stop_replay_prefetch(agent)
     agent.replay_buffer.save(filename)
     logger.info("Saved the current replay buffer to %s", filename)
 
 
+def save_agent_replay_buffer_incremental(agent, t, outdir, logger=None):
+    logger = logger or logging.getLogger(__name__)
+    dirname = os.path.join(outdir, "replay_buffer_checkpoint")
+    stop_replay_prefetch(agent)
+    agent.replay_buffer.save_incremental(dirname)
+    logger.info("Saved the replay buffer at step %s to %s", t, dirname)
+
+
+def check_checkpoint_replay_buffer(agent):
+    replay_buffer = getattr(agent, "replay_buffer", None)
+    if not getattr(replay_buffer, "supports_save_incremental", False):
+        raise NotImplementedError(
+            "checkpoint_replay_buffer requires a replay buffer that supports "
+            "save_incremental, but {} does not".format(type(replay_buffer).__name__)
+        )
+
+
 def ask_and_save_agent_replay_buffer(agent, t, outdir, suffix=""):
     if hasattr(agent, "replay_buffer") and ask_yes_no(
         "Replay buffer has {} transitions. Do you save them to a file?".format(
@@ -35,15 +65,23 @@ def train_agent(
     successful_score=None,
     step_hooks=(),
     logger=None,
+    checkpoint_replay_buffer=False,
+    phase_timer=None,
 ):
 
     logger = logger or logging.getLogger(__name__)
+    phase_timer = phase_timer or NullPhaseTimer()
+
+    if checkpoint_replay_buffer:
+        # Fail before training rather than at the first checkpoint
+        check_checkpoint_replay_buffer(agent)
 
     episode_r = 0
     episode_idx = 0
 
     # o_0, r_0
-    obs = env.reset()
+    with phase_timer.phase("env_reset"):
+        obs = env.reset()
 
     t = step_offset
     if hasattr(agent, "t"):
@@ -54,17 +92,21 @@ def train_agent(
         while t < steps:
 
             # a_t
-            action = agent.act(obs)
+            with phase_timer.phase("act"):
+                action = agent.act(obs)
             # o_{t+1}, r_{t+1}
-            obs, r, done, info = env.step(action)
+            with phase_timer.phase("env_step"):
+                obs, r, done, info = env.step(action)
             t += 1
             episode_r += r
             episode_len += 1
             reset = episode_len == max_episode_len or info.get("needs_reset", False)
-            agent.observe(obs, r, done, reset)
+            with phase_timer.phase("observe"):
+                agent.observe(obs, r, done, reset)
 
-            for hook in step_hooks:
-                hook(env, agent, t)
+            with phase_timer.phase("hooks"):
+                for hook in step_hooks:
+                    hook(env, agent, t)
 
             if done or reset or t == steps:
                 logger.info(
@@ -76,7 +118,8 @@ def train_agent(
                 )
                 logger.info("statistics:%s", agent.get_statistics())
                 if evaluator is not None:
-                    evaluator.evaluate_if_necessary(t=t, episodes=episode_idx + 1)
+                    with phase_timer.phase("evaluation"):
+                        evaluator.evaluate_if_necessary(t=t, episodes=episode_idx + 1)
                     if (
                         successful_score is not None
                         and evaluator.max_score >= successful_score
@@ -88,14 +131,22 @@ def train_agent(
                 episode_r = 0
                 episode_idx += 1
                 episode_len = 0
-                obs = env.reset()
+                with phase_timer.phase("env_reset"):
+                    obs = env.reset()
             if checkpoint_freq and t % checkpoint_freq == 0:
-                save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+                with phase_timer.phase("checkpoint"):
+                    save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+                    if checkpoint_replay_buffer:
+                        save_agent_replay_buffer_incremental(agent, t, outdir, logger)
+            phase_timer.step(t)
 
     except (Exception, KeyboardInterrupt):
         # Save the current model before being killed
         save_agent(agent, t, outdir, logger, suffix="_except")
         raise
+    finally:
+        stop_replay_prefetch(agent)
+        phase_timer.close()
 
     # Save the final model
     save_agent(agent, t, outdir, logger, suffix="_finish")
@@ -207,6 +258,10 @@ def train_agent_with_evaluation(
     save_best_so_far_agent=True,
     use_tensorboard=False,
     logger=None,
+    checkpoint_replay_buffer=False,
+    phase_timer=None,
+    make_eval_env=None,
+    eval_workers=1,
 ):
     """Train an agent while periodically evaluating it.
 
@@ -223,7 +278,10 @@ def train_agent_with_evaluation(
         step_offset (int): Time step from which training starts.
         eval_max_episode_len (int or None): Maximum episode length of
             evaluation runs. If None, train_max_episode_len is used instead.
-        eval_env: Environment used for evaluation.
+        eval_env: Environment used for evaluation. It can be a
+            pfrl.env.VectorEnv, e.g. pfrl.envs.MultiprocessVectorEnv, so that
+            evaluation episodes are run in parallel even though training uses
+            a single env.
         successful_score (float): Finish training if the mean score is greater
             than or equal to this value if not None
         step_hooks (Sequence): Sequence of callable objects that accepts
@@ -234,6 +292,21 @@ def train_agent_with_evaluation(
             the best-so-far score, the current agent is saved.
         use_tensorboard (bool): Additionally log eval stats to tensorboard
         logger (logging.Logger): Logger used in this function.
+        checkpoint_replay_buffer (bool): If set to True, the replay buffer of
+            the agent is also saved at each checkpoint to
+            `outdir/replay_buffer_checkpoint` by `save_incremental`, which
+            writes only the transitions added since the last checkpoint. It
+            can be restored by `agent.replay_buffer.load_incremental`.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training is measured by it and recorded
+            with evaluation results.
+        make_eval_env (callable or None): If set, the agent is evaluated in
+            background processes on snapshots of it, so that training does
+            not wait for evaluation, and eval_env is not used. Each process
+            calls it with its index to make an env, which can be a VectorEnv.
+            See pfrl.experiments.BackgroundEvaluator.
+        eval_workers (int): Number of background evaluation processes used
+            if make_eval_env is set.
     """
 
     logger = logger or logging.getLogger(__name__)
@@ -246,33 +319,61 @@ def train_agent_with_evaluation(
     if eval_max_episode_len is None:
         eval_max_episode_len = train_max_episode_len
 
-    evaluator = Evaluator(
-        agent=agent,
-        n_steps=eval_n_steps,
-        n_episodes=eval_n_episodes,
-        eval_interval=eval_interval,
-        outdir=outdir,
-        max_episode_len=eval_max_episode_len,
-        env=eval_env,
-        step_offset=step_offset,
-        save_best_so_far_agent=save_best_so_far_agent,
-        use_tensorboard=use_tensorboard,
-        logger=logger,
-    )
+    if make_eval_env is None:
+        evaluator = Evaluator(
+            agent=agent,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            env=eval_env,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+            phase_timer=phase_timer,
+        )
+    else:
+        evaluator = BackgroundEvaluator(
+            agent=agent,
+            make_env=make_eval_env,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+            n_workers=eval_workers,
+            phase_timer=phase_timer,
+        )
 
-    train_agent(
-        agent,
-        env,
-        steps,
-        outdir,
-        checkpoint_freq=checkpoint_freq,
-        max_episode_len=train_max_episode_len,
-        step_offset=step_offset,
-        evaluator=evaluator,
-        successful_score=successful_score,
-        step_hooks=step_hooks,
-        logger=logger,
-    )
+    try:
+        train_agent(
+            agent,
+            env,
+            steps,
+            outdir,
+            checkpoint_freq=checkpoint_freq,
+            checkpoint_replay_buffer=checkpoint_replay_buffer,
+            max_episode_len=train_max_episode_len,
+            step_offset=step_offset,
+            evaluator=evaluator,
+            successful_score=successful_score,
+            step_hooks=step_hooks,
+            logger=logger,
+            phase_timer=phase_timer,
+        )
+    except (Exception, KeyboardInterrupt):
+        if make_eval_env is not None:
+            evaluator.close(wait=False)
+        raise
+    if make_eval_env is not None:
+        # Record the results of the evaluations being run
+        evaluator.close()
 
 
 def train_goal_conditioned_agent_with_evaluation(
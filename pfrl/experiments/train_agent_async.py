@@ -7,6 +7,7 @@ from torch import nn
 import numpy as np
 
 from pfrl.experiments.evaluator import AsyncEvaluator
+from pfrl.experiments.phase_timer import NullPhaseTimer
 from pfrl.utils import async_
 from pfrl.utils import random_seed
 import signal
@@ -41,9 +42,11 @@ def train_loop(
     successful_score=None,
     logger=None,
     global_step_hooks=[],
+    phase_timer=None,
 ):
 
     logger = logger or logging.getLogger(__name__)
+    phase_timer = phase_timer or NullPhaseTimer()
 
     if eval_env is None:
         eval_env = env
@@ -61,29 +64,34 @@ def train_loop(
         global_t = 0
         local_t = 0
         global_episodes = 0
-        obs = env.reset()
+        with phase_timer.phase("env_reset"):
+            obs = env.reset()
         episode_len = 0
         successful = False
 
         while True:
 
             # a_t
-            a = agent.act(obs)
+            with phase_timer.phase("act"):
+                a = agent.act(obs)
             # o_{t+1}, r_{t+1}
-            obs, r, done, info = env.step(a)
+            with phase_timer.phase("env_step"):
+                obs, r, done, info = env.step(a)
             local_t += 1
             episode_r += r
             episode_len += 1
             reset = episode_len == max_episode_len or info.get("needs_reset", False)
-            agent.observe(obs, r, done, reset)
+            with phase_timer.phase("observe"):
+                agent.observe(obs, r, done, reset)
 
             # Get and increment the global counter
             with counter.get_lock():
                 counter.value += 1
                 global_t = counter.value
 
-            for hook in global_step_hooks:
-                hook(env, agent, global_t)
+            with phase_timer.phase("hooks"):
+                for hook in global_step_hooks:
+                    hook(env, agent, global_t)
 
             if done or reset or global_t >= steps or stop_event.is_set():
                 if process_idx == 0:
@@ -98,9 +106,13 @@ def train_loop(
 
                 # Evaluate the current agent
                 if evaluator is not None:
-                    eval_score = evaluator.evaluate_if_necessary(
-                        t=global_t, episodes=global_episodes, env=eval_env, agent=agent
-                    )
+                    with phase_timer.phase("evaluation"):
+                        eval_score = evaluator.evaluate_if_necessary(
+                            t=global_t,
+                            episodes=global_episodes,
+                            env=eval_env,
+                            agent=agent,
+                        )
 
                     if (
                         eval_score is not None
@@ -123,7 +135,10 @@ def train_loop(
                 # Start a new episode
                 episode_r = 0
                 episode_len = 0
-                obs = env.reset()
+                with phase_timer.phase("env_reset"):
+                    obs = env.reset()
+
+            phase_timer.step(global_t)
 
             if process_idx == 0 and exception_event.is_set():
                 logger.exception("An exception detected, exiting")
@@ -133,6 +148,8 @@ def train_loop(
     except (Exception, KeyboardInterrupt):
         save_model()
         raise
+    finally:
+        phase_timer.close()
 
     if global_t == steps:
         # Save the final model
@@ -169,6 +186,7 @@ def train_agent_async(
     random_seeds=None,
     stop_event=None,
     exception_event=None,
+    phase_timer=None,
 ):
     """Train agent asynchronously using multiprocessing.
 
@@ -207,6 +225,9 @@ def train_agent_async(
             other thread raised an excpetion. The train will be terminated and
             the current agent will be saved.
             If set to None, a new Event object is created and used internally.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training in the first process is measured
+            by it. Stats are not recorded to scores.txt.
 
     Returns:
         Trained agent.
@@ -294,6 +315,7 @@ def train_agent_async(
                 eval_env=eval_env,
                 global_step_hooks=global_step_hooks,
                 logger=logger,
+                phase_timer=phase_timer if process_idx == 0 else None,
             )
 
         if profile:
@@ -5,8 +5,14 @@ import os
 import numpy as np
 
 
+from pfrl.experiments.evaluator import BackgroundEvaluator
 from pfrl.experiments.evaluator import Evaluator
 from pfrl.experiments.evaluator import save_agent
+from pfrl.experiments.evaluator import split_terminal_observations
+from pfrl.experiments.phase_timer import NullPhaseTimer
+from pfrl.experiments.train_agent import check_checkpoint_replay_buffer
+from pfrl.experiments.train_agent import save_agent_replay_buffer_incremental
+from pfrl.experiments.train_agent import stop_replay_prefetch
 
 
 def train_agent_batch(
@@ -24,12 +30,19 @@ def train_agent_batch(
     step_hooks=(),
     return_window_size=100,
     logger=None,
+    checkpoint_replay_buffer=False,
+    async_batch_size=None,
+    phase_timer=None,
 ):
     """Train an agent in a batch environment.
 
     Args:
         agent: Agent to train.
-        env: Environment to train the agent against.
+        env: Environment to train the agent against. If it resets envs
+            automatically, e.g. `pfrl.envs.MultiprocessVectorEnv` with
+            `auto_reset=True`, the agent observes the terminal observations
+            in infos and `env.reset` is called only for episodes that are
+            cut by `max_episode_len`.
         steps (int): Number of total time steps for training.
         eval_interval (int): Interval of evaluation.
         outdir (str): Path to the directory to output things.
@@ -45,9 +58,23 @@ def train_agent_batch(
             (env, agent, step) as arguments. They are called every step.
             See pfrl.experiments.hooks.
         logger (logging.Logger): Logger used in this function.
+        checkpoint_replay_buffer (bool): If set to True, the replay buffer of
+            the agent is also saved at each checkpoint to
+            `outdir/replay_buffer_checkpoint` by `save_incremental`, which
+            writes only the transitions added since the last checkpoint. It
+            can be restored by `agent.replay_buffer.load_incremental`.
+        async_batch_size (int): If set, envs are stepped asynchronously by
+            `env.step_async` and `env.step_wait`, and the agent acts on and
+            observes only the `async_batch_size` envs that finish stepping
+            first at each iteration, so that slow envs do not stall the
+            others. The agent must accept `env_ids` in `batch_act` and
+            `batch_observe`. The evaluator must use another env.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training is measured by it.
     """
 
     logger = logger or logging.getLogger(__name__)
+    phase_timer = phase_timer or NullPhaseTimer()
     recent_returns = deque(maxlen=return_window_size)
 
     num_envs = env.num_envs
@@ -55,8 +82,20 @@ def train_agent_batch(
     episode_idx = np.zeros(num_envs, dtype="i")
     episode_len = np.zeros(num_envs, dtype="i")
 
+    if async_batch_size is not None:
+        assert 0 < async_batch_size <= num_envs
+        if evaluator is not None and evaluator.env is env:
+            raise ValueError("async_batch_size requires a separate env for evaluation")
+
+    if checkpoint_replay_buffer:
+        # Fail before training rather than at the first checkpoint
+        check_checkpoint_replay_buffer(agent)
+
     # o_0, r_0
-    obss = env.reset()
+    with phase_timer.phase("env_reset"):
+        obss = env.reset()
+    # Indices of the envs the current batch comes from
+    env_ids = np.arange(num_envs)
 
     t = step_offset
     if hasattr(agent, "t"):
@@ -64,27 +103,45 @@ def train_agent_batch(
 
     try:
         while True:
-            # a_t
-            actions = agent.batch_act(obss)
-            # o_{t+1}, r_{t+1}
-            obss, rs, dones, infos = env.step(actions)
-            episode_r += rs
-            episode_len += 1
+            if async_batch_size is None:
+                # a_t
+                with phase_timer.phase("act"):
+                    actions = agent.batch_act(obss)
+                # o_{t+1}, r_{t+1}
+                with phase_timer.phase("env_step"):
+                    obss, rs, dones, infos = env.step(actions)
+            else:
+                with phase_timer.phase("act"):
+                    actions = agent.batch_act(obss, env_ids=env_ids)
+                with phase_timer.phase("env_step"):
+                    env.step_async(actions, env_ids)
+                    # Results of the envs that finish first
+                    env_ids, obss, rs, dones, infos = env.step_wait(async_batch_size)
+                env_ids = np.asarray(env_ids)
+            # Observations of the envs reset automatically by env
+            terminal_obss, auto_reset = split_terminal_observations(obss, infos)
+            episode_r[env_ids] += rs
+            episode_len[env_ids] += 1
 
             # Compute mask for done and reset
             if max_episode_len is None:
-                resets = np.zeros(num_envs, dtype=bool)
+                resets = np.zeros(len(env_ids), dtype=bool)
             else:
-                resets = episode_len == max_episode_len
+                resets = episode_len[env_ids] == max_episode_len
             resets = np.logical_or(
                 resets, [info.get("needs_reset", False) for info in infos]
             )
             # Agent observes the consequences
-            agent.batch_observe(obss, rs, dones, resets)
+            with phase_timer.phase("observe"):
+                if async_batch_size is None:
+                    agent.batch_observe(terminal_obss, rs, dones, resets)
+                else:
+                    agent.batch_observe(
+                        terminal_obss, rs, dones, resets, env_ids=env_ids
+                    )
 
-            # Make mask. 0 if done/reset, 1 if pass
+            # True if done/reset
             end = np.logical_or(resets, dones)
-            not_end = np.logical_not(end)
 
             # For episodes that ends, do the following:
             #   1. increment the episode count
@@ -93,21 +150,28 @@ def train_agent_batch(
             #   4. clear the record of the number of steps
             #   5. reset the env to start a new episode
             # 3-5 are skipped when training is already finished.
-            episode_idx += end
-            recent_returns.extend(episode_r[end])
+            ended_env_ids = env_ids[end]
+            episode_idx[ended_env_ids] += 1
+            recent_returns.extend(episode_r[ended_env_ids])
 
-            for _ in range(num_envs):
+            for _ in range(len(env_ids)):
                 t += 1
                 if checkpoint_freq and t % checkpoint_freq == 0:
-                    save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+                    with phase_timer.phase("checkpoint"):
+                        save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+                        if checkpoint_replay_buffer:
+                            save_agent_replay_buffer_incremental(
+                                agent, t, outdir, logger
+                            )
 
-                for hook in step_hooks:
-                    hook(env, agent, t)
+                with phase_timer.phase("hooks"):
+                    for hook in step_hooks:
+                        hook(env, agent, t)
 
             if (
                 log_interval is not None
                 and t >= log_interval
-                and t % log_interval < num_envs
+                and t % log_interval < len(env_ids)
             ):
                 logger.info(
                     "outdir:{} step:{} episode:{} last_R: {} average_R:{}".format(  # NOQA
@@ -120,31 +184,56 @@ def train_agent_batch(
                 )
                 logger.info("statistics: {}".format(agent.get_statistics()))
             if evaluator:
-                if evaluator.evaluate_if_necessary(t=t, episodes=np.sum(episode_idx)):
+                with phase_timer.phase("evaluation"):
+                    score = evaluator.evaluate_if_necessary(
+                        t=t, episodes=np.sum(episode_idx)
+                    )
+                if score:
                     if (
                         successful_score is not None
                         and evaluator.max_score >= successful_score
                     ):
                         break
 
+            phase_timer.step(t)
+
             if t >= steps:
                 break
 
             # Start new episodes if needed
-            episode_r[end] = 0
-            episode_len[end] = 0
-            obss = env.reset(not_end)
+            episode_r[ended_env_ids] = 0
+            episode_len[ended_env_ids] = 0
+            # Envs reset automatically by env need not be reset
+            to_reset = np.logical_and(end, np.logical_not(auto_reset))
+            with phase_timer.phase("env_reset"):
+                if async_batch_size is None:
+                    if to_reset.any() or not getattr(env, "auto_reset", False):
+                        obss = env.reset(np.logical_not(to_reset))
+                elif to_reset.any():
+                    mask = np.ones(num_envs, dtype=bool)
+                    mask[env_ids[to_reset]] = False
+                    reset_obss = env.reset(mask)
+                    obss = [
+                        reset_obss[i] if r else ob
+                        for i, r, ob in zip(env_ids, to_reset, obss)
+                    ]
 
     except (Exception, KeyboardInterrupt):
         # Save the current model before being killed
         save_agent(agent, t, outdir, logger, suffix="_except")
         env.close()
-        if evaluator:
+        if evaluator and evaluator.env is not None:
             evaluator.env.close()
         raise
     else:
+        if len(env_ids) < num_envs:
+            # Receive the results of the envs still being stepped
+            env.step_wait()
         # Save the final model
         save_agent(agent, t, outdir, logger, suffix="_finish")
+    finally:
+        stop_replay_prefetch(agent)
+        phase_timer.close()
 
 
 def train_agent_batch_with_evaluation(
@@ -166,6 +255,11 @@ def train_agent_batch_with_evaluation(
     step_hooks=(),
     save_best_so_far_agent=True,
     logger=None,
+    checkpoint_replay_buffer=False,
+    async_batch_size=None,
+    phase_timer=None,
+    make_eval_env=None,
+    eval_workers=1,
 ):
     """Train an agent while regularly evaluating it.
 
@@ -195,6 +289,25 @@ def train_agent_batch_with_evaluation(
             if the score (= mean return of evaluation episodes) exceeds
             the best-so-far score, the current agent is saved.
         logger (logging.Logger): Logger used in this function.
+        checkpoint_replay_buffer (bool): If set to True, the replay buffer of
+            the agent is also saved at each checkpoint to
+            `outdir/replay_buffer_checkpoint` by `save_incremental`, which
+            writes only the transitions added since the last checkpoint. It
+            can be restored by `agent.replay_buffer.load_incremental`.
+        async_batch_size (int): If set, envs are stepped asynchronously and
+            the agent works on the `async_batch_size` envs that finish
+            stepping first. See `train_agent_batch`. `eval_env` must be
+            specified.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training is measured by it and recorded
+            with evaluation results.
+        make_eval_env (callable or None): If set, the agent is evaluated in
+            background processes on snapshots of it, so that training does
+            not wait for evaluation, and eval_env is not used. Each process
+            calls it with its index to make an env, which can be a VectorEnv.
+            See pfrl.experiments.BackgroundEvaluator.
+        eval_workers (int): Number of background evaluation processes used
+            if make_eval_env is set.
     """
 
     logger = logger or logging.getLogger(__name__)
@@ -207,32 +320,60 @@ def train_agent_batch_with_evaluation(
     if eval_max_episode_len is None:
         eval_max_episode_len = max_episode_len
 
-    evaluator = Evaluator(
-        agent=agent,
-        n_steps=eval_n_steps,
-        n_episodes=eval_n_episodes,
-        eval_interval=eval_interval,
-        outdir=outdir,
-        max_episode_len=eval_max_episode_len,
-        env=eval_env,
-        step_offset=step_offset,
-        save_best_so_far_agent=save_best_so_far_agent,
-        logger=logger,
-    )
-
-    train_agent_batch(
-        agent,
-        env,
-        steps,
-        outdir,
-        checkpoint_freq=checkpoint_freq,
-        max_episode_len=max_episode_len,
-        step_offset=step_offset,
-        eval_interval=eval_interval,
-        evaluator=evaluator,
-        successful_score=successful_score,
-        return_window_size=return_window_size,
-        log_interval=log_interval,
-        step_hooks=step_hooks,
-        logger=logger,
-    )
+    if make_eval_env is None:
+        evaluator = Evaluator(
+            agent=agent,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            env=eval_env,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            logger=logger,
+            phase_timer=phase_timer,
+        )
+    else:
+        evaluator = BackgroundEvaluator(
+            agent=agent,
+            make_env=make_eval_env,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            logger=logger,
+            n_workers=eval_workers,
+            phase_timer=phase_timer,
+        )
+
+    try:
+        train_agent_batch(
+            agent,
+            env,
+            steps,
+            outdir,
+            checkpoint_freq=checkpoint_freq,
+            checkpoint_replay_buffer=checkpoint_replay_buffer,
+            max_episode_len=max_episode_len,
+            step_offset=step_offset,
+            eval_interval=eval_interval,
+            evaluator=evaluator,
+            successful_score=successful_score,
+            return_window_size=return_window_size,
+            log_interval=log_interval,
+            step_hooks=step_hooks,
+            logger=logger,
+            async_batch_size=async_batch_size,
+            phase_timer=phase_timer,
+        )
+    except (Exception, KeyboardInterrupt):
+        if make_eval_env is not None:
+            evaluator.close(wait=False)
+        raise
+    if make_eval_env is not None:
+        # Record the results of the evaluations being run
+        evaluator.close()
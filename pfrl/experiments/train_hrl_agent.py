@@ -1,11 +1,16 @@
+from collections import deque
 import os
 import logging
 
 import numpy as np
 
 from pfrl.agents.hrl.hiro_agent import HIROAgent
+from pfrl.experiments.evaluator import BackgroundEvaluator
 from pfrl.experiments.evaluator import Evaluator
 from pfrl.experiments.evaluator import save_agent
+from pfrl.experiments.evaluator import split_goal_observations
+from pfrl.experiments.evaluator import split_terminal_observations
+from pfrl.experiments.phase_timer import NullPhaseTimer
 
 
 def train_hrl_agent(
@@ -20,12 +25,15 @@ def train_hrl_agent(
     successful_score=None,
     step_hooks=(),
     logger=None,
+    phase_timer=None,
 ):
 
     logger = logger or logging.getLogger(__name__)
+    phase_timer = phase_timer or NullPhaseTimer()
     episode_r = 0
     episode_idx = 0
-    obs_dict = env.reset()
+    with phase_timer.phase("env_reset"):
+        obs_dict = env.reset()
 
     fg = obs_dict['desired_goal']
     obs = obs_dict['observation']
@@ -42,26 +50,31 @@ def train_hrl_agent(
     try:
         while t < steps:
             # get action
-            action = agent.act_low_level(obs, sg)
+            with phase_timer.phase("act"):
+                action = agent.act_low_level(obs, sg)
 
             # take a step in the environment
-            obs_dict, r, done, info = env.step(action)
+            with phase_timer.phase("env_step"):
+                obs_dict, r, done, info = env.step(action)
             obs = obs_dict['observation']
 
-            n_sg = agent.act_high_level(obs, fg, sg, step, t)
+            with phase_timer.phase("act"):
+                n_sg = agent.act_high_level(obs, fg, sg, step, t)
 
             episode_r += r
             episode_len += 1
 
             reset = episode_len == max_episode_len or info.get("needs_reset", False)
 
-            agent.observe(obs, fg, n_sg, r, done, reset, step, t)
+            with phase_timer.phase("observe"):
+                agent.observe(obs, fg, n_sg, r, done, reset, step, t)
 
             sg = n_sg
             t += 1
             step += 1
-            for hook in step_hooks:
-                hook(env, agent, t)
+            with phase_timer.phase("hooks"):
+                for hook in step_hooks:
+                    hook(env, agent, t)
 
             if done or reset or t == steps:
                 logger.info(
@@ -73,7 +86,8 @@ def train_hrl_agent(
                 )
                 logger.info("statistics:%s", agent.get_statistics())
                 if evaluator is not None:
-                    evaluator.evaluate_if_necessary(t=t, episodes=episode_idx + 1)
+                    with phase_timer.phase("evaluation"):
+                        evaluator.evaluate_if_necessary(t=t, episodes=episode_idx + 1)
                     if (
                         successful_score is not None
                         and evaluator.max_score >= successful_score
@@ -91,19 +105,25 @@ def train_hrl_agent(
                 episode_len = 0
                 step = 0
                 agent.end_episode()
-                obs_dict = env.reset()
+                with phase_timer.phase("env_reset"):
+                    obs_dict = env.reset()
 
                 fg = obs_dict['desired_goal']
                 obs = obs_dict['observation']
                 agent.sample_subgoal(obs, fg)
 
             if checkpoint_freq and t % checkpoint_freq == 0:
-                save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+                with phase_timer.phase("checkpoint"):
+                    save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+
+            phase_timer.step(t)
 
     except (Exception, KeyboardInterrupt):
         # Save the current model before being killed
         save_agent(agent, t, outdir, logger, suffix="_except")
         raise
+    finally:
+        phase_timer.close()
 
     # Save the final model
     save_agent(agent, t, outdir, logger, suffix="_finish")
@@ -127,7 +147,10 @@ def train_hrl_agent_with_evaluation(
     save_best_so_far_agent=True,
     use_tensorboard=False,
     logger=None,
-    record=False
+    record=False,
+    phase_timer=None,
+    make_eval_env=None,
+    eval_workers=1,
 ):
     """Train an HRL (hierarchical reinforcement
     learning) agent while periodically evaluating it.
@@ -145,7 +168,10 @@ def train_hrl_agent_with_evaluation(
         step_offset (int): Time step from which training starts.
         eval_max_episode_len (int or None): Maximum episode length of
             evaluation runs. If None, train_max_episode_len is used instead.
-        eval_env: Environment used for evaluation.
+        eval_env: Environment used for evaluation. It can be a
+            pfrl.env.VectorEnv, e.g. pfrl.envs.MultiprocessVectorEnv, so that
+            evaluation episodes are run in parallel even though training uses
+            a single env.
         successful_score (float): Finish training if the mean score is greater
             than or equal to this value if not None
         step_hooks (Sequence): Sequence of callable objects that accepts
@@ -156,6 +182,16 @@ def train_hrl_agent_with_evaluation(
             the best-so-far score, the current agent is saved.
         use_tensorboard (bool): Additionally log eval stats to tensorboard
         logger (logging.Logger): Logger used in this function.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training is measured by it and recorded to
+            scores.txt.
+        make_eval_env (callable or None): If set, the agent is evaluated in
+            background processes on snapshots of it, so that training does
+            not wait for evaluation, and eval_env is not used. Each process
+            calls it with its index to make an env, which can be a VectorEnv.
+            See pfrl.experiments.BackgroundEvaluator.
+        eval_workers (int): Number of background evaluation processes used
+            if make_eval_env is set.
     """
 
     logger = logger or logging.getLogger(__name__)
@@ -168,34 +204,366 @@ def train_hrl_agent_with_evaluation(
     if eval_max_episode_len is None:
         eval_max_episode_len = train_max_episode_len
 
-    evaluator = Evaluator(
-        agent=agent,
-        n_steps=eval_n_steps,
-        n_episodes=eval_n_episodes,
-        eval_interval=eval_interval,
-        outdir=outdir,
-        max_episode_len=eval_max_episode_len,
-        env=eval_env,
-        step_offset=step_offset,
-        save_best_so_far_agent=save_best_so_far_agent,
-        use_tensorboard=use_tensorboard,
-        logger=logger,
-        record=record
-    )
-
-    train_hrl_agent(
-        agent,
-        env,
-        steps,
-        outdir,
-        checkpoint_freq=checkpoint_freq,
-        max_episode_len=train_max_episode_len,
-        step_offset=step_offset,
-        evaluator=evaluator,
-        successful_score=successful_score,
-        step_hooks=step_hooks,
-        logger=logger,
-    )
+    if make_eval_env is None:
+        evaluator = Evaluator(
+            agent=agent,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            env=eval_env,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+            record=record,
+            phase_timer=phase_timer,
+        )
+    else:
+        evaluator = BackgroundEvaluator(
+            agent=agent,
+            make_env=make_eval_env,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+            n_workers=eval_workers,
+            phase_timer=phase_timer,
+        )
+
+    try:
+        train_hrl_agent(
+            agent,
+            env,
+            steps,
+            outdir,
+            checkpoint_freq=checkpoint_freq,
+            max_episode_len=train_max_episode_len,
+            step_offset=step_offset,
+            evaluator=evaluator,
+            successful_score=successful_score,
+            step_hooks=step_hooks,
+            logger=logger,
+            phase_timer=phase_timer,
+        )
+    except (Exception, KeyboardInterrupt):
+        if make_eval_env is not None:
+            evaluator.close(wait=False)
+        raise
+    if make_eval_env is not None:
+        # Record the results of the evaluations being run
+        evaluator.close()
+
+
+def train_hrl_agent_batch(
+    agent: HIROAgent,
+    env,
+    steps,
+    outdir,
+    checkpoint_freq=None,
+    log_interval=None,
+    max_episode_len=None,
+    step_offset=0,
+    evaluator=None,
+    successful_score=None,
+    step_hooks=(),
+    return_window_size=100,
+    logger=None,
+    phase_timer=None,
+):
+    """Train an HRL agent in a batch environment.
+
+    Subgoals, steps of episodes and high level transitions are tracked for
+    each env, so a pfrl.envs.MultiprocessVectorEnv of goal-conditioned envs
+    can be used to step simulators in parallel.
+
+    Args:
+        agent: A pfrl.agents.HIROAgent.
+        env: pfrl.env.VectorEnv of goal-conditioned envs, whose observations
+            are dicts with "observation" and "desired_goal".
+        steps (int): Number of total time steps for training.
+        outdir (str): Path to the directory to output things.
+        checkpoint_freq (int): frequency at which agents are stored.
+        log_interval (int): Interval of logging.
+        max_episode_len (int): Maximum episode length.
+        step_offset (int): Time step from which training starts.
+        evaluator (Evaluator or None): If set, it is called at every step to
+            evaluate the agent if necessary.
+        successful_score (float): Finish training if the mean score is greater
+            or equal to this value if not None
+        step_hooks (Sequence): Sequence of callable objects that accepts
+            (env, agent, step) as arguments. They are called every step.
+            See pfrl.experiments.hooks.
+        return_window_size (int): Number of training episodes used to estimate
+            the average returns of the current agent.
+        logger (logging.Logger): Logger used in this function.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training is measured by it.
+    """
+
+    logger = logger or logging.getLogger(__name__)
+    phase_timer = phase_timer or NullPhaseTimer()
+    recent_returns = deque(maxlen=return_window_size)
+
+    num_envs = env.num_envs
+    episode_r = np.zeros(num_envs, dtype=np.float64)
+    episode_idx = np.zeros(num_envs, dtype="i")
+    episode_len = np.zeros(num_envs, dtype="i")
+
+    with phase_timer.phase("env_reset"):
+        obss, fgs = split_goal_observations(env.reset())
+    with phase_timer.phase("act"):
+        sgs = agent.batch_sample_subgoal(obss, fgs)
+
+    t = step_offset
+
+    try:
+        while True:
+            # get actions
+            with phase_timer.phase("act"):
+                actions = agent.batch_act_low_level(obss, sgs)
+
+            # take a step in the environments
+            with phase_timer.phase("env_step"):
+                obs_dicts, rs, dones, infos = env.step(actions)
+            # Observations of the envs reset automatically by env
+            terminal_obs_dicts, auto_reset = split_terminal_observations(
+                obs_dicts, infos
+            )
+            obss, _ = split_goal_observations(terminal_obs_dicts)
+            # Steps of the current episodes before this step
+            batch_step = episode_len.copy()
+
+            with phase_timer.phase("act"):
+                n_sgs = agent.batch_act_high_level(obss, fgs, sgs, batch_step, t)
+
+            episode_r += rs
+            episode_len += 1
+
+            if max_episode_len is None:
+                resets = np.zeros(num_envs, dtype=bool)
+            else:
+                resets = episode_len == max_episode_len
+            resets = np.logical_or(
+                resets, [info.get("needs_reset", False) for info in infos]
+            )
+
+            with phase_timer.phase("observe"):
+                agent.batch_observe(obss, fgs, n_sgs, rs, dones, resets, batch_step, t)
+            sgs = n_sgs
+
+            # True if done/reset
+            end = np.logical_or(resets, dones)
+            episode_idx[end] += 1
+            recent_returns.extend(episode_r[end])
+
+            for _ in range(num_envs):
+                t += 1
+                if checkpoint_freq and t % checkpoint_freq == 0:
+                    with phase_timer.phase("checkpoint"):
+                        save_agent(agent, t, outdir, logger, suffix="_checkpoint")
+
+                with phase_timer.phase("hooks"):
+                    for hook in step_hooks:
+                        hook(env, agent, t)
+
+            if (
+                log_interval is not None
+                and t >= log_interval
+                and t % log_interval < num_envs
+            ):
+                logger.info(
+                    "outdir:%s step:%s episode:%s last_R: %s average_R:%s",
+                    outdir,
+                    t,
+                    np.sum(episode_idx),
+                    recent_returns[-1] if recent_returns else np.nan,
+                    np.mean(recent_returns) if recent_returns else np.nan,
+                )
+                logger.info("statistics:%s", agent.get_statistics())
+            if evaluator:
+                with phase_timer.phase("evaluation"):
+                    score = evaluator.evaluate_if_necessary(
+                        t=t, episodes=np.sum(episode_idx)
+                    )
+                if score:
+                    if (
+                        successful_score is not None
+                        and evaluator.max_score >= successful_score
+                    ):
+                        break
+
+            phase_timer.step(t)
+
+            if t >= steps:
+                break
+
+            # Start new episodes if needed
+            episode_r[end] = 0
+            episode_len[end] = 0
+            # Envs reset automatically by env need not be reset
+            to_reset = np.logical_and(end, np.logical_not(auto_reset))
+            with phase_timer.phase("env_reset"):
+                if to_reset.any() or not getattr(env, "auto_reset", False):
+                    obs_dicts = env.reset(np.logical_not(to_reset))
+            obss, fgs = split_goal_observations(obs_dicts)
+            if end.any():
+                with phase_timer.phase("act"):
+                    sgs[end] = agent.batch_sample_subgoal(obss[end], fgs[end])
+
+    except (Exception, KeyboardInterrupt):
+        # Save the current model before being killed
+        save_agent(agent, t, outdir, logger, suffix="_except")
+        env.close()
+        if evaluator and evaluator.env is not None:
+            evaluator.env.close()
+        raise
+    else:
+        # Save the final model
+        save_agent(agent, t, outdir, logger, suffix="_finish")
+    finally:
+        phase_timer.close()
+
+
+def train_hrl_agent_batch_with_evaluation(
+    agent,
+    env,
+    steps,
+    eval_n_steps,
+    eval_n_episodes,
+    eval_interval,
+    outdir,
+    checkpoint_freq=None,
+    max_episode_len=None,
+    step_offset=0,
+    eval_max_episode_len=None,
+    return_window_size=100,
+    eval_env=None,
+    log_interval=None,
+    successful_score=None,
+    step_hooks=(),
+    save_best_so_far_agent=True,
+    use_tensorboard=False,
+    logger=None,
+    phase_timer=None,
+    make_eval_env=None,
+    eval_workers=1,
+):
+    """Train an HRL agent in a batch environment while evaluating it.
+
+    Args:
+        agent: A pfrl.agents.HIROAgent.
+        env: pfrl.env.VectorEnv of goal-conditioned envs to train the agent
+            against.
+        steps (int): Number of total time steps for training.
+        eval_n_steps (int): Number of timesteps at each evaluation phase.
+        eval_n_episodes (int): Number of episodes at each evaluation phase.
+        eval_interval (int): Interval of evaluation.
+        outdir (str): Path to the directory to output things.
+        checkpoint_freq (int): frequency at which agents are stored.
+        max_episode_len (int): Maximum episode length.
+        step_offset (int): Time step from which training starts.
+        eval_max_episode_len (int or None): Maximum episode length of
+            evaluation runs. If set to None, max_episode_len is used instead.
+        return_window_size (int): Number of training episodes used to estimate
+            the average returns of the current agent.
+        eval_env: Environment used for evaluation, which can be a
+            pfrl.env.VectorEnv. If set to None, env is used.
+        log_interval (int): Interval of logging.
+        successful_score (float): Finish training if the mean score is greater
+            or equal to this value if not None
+        step_hooks (Sequence): Sequence of callable objects that accepts
+            (env, agent, step) as arguments. They are called every step.
+            See pfrl.experiments.hooks.
+        save_best_so_far_agent (bool): If set to True, after each evaluation,
+            if the score (= mean return of evaluation episodes) exceeds
+            the best-so-far score, the current agent is saved.
+        use_tensorboard (bool): Additionally log eval stats to tensorboard
+        logger (logging.Logger): Logger used in this function.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training is measured by it and recorded to
+            scores.txt.
+        make_eval_env (callable or None): If set, the agent is evaluated in
+            background processes on snapshots of it, so that training does
+            not wait for evaluation, and eval_env is not used. Each process
+            calls it with its index to make an env, which can be a VectorEnv.
+            See pfrl.experiments.BackgroundEvaluator.
+        eval_workers (int): Number of background evaluation processes used
+            if make_eval_env is set.
+    """
+
+    logger = logger or logging.getLogger(__name__)
+
+    os.makedirs(outdir, exist_ok=True)
+
+    if eval_env is None:
+        eval_env = env
+
+    if eval_max_episode_len is None:
+        eval_max_episode_len = max_episode_len
+
+    if make_eval_env is None:
+        evaluator = Evaluator(
+            agent=agent,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            env=eval_env,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+            phase_timer=phase_timer,
+        )
+    else:
+        evaluator = BackgroundEvaluator(
+            agent=agent,
+            make_env=make_eval_env,
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=eval_max_episode_len,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+            n_workers=eval_workers,
+            phase_timer=phase_timer,
+        )
+
+    try:
+        train_hrl_agent_batch(
+            agent,
+            env,
+            steps,
+            outdir,
+            checkpoint_freq=checkpoint_freq,
+            log_interval=log_interval,
+            max_episode_len=max_episode_len,
+            step_offset=step_offset,
+            evaluator=evaluator,
+            successful_score=successful_score,
+            step_hooks=step_hooks,
+            return_window_size=return_window_size,
+            logger=logger,
+            phase_timer=phase_timer,
+        )
+    except (Exception, KeyboardInterrupt):
+        if make_eval_env is not None:
+            evaluator.close(wait=False)
+        raise
+    if make_eval_env is not None:
+        # Record the results of the evaluations being run
+        evaluator.close()
 
 
 def run_evaluation(args, env, agent):
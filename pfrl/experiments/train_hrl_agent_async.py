@@ -0,0 +1,303 @@
+import logging
+import os
+
+import numpy as np
+import torch.multiprocessing as mp
+
+from pfrl.experiments.evaluator import AsyncEvaluator
+from pfrl.experiments.phase_timer import NullPhaseTimer
+from pfrl.experiments.train_agent_async import kill_all
+from pfrl.utils import async_
+from pfrl.utils import random_seed
+
+
+def train_hrl_loop(
+    process_idx,
+    env,
+    agent,
+    steps,
+    outdir,
+    counter,
+    episodes_counter,
+    stop_event,
+    exception_event,
+    max_episode_len=None,
+    evaluator=None,
+    eval_env=None,
+    successful_score=None,
+    logger=None,
+    global_step_hooks=[],
+    phase_timer=None,
+):
+
+    logger = logger or logging.getLogger(__name__)
+    phase_timer = phase_timer or NullPhaseTimer()
+
+    if eval_env is None:
+        eval_env = env
+
+    def save_model():
+        if process_idx == 0:
+            # Save the current model before being killed
+            dirname = os.path.join(outdir, "{}_except".format(global_t))
+            agent.save(dirname)
+            logger.info("Saved the current model to %s", dirname)
+
+    try:
+
+        episode_r = 0
+        global_t = 0
+        local_t = 0
+        global_episodes = 0
+        with phase_timer.phase("env_reset"):
+            obs_dict = env.reset()
+        fg = obs_dict["desired_goal"]
+        obs = obs_dict["observation"]
+        sg = env.subgoal_space.sample()
+        episode_len = 0
+        step = 0
+        successful = False
+
+        while True:
+
+            # a_t
+            with phase_timer.phase("act"):
+                action = agent.act_low_level(obs, sg)
+            # o_{t+1}, r_{t+1}
+            with phase_timer.phase("env_step"):
+                obs_dict, r, done, info = env.step(action)
+            obs = obs_dict["observation"]
+            with phase_timer.phase("act"):
+                n_sg = agent.act_high_level(obs, fg, sg, step, global_t)
+            local_t += 1
+            episode_r += r
+            episode_len += 1
+            reset = episode_len == max_episode_len or info.get("needs_reset", False)
+            with phase_timer.phase("observe"):
+                agent.observe(obs, fg, n_sg, r, done, reset, step, global_t)
+            sg = n_sg
+            step += 1
+
+            # Get and increment the global counter
+            with counter.get_lock():
+                counter.value += 1
+                global_t = counter.value
+
+            with phase_timer.phase("hooks"):
+                for hook in global_step_hooks:
+                    hook(env, agent, global_t)
+
+            if done or reset or global_t >= steps or stop_event.is_set():
+                if process_idx == 0:
+                    logger.info(
+                        "outdir:%s global_step:%s local_step:%s R:%s",
+                        outdir,
+                        global_t,
+                        local_t,
+                        episode_r,
+                    )
+                    logger.info("statistics:%s", agent.get_statistics())
+
+                # Evaluate the current agent
+                if evaluator is not None:
+                    with phase_timer.phase("evaluation"):
+                        eval_score = evaluator.evaluate_if_necessary(
+                            t=global_t,
+                            episodes=global_episodes,
+                            env=eval_env,
+                            agent=agent,
+                        )
+
+                    if (
+                        eval_score is not None
+                        and successful_score is not None
+                        and eval_score >= successful_score
+                    ):
+                        stop_event.set()
+                        successful = True
+                        # Break immediately in order to avoid an additional
+                        # call of agent.act_low_level
+                        break
+
+                with episodes_counter.get_lock():
+                    episodes_counter.value += 1
+                    global_episodes = episodes_counter.value
+
+                if global_t >= steps or stop_event.is_set():
+                    break
+
+                # Start a new episode, reset the environment and goal
+                episode_r = 0
+                episode_len = 0
+                step = 0
+                agent.end_episode()
+                with phase_timer.phase("env_reset"):
+                    obs_dict = env.reset()
+                fg = obs_dict["desired_goal"]
+                obs = obs_dict["observation"]
+                sg = agent.sample_subgoal(obs, fg)
+
+            phase_timer.step(global_t)
+
+            if process_idx == 0 and exception_event.is_set():
+                logger.exception("An exception detected, exiting")
+                save_model()
+                kill_all()
+
+    except (Exception, KeyboardInterrupt):
+        save_model()
+        raise
+    finally:
+        phase_timer.close()
+
+    if global_t == steps:
+        # Save the final model
+        dirname = os.path.join(outdir, "{}_finish".format(steps))
+        agent.save(dirname)
+        logger.info("Saved the final agent to %s", dirname)
+
+    if successful:
+        # Save the successful model
+        dirname = os.path.join(outdir, "successful")
+        agent.save(dirname)
+        logger.info("Saved the successful agent to %s", dirname)
+
+
+def train_hrl_agent_async(
+    outdir,
+    processes,
+    make_env,
+    make_agent,
+    steps=8 * 10 ** 7,
+    eval_interval=10 ** 6,
+    eval_n_steps=None,
+    eval_n_episodes=10,
+    max_episode_len=None,
+    step_offset=0,
+    successful_score=None,
+    global_step_hooks=[],
+    save_best_so_far_agent=True,
+    use_tensorboard=False,
+    logger=None,
+    random_seeds=None,
+    stop_event=None,
+    exception_event=None,
+    phase_timer=None,
+):
+    """Train HRL agents with actors in separate processes.
+
+    It is the HRL counterpart of `pfrl.experiments.train_agent_async` for
+    actors of actor-learner training, i.e. `make_agent` is the first return
+    value of `pfrl.agents.HIROAgent.setup_actor_learner_training`, whose
+    learner and poller threads must be started before calling it. Each
+    process steps its own env, whose observations are dicts with
+    "observation" and "desired_goal" like those given to
+    `pfrl.experiments.train_hrl_agent`.
+
+    Args:
+        outdir (str): Path to the directory to output things.
+        processes (int): Number of processes.
+        make_env (callable): (process_idx, test) -> Environment.
+        make_agent (callable): (process_idx) -> Actor.
+        steps (int): Number of global time steps for training.
+        eval_interval (int): Interval of evaluation. If set to None, the agent
+            will not be evaluated at all.
+        eval_n_steps (int): Number of eval timesteps at each eval phase
+        eval_n_episodes (int): Number of eval episodes at each eval phase
+        max_episode_len (int): Maximum episode length.
+        step_offset (int): Time step from which training starts.
+        successful_score (float): Finish training if the mean score is greater
+            or equal to this value if not None
+        global_step_hooks (list): List of callable objects that accepts
+            (env, agent, step) as arguments. They are called every global
+            step. See pfrl.experiments.hooks.
+        save_best_so_far_agent (bool): If set to True, after each evaluation,
+            if the score (= mean return of evaluation episodes) exceeds
+            the best-so-far score, the current agent is saved.
+        use_tensorboard (bool): Additionally log eval stats to tensorboard
+        logger (logging.Logger): Logger used in this function.
+        random_seeds (array-like of ints or None): Random seeds for processes.
+            If set to None, [0, 1, ..., processes-1] are used.
+        stop_event (multiprocessing.Event or None): Event to stop training,
+            e.g. `stop_event` of the learner thread, which is set once it
+            finishes its updates. If set to None, a new Event object is
+            created and used internally.
+        exception_event (multiprocessing.Event or None): Event that indicates
+            other thread raised an excpetion, e.g. the fourth return value of
+            `setup_actor_learner_training`. The train will be terminated and
+            the current agent will be saved.
+            If set to None, a new Event object is created and used internally.
+        phase_timer (pfrl.experiments.PhaseTimer or None): If set, wall time
+            spent in each phase of training in the first process is measured
+            by it. Stats are not recorded to scores.txt.
+    """
+
+    logger = logger or logging.getLogger(__name__)
+
+    # Prevent numpy from using multiple threads
+    os.environ["OMP_NUM_THREADS"] = "1"
+
+    counter = mp.Value("l", 0)
+    episodes_counter = mp.Value("l", 0)
+
+    if stop_event is None:
+        stop_event = mp.Event()
+
+    if exception_event is None:
+        exception_event = mp.Event()
+
+    if eval_interval is None:
+        evaluator = None
+    else:
+        evaluator = AsyncEvaluator(
+            n_steps=eval_n_steps,
+            n_episodes=eval_n_episodes,
+            eval_interval=eval_interval,
+            outdir=outdir,
+            max_episode_len=max_episode_len,
+            step_offset=step_offset,
+            save_best_so_far_agent=save_best_so_far_agent,
+            use_tensorboard=use_tensorboard,
+            logger=logger,
+        )
+
+    if random_seeds is None:
+        random_seeds = np.arange(processes)
+
+    def run_func(process_idx):
+        random_seed.set_random_seed(int(random_seeds[process_idx]))
+
+        env = make_env(process_idx, test=False)
+        if evaluator is None:
+            eval_env = env
+        else:
+            eval_env = make_env(process_idx, test=True)
+        agent = make_agent(process_idx)
+        agent.process_idx = process_idx
+
+        train_hrl_loop(
+            process_idx=process_idx,
+            counter=counter,
+            episodes_counter=episodes_counter,
+            agent=agent,
+            env=env,
+            steps=steps,
+            outdir=outdir,
+            max_episode_len=max_episode_len,
+            evaluator=evaluator,
+            successful_score=successful_score,
+            stop_event=stop_event,
+            exception_event=exception_event,
+            eval_env=eval_env,
+            global_step_hooks=global_step_hooks,
+            logger=logger,
+            phase_timer=phase_timer if process_idx == 0 else None,
+        )
+
+        env.close()
+        if eval_env is not env:
+            eval_env.close()
+
+    async_.run_async(processes, run_func)
+
+    stop_event.set()
@@ -1,10 +1,13 @@
 from abc import ABCMeta
 from abc import abstractmethod
 from abc import abstractproperty
+import queue
+import threading
 
 import numpy as np
 import torch
 
+from pfrl.collections.columnar_queue import ColumnarSample
 from pfrl.utils.batch_states import batch_states
 from pfrl.utils.recurrent import concatenate_recurrent_states
 from pfrl.utils.recurrent import flatten_sequences_time_first
@@ -144,6 +147,171 @@ def random_subseq(seq, subseq_len):
         return seq[i : i + subseq_len]
 
 
+class _PinnedBuffers(threading.local):
+    """Page-locked host buffers reused across calls, one set per thread.
+
+    Buffers are identified by fields together with their shapes and dtypes,
+    so that batches of different shapes, e.g. of the low and high levels of
+    HIRO, do not replace each other's buffers.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, key, shape, dtype):
+        buf, event = self.buffers.get((key, tuple(shape), dtype), (None, None))
+        if buf is None:
+            buf = torch.empty(shape, dtype=dtype).pin_memory()
+        elif event is not None:
+            # Wait for the previous copy from this buffer to finish
+            event.synchronize()
+        return buf
+
+    def record(self, key, buf):
+        event = torch.cuda.Event()
+        event.record()
+        self.buffers[key, tuple(buf.shape), buf.dtype] = buf, event
+
+
+_pinned_buffers = _PinnedBuffers()
+_default_batch_states = batch_states
+
+
+def _is_stackable(values):
+    first = values[0]
+    if not isinstance(first, np.ndarray) or first.dtype == object:
+        return False
+    return all(
+        isinstance(v, np.ndarray) and v.shape == first.shape and v.dtype == first.dtype
+        for v in values
+    )
+
+
+def _stack_to_device(values, device, key):
+    """Stack arrays of the same shape and dtype into a tensor on a device.
+
+    For CUDA devices, arrays are stacked into a pinned buffer reused across
+    calls so that they can be copied asynchronously.
+    """
+    device = torch.device(device)
+    if device.type != "cuda":
+        return torch.from_numpy(np.stack(values)).to(device)
+    shape = (len(values),) + values[0].shape
+    dtype = torch.from_numpy(np.empty(0, dtype=values[0].dtype)).dtype
+    buf = _pinned_buffers.get(key, shape, dtype)
+    np.stack(values, out=buf.numpy())
+    batch = buf.to(device, non_blocking=True)
+    _pinned_buffers.record(key, buf)
+    return batch
+
+
+def _array_to_device(array, device, key):
+    """Convert an array into a tensor on a device like `_stack_to_device`."""
+    device = torch.device(device)
+    if device.type != "cuda":
+        return torch.from_numpy(array).to(device)
+    dtype = torch.from_numpy(array[:0]).dtype
+    buf = _pinned_buffers.get(key, array.shape, dtype)
+    np.copyto(buf.numpy(), array)
+    batch = buf.to(device, non_blocking=True)
+    _pinned_buffers.record(key, buf)
+    return batch
+
+
+def _batch_states(states, device, phi, batch_states, key):
+    if batch_states is not _default_batch_states:
+        return batch_states(states, device, phi)
+    if isinstance(states, np.ndarray) and states.dtype != object:
+        # Values gathered from a columnar replay buffer are converted at once
+        # unless phi transforms them
+        rows = list(states)
+        features = [phi(s) for s in rows]
+        if all(f is s for f, s in zip(features, rows)):
+            return _array_to_device(states, device, key)
+    else:
+        features = [phi(s) for s in states]
+    if _is_stackable(features):
+        return _stack_to_device(features, device, key)
+    return batch_states(features, device, lambda x: x)
+
+
+def _batch_values(values, device, key):
+    if isinstance(values, np.ndarray) and values.dtype != object:
+        return torch.as_tensor(values, device=device)
+    values = list(values)
+    if _is_stackable(values):
+        return _stack_to_device(values, device, key)
+    return torch.as_tensor(values, device=device)
+
+
+def _first_values(experiences, key):
+    if isinstance(experiences, ColumnarSample):
+        return experiences.gather_first(key)
+    return [elem[0][key] for elem in experiences]
+
+
+def _last_values(experiences, key):
+    if isinstance(experiences, ColumnarSample):
+        return experiences.gather_last(key)
+    return [elem[-1][key] for elem in experiences]
+
+
+def _step_values(experiences, key, dtype):
+    """Gather values of all transitions into a (batch, n, ...) array.
+
+    Returns:
+        ndarray: (batch, n, ...) values, where values of padded transitions
+            are 0.
+        ndarray: (batch,) number of transitions of each experience.
+    """
+    if isinstance(experiences, ColumnarSample):
+        values, mask = experiences.gather_steps(key)
+        values = values.astype(dtype)
+        values[~mask] = 0
+        return values, experiences.lengths
+    lengths = np.fromiter(
+        (len(exp) for exp in experiences), dtype=np.int64, count=len(experiences)
+    )
+    mask = np.arange(lengths.max()) < lengths[:, None]
+    # Values can be arrays, e.g. rewards of multiple objectives
+    flat_values = np.asarray(
+        [transition[key] for exp in experiences for transition in exp], dtype=dtype
+    )
+    values = np.zeros(mask.shape + flat_values.shape[1:], dtype=dtype)
+    # Row-major order of the mask matches the order of flattened transitions
+    values[mask] = flat_values
+    return values, lengths
+
+
+def _batch_nstep_targets(experiences, device, gamma):
+    """Compute n-step returns, terminal flags and discounts of experiences."""
+    rewards, lengths = _step_values(experiences, "reward", np.float64)
+    terminals, _ = _step_values(experiences, "is_state_terminal", bool)
+    n = rewards.shape[1]
+    return {
+        "reward": torch.as_tensor(
+            np.tensordot(gamma ** np.arange(n), rewards, axes=(0, 1)),
+            dtype=torch.float32,
+            device=device,
+        ),
+        "is_state_terminal": torch.as_tensor(
+            terminals.any(axis=1), dtype=torch.float32, device=device
+        ),
+        "discount": torch.as_tensor(
+            gamma ** lengths, dtype=torch.float32, device=device
+        ),
+    }
+
+
+def _batch_next_actions(experiences, device, batch_exp):
+    # Batch next actions only when all the experiences have them
+    next_actions = _last_values(experiences, "next_action")
+    if (isinstance(next_actions, np.ndarray) and next_actions.dtype != object) or all(
+        next_action is not None for next_action in next_actions
+    ):
+        batch_exp["next_action"] = _batch_values(next_actions, device, "next_action")
+
+
 def batch_experiences(experiences, device, phi, gamma, batch_states=batch_states):
     """Takes a batch of k experiences each of which contains j
 
@@ -157,6 +325,8 @@ def batch_experiences(experiences, device, phi, gamma, batch_states=batch_states
               - reward (float): Reward
               - is_state_terminal (bool): True iff next state is terminal
               - next_state (object): Next state
+            A `ColumnarSample` sampled from a columnar replay buffer is also
+            accepted, in which case each field is gathered at once.
         device : GPU or CPU the tensor should be placed on
         phi : Preprocessing function
         gamma: discount factor
@@ -166,39 +336,20 @@ def batch_experiences(experiences, device, phi, gamma, batch_states=batch_states
     """
 
     batch_exp = {
-        "state": batch_states([elem[0]["state"] for elem in experiences], device, phi),
-        "action": torch.as_tensor(
-            [elem[0]["action"] for elem in experiences], device=device
-        ),
-        "reward": torch.as_tensor(
-            [
-                sum((gamma ** i) * exp[i]["reward"] for i in range(len(exp)))
-                for exp in experiences
-            ],
-            dtype=torch.float32,
-            device=device,
+        "state": _batch_states(
+            _first_values(experiences, "state"), device, phi, batch_states, "state"
         ),
-        "next_state": batch_states(
-            [elem[-1]["next_state"] for elem in experiences], device, phi
-        ),
-        "is_state_terminal": torch.as_tensor(
-            [
-                any(transition["is_state_terminal"] for transition in exp)
-                for exp in experiences
-            ],
-            dtype=torch.float32,
-            device=device,
-        ),
-        "discount": torch.as_tensor(
-            [(gamma ** len(elem)) for elem in experiences],
-            dtype=torch.float32,
-            device=device,
+        "action": _batch_values(_first_values(experiences, "action"), device, "action"),
+        "next_state": _batch_states(
+            _last_values(experiences, "next_state"),
+            device,
+            phi,
+            batch_states,
+            "next_state",
         ),
     }
-    if all(elem[-1]["next_action"] is not None for elem in experiences):
-        batch_exp["next_action"] = torch.as_tensor(
-            [elem[-1]["next_action"] for elem in experiences], device=device
-        )
+    batch_exp.update(_batch_nstep_targets(experiences, device, gamma))
+    _batch_next_actions(experiences, device, batch_exp)
     return batch_exp
 
 
@@ -217,6 +368,8 @@ def batch_experiences_with_goal(experiences, device, phi, gamma, batch_states=ba
               - is_state_terminal (bool): True iff next state is terminal
               - next_state (object): Next state
               - next_goal (object): Next goal
+            A `ColumnarSample` sampled from a columnar replay buffer is also
+            accepted, in which case each field is gathered at once.
         device : GPU or CPU the tensor should be placed on
         phi : Preprocessing function
         gamma: discount factor
@@ -226,45 +379,33 @@ def batch_experiences_with_goal(experiences, device, phi, gamma, batch_states=ba
     """
 
     batch_exp = {
-        "state": batch_states([elem[0]["state"] for elem in experiences], device, phi),
-        "goal": batch_states([elem[0]["goal"] for elem in experiences], device, phi),
-        "action": torch.as_tensor(
-            [elem[0]["action"] for elem in experiences], device=device
+        "state": _batch_states(
+            _first_values(experiences, "state"), device, phi, batch_states, "state"
         ),
-        "reward": torch.as_tensor(
-            [
-                sum((gamma ** i) * exp[i]["reward"] for i in range(len(exp)))
-                for exp in experiences
-            ],
-            dtype=torch.float32,
-            device=device,
-        ),
-        "next_state": batch_states(
-            [elem[-1]["next_state"] for elem in experiences], device, phi
+        "goal": _batch_states(
+            _first_values(experiences, "goal"), device, phi, batch_states, "goal"
         ),
-        "next_goal": batch_states(
-            [elem[-1]["next_goal"] for elem in experiences], device, phi
-        ),
-        "is_state_terminal": torch.as_tensor(
-            [
-                any(transition["is_state_terminal"] for transition in exp)
-                for exp in experiences
-            ],
-            dtype=torch.float32,
-            device=device,
+        "action": _batch_values(_first_values(experiences, "action"), device, "action"),
+        "next_state": _batch_states(
+            _last_values(experiences, "next_state"),
+            device,
+            phi,
+            batch_states,
+            "next_state",
         ),
-        "discount": torch.as_tensor(
-            [(gamma ** len(elem)) for elem in experiences],
-            dtype=torch.float32,
-            device=device,
+        "next_goal": _batch_states(
+            _last_values(experiences, "next_goal"),
+            device,
+            phi,
+            batch_states,
+            "next_goal",
         ),
     }
-    if all(elem[-1]["next_action"] is not None for elem in experiences):
-        batch_exp["next_action"] = torch.as_tensor(
-            [elem[-1]["next_action"] for elem in experiences], device=device
-        )
+    batch_exp.update(_batch_nstep_targets(experiences, device, gamma))
+    _batch_next_actions(experiences, device, batch_exp)
     return batch_exp
 
+
 def high_level_batch_experiences_with_goal(experiences, device, phi, gamma, batch_states=batch_states):
     """Takes a batch of k experiences each of which contains j
 
@@ -281,6 +422,8 @@ def high_level_batch_experiences_with_goal(experiences, device, phi, gamma, batc
               - next_state (object): Next state
               - action_arr (object): list of recent actions
               - state_arr (object): list of recent states
+            A `ColumnarSample` sampled from a columnar replay buffer is also
+            accepted, in which case each field is gathered at once.
         device : GPU or CPU the tensor should be placed on
         phi : Preprocessing function
         gamma: discount factor
@@ -290,47 +433,40 @@ def high_level_batch_experiences_with_goal(experiences, device, phi, gamma, batc
     """
 
     batch_exp = {
-        "state": batch_states([elem[0]["state"] for elem in experiences], device, phi),
-        "goal": batch_states([elem[0]["goal"] for elem in experiences], device, phi),
-        "action": torch.as_tensor(
-            [elem[0]["action"] for elem in experiences], device=device
+        "state": _batch_states(
+            _first_values(experiences, "state"), device, phi, batch_states, "state"
         ),
-        "reward": torch.as_tensor(
-            [
-                sum((gamma ** i) * exp[i]["reward"] for i in range(len(exp)))
-                for exp in experiences
-            ],
-            dtype=torch.float32,
-            device=device,
+        "goal": _batch_states(
+            _first_values(experiences, "goal"), device, phi, batch_states, "goal"
         ),
-        "next_state": batch_states(
-            [elem[-1]["next_state"] for elem in experiences], device, phi
+        "action": _batch_values(_first_values(experiences, "action"), device, "action"),
+        "next_state": _batch_states(
+            _last_values(experiences, "next_state"),
+            device,
+            phi,
+            batch_states,
+            "next_state",
         ),
-        "is_state_terminal": torch.as_tensor(
-            [
-                any(transition["is_state_terminal"] for transition in exp)
-                for exp in experiences
-            ],
-            dtype=torch.float32,
-            device=device,
+        "action_arr": _batch_states(
+            _first_values(experiences, "action_arr"),
+            device,
+            phi,
+            batch_states,
+            "action_arr",
         ),
-        "action_arr": batch_states([elem[0]["action_arr"] for elem in experiences], device, phi),
-        "state_arr": batch_states([elem[0]["state_arr"] for elem in experiences], device, phi),
-        "discount": torch.as_tensor(
-            [(gamma ** len(elem)) for elem in experiences],
-            dtype=torch.float32,
-            device=device,
+        "state_arr": _batch_states(
+            _first_values(experiences, "state_arr"),
+            device,
+            phi,
+            batch_states,
+            "state_arr",
         ),
     }
-    if all(elem[-1]["next_action"] is not None for elem in experiences):
-        batch_exp["next_action"] = torch.as_tensor(
-            [elem[-1]["next_action"] for elem in experiences], device=device
-        )
+    batch_exp.update(_batch_nstep_targets(experiences, device, gamma))
+    _batch_next_actions(experiences, device, batch_exp)
     return batch_exp
 
 
-
-
 def _is_sorted_desc_by_lengths(lst):
     return all(len(a) >= len(b) for a, b in zip(lst, lst[1:]))
 
@@ -422,6 +558,18 @@ class ReplayUpdater(object):
         episodic_update (bool): Use full episodes for update if set True
         episodic_update_len (int or None): Subsequences of this length are used
             for update if set int and episodic_update=True
+        prefetch_size (int): If set to a positive integer, up to this number
+            of minibatches are sampled ahead on a background thread, so that
+            sampling overlaps with updates. Accesses to the replay buffer must
+            then be guarded by `lock`, and errors of prioritized replay
+            buffers must be passed to `update_errors` instead of the buffer.
+            Not supported by columnar replay buffers, whose samples are views
+            of their storage that can be overwritten by later appends while
+            prefetched minibatches wait to be used.
+        collate_func (callable or None): If set, prefetched minibatches are
+            also converted by this callable on the background thread, and
+            the result is passed to `update_func` as the `exp_batch` keyword
+            argument.
     """
 
     def __init__(
@@ -434,9 +582,15 @@ class ReplayUpdater(object):
         replay_start_size,
         update_interval,
         episodic_update_len=None,
+        prefetch_size=0,
+        collate_func=None,
     ):
 
         assert batchsize <= replay_start_size
+        assert prefetch_size >= 0
+        assert not (
+            prefetch_size > 0 and getattr(replay_buffer, "columnar", False)
+        ), "Prefetching is not supported by columnar replay buffers"
         self.replay_buffer = replay_buffer
         self.update_func = update_func
         self.batchsize = batchsize
@@ -445,6 +599,44 @@ class ReplayUpdater(object):
         self.n_times_update = n_times_update
         self.replay_start_size = replay_start_size
         self.update_interval = update_interval
+        self.prefetch_size = prefetch_size
+        self.collate_func = collate_func
+        self.lock = threading.Lock()
+        self._prefetch_queue = None
+        self._prefetch_thread = None
+        self._prefetch_stop_event = threading.Event()
+        # Ids of the prioritized sample the background thread failed to queue
+        self._dropped_ids = None
+        # Ids of the prioritized sample currently being used for update
+        self._sample_ids = None
+        # Number of prioritized samples whose errors are not updated yet
+        self._n_detached = 0
+
+    def _can_sample(self):
+        if len(self.replay_buffer) < self.replay_start_size:
+            return False
+        if self.episodic_update and self.replay_buffer.n_episodes < self.batchsize:
+            return False
+        return True
+
+    def _can_prefetch(self):
+        if not self._can_sample():
+            return False
+        # Data of prioritized samples are not sampled again until their errors
+        # are updated
+        if self.episodic_update:
+            n_available = self.replay_buffer.n_episodes
+        else:
+            n_available = len(self.replay_buffer)
+        return n_available - self._n_detached * self.batchsize >= self.batchsize
+
+    def _sample(self):
+        if self.episodic_update:
+            return self.replay_buffer.sample_episodes(
+                self.batchsize, self.episodic_update_len
+            )
+        else:
+            return self.replay_buffer.sample(self.batchsize)
 
     def can_update_then_sample(self, iteration):
         """If we can update the model if the condition is met,
@@ -456,10 +648,7 @@ class ReplayUpdater(object):
         Returns:
             bool: True iff the condition was updated this time.
         """
-        if len(self.replay_buffer) < self.replay_start_size:
-            return False
-
-        if self.episodic_update and self.replay_buffer.n_episodes < self.batchsize:
+        if not self._can_sample():
             return False
 
         if iteration % self.update_interval != 0:
@@ -468,17 +657,113 @@ class ReplayUpdater(object):
         all_experiences = []
 
         for _ in range(self.n_times_update):
-            if self.episodic_update:
-                episodes = self.replay_buffer.sample_episodes(
-                    self.batchsize, self.episodic_update_len
-                )
-                all_experiences.append(episodes)
-            else:
-                transitions = self.replay_buffer.sample(self.batchsize)
-                all_experiences.append(transitions)
+            all_experiences.append(self._sample())
 
         return all_experiences
 
+    def _prefetch_loop(self):
+        detach = getattr(self.replay_buffer, "detach_last_sample", None)
+        while not self._prefetch_stop_event.is_set():
+            try:
+                with self.lock:
+                    if self._can_prefetch():
+                        experiences = self._sample()
+                        # Errors of this sample are updated after samples
+                        # taken in the meantime
+                        if detach is not None:
+                            ids = detach()
+                            self._n_detached += 1
+                        else:
+                            ids = None
+                    else:
+                        experiences = None
+                if experiences is None:
+                    self._prefetch_stop_event.wait(1e-3)
+                    continue
+                if self.collate_func is not None:
+                    exp_batch = self.collate_func(experiences)
+                else:
+                    exp_batch = None
+                item = (experiences, exp_batch, ids, None)
+            except Exception as e:
+                item = (None, None, None, e)
+            while not self._prefetch_stop_event.is_set():
+                try:
+                    self._prefetch_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            else:
+                # Stopped before the sample was queued, so it is discarded
+                # by `stop_prefetch` as queued ones are
+                self._dropped_ids = item[2]
+            if item[3] is not None:
+                break
+
+    def start_prefetch(self):
+        """Start sampling minibatches on a background thread."""
+        assert self.prefetch_size > 0
+        if self._prefetch_thread is not None:
+            return
+        self._prefetch_queue = queue.Queue(maxsize=self.prefetch_size)
+        self._prefetch_stop_event.clear()
+        self._prefetch_thread = threading.Thread(
+            target=self._prefetch_loop, daemon=True
+        )
+        self._prefetch_thread.start()
+
+    def stop_prefetch(self):
+        """Stop the background thread and discard prefetched minibatches."""
+        if self._prefetch_thread is None:
+            return
+        self._prefetch_stop_event.set()
+        self._prefetch_thread.join()
+        discarded_ids = [self._sample_ids, self._dropped_ids]
+        while not self._prefetch_queue.empty():
+            discarded_ids.append(self._prefetch_queue.get()[2])
+        discard = getattr(self.replay_buffer, "discard_sample", None)
+        if discard is not None:
+            with self.lock:
+                for ids in discarded_ids:
+                    if ids is not None:
+                        discard(ids)
+                        self._n_detached -= 1
+        self._prefetch_thread = None
+        self._prefetch_queue = None
+        self._sample_ids = None
+        self._dropped_ids = None
+
+    def get_prefetched(self):
+        """Return the next prefetched minibatch.
+
+        The background thread is started if it is not running yet.
+
+        Returns:
+            object: Sampled experiences.
+            object: Experiences converted by `collate_func`, or None if
+                `collate_func` is not set.
+        """
+        self.start_prefetch()
+        experiences, exp_batch, ids, error = self._prefetch_queue.get()
+        if error is not None:
+            self.stop_prefetch()
+            raise error
+        self._sample_ids = ids
+        return experiences, exp_batch
+
+    def update_errors(self, errors):
+        """Update errors of the minibatch currently used for update.
+
+        Args:
+            errors (list): Errors of the experiences of the minibatch.
+        """
+        with self.lock:
+            if self._sample_ids is not None:
+                self.replay_buffer.attach_sample(self._sample_ids)
+                self._sample_ids = None
+                self._n_detached -= 1
+            self.replay_buffer.update_errors(errors)
+
     def update_if_necessary(self, iteration):
         """Update the model if the condition is met.
 
@@ -488,22 +773,19 @@ class ReplayUpdater(object):
         Returns:
             bool: True iff the condition was updated this time.
         """
-        if len(self.replay_buffer) < self.replay_start_size:
-            return False
-
-        if self.episodic_update and self.replay_buffer.n_episodes < self.batchsize:
+        if not self._can_sample():
             return False
 
         if iteration % self.update_interval != 0:
             return False
 
         for _ in range(self.n_times_update):
-            if self.episodic_update:
-                episodes = self.replay_buffer.sample_episodes(
-                    self.batchsize, self.episodic_update_len
-                )
-                self.update_func(episodes)
+            if self.prefetch_size > 0:
+                experiences, exp_batch = self.get_prefetched()
+                if exp_batch is not None:
+                    self.update_func(experiences, exp_batch=exp_batch)
+                else:
+                    self.update_func(experiences)
             else:
-                transitions = self.replay_buffer.sample(self.batchsize)
-                self.update_func(transitions)
+                self.update_func(self._sample())
         return True
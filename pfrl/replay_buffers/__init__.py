@@ -1,4 +1,5 @@
 from pfrl.replay_buffers.episodic import EpisodicReplayBuffer  # NOQA
+from pfrl.replay_buffers.frame_stack import FrameStackReplayBuffer  # NOQA
 from pfrl.replay_buffers.persistent import PersistentEpisodicReplayBuffer  # NOQA
 from pfrl.replay_buffers.persistent import PersistentReplayBuffer  # NOQA
 from pfrl.replay_buffers.prioritized import PrioritizedReplayBuffer  # NOQA
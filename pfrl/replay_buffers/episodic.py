@@ -1,6 +1,7 @@
 import collections
 import pickle
 
+from pfrl.collections.persistent_collections import IncrementalSnapshot
 from pfrl.collections.random_access_queue import RandomAccessQueue
 from pfrl.replay_buffer import AbstractEpisodicReplayBuffer
 from pfrl.replay_buffer import random_subseq
@@ -12,6 +13,8 @@ class EpisodicReplayBuffer(AbstractEpisodicReplayBuffer):
         self.episodic_memory = RandomAccessQueue()
         self.memory = RandomAccessQueue()
         self.capacity = capacity
+        # IncrementalSnapshot for each directory
+        self.snapshots = {}
 
     def append(
         self,
@@ -81,6 +84,43 @@ class EpisodicReplayBuffer(AbstractEpisodicReplayBuffer):
                     self.episodic_memory.append(episode)
                     episode = []
 
+    @property
+    def supports_save_incremental(self):
+        """True iff the buffer can be saved by `save_incremental`."""
+        return type(self.episodic_memory) is RandomAccessQueue
+
+    def save_incremental(self, dirname):
+        """Save the episodes to a directory incrementally.
+
+        Only the episodes appended after the last `save_incremental` or
+        `load_incremental` with the same directory are written. See
+        `pfrl.replay_buffers.ReplayBuffer.save_incremental`.
+
+        Args:
+            dirname (str): Path to the directory to save the buffer to.
+        """
+        if not self.supports_save_incremental:
+            raise NotImplementedError(
+                "{} does not support save_incremental".format(type(self).__name__)
+            )
+        if dirname not in self.snapshots:
+            self.snapshots[dirname] = IncrementalSnapshot(dirname)
+        self.snapshots[dirname].save(self.episodic_memory)
+
+    def load_incremental(self, dirname):
+        """Load the episodes saved by `save_incremental`.
+
+        Args:
+            dirname (str): Path to the directory the buffer was saved to.
+        """
+        snapshot = IncrementalSnapshot(dirname)
+        self.episodic_memory = snapshot.load()
+        self.memory = RandomAccessQueue()
+        for episode in self.episodic_memory:
+            for transition in episode:
+                self.memory.append([transition])
+        self.snapshots[dirname] = snapshot
+
     def stop_current_episode(self, env_id=0):
         current_episode = self.current_episode[env_id]
         if current_episode:
@@ -0,0 +1,218 @@
+import pickle
+
+import numpy as np
+
+from pfrl.replay_buffers.replay_buffer import ReplayBuffer
+
+
+class _FrameStore(object):
+    """Reference-counted storage of frames of the same shape and dtype."""
+
+    def __init__(self, frame, size):
+        self.data = np.zeros((size,) + frame.shape, dtype=frame.dtype)
+        self.refcounts = np.zeros(size, dtype=np.int64)
+        self.free = list(reversed(range(size)))
+
+    def __len__(self):
+        return len(self.data) - len(self.free)
+
+    def add(self, frame):
+        if not self.free:
+            self._grow()
+        ix = self.free.pop()
+        self.data[ix] = frame
+        return ix
+
+    def _grow(self):
+        size = len(self.data)
+        new_size = size + max(size // 8, 1)
+        data = np.zeros((new_size,) + self.data.shape[1:], dtype=self.data.dtype)
+        data[:size] = self.data
+        refcounts = np.zeros(new_size, dtype=np.int64)
+        refcounts[:size] = self.refcounts
+        self.data = data
+        self.refcounts = refcounts
+        self.free.extend(reversed(range(size, new_size)))
+
+    def incref(self, ixs):
+        np.add.at(self.refcounts, ixs, 1)
+
+    def decref(self, ixs):
+        np.add.at(self.refcounts, ixs, -1)
+        ixs = np.unique(ixs)
+        self.free.extend(ixs[self.refcounts[ixs] == 0].tolist())
+
+
+class FrameStackReplayBuffer(ReplayBuffer):
+    """Replay buffer that stores each frame of stacked observations once.
+
+    Observations made by `pfrl.wrappers.atari_wrappers.FrameStack` or
+    `pfrl.wrappers.VectorFrameStack` consist of `stack_size` frames, most of
+    which also appear in the previous and the next observations. This buffer
+    splits `state` and `next_state` into frames and stores each unique frame
+    only once in a preallocated array, while transitions keep the indices of
+    their frames. Frames are deduplicated by comparing their contents with the
+    frames of the previous observation of the same env, so deduplication also
+    works for observations that have been pickled, e.g. sent from other
+    processes. Observations are stacked again when sampled, so sampled
+    transitions contain ndarrays instead of the original observations.
+
+    A frame is released when no stored transition refers to it anymore.
+
+    Args:
+        capacity (int): Capacity in terms of number of transitions
+        num_steps (int): Number of timesteps per stored transition
+            (for N-step updates)
+        stack_size (int): Number of frames per observation.
+        stack_axis (int): Axis along which frames are stacked, i.e. 0 for
+            channel_order="chw" and 2 for channel_order="hwc" of `FrameStack`.
+    """
+
+    def __init__(self, capacity=None, num_steps=1, stack_size=4, stack_axis=0):
+        # Experiences are removed by this class so that their frames can be
+        # released, so the queue itself is unbounded.
+        super().__init__(capacity=None, num_steps=num_steps)
+        assert stack_size > 0
+        self.capacity = capacity
+        self.stack_size = stack_size
+        self.stack_axis = stack_axis
+        self.frames = None
+        # Frame indices of the last next_state of each env
+        self.last_frame_indices = {}
+
+    def _split(self, obs):
+        obs = np.asarray(obs)
+        assert obs.shape[self.stack_axis] % self.stack_size == 0
+        return np.split(obs, self.stack_size, axis=self.stack_axis)
+
+    def _store(self, obs, prev_indices, shift):
+        """Store the frames of an observation and return their indices.
+
+        Frame i is compared with frame i + shift of the previous observation
+        and with frame i - 1 of the same observation, and is added to the
+        store only if it is equal to neither of them.
+        """
+        frames = self._split(obs)
+        if self.frames is None:
+            if self.capacity is not None:
+                size = self.capacity + self.num_steps + 2 * self.stack_size
+            else:
+                size = 1024
+            self.frames = _FrameStore(frames[0], size)
+        indices = np.empty(self.stack_size, dtype=np.int64)
+        for i, frame in enumerate(frames):
+            candidates = []
+            if prev_indices is not None and i + shift < self.stack_size:
+                candidates.append(prev_indices[i + shift])
+            if i > 0:
+                candidates.append(indices[i - 1])
+            for ix in candidates:
+                if np.array_equal(self.frames.data[ix], frame):
+                    indices[i] = ix
+                    break
+            else:
+                indices[i] = self.frames.add(frame)
+        self.frames.incref(indices)
+        return indices
+
+    def _set_last_frame_indices(self, env_id, indices):
+        last_indices = self.last_frame_indices.pop(env_id, None)
+        if indices is not None:
+            self.frames.incref(indices)
+            self.last_frame_indices[env_id] = indices
+        if last_indices is not None:
+            self.frames.decref(last_indices)
+
+    def _release(self, transition):
+        self.frames.decref(transition["state"])
+        if transition["next_state"] is not None:
+            self.frames.decref(transition["next_state"])
+
+    def _remove_overflow(self):
+        if self.capacity is None:
+            return
+        while len(self.memory) > self.capacity:
+            # The first transition of an experience does not appear in any
+            # later experience.
+            self._release(self.memory.popleft()[0])
+
+    def append(
+        self,
+        state,
+        action,
+        reward,
+        next_state=None,
+        next_action=None,
+        is_state_terminal=False,
+        env_id=0,
+        **kwargs
+    ):
+        state_indices = self._store(state, self.last_frame_indices.get(env_id), 0)
+        if next_state is not None:
+            next_state_indices = self._store(next_state, state_indices, 1)
+        else:
+            next_state_indices = None
+        if is_state_terminal:
+            self._set_last_frame_indices(env_id, None)
+        else:
+            self._set_last_frame_indices(env_id, next_state_indices)
+        super().append(
+            state=state_indices,
+            action=action,
+            reward=reward,
+            next_state=next_state_indices,
+            next_action=next_action,
+            is_state_terminal=is_state_terminal,
+            env_id=env_id,
+            **kwargs
+        )
+        self._remove_overflow()
+
+    def stop_current_episode(self, env_id=0):
+        super().stop_current_episode(env_id=env_id)
+        if self.frames is not None:
+            self._set_last_frame_indices(env_id, None)
+        self._remove_overflow()
+
+    def _stack(self, indices):
+        return np.concatenate(self.frames.data[indices], axis=self.stack_axis)
+
+    def sample(self, num_experiences):
+        experiences = super().sample(num_experiences)
+        # Overlapping n-step experiences share transitions
+        stacked = {}
+
+        def restore(transition):
+            key = id(transition)
+            if key not in stacked:
+                restored = dict(transition)
+                restored["state"] = self._stack(transition["state"])
+                if transition["next_state"] is not None:
+                    restored["next_state"] = self._stack(transition["next_state"])
+                stacked[key] = restored
+            return stacked[key]
+
+        return [[restore(t) for t in experience] for experience in experiences]
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            pickle.dump((self.memory, self.frames), f)
+
+    def load(self, filename):
+        with open(filename, "rb") as f:
+            self.memory, self.frames = pickle.load(f)
+        # Pending transitions refer to the frames that have been replaced.
+        # Frames kept for pending transitions at the time of saving are not
+        # released, which costs at most a few frames per env.
+        self.last_n_transitions.clear()
+        self.last_frame_indices.clear()
+
+    @property
+    def supports_save_incremental(self):
+        return False
+
+    def save_incremental(self, dirname):
+        # Transitions refer to frames, which are not saved incrementally
+        raise NotImplementedError(
+            "FrameStackReplayBuffer does not support save_incremental"
+        )
@@ -11,10 +11,15 @@ class LowerControllerReplayBuffer(ReplayBuffer):
         capacity (int): capacity in terms of number of transitions
         num_steps (int): Number of timesteps per stored transition
             (for N-step updates)
+        columnar (bool): If set to True, state, goal, action, next_state and
+            next_goal of transitions are stored in preallocated NumPy arrays,
+            one per field, so that `pfrl.replay_buffer.batch_experiences_with_goal`
+            gathers each field of a minibatch at once. See
+            `pfrl.replay_buffers.ReplayBuffer`.
     """
 
-    def __init__(self, capacity=None, num_steps=1):
-        super().__init__(capacity, num_steps)
+    def __init__(self, capacity=None, num_steps=1, columnar=False):
+        super().__init__(capacity, num_steps, columnar=columnar)
 
     def append(
         self,
@@ -62,10 +67,17 @@ class HigherControllerReplayBuffer(ReplayBuffer):
         capacity (int): capacity in terms of number of transitions
         num_steps (int): Number of timesteps per stored transition
             (for N-step updates)
+        columnar (bool): If set to True, fields of transitions are stored in
+            preallocated NumPy arrays. Windows of low level states and actions,
+            i.e. state_arr and action_arr, are stored as arrays of shape
+            (capacity, window length, dim) as long as they have the same
+            length, so that
+            `pfrl.replay_buffer.high_level_batch_experiences_with_goal`
+            gathers them at once. See `pfrl.replay_buffers.ReplayBuffer`.
     """
 
-    def __init__(self, capacity=None, num_steps=1):
-        super().__init__(capacity, num_steps)
+    def __init__(self, capacity=None, num_steps=1, columnar=False):
+        super().__init__(capacity, num_steps, columnar=columnar)
 
     def append(
         self,
@@ -29,6 +29,14 @@ class PersistentReplayBuffer(ReplayBuffer):
             to use this option.
         group: `torch.distributed` group object. Only used when
             `distributed=True` and pfrlmn package is available
+        lazy_load (bool): If set to True, stored data are memory-mapped and
+            unpickled when sampled instead of being loaded at initialization.
+            Not supported when `distributed=True`.
+        flush_interval (int): Number of appended transitions after which
+            they are flushed to storage. Not supported when
+            `distributed=True`.
+        codecs (dict): Codecs to compress fields of transitions with, both in
+            memory and on storage. See :py:class:`ReplayBuffer`.
 
     .. note:: Contrary to the original :py:class:`ReplayBuffer`
             implementation, ``state`` and ``next_state``, ``action`` and
@@ -47,13 +55,21 @@ class PersistentReplayBuffer(ReplayBuffer):
         ancestor=None,
         logger=None,
         distributed=False,
-        group=None
+        group=None,
+        lazy_load=False,
+        flush_interval=1,
+        codecs=None
     ):
-        super().__init__(capacity)
+        super().__init__(capacity, codecs=codecs)
 
         if not distributed:
             self.memory = PersistentRandomAccessQueue(
-                dirname, capacity, ancestor=ancestor, logger=logger
+                dirname,
+                capacity,
+                ancestor=ancestor,
+                logger=logger,
+                lazy_load=lazy_load,
+                flush_interval=flush_interval,
             )
         else:
             try:
@@ -80,6 +96,17 @@ class PersistentReplayBuffer(ReplayBuffer):
             "{}.load() has been ignored, as it is persistent replay buffer".format(self)
         )
 
+    @property
+    def supports_save_incremental(self):
+        # Transitions are already written to the directory
+        return True
+
+    def save_incremental(self, _):
+        pass
+
+    def load_incremental(self, *args, **kwargs):
+        self.load(None)
+
 
 class PersistentEpisodicReplayBuffer(EpisodicReplayBuffer):
     """Episodic version of :py:class:`PersistentReplayBuffer`
@@ -96,6 +123,12 @@ class PersistentEpisodicReplayBuffer(EpisodicReplayBuffer):
             to use this option.
         group: `torch.distributed` group object. Only used when
             `distributed=True` and pfrlmn package is available
+        lazy_load (bool): If set to True, stored data are memory-mapped and
+            unpickled when sampled instead of being loaded at initialization.
+            Not supported when `distributed=True`.
+        flush_interval (int): Number of appended transitions after which
+            they are flushed to storage. Not supported when
+            `distributed=True`.
 
     .. note:: Current implementation is inefficient, as episodic
            memory and memory data shares the almost same data in
@@ -114,7 +147,9 @@ class PersistentEpisodicReplayBuffer(EpisodicReplayBuffer):
         ancestor=None,
         logger=None,
         distributed=False,
-        group=None
+        group=None,
+        lazy_load=False,
+        flush_interval=1
     ):
         super().__init__(capacity)
 
@@ -123,10 +158,20 @@ class PersistentEpisodicReplayBuffer(EpisodicReplayBuffer):
 
         if not distributed:
             self.memory = PersistentRandomAccessQueue(
-                self.memory_dir, capacity, ancestor=ancestor, logger=logger
+                self.memory_dir,
+                capacity,
+                ancestor=ancestor,
+                logger=logger,
+                lazy_load=lazy_load,
+                flush_interval=flush_interval,
             )
             self.episodic_memory = PersistentRandomAccessQueue(
-                self.episodic_memory_dir, capacity, ancestor=ancestor, logger=logger
+                self.episodic_memory_dir,
+                capacity,
+                ancestor=ancestor,
+                logger=logger,
+                lazy_load=lazy_load,
+                flush_interval=flush_interval,
             )
         else:
             try:
@@ -163,3 +208,14 @@ class PersistentEpisodicReplayBuffer(EpisodicReplayBuffer):
         warnings.warn(
             "PersistentEpisodicReplayBuffer.load() is called but it has not effect."
         )
+
+    @property
+    def supports_save_incremental(self):
+        # Transitions are already written to the directory
+        return True
+
+    def save_incremental(self, _):
+        pass
+
+    def load_incremental(self, *args, **kwargs):
+        self.load(None)
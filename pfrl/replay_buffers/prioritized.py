@@ -2,6 +2,7 @@ import collections
 
 import numpy as np
 
+from pfrl.collections.codecs import FieldCodec
 from pfrl.collections.prioritized import PrioritizedBuffer
 from pfrl.replay_buffers.replay_buffer import ReplayBuffer  # NOQA
 
@@ -45,23 +46,20 @@ class PriorityWeightError(object):
         self.error_max = error_max
 
     def priority_from_errors(self, errors):
-        def _clip_error(error):
-            if self.error_min is not None:
-                error = max(self.error_min, error)
-            if self.error_max is not None:
-                error = min(self.error_max, error)
-            return error
-
-        return [(_clip_error(d) + self.eps) ** self.alpha for d in errors]
+        errors = np.asarray(errors, dtype=np.float64)
+        if self.error_min is not None or self.error_max is not None:
+            errors = np.clip(errors, self.error_min, self.error_max)
+        return (errors + self.eps) ** self.alpha
 
     def weights_from_probabilities(self, probabilities, min_probability):
+        probabilities = np.asarray(probabilities, dtype=np.float64)
         if self.normalize_by_max == "batch":
             # discard global min and compute batch min
             min_probability = np.min(probabilities)
         if self.normalize_by_max:
-            weights = [(p / min_probability) ** -self.beta for p in probabilities]
+            weights = (probabilities / min_probability) ** -self.beta
         else:
-            weights = [(len(self.memory) * p) ** -self.beta for p in probabilities]
+            weights = (len(self.memory) * probabilities) ** -self.beta
         self.beta = min(1.0, self.beta + self.beta_add)
         return weights
 
@@ -82,6 +80,15 @@ class PrioritizedReplayBuffer(ReplayBuffer, PriorityWeightError):
             ``True`` (default): divide by the maximum weight in the sampled
             batch. ``'memory'``: divide by the maximum weight in the memory.
             ``False``: do not normalize
+        tree_backend (str): Implementation of trees of priorities.
+            ``'nested'`` (default) or ``'flat'``. See
+            `pfrl.collections.prioritized.PrioritizedBuffer`.
+        stratified (bool): If set to True, minibatches are sampled by
+            stratified sampling, i.e. one transition from each of the
+            segments of equal priority mass. A transition can be sampled more
+            than once in a minibatch.
+        codecs (dict): Codecs to compress fields of transitions with. See
+            `pfrl.replay_buffers.ReplayBuffer`.
     """
 
     def __init__(
@@ -95,11 +102,16 @@ class PrioritizedReplayBuffer(ReplayBuffer, PriorityWeightError):
         error_min=0,
         error_max=1,
         num_steps=1,
+        tree_backend="nested",
+        stratified=False,
+        codecs=None,
     ):
         self.capacity = capacity
         assert num_steps > 0
         self.num_steps = num_steps
-        self.memory = PrioritizedBuffer(capacity=capacity)
+        self.field_codec = FieldCodec(codecs) if codecs else None
+        self.memory = PrioritizedBuffer(capacity=capacity, tree_backend=tree_backend)
+        self.stratified = stratified
         self.last_n_transitions = collections.defaultdict(
             lambda: collections.deque([], maxlen=num_steps)
         )
@@ -116,11 +128,29 @@ class PrioritizedReplayBuffer(ReplayBuffer, PriorityWeightError):
 
     def sample(self, n):
         assert len(self.memory) >= n
-        sampled, probabilities, min_prob = self.memory.sample(n)
+        if self.stratified:
+            sampled, _, probabilities, min_prob = self.memory.sample_stratified(n)
+        else:
+            sampled, probabilities, min_prob = self.memory.sample(n)
         weights = self.weights_from_probabilities(probabilities, min_prob)
         for e, w in zip(sampled, weights):
             e[0]["weight"] = w
-        return sampled
+        return self._decode(sampled)
 
     def update_errors(self, errors):
         self.memory.set_last_priority(self.priority_from_errors(errors))
+
+    def detach_last_sample(self):
+        """Detach the last sample so that errors can be updated later.
+
+        See `pfrl.collections.prioritized.PrioritizedBuffer.detach_last_sample`.
+        """
+        return self.memory.detach_last_sample()
+
+    def attach_sample(self, ids):
+        """Attach a detached sample so that `update_errors` targets it."""
+        self.memory.attach_sample(ids)
+
+    def discard_sample(self, ids):
+        """Give up updating errors of a detached sample."""
+        self.memory.discard_sample(ids)
@@ -22,15 +22,20 @@ class PrioritizedEpisodicReplayBuffer(EpisodicReplayBuffer, PriorityWeightError)
         return_sample_weights=True,
         error_min=None,
         error_max=None,
+        tree_backend="nested",
+        stratified=False,
     ):
         self.current_episode = collections.defaultdict(list)
         self.episodic_memory = PrioritizedBuffer(
-            capacity=None, wait_priority_after_sampling=wait_priority_after_sampling
+            capacity=None,
+            wait_priority_after_sampling=wait_priority_after_sampling,
+            tree_backend=tree_backend,
         )
         self.memory = RandomAccessQueue(maxlen=capacity)
         self.capacity_left = capacity
         self.default_priority_func = default_priority_func
         self.uniform_ratio = uniform_ratio
+        self.stratified = stratified
         self.return_sample_weights = return_sample_weights
         PriorityWeightError.__init__(
             self,
@@ -46,9 +51,15 @@ class PrioritizedEpisodicReplayBuffer(EpisodicReplayBuffer, PriorityWeightError)
     def sample_episodes(self, n_episodes, max_len=None):
         """Sample n unique samples from this replay buffer"""
         assert len(self.episodic_memory) >= n_episodes
-        episodes, probabilities, min_prob = self.episodic_memory.sample(
-            n_episodes, uniform_ratio=self.uniform_ratio
-        )
+        if self.stratified:
+            sampled = self.episodic_memory.sample_stratified(
+                n_episodes, uniform_ratio=self.uniform_ratio
+            )
+            episodes, _, probabilities, min_prob = sampled
+        else:
+            episodes, probabilities, min_prob = self.episodic_memory.sample(
+                n_episodes, uniform_ratio=self.uniform_ratio
+            )
         if max_len is not None:
             episodes = [random_subseq(ep, max_len) for ep in episodes]
         if self.return_sample_weights:
@@ -60,6 +71,21 @@ class PrioritizedEpisodicReplayBuffer(EpisodicReplayBuffer, PriorityWeightError)
     def update_errors(self, errors):
         self.episodic_memory.set_last_priority(self.priority_from_errors(errors))
 
+    def detach_last_sample(self):
+        """Detach the last sample so that errors can be updated later.
+
+        See `pfrl.collections.prioritized.PrioritizedBuffer.detach_last_sample`.
+        """
+        return self.episodic_memory.detach_last_sample()
+
+    def attach_sample(self, ids):
+        """Attach a detached sample so that `update_errors` targets it."""
+        self.episodic_memory.attach_sample(ids)
+
+    def discard_sample(self, ids):
+        """Give up updating errors of a detached sample."""
+        self.episodic_memory.discard_sample(ids)
+
     def stop_current_episode(self, env_id=0):
         current_episode = self.current_episode[env_id]
         if current_episode:
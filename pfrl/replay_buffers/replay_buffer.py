@@ -1,6 +1,11 @@
 import collections
 import pickle
 
+from pfrl.collections import chunk_stream
+from pfrl.collections.codecs import FieldCodec
+from pfrl.collections.columnar_queue import ColumnarQueue
+from pfrl.collections.persistent_collections import IncrementalSnapshot
+from pfrl.collections.persistent_collections import MappedRandomAccessQueue
 from pfrl.collections.random_access_queue import RandomAccessQueue
 from pfrl import replay_buffer
 
@@ -15,16 +20,38 @@ class ReplayBuffer(replay_buffer.AbstractReplayBuffer):
         capacity (int): capacity in terms of number of transitions
         num_steps (int): Number of timesteps per stored transition
             (for N-step updates)
+        columnar (bool): If set to True, transitions are stored in
+            preallocated NumPy arrays, one per field, instead of a list of
+            dicts. Dtypes and shapes of the arrays are inferred from the first
+            appended transition. `sample` then returns a
+            `pfrl.collections.columnar_queue.ColumnarSample`, from which
+            `pfrl.replay_buffer.batch_experiences` gathers each field of a
+            minibatch at once. It cannot be used with prefetching of
+            `pfrl.replay_buffer.ReplayUpdater`.
+        codecs (dict): If specified, fields of transitions are compressed
+            when appended and decompressed when sampled. Keys are field names
+            and values are codecs or codec names, e.g.
+            ``{"state": "lz4", "next_state": "lz4"}`` to compress image
+            observations only. See `pfrl.collections.codecs.FieldCodec`.
+            Not supported when `columnar=True`.
     """
 
-    def __init__(self, capacity=None, num_steps=1):
+    def __init__(self, capacity=None, num_steps=1, columnar=False, codecs=None):
         self.capacity = capacity
         assert num_steps > 0
         self.num_steps = num_steps
-        self.memory = RandomAccessQueue(maxlen=capacity)
+        self.columnar = columnar
+        assert not (columnar and codecs)
+        self.field_codec = FieldCodec(codecs) if codecs else None
+        if columnar:
+            self.memory = ColumnarQueue(maxlen=capacity, num_steps=num_steps)
+        else:
+            self.memory = RandomAccessQueue(maxlen=capacity)
         self.last_n_transitions = collections.defaultdict(
             lambda: collections.deque([], maxlen=num_steps)
         )
+        # IncrementalSnapshot for each directory
+        self.snapshots = {}
 
     def append(
         self,
@@ -47,6 +74,8 @@ class ReplayBuffer(replay_buffer.AbstractReplayBuffer):
             is_state_terminal=is_state_terminal,
             **kwargs
         )
+        if self.field_codec is not None:
+            experience = self.field_codec.encode(experience)
         last_n_transitions.append(experience)
         if is_state_terminal:
             while last_n_transitions:
@@ -73,18 +102,82 @@ class ReplayBuffer(replay_buffer.AbstractReplayBuffer):
 
     def sample(self, num_experiences):
         assert len(self.memory) >= num_experiences
-        return self.memory.sample(num_experiences)
+        return self._decode(self.memory.sample(num_experiences))
+
+    def _decode(self, experiences):
+        if self.field_codec is None:
+            return experiences
+        return self.field_codec.decode_experiences(experiences)
 
     def __len__(self):
         return len(self.memory)
 
     def save(self, filename):
         with open(filename, "wb") as f:
-            pickle.dump(self.memory, f)
+            if type(self.memory) in (RandomAccessQueue, MappedRandomAccessQueue):
+                # Written chunk by chunk so that the whole memory is not
+                # serialized at once. Transitions of N-step experiences are
+                # written once so that they are still shared when loaded.
+                header = dict(maxlen=self.memory.maxlen)
+                chunk_stream.dump_chunks(
+                    f, self.memory, header=header, shared=self.num_steps > 1
+                )
+            else:
+                pickle.dump(self.memory, f)
 
     def load(self, filename):
         with open(filename, "rb") as f:
-            self.memory = pickle.load(f)
+            if chunk_stream.is_chunk_stream(f):
+                header, chunks = chunk_stream.load_chunks(f)
+                self.memory = RandomAccessQueue(maxlen=header["maxlen"])
+                for chunk in chunks:
+                    self.memory.extend(chunk)
+            else:
+                self.memory = pickle.load(f)
         if isinstance(self.memory, collections.deque):
             # Load v0.2
             self.memory = RandomAccessQueue(self.memory, maxlen=self.memory.maxlen)
+
+    @property
+    def supports_save_incremental(self):
+        """True iff the buffer can be saved by `save_incremental`."""
+        # Experiences are written one by one, so N-step experiences would
+        # store each of their shared transitions N times
+        return self.num_steps == 1 and type(self.memory) in (
+            RandomAccessQueue,
+            MappedRandomAccessQueue,
+        )
+
+    def save_incremental(self, dirname):
+        """Save the buffer to a directory incrementally.
+
+        Unlike `save`, only the experiences appended after the last
+        `save_incremental` or `load_incremental` with the same directory are
+        written, so saving the buffer frequently, e.g. at every checkpoint,
+        is cheap. Buffers of N-step experiences are not supported.
+
+        See `pfrl.collections.persistent_collections.IncrementalSnapshot`.
+
+        Args:
+            dirname (str): Path to the directory to save the buffer to.
+        """
+        if not self.supports_save_incremental:
+            raise NotImplementedError(
+                "{} does not support save_incremental".format(type(self).__name__)
+            )
+        if dirname not in self.snapshots:
+            self.snapshots[dirname] = IncrementalSnapshot(dirname)
+        self.snapshots[dirname].save(self.memory)
+
+    def load_incremental(self, dirname, lazy=False):
+        """Load the buffer saved by `save_incremental`.
+
+        Args:
+            dirname (str): Path to the directory the buffer was saved to.
+            lazy (bool): If set to True, saved experiences are not read but
+                memory-mapped, and they are unpickled every time they are
+                sampled, which saves memory and loading time.
+        """
+        snapshot = IncrementalSnapshot(dirname)
+        self.memory = snapshot.load(lazy=lazy)
+        self.snapshots[dirname] = snapshot
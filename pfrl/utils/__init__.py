@@ -7,4 +7,5 @@ from pfrl.utils.pretrained_models import download_model  # NOQA
 from pfrl.utils.contexts import evaluating  # NOQA
 from pfrl.utils.stoppable_thread import StoppableThread  # NOQA
 from pfrl.utils.clip_l2_grad_norm import clip_l2_grad_norm_  # NOQA
-from pfrl.utils.hrl_utils import _is_update, _mean_or_nan # NOQA
\ No newline at end of file
+from pfrl.utils.hrl_utils import _is_update, _mean_or_nan # NOQA
+from pfrl.utils.hrl_utils import RunningVariance  # NOQA
\ No newline at end of file
@@ -0,0 +1,42 @@
+def batch_env_ids(env_ids, batch_size):
+    """Return indices of the envs a batch comes from.
+
+    Args:
+        env_ids (Sequence of int or None): Indices of the envs. If None, the
+            batch comes from all the envs in order.
+        batch_size (int): Size of the batch.
+
+    Returns:
+        Sequence of int: Indices of the envs.
+    """
+    if env_ids is None:
+        return range(batch_size)
+    assert len(env_ids) == batch_size
+    return [int(i) for i in env_ids]
+
+
+def update_at_env_ids(values, env_ids, new_values):
+    """Update per-env values with values of a batch.
+
+    This function can be used to keep values, e.g. last observations, of
+    each env when only a subset of envs is stepped at a time.
+
+    Args:
+        values (list or None): Values indexed by env index.
+        env_ids (Sequence of int or None): Indices of the envs the batch
+            comes from. If None, the batch comes from all the envs.
+        new_values (Sequence): Values of the batch.
+
+    Returns:
+        list: Updated values. If `env_ids` is None, they are just
+            `new_values`. Otherwise, the list is extended with None if
+            necessary.
+    """
+    if env_ids is None:
+        return list(new_values)
+    values = list(values) if values is not None else []
+    size = max(env_ids, default=-1) + 1
+    values.extend([None] * (size - len(values)))
+    for i, value in zip(env_ids, new_values):
+        values[i] = value
+    return values
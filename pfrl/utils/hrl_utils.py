@@ -10,3 +10,42 @@ def _is_update(episode, freq, ignore=0, rem=0):
 def _mean_or_nan(xs):
     """Return its mean a non-empty sequence, numpy.nan for a empty one."""
     return np.mean(xs) if xs else np.nan
+
+
+class RunningVariance(object):
+    """Running mean and variance of values by Welford's algorithm.
+
+    Batches of values are merged by the parallel form of the algorithm, so
+    that values are neither stored nor revisited.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        """Add values to the statistics.
+
+        Args:
+            values (array-like): Values of any shape.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        n = values.size
+        if n == 0:
+            return
+        batch_mean = values.mean()
+        batch_m2 = np.sum(np.square(values - batch_mean))
+        delta = batch_mean - self.mean
+        count = self.count + n
+        self.mean += delta * n / count
+        self.m2 += batch_m2 + delta ** 2 * self.count * n / count
+        self.count = count
+
+    @property
+    def variance(self):
+        """Population variance as computed by np.var, numpy.nan if empty."""
+        return self.m2 / self.count if self.count else np.nan
@@ -60,18 +60,34 @@ class VectorFrameStack(VectorEnvWrapper):
     memory usage. To avoid the issue, use this wrapper instead of `FrameStack`
     so that LazyFrames are not passed between processes.
 
+    Frame preprocessing, e.g. `pfrl.wrappers.atari_wrappers.WarpFrame`, is
+    best done inside subprocesses by wrapping envs in `env_fns` of
+    `pfrl.envs.MultiprocessVectorEnv`, so that only preprocessed frames are
+    sent to this wrapper.
+
     Args:
         env (VectorEnv): Env to wrap.
         k (int): How many frames to stack.
         stack_axis (int): Axis along which frames are concatenated.
+        batch_array (bool): If set to True, stacked frames of all the envs
+            are kept in a single ndarray of shape
+            `(num_envs,) + observation_space.shape` and its copy is returned
+            as a batch of observations instead of a list of LazyFrames, so
+            that agents can feed it to models without assembling each
+            observation. Consecutive observations do not share frames, so
+            it is suited to agents that do not keep observations for long,
+            e.g. on-policy ones, rather than ones with large replay buffers.
+            Using it with `pfrl.envs.MultiprocessVectorEnv` with
+            `shared_memory=True` avoids handling frames of each env in
+            Python.
     """
 
-    def __init__(self, env, k, stack_axis=0):
+    def __init__(self, env, k, stack_axis=0, batch_array=False):
         """Stack k last frames."""
         VectorEnvWrapper.__init__(self, env)
         self.k = k
         self.stack_axis = stack_axis
-        self.frames = [deque([], maxlen=k) for _ in range(env.num_envs)]
+        self.batch_array = batch_array
         orig_obs_space = env.observation_space
         assert isinstance(orig_obs_space, spaces.Box)
         low = np.repeat(orig_obs_space.low, k, axis=self.stack_axis)
@@ -79,27 +95,100 @@ class VectorFrameStack(VectorEnvWrapper):
         self.observation_space = spaces.Box(
             low=low, high=high, dtype=orig_obs_space.dtype
         )
+        if batch_array:
+            self.stacked_obs = np.zeros(
+                (env.num_envs,) + self.observation_space.shape,
+                dtype=orig_obs_space.dtype,
+            )
+            # View whose axis 1 is the stack axis
+            self._stacked_view = np.moveaxis(self.stacked_obs, stack_axis + 1, 1)
+            self._frame_size = orig_obs_space.shape[stack_axis]
+        else:
+            self.frames = [deque([], maxlen=k) for _ in range(env.num_envs)]
 
     def reset(self, mask=None):
         batch_ob = self.env.reset(mask=mask)
         if mask is None:
             mask = np.zeros(self.env.num_envs)
-        for m, frames, ob in zip(mask, self.frames, batch_ob):
-            if not m:
-                for _ in range(self.k):
-                    frames.append(ob)
+        env_ids = [i for i, m in enumerate(mask) if not m]
+        if env_ids:
+            self._fill(env_ids, [batch_ob[i] for i in env_ids])
         return self._get_ob()
 
     def step(self, action):
         batch_ob, reward, done, info = self.env.step(action)
-        for frames, ob in zip(self.frames, batch_ob):
-            frames.append(ob)
+        info = self._append(None, batch_ob, info)
         return self._get_ob(), reward, done, info
 
-    def _get_ob(self):
+    def step_async(self, actions, env_ids=None):
+        self.env.step_async(actions, env_ids)
+
+    def step_wait(self, batch_size=None):
+        env_ids, batch_ob, reward, done, info = self.env.step_wait(batch_size)
+        info = self._append(env_ids, batch_ob, info)
+        return env_ids, self._get_ob(env_ids), reward, done, info
+
+    def _append(self, env_ids, batch_ob, info):
+        """Append new frames and handle envs reset automatically.
+
+        Terminal observations in infos are replaced with stacked ones.
+        """
+        auto_reset = [i for i, inf in enumerate(info) if "terminal_observation" in inf]
+        if not auto_reset:
+            self._push(env_ids, batch_ob)
+            return info
+        # The last frames of episodes are appended instead of the first ones
+        # of the next episodes, which are appended after stacking.
+        self._push(
+            env_ids,
+            [
+                inf["terminal_observation"] if "terminal_observation" in inf else ob
+                for ob, inf in zip(batch_ob, info)
+            ],
+        )
+        reset_ids = [i if env_ids is None else env_ids[i] for i in auto_reset]
+        info = list(info)
+        for i, terminal_ob in zip(auto_reset, self._get_ob(reset_ids)):
+            info[i] = dict(info[i], terminal_observation=terminal_ob)
+        self._fill(reset_ids, [batch_ob[i] for i in auto_reset])
+        return info
+
+    def _push(self, env_ids, batch_ob):
+        if self.batch_array:
+            # Shift frames of each env by one frame and write the new ones
+            index = slice(None) if env_ids is None else list(env_ids)
+            c = self._frame_size
+            batch_ob = np.moveaxis(np.asarray(batch_ob), self.stack_axis + 1, 1)
+            self._stacked_view[index, :-c] = self._stacked_view[index, c:]
+            self._stacked_view[index, -c:] = batch_ob
+        else:
+            if env_ids is None:
+                env_ids = range(self.env.num_envs)
+            for i, ob in zip(env_ids, batch_ob):
+                self.frames[i].append(ob)
+
+    def _fill(self, env_ids, batch_ob):
+        if self.batch_array:
+            index = list(env_ids)
+            c = self._frame_size
+            batch_ob = np.moveaxis(np.asarray(batch_ob), self.stack_axis + 1, 1)
+            for j in range(self.k):
+                self._stacked_view[index, j * c : (j + 1) * c] = batch_ob
+        else:
+            for i, ob in zip(env_ids, batch_ob):
+                for _ in range(self.k):
+                    self.frames[i].append(ob)
+
+    def _get_ob(self, env_ids=None):
+        if self.batch_array:
+            if env_ids is None:
+                return self.stacked_obs.copy()
+            return self.stacked_obs[list(env_ids)]
+        if env_ids is None:
+            env_ids = range(self.env.num_envs)
         assert len(self.frames) == self.env.num_envs
-        assert len(self.frames[0]) == self.k
+        assert all(len(self.frames[i]) == self.k for i in env_ids)
         return [
-            LazyFrames(list(frames), stack_axis=self.stack_axis)
-            for frames in self.frames
+            LazyFrames(list(self.frames[i]), stack_axis=self.stack_axis)
+            for i in env_ids
         ]
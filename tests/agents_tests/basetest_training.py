@@ -102,7 +102,12 @@ class _TestBatchTrainingMixin(object):
         return vec_env, successful_return
 
     def _test_batch_training(
-        self, gpu, steps=5000, load_model=False, require_success=True
+        self,
+        gpu,
+        steps=5000,
+        load_model=False,
+        require_success=True,
+        async_batch_size=None,
     ):
 
         random_seed.set_random_seed(1)
@@ -128,6 +133,7 @@ class _TestBatchTrainingMixin(object):
             eval_n_episodes=5,
             successful_score=1,
             eval_env=test_env,
+            async_batch_size=async_batch_size,
         )
         env.close()
 
@@ -166,6 +172,23 @@ class _TestBatchTrainingMixin(object):
         self._test_batch_training(-1, steps=0, load_model=True, require_success=False)
 
 
+class _TestAsyncBatchTrainingMixin(object):
+    """Mixin for testing batch training with envs stepped asynchronously.
+
+    Inherit this after _TestBatchTrainingMixin to enable test cases for agents
+    that accept env_ids.
+    """
+
+    @pytest.mark.slow
+    def test_async_batch_training_cpu(self):
+        self._test_batch_training(-1, steps=100000, async_batch_size=1)
+
+    def test_async_batch_training_cpu_fast(self):
+        self._test_batch_training(
+            -1, steps=10, require_success=False, async_batch_size=1
+        )
+
+
 class _TestActorLearnerTrainingMixin(object):
     """Mixin for testing actor-learner training.
     Inherit this after _TestTraining to enable test cases for batch training.
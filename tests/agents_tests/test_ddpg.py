@@ -2,6 +2,7 @@ import pytest
 
 from pfrl.agents.ddpg import DDPG
 import basetest_ddpg as base
+from basetest_training import _TestAsyncBatchTrainingMixin
 from basetest_training import _TestBatchTrainingMixin
 
 
@@ -28,7 +29,11 @@ class TestDDPGOnContinuousPOABC(base._TestDDPGOnContinuousPOABC):
         )
 
 
-class TestDDPGOnContinuousABC(_TestBatchTrainingMixin, base._TestDDPGOnContinuousABC):
+class TestDDPGOnContinuousABC(
+    _TestBatchTrainingMixin,
+    _TestAsyncBatchTrainingMixin,
+    base._TestDDPGOnContinuousABC,
+):
     def make_ddpg_agent(
         self, env, policy, q_func, actor_opt, critic_opt, explorer, rbuf, gpu,
     ):
@@ -8,13 +8,17 @@ from pfrl.agents.dqn import compute_value_loss
 from pfrl.agents.dqn import compute_weighted_value_loss
 from pfrl.agents.dqn import DQN
 from basetest_training import _TestActorLearnerTrainingMixin
+from basetest_training import _TestAsyncBatchTrainingMixin
 from basetest_training import _TestBatchTrainingMixin
 
 assertions = unittest.TestCase("__init__")
 
 
 class TestDQNOnDiscreteABC(
-    _TestActorLearnerTrainingMixin, _TestBatchTrainingMixin, base._TestDQNOnDiscreteABC
+    _TestActorLearnerTrainingMixin,
+    _TestBatchTrainingMixin,
+    _TestAsyncBatchTrainingMixin,
+    base._TestDQNOnDiscreteABC,
 ):
     def make_dqn_agent(self, env, q_func, opt, explorer, rbuf, gpu):
         return DQN(
@@ -39,6 +43,66 @@ class TestDQNOnDiscreteABC(
                 env=env, q_func=q_func, opt=opt, explorer=explorer, rbuf=rbuf, gpu=None
             )
 
+    @pytest.mark.parametrize("shared_memory_capacity", [None, 1, 8])
+    def test_actor_learner_transitions(self, shared_memory_capacity):
+        env, _ = self.make_env_and_successful_return(test=False)
+        agent = self.make_agent(env, -1)
+        make_actor, _, poller, exception_event = agent.setup_actor_learner_training(
+            n_actors=1, shared_memory_capacity=shared_memory_capacity
+        )
+        actor = make_actor(0)
+        poller.start()
+        n_steps = 20
+        obs = env.reset()
+        for _ in range(n_steps):
+            obs, reward, done, _ = env.step(actor.act(obs))
+            actor.observe(obs, reward, done, done)
+            if done:
+                obs = env.reset()
+        # Requesting statistics waits until the poller handles all the
+        # transitions written before
+        stats = dict(actor.get_statistics())
+        poller.stop()
+        poller.join()
+        assert not exception_event.is_set()
+        assert (actor.shared_memory_ring is None) == (shared_memory_capacity is None)
+        assert stats["cumulative_steps"] == n_steps
+        assert len(agent.replay_buffer) == n_steps
+
+    def test_actor_learner_columnar_replay_buffer(self):
+        env, _ = self.make_env_and_successful_return(test=False)
+        q_func = self.make_q_func(env)
+        rbuf = pfrl.replay_buffers.ReplayBuffer(capacity=150, columnar=True)
+        agent = self.make_dqn_agent(
+            env=env,
+            q_func=q_func,
+            opt=self.make_optimizer(env, q_func),
+            explorer=self.make_explorer(env),
+            rbuf=rbuf,
+            gpu=None,
+        )
+        (
+            make_actor,
+            learner,
+            poller,
+            exception_event,
+        ) = agent.setup_actor_learner_training(n_actors=1, n_updates=20)
+        actor = make_actor(0)
+        poller.start()
+        learner.start()
+        obs = env.reset()
+        # The buffer is full, so slots are overwritten while the learner updates
+        while learner.is_alive():
+            obs, reward, done, _ = env.step(actor.act(obs))
+            actor.observe(obs, reward, done, done)
+            if done:
+                obs = env.reset()
+        learner.join()
+        poller.stop()
+        poller.join()
+        assert not exception_event.is_set()
+        assert agent.optim_t == 20
+
 
 class TestDQNOnDiscreteABCBoltzmann(
     _TestActorLearnerTrainingMixin, _TestBatchTrainingMixin, base._TestDQNOnDiscreteABC
@@ -57,6 +121,26 @@ class TestDQNOnDiscreteABCBoltzmann(
         )
 
 
+class TestDQNOnDiscreteABCPrefetch(
+    _TestActorLearnerTrainingMixin, _TestBatchTrainingMixin, base._TestDQNOnDiscreteABC
+):
+    def make_replay_buffer(self, env):
+        return pfrl.replay_buffers.PrioritizedReplayBuffer(10 ** 5)
+
+    def make_dqn_agent(self, env, q_func, opt, explorer, rbuf, gpu):
+        return DQN(
+            q_func,
+            opt,
+            rbuf,
+            gpu=gpu,
+            gamma=0.9,
+            explorer=explorer,
+            replay_start_size=100,
+            target_update_interval=100,
+            prefetch_size=2,
+        )
+
+
 class TestDQNOnContinuousABC(
     _TestActorLearnerTrainingMixin,
     _TestBatchTrainingMixin,
@@ -78,6 +162,7 @@ class TestDQNOnContinuousABC(
 class TestDQNOnDiscretePOABC(
     _TestActorLearnerTrainingMixin,
     _TestBatchTrainingMixin,
+    _TestAsyncBatchTrainingMixin,
     base._TestDQNOnDiscretePOABC,
 ):
     def make_dqn_agent(self, env, q_func, opt, explorer, rbuf, gpu):
@@ -0,0 +1,314 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from pfrl.agents import HIROAgent
+from pfrl.replay_buffer import batch_experiences_with_goal
+
+
+def _make_agent(train_freq, add_entropy_layer=None, **kwargs):
+    agent = HIROAgent(
+        state_dim=6,
+        action_dim=2,
+        goal_dim=2,
+        subgoal_dim=3,
+        high_level_burnin_action_func=lambda: np.ones(3, dtype=np.float32),
+        low_level_burnin_action_func=lambda: np.ones(2, dtype=np.float32),
+        scale_low=np.ones(2, dtype=np.float32),
+        scale_high=np.full(3, 10, dtype=np.float32),
+        buffer_size=1000,
+        subgoal_freq=train_freq,
+        train_freq=train_freq,
+        reward_scaling=0.1,
+        gpu=None,
+        add_entropy_layer=add_entropy_layer,
+        goal_threshold=1.0,
+        soft_subgoal_update=1.0,
+        start_training_steps=0,
+        **kwargs,
+    )
+    # Windows of high level transitions have the same length
+    agent.change_temporal_delay_(train_freq)
+    return agent
+
+
+@pytest.mark.parametrize("num_envs", [1, 3])
+@pytest.mark.parametrize("columnar_replay_buffer", [False, True])
+def test_batch_observe(num_envs, columnar_replay_buffer):
+    train_freq = 5
+    steps = 23
+    agent = _make_agent(train_freq, columnar_replay_buffer=columnar_replay_buffer)
+    goals = np.arange(num_envs * 2, dtype=np.float32).reshape(num_envs, 2)
+    obss = np.zeros((num_envs, 6), dtype=np.float32)
+    sgs = agent.batch_sample_subgoal(obss, goals)
+    assert sgs.shape == (num_envs, 3)
+    for step in range(steps):
+        actions = agent.batch_act_low_level(obss, sgs)
+        assert actions.shape == (num_envs, 2)
+        obss = obss + 0.1
+        batch_step = np.full(num_envs, step)
+        n_sgs = agent.batch_act_high_level(
+            obss, goals, sgs, batch_step, step * num_envs
+        )
+        assert n_sgs.shape == (num_envs, 3)
+        # Episodes of the first env end after the last step
+        dones = np.zeros(num_envs, dtype=bool)
+        dones[0] = step == steps - 1
+        agent.batch_observe(
+            obss,
+            goals,
+            n_sgs,
+            np.ones(num_envs),
+            dones,
+            np.zeros(num_envs, dtype=bool),
+            batch_step,
+            step * num_envs,
+        )
+        sgs = n_sgs
+
+    assert len(agent.low_con.agent.replay_buffer) == steps * num_envs
+    # High level transitions are made at steps 6, 11, 16 and 21 of each env,
+    # i.e. of windows of steps 1-5, 6-10, 11-15 and 16-20
+    high_level_buffer = agent.high_con.agent.replay_buffer
+    assert len(high_level_buffer) == 4 * num_envs
+    for (transition,) in high_level_buffer.memory:
+        assert len(transition["state_arr"]) == train_freq
+        assert len(transition["action_arr"]) == train_freq
+        np.testing.assert_allclose(transition["reward"], 0.1 * train_freq)
+    # The first env starts a new episode
+    assert agent.batch_state_arr[0] == []
+    if num_envs > 1:
+        assert len(agent.batch_state_arr[1]) == 2
+    # Final positions are tracked per env, and only the first env has ended
+    stats = dict(agent.get_statistics())
+    np.testing.assert_allclose(
+        [stats["final_x"], stats["final_y"], stats["final_z"]], obss[0][:3]
+    )
+    assert np.isnan(agent.batch_final_pos[1:]).all()
+
+    # Both controllers can be updated from their replay buffers
+    low_level_buffer = agent.low_con.agent.replay_buffer
+    agent.low_con.agent.update(low_level_buffer.sample(10))
+    agent.high_con.minibatch_size = len(high_level_buffer)
+    agent.high_con.agent.replay_updater.replay_start_size = len(high_level_buffer)
+    agent.high_con.agent.replay_updater.batchsize = len(high_level_buffer)
+    agent.high_con.update(agent.low_con)
+    assert agent.high_con.agent.q_func_n_updates == 1
+
+
+def test_batch_act_high_level_subgoal_transition():
+    agent = _make_agent(train_freq=3)
+    agent.start_training_steps = 100
+    obss = np.zeros((2, 6), dtype=np.float32)
+    goals = np.zeros((2, 2), dtype=np.float32)
+    sgs = np.ones((2, 3), dtype=np.float32)
+    agent.batch_act_low_level(obss, sgs)
+    n_sgs = agent.batch_act_high_level(
+        obss + 0.5, goals, sgs, np.array([1, 3]), global_step=100
+    )
+    # The first env follows the subgoal transition and the second env chooses
+    # a new subgoal
+    np.testing.assert_allclose(n_sgs[0], [0.5, 0.5, 0.5])
+    np.testing.assert_allclose(agent.batch_sr, -np.sqrt(3 * 0.5**2))
+
+
+def test_batch_act_high_level_requires_low_level():
+    agent = _make_agent(train_freq=3)
+    obss = np.zeros((2, 6), dtype=np.float32)
+    goals = np.zeros((2, 2), dtype=np.float32)
+    sgs = np.ones((2, 3), dtype=np.float32)
+    with pytest.raises(AssertionError):
+        agent.batch_act_high_level(obss, goals, sgs, np.array([1, 1]))
+    agent.batch_act_low_level(obss, sgs)
+    agent.batch_act_high_level(obss, goals, sgs, np.array([1, 1]))
+    # batch_act_low_level is called again at the next step
+    with pytest.raises(AssertionError):
+        agent.batch_act_high_level(obss, goals, sgs, np.array([2, 2]))
+
+
+def _reference_corrections(high_con, low_con, states, next_states, actions, low_states):
+    # Candidates are evaluated one by one via LowerController.policy
+    goal_dim = actions.shape[-1]
+    loc = (next_states - states)[:, None, :goal_dim]
+    random_goals = loc + 0.5 * high_con.scale * np.random.normal(
+        size=(len(states), high_con.candidate_goals, goal_dim)
+    )
+    candidates = np.concatenate([actions[:, None], loc, random_goals], axis=1)
+    candidates = candidates.clip(-high_con.scale, high_con.scale)
+    low_actions = []
+    low_con.agent.training = False
+    for c in range(candidates.shape[1]):
+        subgoals = (candidates[:, c] + low_states[:, 0, :goal_dim])[
+            :, None
+        ] - low_states[:, :, :goal_dim]
+        low_actions.append(
+            low_con.policy(
+                low_states.reshape(-1, low_states.shape[-1]),
+                subgoals.reshape(-1, goal_dim),
+            ).reshape(low_states.shape[:2] + (-1,))
+        )
+    low_con.agent.training = True
+    return candidates, np.stack(low_actions, axis=1)
+
+
+@pytest.mark.parametrize("add_entropy_layer", [None, "bottom"])
+@pytest.mark.parametrize("correction_batch_size", [7, 4096])
+def test_off_policy_corrections(add_entropy_layer, correction_batch_size):
+    agent = _make_agent(
+        train_freq=5,
+        add_entropy_layer=add_entropy_layer,
+        candidate_goals=4,
+        correction_batch_size=correction_batch_size,
+    )
+    batch_size, seq_len = 6, 5
+    states = np.random.uniform(-1, 1, size=(batch_size, 6)).astype(np.float32)
+    next_states = states + np.random.uniform(-1, 1, size=(batch_size, 6)).astype(
+        np.float32
+    )
+    actions = np.random.uniform(-10, 10, size=(batch_size, 3)).astype(np.float32)
+    low_states = np.random.uniform(-1, 1, size=(batch_size, seq_len, 6)).astype(
+        np.float32
+    )
+    candidates, cand_low_actions = _reference_corrections(
+        agent.high_con, agent.low_con, states, next_states, actions, low_states
+    )
+    # Low level actions are taken with the first random candidate for even
+    # indices and with the original subgoal for odd indices
+    expected = np.where(
+        np.arange(batch_size)[:, None] % 2 == 0, candidates[:, 2], actions
+    )
+    low_actions = np.where(
+        np.arange(batch_size)[:, None, None] % 2 == 0,
+        cand_low_actions[:, 2],
+        cand_low_actions[:, 0],
+    )
+
+    def randn(*size, device=None):
+        # Random candidates same as the reference
+        return torch.as_tensor(
+            (candidates[:, 2:] - (next_states - states)[:, None, :3])
+            / (0.5 * agent.high_con.scale),
+            dtype=torch.float32,
+        )
+
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(torch, "randn", randn)
+        corrected = agent.high_con._off_policy_corrections(
+            agent.low_con,
+            torch.as_tensor(states),
+            torch.as_tensor(actions),
+            torch.as_tensor(next_states),
+            torch.as_tensor(low_states),
+            torch.as_tensor(low_actions),
+        )
+    assert isinstance(corrected, torch.Tensor)
+    np.testing.assert_allclose(corrected.numpy(), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_actor_learner_transitions():
+    train_freq = 5
+    steps = 23
+    agent = _make_agent(train_freq)
+    make_actor, learner, poller, exception_event = agent.setup_actor_learner_training(
+        n_actors=1, n_updates=train_freq * 2, actor_update_interval=train_freq
+    )
+    actor = make_actor(0)
+    poller.start()
+    goal = np.ones(2, dtype=np.float32)
+    obs = np.zeros(6, dtype=np.float32)
+    sg = actor.sample_subgoal(obs, goal)
+    for step in range(steps):
+        action = actor.act_low_level(obs, sg)
+        assert action.shape == (2,)
+        # Burn-in actions are used until the policy is updated
+        np.testing.assert_allclose(action, 1)
+        obs = obs + 0.1
+        n_sg = actor.act_high_level(obs, goal, sg, step, step)
+        done = step == steps - 1
+        actor.observe(obs, goal, n_sg, 1.0, done, False, step, step)
+        sg = n_sg
+    actor.end_episode()
+    # Requesting statistics waits until the poller handles all the
+    # transitions sent before
+    actor.get_statistics()
+    assert len(agent.low_con.agent.replay_buffer) == steps
+    high_level_buffer = agent.high_con.agent.replay_buffer
+    assert len(high_level_buffer) == 4
+    for (transition,) in high_level_buffer.memory:
+        assert transition["state_arr"].shape == (train_freq, 6)
+        assert transition["action_arr"].shape == (train_freq, 2)
+        np.testing.assert_allclose(transition["reward"], 0.1 * train_freq)
+
+    for controller in (agent.low_con, agent.high_con):
+        controller.agent.replay_updater.replay_start_size = 2
+        controller.agent.minibatch_size = 2
+    learner.start()
+    learner.join(timeout=60)
+    poller.stop()
+    poller.join()
+    assert not learner.is_alive()
+    assert not exception_event.is_set()
+    assert agent.low_con.agent.q_func_n_updates == train_freq * 2
+    assert agent.high_con.agent.q_func_n_updates == 2
+    # The shared policies are synchronized with the learner
+    assert agent.update_counter.value == 2
+    for shared, policy in zip(
+        actor.low_level_actor.policy.parameters(),
+        agent.low_con.agent.policy.parameters(),
+    ):
+        torch.testing.assert_close(shared, policy)
+    assert actor.low_level_actor.policy_n_updates[0] > 0
+
+
+@pytest.mark.parametrize("statistics_interval", [None, 1, 2])
+def test_statistics_interval(statistics_interval):
+    agent = _make_agent(5, statistics_interval=statistics_interval)
+    td3 = agent.low_con.agent
+    rng = np.random.RandomState(0)
+    for _ in range(100):
+        td3.replay_buffer.append(
+            state=rng.normal(size=6).astype(np.float32),
+            goal=rng.normal(size=3).astype(np.float32),
+            action=rng.uniform(-1, 1, size=2).astype(np.float32),
+            reward=rng.normal(),
+            next_state=rng.normal(size=6).astype(np.float32),
+            next_goal=rng.normal(size=3).astype(np.float32),
+            next_action=None,
+            is_state_terminal=False,
+        )
+    batch = batch_experiences_with_goal(
+        td3.replay_buffer.sample(100), td3.device, td3.phi, td3.gamma
+    )
+    one_step_kls = []
+    for _ in range(4):
+        prior_policy = copy.deepcopy(td3.policy)
+        td3.update(None, exp_batch=batch)
+        with torch.no_grad():
+            one_step_kls.append(
+                td3.compute_kl(td3.policy, prior_policy, batch["state"], batch["goal"])
+            )
+    # Policies are updated at the 2nd and 4th updates
+    assert td3.policy_n_updates == 2
+    if statistics_interval is None:
+        assert td3.one_step_kl_divergence == 0.0
+        assert td3.kl_divergence == 0.0
+        assert len(td3.q_func1_variance_record) == 0
+    else:
+        # KL divergences are last computed at the 4th update if they are
+        # computed at every policy update, or at the 2nd update otherwise
+        last_kl_update = 3 if statistics_interval == 1 else 1
+        np.testing.assert_allclose(
+            td3.one_step_kl_divergence, one_step_kls[last_kl_update], rtol=1e-5
+        )
+        assert td3.kl_divergence > 0
+        # Each variance is of 100 Q-values, i.e. of a single minibatch
+        assert len(td3.q_func1_variance_record) == 4 // statistics_interval
+        assert len(td3.q_func2_variance_record) == 4 // statistics_interval
+        if statistics_interval == 1:
+            np.testing.assert_allclose(
+                td3.q_func1_variance_record[-1],
+                np.var(list(td3.q1_record)[-100:]),
+                rtol=1e-5,
+            )
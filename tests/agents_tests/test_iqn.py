@@ -7,6 +7,7 @@ import basetest_dqn_like as base
 
 # IQN does not support the actor-learner interface for now
 # from basetest_training import _TestActorLearnerTrainingMixin
+from basetest_training import _TestAsyncBatchTrainingMixin
 from basetest_training import _TestBatchTrainingMixin
 import pfrl
 from pfrl.agents import iqn
@@ -55,6 +56,7 @@ class TestIQNOnDiscreteABC(
 class TestIQNOnDiscretePOABC(
     # _TestActorLearnerTrainingMixin,
     _TestBatchTrainingMixin,
+    _TestAsyncBatchTrainingMixin,
     base._TestDQNOnDiscretePOABC,
 ):
     def make_q_func(self, env):
@@ -0,0 +1,113 @@
+import io
+import pickle
+
+import numpy as np
+import pytest
+
+from pfrl.collections import chunk_stream
+from pfrl.collections.codecs import CompressedArray
+from pfrl.collections.codecs import FieldCodec
+from pfrl.collections.codecs import get_codec
+from pfrl.wrappers.atari_wrappers import LazyFrames
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lz4"])
+@pytest.mark.parametrize(
+    "array",
+    [
+        np.zeros((4, 84, 84), dtype=np.uint8),
+        np.arange(12, dtype=np.float32).reshape(3, 4),
+        np.ones(0, dtype=np.int64),
+    ],
+)
+def test_compressed_array(codec, array):
+    if codec == "lz4":
+        pytest.importorskip("lz4")
+    compressed = CompressedArray.compress(array, codec)
+    assert compressed.codec == codec
+    # Pickled without the codec object
+    compressed = pickle.loads(pickle.dumps(compressed))
+    decompressed = compressed.decompress()
+    assert decompressed.dtype == array.dtype
+    np.testing.assert_array_equal(decompressed, array)
+    # Decompressed arrays are writable
+    decompressed[...] = 0
+
+
+def test_get_codec():
+    assert get_codec("zlib") is get_codec("zlib")
+    codec = get_codec("zlib")
+    assert get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        get_codec("unknown")
+
+
+def test_field_codec():
+    field_codec = FieldCodec({"state": "zlib", "next_state": "zlib", "action": "zlib"})
+    frame = np.full((1, 8, 8), 3, dtype=np.uint8)
+    transition = dict(
+        state=LazyFrames([frame] * 4, stack_axis=0),
+        action=np.int64(1),
+        reward=1.0,
+        next_state=np.zeros((4, 8, 8), dtype=np.uint8),
+        is_state_terminal=False,
+    )
+    encoded = field_codec.encode(transition)
+    assert isinstance(encoded["state"], CompressedArray)
+    assert isinstance(encoded["next_state"], CompressedArray)
+    # Too small to compress
+    assert encoded["action"] is transition["action"]
+    assert encoded["reward"] == transition["reward"]
+
+    decoded = field_codec.decode(encoded)
+    assert decoded.keys() == transition.keys()
+    np.testing.assert_array_equal(decoded["state"], np.asarray(transition["state"]))
+    np.testing.assert_array_equal(decoded["next_state"], transition["next_state"])
+    assert decoded["action"] == transition["action"]
+
+    # Shared transitions are decoded once
+    experiences = field_codec.decode_experiences([[encoded], [encoded, encoded]])
+    assert experiences[0][0] is experiences[1][0]
+    assert experiences[1][0] is experiences[1][1]
+
+
+@pytest.mark.parametrize("n", [0, 1, 5, 6, 20])
+def test_chunk_stream(n):
+    f = io.BytesIO()
+    chunk_stream.dump_chunks(f, iter(range(n)), header={"n": n}, chunk_size=5)
+    f.seek(0)
+    assert chunk_stream.is_chunk_stream(f)
+    header, chunks = chunk_stream.load_chunks(f)
+    assert header == {"n": n}
+    chunks = list(chunks)
+    assert all(len(chunk) <= 5 for chunk in chunks)
+    assert sum(chunks, []) == list(range(n))
+
+    f = io.BytesIO(pickle.dumps(list(range(n))))
+    assert not chunk_stream.is_chunk_stream(f)
+    assert f.tell() == 0
+
+
+def test_chunk_stream_shared_objects():
+    # Items of each group of 4 share their objects like N-step experiences,
+    # and items of two groups are interleaved like experiences of two envs
+    groups = [[dict(x=i) for _ in range(2)] for i in range(6)]
+    items = [
+        [group[0], group[j % 2]]
+        for k in range(0, len(groups), 2)
+        for j in range(4)
+        for group in groups[k : k + 2]
+    ]
+    f = io.BytesIO()
+    chunk_stream.dump_chunks(f, items, chunk_size=3, shared=True)
+    f.seek(0)
+    _, chunks = chunk_stream.load_chunks(f)
+    chunks = list(chunks)
+    assert all(len(chunk) <= 3 for chunk in chunks)
+    loaded_items = sum(chunks, [])
+    assert loaded_items == items
+    # Objects are shared across chunks as before
+    for item, loaded_item in zip(items, loaded_items):
+        for x, y in zip(item, loaded_item):
+            assert (x is item[0]) == (y is loaded_item[0])
+    assert len({id(x) for item in loaded_items for x in item}) == 12
@@ -0,0 +1,117 @@
+import collections
+import pickle
+
+import numpy as np
+import pytest
+
+from pfrl.collections.columnar_queue import ColumnarQueue
+
+
+def _transition(i):
+    return dict(
+        state=np.full((2, 3), i, dtype=np.uint8),
+        action=i,
+        reward=float(i),
+        next_state=np.full((2, 3), i + 1, dtype=np.uint8),
+        next_action=None,
+        is_state_terminal=False,
+    )
+
+
+def _assert_experience_equal(expected, actual):
+    assert len(expected) == len(actual)
+    for t_expected, t_actual in zip(expected, actual):
+        assert t_expected.keys() == t_actual.keys()
+        for key in t_expected:
+            np.testing.assert_array_equal(t_expected[key], t_actual[key])
+
+
+@pytest.mark.parametrize("maxlen", [1, 10, None])
+@pytest.mark.parametrize("num_steps", [1, 3])
+class TestColumnarQueue:
+    @pytest.fixture(autouse=True)
+    def setUp(self, maxlen, num_steps):
+        self.maxlen = maxlen
+        self.num_steps = num_steps
+        self.y_queue = ColumnarQueue(maxlen=maxlen, num_steps=num_steps)
+        self.t_queue = collections.deque(maxlen=maxlen)
+
+    def append_windows(self, start, stop):
+        # Append overlapping n-step windows as ReplayBuffer does
+        window = collections.deque(maxlen=self.num_steps)
+        for i in range(start, stop):
+            window.append(_transition(i))
+            if len(window) == self.num_steps:
+                self.y_queue.append(list(window))
+                self.t_queue.append(list(window))
+        while len(window) > 1:
+            del window[0]
+            self.y_queue.append(list(window))
+            self.t_queue.append(list(window))
+
+    def check_all(self):
+        assert len(self.y_queue) == len(self.t_queue)
+        for expected, actual in zip(self.t_queue, self.y_queue):
+            _assert_experience_equal(expected, actual)
+        for i in range(-len(self.t_queue), 0):
+            _assert_experience_equal(self.t_queue[i], self.y_queue[i])
+
+    def test_append_and_popleft(self):
+        self.check_all()
+        for k in range(5):
+            self.append_windows(k * 100, k * 100 + 200 // (k + 1))
+            self.check_all()
+            for _ in range(min(3, len(self.t_queue))):
+                _assert_experience_equal(
+                    self.t_queue.popleft(), self.y_queue.popleft()
+                )
+            self.check_all()
+
+    def test_sample(self):
+        self.append_windows(0, 30)
+        sample = self.y_queue.sample(len(self.y_queue))
+        assert len(sample) == len(self.y_queue)
+        states = sample.gather_first("state")
+        next_states = sample.gather_last("next_state")
+        rewards, mask = sample.gather_steps("reward")
+        for i, experience in enumerate(sample):
+            np.testing.assert_array_equal(states[i], experience[0]["state"])
+            np.testing.assert_array_equal(
+                next_states[i], experience[-1]["next_state"]
+            )
+            assert mask[i].sum() == len(experience)
+            assert list(rewards[i][mask[i]]) == [t["reward"] for t in experience]
+
+    def test_grow(self):
+        self.append_windows(0, 3000)
+        assert len(self.y_queue) == len(self.t_queue)
+        for i in [0, len(self.t_queue) // 2, -1]:
+            _assert_experience_equal(self.t_queue[i], self.y_queue[i])
+
+    def test_pickle(self):
+        self.append_windows(0, 30)
+        self.y_queue = pickle.loads(pickle.dumps(self.y_queue))
+        self.check_all()
+        self.append_windows(30, 60)
+        self.check_all()
+
+
+def test_object_column_fallback():
+    queue = ColumnarQueue(maxlen=10)
+    queue.append([dict(state=np.zeros(2), next_state=np.zeros(2))])
+    queue.append([dict(state=np.ones(2), next_state=None)])
+    assert queue[0][0]["next_state"].tolist() == [0, 0]
+    assert queue[1][0]["next_state"] is None
+    np.testing.assert_array_equal(queue[1][0]["state"], np.ones(2))
+
+
+def test_column_promotion():
+    queue = ColumnarQueue(maxlen=10)
+    for i, reward in enumerate([0, 0.7, 1.5]):
+        queue.append([dict(state=np.zeros(2), reward=reward, flag=i == 1)])
+    queue.append([dict(state=np.ones(3), reward=1, flag=2)])
+    assert [e[0]["reward"] for e in queue] == [0, 0.7, 1.5, 1]
+    assert [e[0]["flag"] for e in queue] == [False, True, False, 2]
+    # Values of other shapes are kept in an object column
+    assert queue[3][0]["state"].tolist() == [1, 1, 1]
+    assert queue[0][0]["state"].tolist() == [0, 0]
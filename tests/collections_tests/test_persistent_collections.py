@@ -1,12 +1,18 @@
+import os
 import tempfile
 
 import pytest
 
+from pfrl.collections.persistent_collections import IncrementalSnapshot
+from pfrl.collections.persistent_collections import MappedRandomAccessQueue
 from pfrl.collections.persistent_collections import PersistentRandomAccessQueue
+from pfrl.collections.random_access_queue import RandomAccessQueue
 
 
-def check_basic(tmpd):
-    rb = PersistentRandomAccessQueue(tmpd, 16)
+def check_basic(tmpd, lazy_load=False, flush_interval=1):
+    rb = PersistentRandomAccessQueue(
+        tmpd, 16, lazy_load=lazy_load, flush_interval=flush_interval
+    )
     assert 16 == rb.maxlen
 
     data = {0x42: "pocketburger"}
@@ -43,16 +49,22 @@ def check_basic(tmpd):
     assert deadbeefs == sorted(samples)
 
 
-def test_basic_single_node():
+@pytest.mark.parametrize("lazy_load", [False, True])
+@pytest.mark.parametrize("flush_interval", [1, 7])
+def test_basic_single_node(lazy_load, flush_interval):
     with tempfile.TemporaryDirectory() as tmpd:
-        check_basic(tmpd)
+        check_basic(tmpd, lazy_load=lazy_load, flush_interval=flush_interval)
 
 
-def test_recovery():
+@pytest.mark.parametrize("lazy_load", [False, True])
+@pytest.mark.parametrize("flush_interval", [1, 7])
+def test_recovery(lazy_load, flush_interval):
     deadbeefs = []
     with tempfile.TemporaryDirectory() as tmpd:
         for x in range(42):
-            rb = PersistentRandomAccessQueue(tmpd, 16)
+            rb = PersistentRandomAccessQueue(
+                tmpd, 16, lazy_load=lazy_load, flush_interval=flush_interval
+            )
             assert 16 == rb.maxlen
 
             deadbeefs = deadbeefs[-16:]
@@ -68,9 +80,58 @@ def test_recovery():
                 rb.append(data)
                 deadbeefs.append(data)
 
+            if lazy_load:
+                assert [data for data in rb] == deadbeefs[-16:]
+                assert rb[0] == deadbeefs[-16]
+                assert rb[-1] == deadbeefs[-1]
+
             rb.close()
 
 
+def test_lazy_load():
+    with tempfile.TemporaryDirectory() as tmpd:
+        rb = PersistentRandomAccessQueue(tmpd, 8)
+        for i in range(5):
+            rb.append({"i": i})
+        rb.close()
+
+        rb = PersistentRandomAccessQueue(tmpd, 8, lazy_load=True)
+        # Stored data are not loaded but mapped
+        assert len(rb.buffer) == 0
+        assert len(rb) == 5
+        assert rb[1] == {"i": 1}
+        # Each access unpickles a new object
+        assert rb[1] is not rb[1]
+        assert sorted(x["i"] for x in rb.sample(5)) == list(range(5))
+
+        for i in range(5, 10):
+            rb.append({"i": i})
+        # The oldest mapped data are removed first
+        assert len(rb) == 8
+        assert [x["i"] for x in rb] == list(range(2, 10))
+        rb.popleft()
+        assert rb[0] == {"i": 3}
+        assert len(rb.mapped) == 2
+        rb.close()
+
+
+def test_flush_interval():
+    with tempfile.TemporaryDirectory() as tmpd:
+        rb = PersistentRandomAccessQueue(tmpd, 16, flush_interval=4)
+        for i in range(6):
+            rb.append(i)
+        # Only the data of the first group commit are visible on storage
+        reader = PersistentRandomAccessQueue(tmpd + "/reader", 16, ancestor=tmpd)
+        assert list(reader) == [0, 1, 2, 3]
+        reader.close()
+        rb.flush()
+        reader = PersistentRandomAccessQueue(tmpd + "/reader2", 16, ancestor=tmpd)
+        assert list(reader) == list(range(6))
+        reader.close()
+        rb.close()
+
+
+@pytest.mark.parametrize("lazy_load", [False, True])
 @pytest.mark.parametrize(
     "maxlen,ancestors_level,datasizes",
     [
@@ -84,7 +145,7 @@ def test_recovery():
         (17, 3, (5, 7, 20)),
     ],
 )
-def test_ancestor(maxlen, ancestors_level, datasizes):
+def test_ancestor(maxlen, ancestors_level, datasizes, lazy_load):
     # Test multiple depth of ancestors
     # maxlen: max length of the buffer(s)
     # ancestors_level: The number of ancestors to use
@@ -103,7 +164,10 @@ def test_ancestor(maxlen, ancestors_level, datasizes):
             anc = None
         else:
             anc = tmpdirs[level - 1].name
-        buf = PersistentRandomAccessQueue(tmp_dir.name, maxlen, ancestor=anc)
+        buf = PersistentRandomAccessQueue(
+            tmp_dir.name, maxlen, ancestor=anc, lazy_load=lazy_load
+        )
+        assert sorted(buf) == sorted(c0bebeefs)
         buffers.append(buf)
 
         for i in range(datasize):
@@ -118,3 +182,69 @@ def test_ancestor(maxlen, ancestors_level, datasizes):
 
     for d in tmpdirs:
         d.cleanup()
+
+
+def _count_chunk_files(dirname):
+    return len([f for f in os.listdir(dirname) if f.endswith(".data")])
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_incremental_snapshot(lazy):
+    with tempfile.TemporaryDirectory() as tmpd:
+        # Each datum is written to a chunk file of its own
+        snapshot = IncrementalSnapshot(tmpd, chunk_size=1)
+        queue = RandomAccessQueue(maxlen=5)
+        for i in range(3):
+            queue.append(list(range(100 * i, 100 * i + 100)))
+        snapshot.save(queue)
+        assert _count_chunk_files(tmpd) == 3
+
+        # Only new data are written, and chunks of removed data are deleted
+        for i in range(3, 7):
+            queue.append(list(range(100 * i, 100 * i + 100)))
+        snapshot.save(queue)
+        assert snapshot.meta["n_appended"] == 7
+        assert [chunk["gen"] for chunk in snapshot.meta["chunks"]] == list(range(2, 7))
+        assert _count_chunk_files(tmpd) == 5
+        snapshot.save(queue)
+        assert _count_chunk_files(tmpd) == 5
+
+        loaded_snapshot = IncrementalSnapshot(tmpd)
+        loaded = loaded_snapshot.load(lazy=lazy)
+        assert isinstance(
+            loaded, MappedRandomAccessQueue if lazy else RandomAccessQueue
+        )
+        assert list(loaded) == list(queue)
+        assert loaded.maxlen == 5
+        assert loaded.n_appended == 7
+
+        # The loaded queue is saved incrementally
+        loaded.append([-1])
+        loaded_snapshot.save(loaded)
+        assert loaded_snapshot.meta["chunks"][-1]["start"] == 7
+        assert list(IncrementalSnapshot(tmpd).load()) == list(loaded)
+
+        # Other queues are saved from scratch
+        other = RandomAccessQueue([[1], [2]], maxlen=5)
+        loaded_snapshot.save(other)
+        assert list(IncrementalSnapshot(tmpd).load(lazy=lazy)) == [[1], [2]]
+        assert _count_chunk_files(tmpd) == 1
+
+
+def test_incremental_snapshot_partially_removed_chunk():
+    with tempfile.TemporaryDirectory() as tmpd:
+        snapshot = IncrementalSnapshot(tmpd)
+        queue = RandomAccessQueue(range(4), maxlen=4)
+        snapshot.save(queue)
+        queue.extend(range(4, 6))
+        snapshot.save(queue)
+        # The first chunk is kept for data 2 and 3
+        assert _count_chunk_files(tmpd) == 2
+        for lazy in [False, True]:
+            loaded = IncrementalSnapshot(tmpd).load(lazy=lazy)
+            assert list(loaded) == [2, 3, 4, 5]
+            loaded.append(6)
+            assert list(loaded) == [3, 4, 5, 6]
+
+        with pytest.raises(FileNotFoundError):
+            IncrementalSnapshot(os.path.join(tmpd, "missing")).load()
@@ -8,11 +8,12 @@ from pfrl.collections import prioritized
 
 
 @pytest.mark.parametrize("uniform_ratio", [0, 0.7, 1])
-def test_prioritized_buffer_convergence(uniform_ratio):
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
+def test_prioritized_buffer_convergence(uniform_ratio, tree_backend):
     expected_corr_range = {0: (0.9, 1), 0.7: (0.5, 0.85), 1: (-0.3, 0.3)}[uniform_ratio]
     size = 100
 
-    buf = prioritized.PrioritizedBuffer(capacity=size)
+    buf = prioritized.PrioritizedBuffer(capacity=size, tree_backend=tree_backend)
     for x in range(size):
         buf.append(x)
 
@@ -56,11 +57,14 @@ def test_prioritized_buffer_convergence(uniform_ratio):
 @pytest.mark.parametrize("wait_priority_after_sampling", [True, False])
 @pytest.mark.parametrize("initial_priority", [0.1, 1])
 @pytest.mark.parametrize("uniform_ratio", [0, 0.1, 1])
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
 def test_prioritized_buffer_flood(
-    capacity, wait_priority_after_sampling, initial_priority, uniform_ratio
+    capacity, wait_priority_after_sampling, initial_priority, uniform_ratio, tree_backend
 ):
     buf = prioritized.PrioritizedBuffer(
-        capacity=capacity, wait_priority_after_sampling=wait_priority_after_sampling,
+        capacity=capacity,
+        wait_priority_after_sampling=wait_priority_after_sampling,
+        tree_backend=tree_backend,
     )
     for _ in range(100):
         for x in range(capacity + 1):
@@ -75,6 +79,123 @@ def test_prioritized_buffer_flood(
                 buf.set_last_priority([1.0] * n)
 
 
+@pytest.mark.parametrize("capacity", [None, 1, 7])
+def test_flat_tree_queue_consistency(capacity):
+    nested_sums = prioritized.SumTreeQueue()
+    nested_mins = prioritized.MinTreeQueue()
+    flat_sums = prioritized.FlatSumTreeQueue(capacity=capacity)
+    flat_mins = prioritized.FlatMinTreeQueue(capacity=capacity)
+    for step in range(300):
+        op = random.random()
+        if op < 0.5 or nested_sums.length == 0:
+            v = random.uniform(1e-3, 10)
+            for t in [nested_sums, nested_mins, flat_sums, flat_mins]:
+                t.append(v)
+        elif op < 0.7:
+            v = nested_sums.popleft()
+            nested_mins.popleft()
+            assert flat_sums.popleft() == v
+            flat_mins.popleft()
+        else:
+            ixs = random.sample(range(nested_sums.length), k=nested_sums.length // 2)
+            vals = [random.uniform(1e-3, 10) for _ in ixs]
+            for t in [nested_sums, nested_mins, flat_sums, flat_mins]:
+                t.update(ixs, vals)
+        assert len(flat_sums) == nested_sums.length
+        np.testing.assert_allclose(flat_sums.sum(), nested_sums.sum())
+        assert flat_mins.min() == nested_mins.min()
+
+
+def test_flat_sum_tree_queue_find():
+    t = prioritized.FlatSumTreeQueue(capacity=4)
+    for v in [1.0, 0.0, 2.0, 3.0]:
+        t.append(v)
+    # Move head so that leaves wrap around the array
+    t.popleft()
+    t.append(4.0)
+    # Values of the queue: [0, 2, 3, 4]
+    found = t.find(np.linspace(0, t.sum(), num=900, endpoint=False))
+    np.testing.assert_array_equal(np.bincount(found, minlength=4), [0, 200, 300, 400])
+
+
+@pytest.mark.parametrize("remove", [True, False])
+def test_flat_sum_tree_queue_prioritized_sample(remove):
+    t = prioritized.FlatSumTreeQueue()
+    for v in range(10):
+        t.append(float(v))
+    ixs, vals = t.prioritized_sample(9, remove=remove)
+    # Zero-priority index 0 must never be sampled, and samples are unique
+    assert sorted(ixs) == list(range(1, 10))
+    assert vals == [float(ix) for ix in ixs]
+    if remove:
+        assert t.sum() == 0
+    else:
+        assert t.sum() == sum(range(10))
+
+
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
+@pytest.mark.parametrize("wait_priority_after_sampling", [True, False])
+def test_prioritized_buffer_sample_stratified(
+    tree_backend, wait_priority_after_sampling
+):
+    size = 16
+    buf = prioritized.PrioritizedBuffer(
+        capacity=size,
+        wait_priority_after_sampling=wait_priority_after_sampling,
+        tree_backend=tree_backend,
+    )
+    for x in range(size + 4):
+        buf.append(x)
+
+    # With equal priorities, each segment corresponds to exactly one datum
+    sampled, indices, probabilities, min_prob = buf.sample_stratified(size)
+    assert isinstance(indices, np.ndarray)
+    assert isinstance(probabilities, np.ndarray)
+    assert sorted(sampled) == list(range(4, size + 4))
+    assert sorted(indices) == list(range(size))
+    np.testing.assert_allclose(probabilities, 1 / size)
+    np.testing.assert_allclose(min_prob, 1 / size)
+    # Datum i has priority i + 1
+    buf.set_last_priority(indices + 1.0)
+
+    total = size * (size + 1) / 2
+    for _ in range(10):
+        sampled, indices, probabilities, _ = buf.sample_stratified(8)
+        np.testing.assert_allclose(probabilities, (indices + 1) / total)
+        assert [x - 4 for x in sampled] == list(indices)
+        buf.set_last_priority(indices + 1.0)
+
+
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
+def test_prioritized_buffer_detach_sample(tree_backend):
+    buf = prioritized.PrioritizedBuffer(capacity=10, tree_backend=tree_backend)
+    for x in range(10):
+        buf.append(x)
+    sampled1, _, _ = buf.sample(4)
+    ids1 = buf.detach_last_sample()
+    # Data sampled and detached are not sampled again until their priorities
+    # are set
+    sampled2, _, _ = buf.sample(6)
+    ids2 = buf.detach_last_sample()
+    assert sorted(sampled1 + sampled2) == list(range(10))
+    # Pop two data so that the ids differ from indices
+    buf.append(10, priority=1.0)
+    buf.append(11, priority=1.0)
+
+    buf.attach_sample(ids1)
+    buf.set_last_priority([x + 1.0 for x in sampled1])
+    buf.discard_sample(ids2)
+    priorities = [buf.priority_sums[i] for i in range(len(buf))]
+    for i, x in enumerate(buf.data):
+        if x in sampled1:
+            assert priorities[i] == x + 1.0
+        elif x >= 10:
+            assert priorities[i] == 1.0
+        else:
+            assert priorities[i] == buf.max_priority
+    assert buf.max_priority == max(x + 1.0 for x in sampled1)
+
+
 class TestSumTree(unittest.TestCase):
     def test_read_write(self):
         t = prioritized.SumTree()
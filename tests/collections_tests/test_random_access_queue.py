@@ -86,3 +86,15 @@ class TestRandomAccessQueue:
                 self.y_queue.popleft()
         else:
             assert self.y_queue.popleft() == t
+
+
+def test_random_access_queue_n_appended():
+    queue = RandomAccessQueue(range(3), maxlen=4)
+    assert queue.n_appended == 3
+    queue.append(3)
+    queue.extend(x for x in range(4, 7))
+    queue.popleft()
+    assert queue.n_appended == 7
+    # The first datum is the 4th appended one
+    assert list(queue) == [4, 5, 6]
+    assert queue.n_appended - len(queue) == 4
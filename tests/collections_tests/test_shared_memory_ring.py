@@ -0,0 +1,100 @@
+import multiprocessing as mp
+
+import numpy as np
+import pytest
+
+from pfrl.collections.shared_memory_ring import SharedMemoryRing
+
+
+def _make_transition(i):
+    return {
+        "state": np.full((2, 3), i, dtype=np.float32),
+        "action": np.int64(i % 4),
+        "reward": float(i),
+        "next_state": np.full((2, 3), i + 1, dtype=np.float32),
+        "is_state_terminal": i % 5 == 0,
+    }
+
+
+def _check_transition(transition, i):
+    expected = _make_transition(i)
+    assert transition.keys() == expected.keys()
+    np.testing.assert_array_equal(transition["state"], expected["state"])
+    assert transition["state"].dtype == np.float32
+    np.testing.assert_array_equal(transition["next_state"], expected["next_state"])
+    assert transition["action"] == expected["action"]
+    assert transition["reward"] == expected["reward"]
+    assert transition["is_state_terminal"] == expected["is_state_terminal"]
+
+
+def _produce(ring, n):
+    for i in range(n):
+        ring.put(_make_transition(i))
+
+
+@pytest.mark.parametrize("capacity", [1, 3, 16])
+def test_shared_memory_ring(capacity):
+    ring = SharedMemoryRing(_make_transition(0), capacity)
+    assert len(ring) == 0
+    assert ring.get_all() == []
+    t = 0
+    for n in [1, capacity, 1, capacity]:
+        for i in range(t, t + n):
+            ring.put(_make_transition(i))
+        assert len(ring) == n
+        transitions = ring.get_all()
+        assert len(ring) == 0
+        assert len(transitions) == n
+        for i, transition in enumerate(transitions, start=t):
+            _check_transition(transition, i)
+        t += n
+
+
+def test_shared_memory_ring_can_store():
+    ring = SharedMemoryRing(_make_transition(0), 4)
+    assert ring.can_store(_make_transition(1))
+    transition = _make_transition(1)
+    transition["state"] = np.zeros(3, dtype=np.float32)
+    assert not ring.can_store(transition)
+    transition = _make_transition(1)
+    transition["extra"] = 0
+    assert not ring.can_store(transition)
+    transition = _make_transition(1)
+    transition["action"] = None
+    assert not ring.can_store(transition)
+    # Values are not stored if they would be truncated
+    transition = _make_transition(1)
+    transition["action"] = 0.5
+    assert not ring.can_store(transition)
+    transition = _make_transition(1)
+    transition["state"] = np.zeros((2, 3), dtype=np.float64)
+    assert not ring.can_store(transition)
+    transition = _make_transition(1)
+    transition["action"] = np.int32(1)
+    assert ring.can_store(transition)
+
+    transition = _make_transition(1)
+    transition["recurrent_state"] = None
+    with pytest.raises(ValueError):
+        SharedMemoryRing(transition, 4)
+
+
+@pytest.mark.parametrize("capacity", [1, 7])
+def test_shared_memory_ring_between_processes(capacity):
+    n = 50
+    # The ring is received through a pipe in the same way as actors send it
+    # to the learner.
+    receiver, sender = mp.Pipe(duplex=False)
+    producer_ring = SharedMemoryRing(_make_transition(0), capacity)
+    sender.send(producer_ring)
+    ring = receiver.recv()
+    process = mp.Process(target=_produce, args=(producer_ring, n))
+    process.start()
+    transitions = []
+    while len(transitions) < n:
+        transitions.extend(ring.get_all())
+    process.join()
+    assert process.exitcode == 0
+    assert len(transitions) == n
+    for i, transition in enumerate(transitions):
+        _check_transition(transition, i)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from pfrl.envs.abc import ABC
+from pfrl.envs.vector_abc import VectorABC
+
+
+@pytest.mark.parametrize("discrete", [True, False])
+@pytest.mark.parametrize("partially_observable", [True, False])
+@pytest.mark.parametrize("episodic", [True, False])
+@pytest.mark.parametrize("size", [1, 3])
+def test_vector_abc_deterministic(discrete, partially_observable, episodic, size):
+    # Deterministic envs behave the same as ABC
+    num_envs = 5
+    kwargs = dict(
+        size=size,
+        discrete=discrete,
+        partially_observable=partially_observable,
+        episodic=episodic,
+        deterministic=True,
+    )
+    envs = [ABC(**kwargs) for _ in range(num_envs)]
+    vec_env = VectorABC(num_envs, **kwargs)
+    assert vec_env.observation_space == envs[0].observation_space
+    assert vec_env.action_space == envs[0].action_space
+
+    random_state = np.random.RandomState(0)
+    obs = vec_env.reset()
+    np.testing.assert_array_equal(obs, np.stack([env.reset() for env in envs]))
+    for _ in range(20):
+        if discrete:
+            # Biased to the correct actions so that episodes last long
+            actions = np.where(
+                random_state.rand(num_envs) < 0.8,
+                vec_env._state,
+                random_state.randint(size, size=num_envs),
+            )
+        else:
+            actions = random_state.uniform(-1, 1, size=(num_envs, size)).astype(
+                np.float32
+            )
+        obs, rewards, dones, infos = vec_env.step(actions)
+        assert obs.shape == (num_envs, size + 2)
+        assert obs.dtype == np.float32
+        assert len(infos) == num_envs
+        expected = [env.step(a) for env, a in zip(envs, actions)]
+        np.testing.assert_array_equal(obs, np.stack([e[0] for e in expected]))
+        np.testing.assert_array_equal(rewards, [e[1] for e in expected])
+        np.testing.assert_array_equal(dones, [e[2] for e in expected])
+        obs = vec_env.reset(mask=np.logical_not(dones))
+        for env, done, ob in zip(envs, dones, obs):
+            if done:
+                np.testing.assert_array_equal(ob, env.reset())
+
+
+@pytest.mark.parametrize("discrete", [True, False])
+def test_vector_abc_stochastic(discrete):
+    num_envs = 1000
+    vec_env = VectorABC(
+        num_envs, size=2, discrete=discrete, partially_observable=True, seed=0
+    )
+    obs = vec_env.reset()
+    # Both offsets are used
+    assert 0 < obs[:, 0].sum() < num_envs
+    assert (obs.sum(axis=1) == 1).all()
+    if discrete:
+        actions = np.zeros(num_envs, dtype=np.int64)
+    else:
+        # Action 0 is taken with probability e^2 / (1 + e^2)
+        actions = np.tile(np.asarray([1, -1], dtype=np.float32), (num_envs, 1))
+    _, rewards, dones, _ = vec_env.step(actions)
+    assert (rewards == 0).all()
+    if discrete:
+        assert not dones.any()
+    else:
+        np.testing.assert_allclose(dones.mean(), 1 / (1 + np.exp(2)), atol=0.05)
+
+    # Same seed, same results
+    other_env = VectorABC(
+        num_envs, size=2, discrete=discrete, partially_observable=True, seed=0
+    )
+    np.testing.assert_array_equal(other_env.reset(), obs)
+
+
+def test_vector_abc_auto_reset():
+    num_envs = 4
+    vec_env = VectorABC(num_envs, size=2, deterministic=True, auto_reset=True)
+    vec_env.reset()
+    obs, rewards, dones, infos = vec_env.step([0, 0, 1, 1])
+    np.testing.assert_array_equal(dones, [False, False, True, True])
+    assert "terminal_observation" not in infos[0]
+    # Terminal state
+    np.testing.assert_array_equal(infos[2]["terminal_observation"], [0, 0, 1, 0])
+    # Reset to the initial state
+    np.testing.assert_array_equal(obs[2], [1, 0, 0, 0])
+    obs, rewards, dones, infos = vec_env.step([1, 0, 0, 0])
+    np.testing.assert_array_equal(rewards, [1, 0, 0, 0])
+    np.testing.assert_array_equal(dones, [True, True, False, False])
+    np.testing.assert_array_equal(obs[:2], [[1, 0, 0, 0]] * 2)
@@ -1,3 +1,5 @@
+import time
+
 import gym
 import numpy as np
 import pytest
@@ -9,7 +11,13 @@ import pfrl
 @pytest.mark.parametrize("env_id", ["CartPole-v0", "Pendulum-v0"])
 @pytest.mark.parametrize("random_seed_offset", [0, 100])
 @pytest.mark.parametrize(
-    "vector_env_to_test", ["SerialVectorEnv", "MultiprocessVectorEnv"]
+    "vector_env_to_test",
+    [
+        "SerialVectorEnv",
+        "MultiprocessVectorEnv",
+        "MultiprocessVectorEnvSharedMemory",
+        "MultiprocessVectorEnvEnvsPerWorker",
+    ],
 )
 class TestSerialVectorEnv:
     @pytest.fixture(autouse=True)
@@ -27,6 +35,16 @@ class TestSerialVectorEnv:
             self.vec_env = pfrl.envs.MultiprocessVectorEnv(
                 [(lambda: gym.make(self.env_id)) for _ in range(self.num_envs)]
             )
+        elif self.vector_env_to_test == "MultiprocessVectorEnvSharedMemory":
+            self.vec_env = pfrl.envs.MultiprocessVectorEnv(
+                [(lambda: gym.make(self.env_id)) for _ in range(self.num_envs)],
+                shared_memory=True,
+            )
+        elif self.vector_env_to_test == "MultiprocessVectorEnvEnvsPerWorker":
+            self.vec_env = pfrl.envs.MultiprocessVectorEnv(
+                [(lambda: gym.make(self.env_id)) for _ in range(self.num_envs)],
+                envs_per_worker=2,
+            )
         else:
             assert False
         # Init envs to compare against
@@ -82,3 +100,185 @@ class TestSerialVectorEnv:
             if not mask[i]:
                 real_obss[i] = self.envs[i].reset()
         np.testing.assert_allclose(obss, real_obss)
+
+    def test_step_async(self):
+        seeds = [self.random_seed_offset + i for i in range(self.num_envs)]
+        self.vec_env.seed(seeds)
+        for env, seed in zip(self.envs, seeds):
+            env.seed(seed)
+        self.vec_env.reset()
+        for env in self.envs:
+            env.reset()
+
+        # step all the envs
+        actions = [env.action_space.sample() for env in self.envs]
+        real_results = [env.step(action) for env, action in zip(self.envs, actions)]
+        self.vec_env.step_async(actions)
+        env_ids, obss, rewards, dones, infos = self.vec_env.step_wait()
+        assert sorted(env_ids) == list(range(self.num_envs))
+        for i, ob, reward, done, info in zip(env_ids, obss, rewards, dones, infos):
+            np.testing.assert_allclose(ob, real_results[i][0])
+            assert (reward, done, info) == real_results[i][1:]
+
+        # step only the last env
+        last = self.num_envs - 1
+        action = self.envs[last].action_space.sample()
+        real_ob, real_reward, _, _ = self.envs[last].step(action)
+        self.vec_env.step_async([action], [last])
+        env_ids, obss, rewards, _, _ = self.vec_env.step_wait(1)
+        assert tuple(env_ids) == (last,)
+        np.testing.assert_allclose(obss[0], real_ob)
+        assert rewards[0] == real_reward
+
+        # reset the first env while the others are stepped
+        if self.num_envs > 1:
+            actions = [env.action_space.sample() for env in self.envs[1:]]
+            real_results = [
+                env.step(action) for env, action in zip(self.envs[1:], actions)
+            ]
+            self.vec_env.step_async(actions, range(1, self.num_envs))
+            mask = np.ones(self.num_envs)
+            mask[0] = 0
+            obss = self.vec_env.reset(mask)
+            np.testing.assert_allclose(obss[0], self.envs[0].reset())
+            env_ids, obss, _, _, _ = self.vec_env.step_wait()
+            assert sorted(env_ids) == list(range(1, self.num_envs))
+            for i, ob in zip(env_ids, obss):
+                np.testing.assert_allclose(ob, real_results[i - 1][0])
+
+
+@pytest.mark.parametrize(
+    "vector_env_to_test",
+    ["SerialVectorEnv", "MultiprocessVectorEnv", "MultiprocessVectorEnvSharedMemory"],
+)
+def test_vector_env_auto_reset(vector_env_to_test):
+    num_envs = 2
+    if vector_env_to_test == "SerialVectorEnv":
+        vec_env = pfrl.envs.SerialVectorEnv(
+            [gym.make("CartPole-v0") for _ in range(num_envs)], auto_reset=True
+        )
+    else:
+        vec_env = pfrl.envs.MultiprocessVectorEnv(
+            [(lambda: gym.make("CartPole-v0")) for _ in range(num_envs)],
+            shared_memory=vector_env_to_test == "MultiprocessVectorEnvSharedMemory",
+            auto_reset=True,
+        )
+    envs = [gym.make("CartPole-v0") for _ in range(num_envs)]
+    vec_env.seed(list(range(num_envs)))
+    for i, env in enumerate(envs):
+        env.seed(i)
+    vec_env.reset()
+    for env in envs:
+        env.reset()
+    n_dones = 0
+    # Pushing the cart to the left ends episodes in about 10 steps
+    for _ in range(30):
+        obss, _, dones, infos = vec_env.step([0] * num_envs)
+        for env, ob, done, info in zip(envs, obss, dones, infos):
+            real_ob, _, real_done, _ = env.step(0)
+            assert done == real_done
+            if done:
+                np.testing.assert_allclose(info["terminal_observation"], real_ob)
+                real_ob = env.reset()
+                n_dones += 1
+            else:
+                assert "terminal_observation" not in info
+            np.testing.assert_allclose(ob, real_ob)
+    assert n_dones > num_envs
+    vec_env.close()
+
+
+class SlowStepEnv(gym.Wrapper):
+    def __init__(self, env, sleep):
+        super().__init__(env)
+        self.sleep = sleep
+
+    def step(self, action):
+        time.sleep(self.sleep)
+        return self.env.step(action)
+
+
+@pytest.mark.parametrize("shared_memory", [False, True])
+def test_multiprocess_vector_env_step_wait_first_ready(shared_memory):
+    num_envs = 3
+    # The first env is much slower than the others
+    vec_env = pfrl.envs.MultiprocessVectorEnv(
+        [
+            (lambda i=i: SlowStepEnv(gym.make("CartPole-v0"), 1.0 if i == 0 else 0))
+            for i in range(num_envs)
+        ],
+        shared_memory=shared_memory,
+    )
+    vec_env.seed(0)
+    vec_env.reset()
+    vec_env.step_async([0] * num_envs)
+    env_ids, obss, _, _, _ = vec_env.step_wait(2)
+    assert sorted(env_ids) == [1, 2]
+    assert len(obss) == 2
+    # The faster envs can be stepped again while the first one is busy
+    vec_env.step_async([0, 0], env_ids)
+    env_ids, _, _, _, _ = vec_env.step_wait(2)
+    assert sorted(env_ids) == [1, 2]
+    env_ids, _, _, _, _ = vec_env.step_wait()
+    assert tuple(env_ids) == (0,)
+    # Results not received are discarded on close
+    vec_env.step_async([0] * num_envs)
+    vec_env.close()
+
+
+def test_multiprocess_vector_env_shared_memory():
+    num_envs = 3
+    vec_env = pfrl.envs.MultiprocessVectorEnv(
+        [(lambda: gym.make("CartPole-v0")) for _ in range(num_envs)],
+        shared_memory=True,
+    )
+    vec_env.seed(list(range(num_envs)))
+    obss = vec_env.reset()
+    # Observations are batched into a single array
+    assert isinstance(obss, np.ndarray)
+    assert obss.shape == (num_envs,) + vec_env.observation_space.shape
+    assert obss.dtype == vec_env.observation_space.dtype
+    first_obss = obss.copy()
+    next_obss, _, _, _ = vec_env.step([0] * num_envs)
+    assert isinstance(next_obss, np.ndarray)
+    # Returned observations are not overwritten by later steps
+    np.testing.assert_array_equal(obss, first_obss)
+    assert not np.array_equal(next_obss, first_obss)
+    vec_env.close()
+
+    with pytest.raises(ValueError):
+        pfrl.envs.MultiprocessVectorEnv(
+            [(lambda: gym.make("FrozenLake-v1")) for _ in range(num_envs)],
+            shared_memory=True,
+        )
+
+
+@pytest.mark.parametrize("shared_memory", [False, True])
+def test_multiprocess_vector_env_envs_per_worker(shared_memory):
+    num_envs = 5
+    vec_env = pfrl.envs.MultiprocessVectorEnv(
+        [(lambda: gym.make("CartPole-v0")) for _ in range(num_envs)],
+        shared_memory=shared_memory,
+        envs_per_worker=2,
+    )
+    envs = [gym.make("CartPole-v0") for _ in range(num_envs)]
+    assert vec_env.num_envs == num_envs
+    assert vec_env.num_workers == 3
+    vec_env.seed(list(range(num_envs)))
+    for i, env in enumerate(envs):
+        env.seed(i)
+    np.testing.assert_allclose(vec_env.reset(), [env.reset() for env in envs])
+    actions = [i % 2 for i in range(num_envs)]
+    obss, rewards, _, _ = vec_env.step(actions)
+    real_obss, real_rewards, _, _ = zip(
+        *[env.step(action) for env, action in zip(envs, actions)]
+    )
+    np.testing.assert_allclose(obss, real_obss)
+    assert rewards == real_rewards
+    # Only the envs not masked in the second worker are reset
+    mask = np.array([1, 1, 0, 1, 1])
+    obss = vec_env.reset(mask)
+    real_obss = list(real_obss)
+    real_obss[2] = envs[2].reset()
+    np.testing.assert_allclose(obss, real_obss)
+    vec_env.close()
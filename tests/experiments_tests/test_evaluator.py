@@ -1,9 +1,12 @@
+import multiprocessing
+import os
 import tempfile
 import unittest
 from unittest import mock
 
 import numpy as np
 import pytest
+import torch
 
 import pfrl
 from pfrl.experiments import evaluator
@@ -276,6 +279,12 @@ def test_batch_run_evaluation_episodes_with_n_steps(n_episodes, n_steps):
 
 class TestBatchRunEvaluationEpisode(unittest.TestCase):
     def test_needs_reset(self):
+        self._test_needs_reset(auto_reset=False)
+
+    def test_needs_reset_auto_reset(self):
+        self._test_needs_reset(auto_reset=True)
+
+    def _test_needs_reset(self, auto_reset):
         # MagicMock can mock eval_mode while Mock cannot
         agent = mock.MagicMock()
         agent.batch_act.side_effect = [[1, 1]] * 5
@@ -298,7 +307,13 @@ class TestBatchRunEvaluationEpisode(unittest.TestCase):
                 # First episode: 0 -> 1 (reset)
                 # Second episode: 2 -> 3 (reset)
                 # Third episode: 4 -> 5 -> 6 -> 7 (done)
-                env.reset.side_effect = [("state", 0), ("state", 2), ("state", 4)]
+                # Reset again when the env resets itself after (7)
+                env.reset.side_effect = [
+                    ("state", 0),
+                    ("state", 2),
+                    ("state", 4),
+                    ("state", 8),
+                ]
                 env.step.side_effect = [
                     (("state", 1), 2, False, {"needs_reset": True}),
                     (("state", 3), 3, False, {"needs_reset": True}),
@@ -308,7 +323,9 @@ class TestBatchRunEvaluationEpisode(unittest.TestCase):
                 ]
             return env
 
-        vec_env = pfrl.envs.SerialVectorEnv([make_env(i) for i in range(2)])
+        vec_env = pfrl.envs.SerialVectorEnv(
+            [make_env(i) for i in range(2)], auto_reset=auto_reset
+        )
 
         # First Env: [1 2 (3_a) 5 6 (7_a)]
         # Second Env: [(1) (3_b) 5 6 (7_b)]
@@ -323,3 +340,232 @@ class TestBatchRunEvaluationEpisode(unittest.TestCase):
         np.testing.assert_allclose(scores[3], 0.4)
         # batch_reset should be all True
         assert all(agent.batch_observe.call_args[0][3])
+        # The agent observes the last observations of episodes and acts on
+        # the first ones of the next episodes
+        observed = [call[0][0] for call in agent.batch_observe.call_args_list]
+        assert list(observed[0]) == [("state", 1), ("state", 1)]
+        assert list(observed[1]) == [("state", 2), ("state", 3)]
+        acted = [call[0][0] for call in agent.batch_act.call_args_list]
+        assert list(acted[1]) == [("state", 1), ("state", 2)]
+        assert list(acted[2]) == [("state", 2), ("state", 4)]
+        assert vec_env.envs[0].reset.call_count == 2
+        assert vec_env.envs[1].reset.call_count == (4 if auto_reset else 3)
+
+
+@pytest.mark.parametrize("auto_reset", [False, True])
+def test_batch_run_evaluation_episodes_hrl(auto_reset):
+    agent = mock.MagicMock(spec=pfrl.agents.HIROAgent)
+    agent.batch_sample_subgoal.side_effect = lambda obss, fgs: np.zeros((len(obss), 1))
+    agent.batch_act_low_level.side_effect = lambda obss, sgs: np.zeros(len(obss))
+    agent.batch_act_high_level.side_effect = lambda obss, fgs, sgs, steps: sgs + 1
+    agent.evaluate_final_goal.side_effect = lambda fg, obs: obs[0] >= fg[0]
+
+    def ob(x):
+        return {"observation": np.array([x]), "desired_goal": np.array([1.0])}
+
+    def make_env(idx):
+        env = mock.Mock()
+        if idx == 0:
+            # First episode: 0 -> 0.5 -> 1 (done, success)
+            env.reset.side_effect = [ob(0), ob(0)]
+            env.step.side_effect = [
+                (ob(0.5), 0, False, {}),
+                (ob(1), 1, True, {}),
+            ]
+        else:
+            # First episode: 0 -> -1 (done, failure)
+            # Second episode: 0 -> 2 (done, success)
+            env.reset.side_effect = [ob(0), ob(0), ob(0)]
+            env.step.side_effect = [
+                (ob(-1), -1, True, {}),
+                (ob(2), 1, True, {}),
+            ]
+        return env
+
+    vec_env = pfrl.envs.SerialVectorEnv(
+        [make_env(i) for i in range(2)], auto_reset=auto_reset
+    )
+    scores, success_rate = evaluator.batch_run_evaluation_episodes(
+        vec_env, agent, n_steps=None, n_episodes=3
+    )
+    assert scores == [1, -1, 1]
+    np.testing.assert_allclose(success_rate, 2 / 3)
+    steps = [call[0][3] for call in agent.batch_act_high_level.call_args_list]
+    np.testing.assert_array_equal(steps, [[0, 0], [1, 0]])
+    # A new subgoal is sampled for the new episode of the second env
+    np.testing.assert_array_equal(
+        agent.batch_act_low_level.call_args_list[1][0][1], [[1], [0]]
+    )
+    with pytest.raises(AssertionError):
+        evaluator.batch_run_evaluation_episodes(
+            vec_env, agent, n_steps=10, n_episodes=None
+        )
+
+
+class _WeightAgent(pfrl.agent.AttributeSavingMixin, pfrl.agent.Agent):
+    """Agent whose action is the weight of its model."""
+
+    saved_attributes = ("model",)
+
+    def __init__(self):
+        self.model = torch.nn.Linear(1, 1, bias=False)
+
+    @property
+    def weight(self):
+        return self.model.weight.item()
+
+    @weight.setter
+    def weight(self, value):
+        with torch.no_grad():
+            self.model.weight.fill_(value)
+
+    def act(self, obs):
+        return self.weight
+
+    def observe(self, obs, reward, done, reset):
+        pass
+
+    def get_statistics(self):
+        return [("weight", self.weight)]
+
+
+class _OneStepEnv(object):
+    """Env that gives the action as the reward and ends in one step."""
+
+    def reset(self):
+        return 0
+
+    def step(self, action):
+        return 0, action, True, {}
+
+    def close(self):
+        pass
+
+
+def _make_env_with_subprocess(process_idx):
+    # Envs such as MultiprocessVectorEnv start processes of their own
+    p = multiprocessing.Process(target=int)
+    p.start()
+    p.join()
+    return _OneStepEnv()
+
+
+class _FailingEnv(_OneStepEnv):
+    def step(self, action):
+        raise ValueError("env error")
+
+
+class TestBackgroundEvaluator(unittest.TestCase):
+    def test_evaluate_if_necessary(self):
+        outdir = tempfile.mkdtemp()
+        agent = _WeightAgent()
+        agent.weight = 1
+        make_env = mock.Mock(side_effect=lambda process_idx: _OneStepEnv())
+        agent_evaluator = evaluator.BackgroundEvaluator(
+            agent=agent,
+            make_env=make_env,
+            n_steps=None,
+            n_episodes=2,
+            eval_interval=3,
+            outdir=outdir,
+            n_workers=1,
+        )
+        agent_evaluator.evaluate_if_necessary(t=1, episodes=1)
+        agent_evaluator.evaluate_if_necessary(t=3, episodes=1)
+        # The snapshot at t=3 is evaluated
+        agent.weight = 2
+        agent_evaluator.receive_results(block=True)
+        self.assertEqual(agent_evaluator.max_score, 1)
+        agent_evaluator.evaluate_if_necessary(t=6, episodes=2)
+        agent.weight = 0
+        agent_evaluator.close()
+        self.assertEqual(agent_evaluator.max_score, 2)
+        for p in agent_evaluator.processes:
+            self.assertFalse(p.is_alive())
+
+        with open(os.path.join(outdir, "scores.txt")) as f:
+            lines = [line.split("\t") for line in f.read().splitlines()]
+        self.assertEqual(lines[0][:4], ["steps", "episodes", "elapsed", "mean"])
+        self.assertEqual(lines[0][-1], "weight")
+        self.assertEqual(len(lines), 3)
+        self.assertEqual([line[0] for line in lines[1:]], ["3", "6"])
+        self.assertEqual([float(line[3]) for line in lines[1:]], [1, 2])
+        # Agent statistics at the time of snapshots are recorded
+        self.assertEqual([float(line[-1]) for line in lines[1:]], [1, 2])
+
+        # The evaluated snapshot is saved instead of the current agent
+        best_agent = _WeightAgent()
+        best_agent.load(os.path.join(outdir, "best"))
+        self.assertEqual(best_agent.weight, 2)
+
+    def test_skip_while_busy(self):
+        outdir = tempfile.mkdtemp()
+        agent = _WeightAgent()
+        agent_evaluator = evaluator.BackgroundEvaluator(
+            agent=agent,
+            make_env=lambda process_idx: _OneStepEnv(),
+            n_steps=None,
+            n_episodes=1,
+            eval_interval=1,
+            outdir=outdir,
+            save_best_so_far_agent=False,
+            n_workers=1,
+        )
+        self.assertTrue(agent_evaluator.evaluate_and_update_max_score(1, 1))
+        self.assertFalse(agent_evaluator.evaluate_and_update_max_score(2, 1))
+        agent_evaluator.close()
+        with open(os.path.join(outdir, "scores.txt")) as f:
+            self.assertEqual(len(f.read().splitlines()), 2)
+        self.assertFalse(os.path.exists(os.path.join(outdir, "best")))
+
+    def test_env_with_subprocesses(self):
+        agent = _WeightAgent()
+        agent.weight = 1
+        agent_evaluator = evaluator.BackgroundEvaluator(
+            agent=agent,
+            make_env=_make_env_with_subprocess,
+            n_steps=None,
+            n_episodes=1,
+            eval_interval=1,
+            outdir=tempfile.mkdtemp(),
+            n_workers=1,
+        )
+        agent_evaluator.evaluate_and_update_max_score(1, 1)
+        self.assertEqual(agent_evaluator.receive_results(block=True), 1)
+        agent_evaluator.close()
+
+    def test_worker_error(self):
+        agent_evaluator = evaluator.BackgroundEvaluator(
+            agent=_WeightAgent(),
+            make_env=lambda process_idx: _FailingEnv(),
+            n_steps=None,
+            n_episodes=1,
+            eval_interval=1,
+            outdir=tempfile.mkdtemp(),
+            n_workers=1,
+        )
+        agent_evaluator.evaluate_and_update_max_score(1, 1)
+        for p in agent_evaluator.processes:
+            p.join()
+        # Errors are raised without blocking
+        with self.assertRaisesRegex(RuntimeError, "env error"):
+            agent_evaluator.receive_results()
+        agent_evaluator.close(wait=False)
+
+    def test_worker_exit(self):
+        agent_evaluator = evaluator.BackgroundEvaluator(
+            agent=_WeightAgent(),
+            make_env=lambda process_idx: _OneStepEnv(),
+            n_steps=None,
+            n_episodes=1,
+            eval_interval=1,
+            outdir=tempfile.mkdtemp(),
+            n_workers=1,
+        )
+        for p in agent_evaluator.processes:
+            p.terminate()
+            p.join()
+        agent_evaluator.evaluate_and_update_max_score(1, 1)
+        with self.assertRaisesRegex(RuntimeError, "exited unexpectedly"):
+            agent_evaluator.receive_results()
+        agent_evaluator.close(wait=False)
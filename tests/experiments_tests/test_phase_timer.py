@@ -0,0 +1,136 @@
+import os
+import pstats
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pfrl
+from pfrl.experiments.phase_timer import NullPhaseTimer
+from pfrl.experiments.phase_timer import PhaseTimer
+
+
+class TestPhaseTimer(unittest.TestCase):
+    def test_phase(self):
+        timer = PhaseTimer(phases=["a", "b"])
+        with timer.phase("a"):
+            time.sleep(0.01)
+        with timer.phase("a"):
+            time.sleep(0.01)
+        stats = dict(timer.get_statistics())
+        self.assertEqual(list(stats), ["a_time", "b_time"])
+        self.assertGreaterEqual(stats["a_time"], 0.02)
+        self.assertEqual(stats["b_time"], 0)
+
+    def test_summary(self):
+        timer = PhaseTimer(phases=["a", "b"])
+        for _ in range(3):
+            with timer.phase("a"):
+                # Nested entries are not counted again
+                with timer.phase("a"):
+                    time.sleep(0.01)
+        summary = timer.summary()
+        self.assertEqual(list(summary), ["a", "b"])
+        self.assertEqual(summary["a"]["count"], 3)
+        self.assertGreaterEqual(summary["a"]["total"], 0.03)
+        self.assertEqual(summary["a"]["total"], dict(timer.get_statistics())["a_time"])
+        self.assertEqual(summary["b"], dict(total=0, count=0))
+
+    def test_report(self):
+        sink = mock.Mock()
+        timer = PhaseTimer(phases=["a"], report_interval=2, sinks=[sink])
+        for t in range(1, 6):
+            with timer.phase("a"):
+                pass
+            timer.step(t)
+        # Reported at t=3 and t=5 since the interval starts at t=1
+        self.assertEqual(sink.call_count, 2)
+        t, stats = sink.call_args_list[0][0]
+        self.assertEqual(t, 3)
+        self.assertEqual([name for name, _ in stats], ["a_time", "wall_time"])
+        for _, value in stats:
+            self.assertGreaterEqual(value, 0)
+        self.assertEqual(sink.call_args_list[1][0][0], 5)
+
+    def test_log_stats(self):
+        logger = mock.Mock()
+        timer = PhaseTimer(phases=["a"], report_interval=1, logger=logger)
+        timer.step(0)
+        timer.step(1)
+        self.assertEqual(logger.info.call_count, 1)
+
+    def test_cprofile(self):
+        outdir = tempfile.mkdtemp()
+        timer = PhaseTimer(profile_steps=(2, 4), outdir=outdir)
+        filename = os.path.join(outdir, "profile_2-4.prof")
+        for t in range(1, 4):
+            timer.step(t)
+            self.assertFalse(os.path.exists(filename))
+        timer.step(4)
+        self.assertTrue(os.path.exists(filename))
+        pstats.Stats(filename)
+        # Profiling is done only once
+        timer.step(2)
+        timer.close()
+        self.assertIsNone(timer._profile)
+
+    def test_close_stops_profile(self):
+        outdir = tempfile.mkdtemp()
+        timer = PhaseTimer(profile_steps=(0, 100), outdir=outdir)
+        timer.step(0)
+        timer.close()
+        self.assertTrue(os.path.exists(os.path.join(outdir, "profile_0-100.prof")))
+
+    def test_null_phase_timer(self):
+        timer = NullPhaseTimer()
+        with timer.phase("act"):
+            pass
+        timer.step(1)
+        timer.close()
+        self.assertEqual(timer.get_statistics(), [])
+        self.assertEqual(timer.summary(), {})
+
+
+class TestTrainAgentWithPhaseTimer(unittest.TestCase):
+    def test(self):
+        outdir = tempfile.mkdtemp()
+
+        agent = mock.MagicMock()
+        agent.get_statistics.return_value = []
+        env = mock.Mock()
+        env.reset.return_value = ("state", 0)
+        env.step.return_value = (("state", 1), 0, True, {})
+        timer = PhaseTimer()
+        evaluator = pfrl.experiments.evaluator.Evaluator(
+            agent=agent,
+            env=env,
+            n_steps=None,
+            n_episodes=1,
+            eval_interval=2,
+            outdir=outdir,
+            max_episode_len=None,
+            step_offset=0,
+            save_best_so_far_agent=False,
+            phase_timer=timer,
+        )
+
+        pfrl.experiments.train_agent(
+            agent=agent,
+            env=env,
+            steps=4,
+            outdir=outdir,
+            evaluator=evaluator,
+            phase_timer=timer,
+        )
+
+        with open(os.path.join(outdir, "scores.txt")) as f:
+            lines = f.read().splitlines()
+        header = lines[0].split("\t")
+        for name in timer.phases:
+            self.assertIn(name + "_time", header)
+        self.assertEqual(len(lines), 3)
+        for line in lines[1:]:
+            self.assertEqual(len(line.split("\t")), len(header))
+        stats = dict(timer.get_statistics())
+        self.assertGreater(stats["act_time"], 0)
+        self.assertGreater(stats["evaluation_time"], 0)
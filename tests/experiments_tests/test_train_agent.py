@@ -1,3 +1,4 @@
+import os
 import tempfile
 import unittest
 from unittest import mock
@@ -84,3 +85,114 @@ class TestTrainAgent(unittest.TestCase):
             self.assertEqual(args[1], agent)
             # step starts with 1
             self.assertEqual(args[2], i + 1)
+
+    def test_checkpoint_replay_buffer(self):
+
+        outdir = tempfile.mkdtemp()
+
+        agent = mock.Mock()
+        env = mock.Mock()
+        env.reset.side_effect = [("state", 0)]
+        env.step.side_effect = [(("state", i), 0, i == 5, {}) for i in range(1, 6)]
+
+        pfrl.experiments.train_agent(
+            agent=agent,
+            env=env,
+            steps=5,
+            outdir=outdir,
+            checkpoint_freq=2,
+            checkpoint_replay_buffer=True,
+        )
+
+        # Checkpoints at steps 2 and 4 save the agent and its replay buffer
+        self.assertEqual(agent.save.call_count, 3)
+        self.assertEqual(agent.replay_buffer.save_incremental.call_count, 2)
+        for call in agent.replay_buffer.save_incremental.call_args_list:
+            args, kwargs = call
+            self.assertEqual(args[0], os.path.join(outdir, "replay_buffer_checkpoint"))
+
+    def test_checkpoint_replay_buffer_stops_prefetch(self):
+
+        outdir = tempfile.mkdtemp()
+
+        agent = mock.Mock()
+        env = mock.Mock()
+        env.reset.side_effect = [("state", 0)]
+        env.step.side_effect = [(("state", i), 0, i == 5, {}) for i in range(1, 6)]
+
+        pfrl.experiments.train_agent(
+            agent=agent,
+            env=env,
+            steps=5,
+            outdir=outdir,
+            checkpoint_freq=2,
+            checkpoint_replay_buffer=True,
+        )
+
+        # Prefetching is stopped before the replay buffer is saved and when
+        # training ends
+        calls = [
+            name
+            for name, _, _ in agent.mock_calls
+            if name
+            in ("replay_updater.stop_prefetch", "replay_buffer.save_incremental")
+        ]
+        self.assertEqual(
+            calls,
+            [
+                "replay_updater.stop_prefetch",
+                "replay_buffer.save_incremental",
+                "replay_updater.stop_prefetch",
+                "replay_buffer.save_incremental",
+                "replay_updater.stop_prefetch",
+            ],
+        )
+
+    def test_prefetch_thread_stopped(self):
+
+        outdir = tempfile.mkdtemp()
+
+        rbuf = pfrl.replay_buffers.PrioritizedReplayBuffer(10)
+        for i in range(10):
+            rbuf.append(state=i, action=0, reward=0, next_state=i + 1)
+        agent = mock.Mock()
+        agent.replay_updater = pfrl.replay_buffer.ReplayUpdater(
+            replay_buffer=rbuf,
+            update_func=mock.Mock(),
+            batchsize=2,
+            episodic_update=False,
+            n_times_update=1,
+            replay_start_size=2,
+            update_interval=1,
+            prefetch_size=2,
+        )
+        agent.replay_updater.start_prefetch()
+        env = mock.Mock()
+        env.reset.side_effect = [("state", 0)]
+        env.step.side_effect = [(("state", 1), 0, True, {})]
+
+        pfrl.experiments.train_agent(agent=agent, env=env, steps=1, outdir=outdir)
+
+        self.assertIsNone(agent.replay_updater._prefetch_thread)
+        # Prefetched samples are attached to the buffer again
+        self.assertEqual(agent.replay_updater._n_detached, 0)
+
+    def test_checkpoint_replay_buffer_unsupported(self):
+
+        outdir = tempfile.mkdtemp()
+
+        agent = mock.Mock()
+        agent.replay_buffer = pfrl.replay_buffers.PrioritizedReplayBuffer(10)
+        env = mock.Mock()
+
+        # Training fails before the first checkpoint
+        with self.assertRaises(NotImplementedError):
+            pfrl.experiments.train_agent(
+                agent=agent,
+                env=env,
+                steps=5,
+                outdir=outdir,
+                checkpoint_freq=2,
+                checkpoint_replay_buffer=True,
+            )
+        env.step.assert_not_called()
@@ -3,6 +3,7 @@ import tempfile
 import unittest
 from unittest import mock
 
+import numpy as np
 import pytest
 
 import pfrl
@@ -141,3 +142,141 @@ class TestTrainAgentBatchNeedsReset(unittest.TestCase):
         self.assertEqual(vec_env.envs[0].step.call_count, 5)
         self.assertEqual(vec_env.envs[1].reset.call_count, 3)
         self.assertEqual(vec_env.envs[1].step.call_count, 5)
+
+
+def test_train_agent_batch_async():
+    steps = 10
+    outdir = tempfile.mkdtemp()
+
+    agent = mock.Mock()
+    agent.batch_act.side_effect = lambda obss, env_ids: [1] * len(obss)
+
+    def make_env():
+        env = mock.Mock()
+        env.reset.side_effect = [("state", 0)] * 1000
+        # Episodic env that terminates after 5 actions
+        env.step.side_effect = [
+            (("state", 1), 0, False, {}),
+            (("state", 2), 0, False, {}),
+            (("state", 3), -0.5, False, {}),
+            (("state", 4), 0, False, {}),
+            (("state", 5), 1, True, {}),
+        ] * 1000
+        return env
+
+    # SerialVectorEnv returns results in the order envs are stepped, so envs
+    # alternate when only one of them is returned at a time
+    vec_env = pfrl.envs.SerialVectorEnv([make_env() for _ in range(2)])
+
+    hook = mock.Mock()
+
+    pfrl.experiments.train_agent_batch(
+        agent=agent,
+        env=vec_env,
+        steps=steps,
+        outdir=outdir,
+        step_hooks=[hook],
+        async_batch_size=1,
+    )
+
+    assert agent.batch_act.call_count == steps
+    assert agent.batch_observe.call_count == steps
+    assert hook.call_count == steps
+    for i, call in enumerate(agent.batch_observe.call_args_list):
+        _, kwargs = call
+        np.testing.assert_array_equal(kwargs["env_ids"], [i % 2])
+    # Both the envs are stepped at first, then the one returned is stepped
+    # again. The last step of the first env is received after training.
+    assert vec_env.envs[0].step.call_count == 6
+    assert vec_env.envs[1].step.call_count == 5
+    assert not vec_env.ready
+    # The first env is reset after its episode ends at step 9, while the
+    # second one is not because its episode ends at the last step
+    assert vec_env.envs[0].reset.call_count == 2
+    assert vec_env.envs[1].reset.call_count == 1
+
+
+def test_train_agent_batch_async_requires_eval_env():
+    outdir = tempfile.mkdtemp()
+    vec_env = pfrl.envs.SerialVectorEnv([mock.Mock() for _ in range(2)])
+    evaluator = mock.Mock()
+    evaluator.env = vec_env
+    with pytest.raises(ValueError):
+        pfrl.experiments.train_agent_batch(
+            agent=mock.Mock(),
+            env=vec_env,
+            steps=10,
+            outdir=outdir,
+            evaluator=evaluator,
+            async_batch_size=1,
+        )
+
+
+def test_train_agent_batch_checkpoint_replay_buffer_unsupported():
+    outdir = tempfile.mkdtemp()
+    envs = [mock.Mock() for _ in range(2)]
+    agent = mock.Mock()
+    agent.replay_buffer = pfrl.replay_buffers.FrameStackReplayBuffer(10)
+    with pytest.raises(NotImplementedError):
+        pfrl.experiments.train_agent_batch(
+            agent=agent,
+            env=pfrl.envs.SerialVectorEnv(envs),
+            steps=10,
+            outdir=outdir,
+            checkpoint_freq=2,
+            checkpoint_replay_buffer=True,
+        )
+    for env in envs:
+        env.step.assert_not_called()
+
+
+@pytest.mark.parametrize("max_episode_len", [None, 3])
+def test_train_agent_batch_auto_reset(max_episode_len):
+    steps = 12
+    outdir = tempfile.mkdtemp()
+
+    agent = mock.Mock()
+    agent.batch_act.side_effect = [[1, 1]] * 1000
+
+    def make_env():
+        env = mock.Mock()
+        env.reset.side_effect = [("state", 0)] * 1000
+        # Episodic env that terminates after 5 actions
+        env.step.side_effect = [
+            (("state", 1), 0, False, {}),
+            (("state", 2), 0, False, {}),
+            (("state", 3), -0.5, False, {}),
+            (("state", 4), 0, False, {}),
+            (("state", 5), 1, True, {}),
+        ] * 1000
+        return env
+
+    vec_env = pfrl.envs.SerialVectorEnv([make_env() for _ in range(2)], auto_reset=True)
+    with mock.patch.object(vec_env, "reset", wraps=vec_env.reset) as reset:
+        pfrl.experiments.train_agent_batch(
+            agent=agent,
+            env=vec_env,
+            steps=steps,
+            outdir=outdir,
+            max_episode_len=max_episode_len,
+        )
+
+    assert agent.batch_act.call_count == 6
+    observed = [call[0][0] for call in agent.batch_observe.call_args_list]
+    acted = [call[0][0] for call in agent.batch_act.call_args_list]
+    if max_episode_len is None:
+        # Envs reset themselves after the 5th step
+        assert list(observed[4]) == [("state", 5)] * 2
+        assert list(acted[5]) == [("state", 0)] * 2
+        assert reset.call_count == 1
+        for env in vec_env.envs:
+            assert env.reset.call_count == 2
+    else:
+        # Episodes cut by max_episode_len are reset by the training loop
+        assert list(observed[2]) == [("state", 3)] * 2
+        assert list(acted[3]) == [("state", 0)] * 2
+        assert reset.call_count == 2
+        # The first reset, the one after the 3rd step and the one by the
+        # env itself after the 5th step
+        for env in vec_env.envs:
+            assert env.reset.call_count == 3
@@ -0,0 +1,85 @@
+import tempfile
+from unittest import mock
+
+import numpy as np
+import pytest
+
+import pfrl
+
+
+def _ob(x):
+    return {"observation": np.array([x, 0, 0]), "desired_goal": np.array([9.0])}
+
+
+@pytest.mark.parametrize("auto_reset", [False, True])
+@pytest.mark.parametrize("max_episode_len", [None, 2])
+def test_train_hrl_agent_batch(auto_reset, max_episode_len):
+    outdir = tempfile.mkdtemp()
+    num_envs = 2
+    steps = 6
+
+    agent = mock.Mock()
+    agent.batch_sample_subgoal.side_effect = lambda obss, fgs: np.zeros((len(obss), 3))
+    agent.batch_act_low_level.side_effect = lambda obss, sgs: np.zeros((len(obss), 1))
+    agent.batch_act_high_level.side_effect = lambda obss, fgs, sgs, *args: sgs + 1
+
+    def make_env():
+        env = mock.Mock()
+        env.reset.side_effect = [_ob(0)] * 10
+        # Episodic env that terminates after 3 actions
+        env.step.side_effect = [
+            (_ob(1), 0, False, {}),
+            (_ob(2), 0, False, {}),
+            (_ob(3), 1, True, {}),
+        ] * 10
+        return env
+
+    vec_env = pfrl.envs.SerialVectorEnv(
+        [make_env() for _ in range(num_envs)], auto_reset=auto_reset
+    )
+    hook = mock.Mock()
+
+    pfrl.experiments.train_hrl_agent_batch(
+        agent=agent,
+        env=vec_env,
+        steps=steps,
+        outdir=outdir,
+        max_episode_len=max_episode_len,
+        step_hooks=[hook],
+    )
+
+    assert agent.batch_act_low_level.call_count == 3
+    assert agent.batch_act_high_level.call_count == 3
+    assert agent.batch_observe.call_count == 3
+    assert hook.call_count == steps
+    assert [call[0][2] for call in hook.call_args_list] == list(range(1, steps + 1))
+
+    # Steps of episodes and global steps
+    batch_steps = [call[0][6] for call in agent.batch_observe.call_args_list]
+    global_steps = [call[0][7] for call in agent.batch_observe.call_args_list]
+    assert global_steps == [0, 2, 4]
+    dones = [call[0][4] for call in agent.batch_observe.call_args_list]
+    resets = [call[0][5] for call in agent.batch_observe.call_args_list]
+    if max_episode_len is None:
+        np.testing.assert_array_equal(batch_steps, [[0, 0], [1, 1], [2, 2]])
+        np.testing.assert_array_equal(resets, np.zeros((3, 2), dtype=bool))
+        # Subgoals are sampled only in the beginning
+        assert agent.batch_sample_subgoal.call_count == 1
+    else:
+        np.testing.assert_array_equal(batch_steps, [[0, 0], [1, 1], [0, 0]])
+        np.testing.assert_array_equal(resets, [[0, 0], [1, 1], [0, 0]])
+        # Subgoals are sampled for new episodes
+        assert agent.batch_sample_subgoal.call_count == 2
+    np.testing.assert_array_equal(dones[2], [True, True])
+    # The last observations of episodes are observed
+    observed = agent.batch_observe.call_args_list[2][0][0]
+    np.testing.assert_array_equal(observed[:, 0], [3, 3])
+
+    for env in vec_env.envs:
+        # Envs that reset themselves do so after the last iteration too
+        if max_episode_len is None:
+            # Only in the beginning
+            assert env.reset.call_count == 1 + auto_reset
+        else:
+            # In the beginning and after 2 iterations
+            assert env.reset.call_count == 2 + auto_reset
@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+import pytest
+import torch.multiprocessing as mp
+
+import pfrl
+from pfrl.experiments.train_hrl_agent_async import train_hrl_loop
+
+
+def _ob(x):
+    return {"observation": np.array([x, 0, 0]), "desired_goal": np.array([9.0])}
+
+
+def _make_agent():
+    agent = mock.Mock()
+    agent.sample_subgoal.side_effect = lambda obs, fg: np.zeros(3)
+    agent.act_low_level.side_effect = lambda obs, sg: np.zeros(1)
+    agent.act_high_level.side_effect = lambda obs, fg, sg, *args: sg + 1
+    agent.get_statistics.return_value = []
+    return agent
+
+
+def _make_env():
+    env = mock.Mock()
+    env.subgoal_space.sample.return_value = np.zeros(3)
+    env.reset.side_effect = [_ob(0)] * 100
+    # Episodic env that terminates after 3 actions
+    env.step.side_effect = [
+        (_ob(1), 0, False, {}),
+        (_ob(2), 0, False, {}),
+        (_ob(3), 1, True, {}),
+    ] * 100
+    return env
+
+
+@pytest.mark.parametrize("max_episode_len", [None, 2])
+def test_train_hrl_loop(max_episode_len):
+    outdir = tempfile.mkdtemp()
+    steps = 6
+    agent = _make_agent()
+    env = _make_env()
+    hook = mock.Mock()
+
+    train_hrl_loop(
+        process_idx=0,
+        env=env,
+        agent=agent,
+        steps=steps,
+        outdir=outdir,
+        counter=mp.Value("l", 0),
+        episodes_counter=mp.Value("l", 0),
+        stop_event=mp.Event(),
+        exception_event=mp.Event(),
+        max_episode_len=max_episode_len,
+        global_step_hooks=[hook],
+    )
+
+    assert agent.act_low_level.call_count == steps
+    assert agent.act_high_level.call_count == steps
+    assert agent.observe.call_count == steps
+    assert [call[0][2] for call in hook.call_args_list] == list(range(1, steps + 1))
+
+    # Steps of episodes and global steps passed to observe
+    episode_steps = [call[0][6] for call in agent.observe.call_args_list]
+    global_steps = [call[0][7] for call in agent.observe.call_args_list]
+    assert global_steps == list(range(steps))
+    resets = [call[0][5] for call in agent.observe.call_args_list]
+    if max_episode_len is None:
+        assert episode_steps == [0, 1, 2, 0, 1, 2]
+        assert resets == [False] * steps
+    else:
+        # Episodes are reset after 2 steps or end after the third action
+        assert episode_steps == [0, 1, 0, 0, 1, 0]
+        assert resets == [False, True, False] * 2
+    # Subgoals of new episodes are sampled by the agent and used
+    assert agent.sample_subgoal.call_count == agent.end_episode.call_count
+    first_sg = agent.act_low_level.call_args_list[0][0][1]
+    np.testing.assert_array_equal(first_sg, np.zeros(3))
+    np.testing.assert_array_equal(agent.act_low_level.call_args_list[1][0][1], 1)
+
+    agent.save.assert_called_once_with(os.path.join(outdir, "{}_finish".format(steps)))
+
+
+def test_train_hrl_agent_async():
+    outdir = tempfile.mkdtemp()
+    steps = 10
+    agent = _make_agent()
+    envs = [_make_env() for _ in range(2)]
+
+    # Mock states cannot be shared among processes, so threading is used
+    # instead of multiprocessing as in test_train_agent_async.
+    with mock.patch(
+        "torch.multiprocessing.Process", threading.Thread
+    ), mock.patch.object(threading.Thread, "exitcode", create=True, new=0):
+        pfrl.experiments.train_hrl_agent_async(
+            processes=2,
+            make_agent=lambda process_idx: agent,
+            make_env=lambda process_idx, test: envs[process_idx],
+            steps=steps,
+            outdir=outdir,
+            eval_interval=None,
+            random_seeds=np.arange(2),
+        )
+
+    assert agent.observe.call_count >= steps
+    for env in envs:
+        assert env.close.call_count == 1
@@ -0,0 +1,108 @@
+import collections
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from pfrl import replay_buffers
+from pfrl.wrappers.atari_wrappers import LazyFrames
+
+
+def _run_episodes(rbufs, n_envs, n_steps, stack_size, stack_axis, seed):
+    """Append frame-stacked transitions of envs that reset at random."""
+    random_state = np.random.RandomState(seed)
+    frame_shape = [5, 6]
+    frame_shape.insert(stack_axis, 1)
+    stacks = [None] * n_envs
+
+    def new_frame():
+        return random_state.randint(0, 256, size=frame_shape).astype(np.uint8)
+
+    for t in range(n_steps):
+        env_id = t % n_envs
+        if stacks[env_id] is None:
+            frame = new_frame()
+            stacks[env_id] = collections.deque([frame] * stack_size, stack_size)
+        state = LazyFrames(list(stacks[env_id]), stack_axis=stack_axis)
+        stacks[env_id].append(new_frame())
+        # Observations are sometimes given as materialized arrays
+        next_state = LazyFrames(list(stacks[env_id]), stack_axis=stack_axis)
+        if random_state.rand() < 0.5:
+            next_state = np.asarray(next_state)
+        is_state_terminal = random_state.rand() < 0.05
+        reset = random_state.rand() < 0.05
+        for rbuf in rbufs:
+            rbuf.append(
+                state=state,
+                action=t,
+                reward=float(t),
+                next_state=next_state,
+                is_state_terminal=is_state_terminal,
+                env_id=env_id,
+            )
+            if not is_state_terminal and reset:
+                rbuf.stop_current_episode(env_id=env_id)
+        if is_state_terminal or reset:
+            stacks[env_id] = None
+
+
+def _check_same_experiences(experiences, expected_experiences):
+    assert len(experiences) == len(expected_experiences)
+    for experience, expected in zip(experiences, expected_experiences):
+        assert len(experience) == len(expected)
+        for transition, expected_transition in zip(experience, expected):
+            assert transition.keys() == expected_transition.keys()
+            for key in ["state", "next_state"]:
+                expected_value = np.asarray(expected_transition[key])
+                assert transition[key].dtype == expected_value.dtype
+                np.testing.assert_array_equal(transition[key], expected_value)
+            for key in ["action", "reward", "is_state_terminal", "next_action"]:
+                assert transition[key] == expected_transition[key]
+
+
+@pytest.mark.parametrize("capacity", [30, None])
+@pytest.mark.parametrize("num_steps", [1, 3])
+@pytest.mark.parametrize("n_envs", [1, 3])
+@pytest.mark.parametrize("stack_axis", [0, 2])
+def test_frame_stack_replay_buffer(capacity, num_steps, n_envs, stack_axis):
+    stack_size = 4
+    rbuf = replay_buffers.FrameStackReplayBuffer(
+        capacity, num_steps=num_steps, stack_size=stack_size, stack_axis=stack_axis
+    )
+    expected_rbuf = replay_buffers.ReplayBuffer(capacity, num_steps=num_steps)
+    _run_episodes([rbuf, expected_rbuf], n_envs, 200, stack_size, stack_axis, 0)
+
+    assert len(rbuf) == len(expected_rbuf)
+    np.random.seed(0)
+    experiences = rbuf.sample(len(rbuf))
+    np.random.seed(0)
+    expected_experiences = expected_rbuf.sample(len(expected_rbuf))
+    _check_same_experiences(experiences, expected_experiences)
+
+    # Each step adds only one new frame, and frames of removed transitions
+    # are released
+    n_transitions = 200 if capacity is None else capacity + num_steps
+    assert len(rbuf.frames) <= n_transitions * 1.2 + n_envs * stack_size * 2
+
+    # Save and load
+    tempdir = tempfile.mkdtemp()
+    filename = os.path.join(tempdir, "rbuf.pkl")
+    rbuf.save(filename)
+    loaded_rbuf = replay_buffers.FrameStackReplayBuffer(
+        capacity, num_steps=num_steps, stack_size=stack_size, stack_axis=stack_axis
+    )
+    loaded_rbuf.load(filename)
+    assert len(loaded_rbuf) == len(rbuf)
+    np.random.seed(0)
+    _check_same_experiences(loaded_rbuf.sample(len(rbuf)), experiences)
+
+    # Appending after loading keeps stored frames intact
+    expected_rbuf = replay_buffers.ReplayBuffer(capacity, num_steps=num_steps)
+    _run_episodes([loaded_rbuf, expected_rbuf], n_envs, 100, stack_size, stack_axis, 1)
+    if capacity is not None:
+        assert len(loaded_rbuf) == len(expected_rbuf)
+        np.random.seed(1)
+        experiences = loaded_rbuf.sample(len(loaded_rbuf))
+        np.random.seed(1)
+        _check_same_experiences(experiences, expected_rbuf.sample(len(expected_rbuf)))
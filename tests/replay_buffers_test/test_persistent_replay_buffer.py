@@ -1,9 +1,11 @@
 import os
 import tempfile
 
+import numpy as np
 import pytest
 
 from pfrl.replay_buffers import PersistentEpisodicReplayBuffer
+from pfrl.replay_buffers import PersistentReplayBuffer
 
 
 @pytest.mark.parametrize("capacity", [None, 100])
@@ -51,7 +53,8 @@ class TestEpisodicReplayBuffer(object):
                     assert t0["next_state"] == t1["state"]
                     assert t0["next_action"] == t1["action"]
 
-    def test_save_and_load(self, capacity):
+    @pytest.mark.parametrize("lazy_load", [False, True])
+    def test_save_and_load(self, capacity, lazy_load):
         tempdir = tempfile.mkdtemp()
 
         rbuf = PersistentEpisodicReplayBuffer(self.tempdir.name, capacity)
@@ -88,7 +91,9 @@ class TestEpisodicReplayBuffer(object):
         del rbuf
 
         # Re-initialize rbuf
-        rbuf = PersistentEpisodicReplayBuffer(self.tempdir.name, capacity)
+        rbuf = PersistentEpisodicReplayBuffer(
+            self.tempdir.name, capacity, lazy_load=lazy_load
+        )
 
         # Sampled transitions are exactly what I added!
         s5 = rbuf.sample(5)
@@ -172,3 +177,28 @@ class TestEpisodicReplayBufferWithEnvID(object):
 
         # Finally it should have 4 + 2 + 9 = 15 transitions
         assert len(rbuf) == 15
+
+
+@pytest.mark.parametrize("lazy_load", [False, True])
+def test_persistent_replay_buffer_codecs(lazy_load):
+    codecs = {"state": "zlib", "next_state": "zlib"}
+    with tempfile.TemporaryDirectory() as dirname:
+        rbuf = PersistentReplayBuffer(dirname, 100, codecs=codecs)
+        for i in range(20):
+            rbuf.append(
+                state=np.full((4, 8, 8), i, dtype=np.uint8),
+                action=i,
+                reward=float(i),
+                next_state=np.full((4, 8, 8), i + 1, dtype=np.uint8),
+                is_state_terminal=False,
+            )
+        rbuf.memory.close()
+
+        # Compressed transitions are restored from storage
+        rbuf = PersistentReplayBuffer(dirname, 100, codecs=codecs, lazy_load=lazy_load)
+        assert len(rbuf) == 20
+        for (transition,) in rbuf.sample(20):
+            i = transition["action"]
+            assert transition["state"].shape == (4, 8, 8)
+            assert (transition["state"] == i).all()
+            assert (transition["next_state"] == i + 1).all()
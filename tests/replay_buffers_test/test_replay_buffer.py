@@ -9,21 +9,24 @@ import pytest
 
 from pfrl import replay_buffers
 from pfrl import replay_buffer
+from pfrl.collections import chunk_stream
 import torch
 
 
 @pytest.mark.parametrize("capacity", [100, None])
 @pytest.mark.parametrize("num_steps", [1, 3])
+@pytest.mark.parametrize("columnar", [False, True])
 class TestReplayBuffer:
     @pytest.fixture(autouse=True)
-    def setUp(self, capacity, num_steps):
+    def setUp(self, capacity, num_steps, columnar):
         self.capacity = capacity
         self.num_steps = num_steps
+        self.columnar = columnar
 
     def test_append_and_sample(self):
         capacity = self.capacity
         num_steps = self.num_steps
-        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps)
+        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps, columnar=self.columnar)
 
         assert len(rbuf) == 0
 
@@ -70,7 +73,7 @@ class TestReplayBuffer:
     def test_append_and_terminate(self):
         capacity = self.capacity
         num_steps = self.num_steps
-        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps)
+        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps, columnar=self.columnar)
 
         assert len(rbuf) == 0
 
@@ -122,7 +125,7 @@ class TestReplayBuffer:
     def test_stop_current_episode(self):
         capacity = self.capacity
         num_steps = self.num_steps
-        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps)
+        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps, columnar=self.columnar)
 
         assert len(rbuf) == 0
 
@@ -150,7 +153,7 @@ class TestReplayBuffer:
 
         tempdir = tempfile.mkdtemp()
 
-        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps)
+        rbuf = replay_buffers.ReplayBuffer(capacity, num_steps, columnar=self.columnar)
 
         correct_item = collections.deque([], maxlen=num_steps)
         # Add two transitions
@@ -185,7 +188,7 @@ class TestReplayBuffer:
         rbuf.save(filename)
 
         # Initialize rbuf
-        rbuf = replay_buffers.ReplayBuffer(capacity)
+        rbuf = replay_buffers.ReplayBuffer(capacity, columnar=self.columnar)
 
         # Of course it has no transition yet
         assert len(rbuf) == 0
@@ -320,11 +323,13 @@ class TestEpisodicReplayBuffer:
 
 @pytest.mark.parametrize("capacity", [100, None])
 @pytest.mark.parametrize("normalize_by_max", ["batch", "memory"])
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
 class TestPrioritizedReplayBuffer:
     @pytest.fixture(autouse=True)
-    def setUp(self, capacity, normalize_by_max):
+    def setUp(self, capacity, normalize_by_max, tree_backend):
         self.capacity = capacity
         self.normalize_by_max = normalize_by_max
+        self.tree_backend = tree_backend
         self.num_steps = 1
 
     def test_append_and_sample(self):
@@ -335,6 +340,7 @@ class TestPrioritizedReplayBuffer:
             normalize_by_max=self.normalize_by_max,
             error_max=5,
             num_steps=num_steps,
+            tree_backend=self.tree_backend,
         )
 
         assert len(rbuf) == 0
@@ -406,6 +412,7 @@ class TestPrioritizedReplayBuffer:
             normalize_by_max=self.normalize_by_max,
             error_max=1000,
             num_steps=self.num_steps,
+            tree_backend=self.tree_backend,
         )
 
         # Add 100 transitions
@@ -455,7 +462,9 @@ class TestPrioritizedReplayBuffer:
         if capacity is None:
             return
 
-        rbuf = replay_buffers.PrioritizedReplayBuffer(capacity)
+        rbuf = replay_buffers.PrioritizedReplayBuffer(
+            capacity, tree_backend=self.tree_backend
+        )
         # Fill the buffer
         for _ in range(capacity):
             trans1 = dict(
@@ -488,7 +497,9 @@ class TestPrioritizedReplayBuffer:
 
         tempdir = tempfile.mkdtemp()
 
-        rbuf = replay_buffers.PrioritizedReplayBuffer(capacity, num_steps=num_steps)
+        rbuf = replay_buffers.PrioritizedReplayBuffer(
+            capacity, num_steps=num_steps, tree_backend=self.tree_backend
+        )
 
         # Add two transitions
         correct_item = collections.deque([], maxlen=num_steps)
@@ -523,7 +534,9 @@ class TestPrioritizedReplayBuffer:
         rbuf.save(filename)
 
         # Initialize rbuf
-        rbuf = replay_buffers.PrioritizedReplayBuffer(capacity, num_steps=num_steps)
+        rbuf = replay_buffers.PrioritizedReplayBuffer(
+            capacity, num_steps=num_steps, tree_backend=self.tree_backend
+        )
 
         # Of course it has no transition yet
         assert len(rbuf) == 0
@@ -546,6 +559,258 @@ class TestPrioritizedReplayBuffer:
             assert s2[1] == list(correct_item)
 
 
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
+def test_prioritized_replay_buffer_stratified(tree_backend):
+    rbuf = replay_buffers.PrioritizedReplayBuffer(
+        100, tree_backend=tree_backend, stratified=True
+    )
+    for i in range(100):
+        rbuf.append(
+            state=i,
+            action=1,
+            reward=2,
+            next_state=i + 1,
+            next_action=1,
+            is_state_terminal=False,
+        )
+    samples = rbuf.sample(100)
+    # All the transitions have the same priority, so each is sampled once
+    assert sorted(s[0]["state"] for s in samples) == list(range(100))
+    rbuf.update_errors([s[0]["state"] / 100 for s in samples])
+    for _ in range(10):
+        samples = rbuf.sample(32)
+        weights = [s[0]["weight"] for s in samples]
+        # The sample with the smallest priority has the largest weight
+        np.testing.assert_allclose(max(weights), 1.0)
+        assert max(weights) == weights[int(np.argmin([s[0]["state"] for s in samples]))]
+        rbuf.update_errors([s[0]["state"] / 100 for s in samples])
+
+
+@pytest.mark.parametrize("prioritized", [False, True])
+@pytest.mark.parametrize("num_steps", [1, 3])
+def test_replay_buffer_codecs(prioritized, num_steps):
+    codecs = {"state": "zlib", "next_state": "zlib"}
+    if prioritized:
+        rbuf = replay_buffers.PrioritizedReplayBuffer(
+            30, num_steps=num_steps, codecs=codecs
+        )
+    else:
+        rbuf = replay_buffers.ReplayBuffer(30, num_steps=num_steps, codecs=codecs)
+    for i in range(50):
+        rbuf.append(
+            state=np.full((4, 8, 8), i, dtype=np.uint8),
+            action=i,
+            reward=float(i),
+            next_state=np.full((4, 8, 8), i + 1, dtype=np.uint8),
+            is_state_terminal=i % 20 == 19,
+        )
+    # Stored states are compressed
+    memory = rbuf.memory.data if prioritized else rbuf.memory
+    transition = memory[0][0]
+    assert transition["state"].nbytes < 4 * 8 * 8
+    assert transition["next_state"].nbytes < 4 * 8 * 8
+
+    def check(experiences):
+        for experience in experiences:
+            for transition in experience:
+                i = transition["action"]
+                assert transition["state"].dtype == np.uint8
+                assert transition["state"].shape == (4, 8, 8)
+                assert (transition["state"] == i).all()
+                assert (transition["next_state"] == i + 1).all()
+
+    check(rbuf.sample(10))
+    if prioritized:
+        rbuf.update_errors([0.5] * 10)
+        return
+
+    # Compressed transitions are saved and loaded as they are
+    filename = os.path.join(tempfile.mkdtemp(), "rbuf.pkl")
+    rbuf.save(filename)
+    loaded_rbuf = replay_buffers.ReplayBuffer(30, num_steps=num_steps, codecs=codecs)
+    loaded_rbuf.load(filename)
+    assert len(loaded_rbuf) == len(rbuf)
+    assert loaded_rbuf.memory.maxlen == rbuf.memory.maxlen
+    check(loaded_rbuf.sample(len(loaded_rbuf)))
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_replay_buffer_save_incremental(lazy):
+    def append(rbuf, start, stop):
+        for i in range(start, stop):
+            rbuf.append(
+                state=np.full(4, i),
+                action=i,
+                reward=float(i),
+                next_state=np.full(4, i + 1),
+                is_state_terminal=i % 7 == 6,
+            )
+
+    def check_same(rbuf, expected_rbuf):
+        assert len(rbuf) == len(expected_rbuf)
+        for experience, expected in zip(rbuf.memory, expected_rbuf.memory):
+            assert [t["action"] for t in experience] == [t["action"] for t in expected]
+        experience = rbuf.sample(1)[0]
+        np.testing.assert_array_equal(
+            experience[0]["state"], np.full(4, experience[0]["action"])
+        )
+
+    dirname = tempfile.mkdtemp()
+    rbuf = replay_buffers.ReplayBuffer(20)
+    assert rbuf.supports_save_incremental
+    append(rbuf, 0, 15)
+    rbuf.save_incremental(dirname)
+    # Saved at the end of an episode so that no transition is pending
+    append(rbuf, 15, 28)
+    rbuf.save_incremental(dirname)
+
+    loaded_rbuf = replay_buffers.ReplayBuffer(20)
+    loaded_rbuf.load_incremental(dirname, lazy=lazy)
+    check_same(loaded_rbuf, rbuf)
+
+    # Training continues after loading
+    append(rbuf, 28, 40)
+    append(loaded_rbuf, 28, 40)
+    check_same(loaded_rbuf, rbuf)
+    loaded_rbuf.save_incremental(dirname)
+    reloaded_rbuf = replay_buffers.ReplayBuffer(20)
+    reloaded_rbuf.load_incremental(dirname, lazy=lazy)
+    check_same(reloaded_rbuf, rbuf)
+
+
+def test_episodic_replay_buffer_save_incremental():
+    dirname = tempfile.mkdtemp()
+    rbuf = replay_buffers.EpisodicReplayBuffer(30)
+    assert rbuf.supports_save_incremental
+    for i in range(50):
+        rbuf.append(state=i, action=i, reward=i, is_state_terminal=i % 8 == 7)
+        if i % 8 == 7:
+            rbuf.save_incremental(dirname)
+
+    loaded_rbuf = replay_buffers.EpisodicReplayBuffer(30)
+    loaded_rbuf.load_incremental(dirname)
+    assert loaded_rbuf.n_episodes == rbuf.n_episodes
+    assert len(loaded_rbuf) == len(rbuf)
+    assert [t[0]["state"] for t in loaded_rbuf.memory] == [
+        t[0]["state"] for t in rbuf.memory
+    ]
+    # Transitions are shared by memory and episodic_memory as before saving
+    assert loaded_rbuf.memory[0][0] is loaded_rbuf.episodic_memory[0][0]
+
+
+@pytest.mark.parametrize(
+    "make_rbuf",
+    [
+        lambda: replay_buffers.PrioritizedReplayBuffer(10),
+        # Transitions shared by N-step experiences would be duplicated
+        lambda: replay_buffers.ReplayBuffer(10, num_steps=3),
+    ],
+)
+def test_replay_buffer_save_incremental_unsupported(make_rbuf):
+    rbuf = make_rbuf()
+    assert not rbuf.supports_save_incremental
+    with pytest.raises(NotImplementedError):
+        rbuf.save_incremental(tempfile.mkdtemp())
+
+
+@pytest.mark.parametrize("n_envs", [1, 4])
+def test_replay_buffer_save_shares_nstep_transitions(n_envs):
+    rbuf = replay_buffers.ReplayBuffer(num_steps=3)
+    # More experiences than the number of experiences per chunk, where
+    # experiences of different envs are interleaved
+    for i in range(3000):
+        env_id = i % n_envs
+        rbuf.append(
+            state=i,
+            action=0,
+            reward=0,
+            is_state_terminal=i % 7 == 6,
+            env_id=env_id,
+        )
+        if i % 7 == 6:
+            rbuf.stop_current_episode(env_id=env_id)
+    for env_id in range(n_envs):
+        rbuf.stop_current_episode(env_id=env_id)
+    filename = os.path.join(tempfile.mkdtemp(), "rbuf.pkl")
+    rbuf.save(filename)
+    with open(filename, "rb") as f:
+        _, chunks = chunk_stream.load_chunks(f)
+        assert max(len(chunk) for chunk in chunks) <= 1024
+    loaded_rbuf = replay_buffers.ReplayBuffer(num_steps=3)
+    loaded_rbuf.load(filename)
+
+    def n_transitions(rbuf):
+        return len({id(t) for experience in rbuf.memory for t in experience})
+
+    assert len(loaded_rbuf) == len(rbuf)
+    assert [[t["state"] for t in e] for e in loaded_rbuf.memory] == [
+        [t["state"] for t in e] for e in rbuf.memory
+    ]
+    # Transitions are not duplicated across chunks
+    assert n_transitions(loaded_rbuf) == n_transitions(rbuf) == 3000
+
+
+@pytest.mark.parametrize("prioritized", [False, True])
+@pytest.mark.parametrize("prefetch_size", [1, 3])
+def test_replay_updater_prefetch(prioritized, prefetch_size):
+    if prioritized:
+        rbuf = replay_buffers.PrioritizedReplayBuffer(50, alpha=1.0)
+    else:
+        rbuf = replay_buffers.ReplayBuffer(50)
+    updates = []
+
+    def update_func(experiences, exp_batch=None):
+        updates.append((experiences, exp_batch))
+        if prioritized:
+            # Errors are determined by transitions
+            updater.update_errors([e[0]["state"] / 100 for e in experiences])
+
+    updater = replay_buffer.ReplayUpdater(
+        replay_buffer=rbuf,
+        update_func=update_func,
+        batchsize=8,
+        episodic_update=False,
+        n_times_update=2,
+        replay_start_size=10,
+        update_interval=1,
+        prefetch_size=prefetch_size,
+        collate_func=lambda experiences: [e[0]["state"] for e in experiences],
+    )
+    for t in range(100):
+        with updater.lock:
+            rbuf.append(state=t, action=0, reward=0, next_state=t + 1)
+        updated = updater.update_if_necessary(t)
+        assert updated == (t >= 9)
+    updater.stop_prefetch()
+
+    assert len(updates) == 2 * 91
+    for experiences, exp_batch in updates:
+        assert len(experiences) == 8
+        assert exp_batch == [e[0]["state"] for e in experiences]
+    if prioritized:
+        # Errors of every prefetched minibatch are set to its own transitions
+        for i, experience in enumerate(rbuf.memory.data):
+            state = experience[0]["state"]
+            expected = rbuf.priority_from_errors([state / 100])[0]
+            priority = rbuf.memory.priority_sums[i]
+            assert priority in (expected, rbuf.memory.max_priority)
+
+
+def test_replay_updater_prefetch_columnar_unsupported():
+    rbuf = replay_buffers.ReplayBuffer(50, columnar=True)
+    with pytest.raises(AssertionError):
+        replay_buffer.ReplayUpdater(
+            replay_buffer=rbuf,
+            update_func=lambda experiences: None,
+            batchsize=8,
+            episodic_update=False,
+            n_times_update=1,
+            replay_start_size=10,
+            update_interval=1,
+            prefetch_size=1,
+        )
+
+
 def exp_return_of_episode(episode):
     return sum(np.exp(x["reward"]) for x in episode)
 
@@ -557,6 +822,7 @@ def exp_return_of_episode(episode):
 )
 @pytest.mark.parametrize("uniform_ratio", [0, 0.1, 1.0])
 @pytest.mark.parametrize("return_sample_weights", [True, False])
+@pytest.mark.parametrize("tree_backend", ["nested", "flat"])
 class TestPrioritizedEpisodicReplayBuffer:
     @pytest.fixture(autouse=True)
     def setUp(
@@ -566,6 +832,7 @@ class TestPrioritizedEpisodicReplayBuffer:
         default_priority_func,
         uniform_ratio,
         return_sample_weights,
+        tree_backend,
     ):
         self.capacity = 100
         self.normalize_by_max = normalize_by_max
@@ -573,6 +840,7 @@ class TestPrioritizedEpisodicReplayBuffer:
         self.default_priority_func = default_priority_func
         self.uniform_ratio = uniform_ratio
         self.return_sample_weights = return_sample_weights
+        self.tree_backend = tree_backend
 
     def test_append_and_sample(self):
         rbuf = replay_buffers.PrioritizedEpisodicReplayBuffer(
@@ -582,6 +850,7 @@ class TestPrioritizedEpisodicReplayBuffer:
             uniform_ratio=self.uniform_ratio,
             wait_priority_after_sampling=self.wait_priority_after_sampling,
             return_sample_weights=self.return_sample_weights,
+            tree_backend=self.tree_backend,
         )
 
         for n in [10, 15, 5] * 3:
@@ -636,7 +905,8 @@ class TestPrioritizedEpisodicReplayBuffer:
 
 
 @pytest.mark.parametrize(
-    "replay_buffer_type", ["ReplayBuffer", "PrioritizedReplayBuffer"]
+    "replay_buffer_type",
+    ["ReplayBuffer", "ColumnarReplayBuffer", "PrioritizedReplayBuffer"],
 )
 class TestReplayBufferWithEnvID:
     @pytest.fixture(autouse=True)
@@ -647,6 +917,10 @@ class TestReplayBufferWithEnvID:
         n = 5
         if self.replay_buffer_type == "ReplayBuffer":
             rbuf = replay_buffers.ReplayBuffer(capacity=None, num_steps=n)
+        elif self.replay_buffer_type == "ColumnarReplayBuffer":
+            rbuf = replay_buffers.ReplayBuffer(
+                capacity=None, num_steps=n, columnar=True
+            )
         elif self.replay_buffer_type == "PrioritizedReplayBuffer":
             rbuf = replay_buffers.PrioritizedReplayBuffer(capacity=None, num_steps=n)
         else:
@@ -864,3 +1138,246 @@ class TestBatchExperiences(unittest.TestCase):
             list(np.asarray([0.99 ** 3, 0.99 ** 1, 0.99 ** 4], dtype=np.float32)),
         )
         self.assertSequenceEqual(list(batch["next_state"]), list(np.asarray([2, 1, 5])))
+
+    def test_batch_experiences_nstep(self):
+        gamma = 0.9
+        experiences = []
+        for length in [1, 3, 2, 3]:
+            experiences.append(
+                [
+                    dict(
+                        state=np.full(4, length, dtype=np.uint8),
+                        action=np.asarray([0.5 * i], dtype=np.float32),
+                        reward=float(length + i),
+                        next_state=np.full(4, i, dtype=np.uint8),
+                        next_action=None,
+                        is_state_terminal=(length == 2 and i == 1),
+                    )
+                    for i in range(length)
+                ]
+            )
+        batch = replay_buffer.batch_experiences(
+            experiences, torch.device("cpu"), lambda x: x, gamma
+        )
+        assert batch["state"].dtype == torch.uint8
+        assert batch["state"].shape == (4, 4)
+        assert batch["action"].dtype == torch.float32
+        assert batch["action"].shape == (4, 1)
+        assert "next_action" not in batch
+        expected_rewards = [
+            sum(gamma ** i * t["reward"] for i, t in enumerate(exp))
+            for exp in experiences
+        ]
+        np.testing.assert_allclose(batch["reward"].numpy(), expected_rewards, rtol=1e-6)
+        np.testing.assert_array_equal(
+            batch["is_state_terminal"].numpy(), [0.0, 0.0, 1.0, 0.0]
+        )
+        np.testing.assert_allclose(
+            batch["discount"].numpy(), [gamma, gamma ** 3, gamma ** 2, gamma ** 3]
+        )
+        np.testing.assert_array_equal(
+            batch["next_state"].numpy(), [[0] * 4, [2] * 4, [1] * 4, [2] * 4]
+        )
+
+    def test_batch_experiences_array_rewards(self):
+        gamma = 0.9
+        list_rbuf = replay_buffers.ReplayBuffer(capacity=20, num_steps=3)
+        columnar_rbuf = replay_buffers.ReplayBuffer(
+            capacity=20, num_steps=3, columnar=True
+        )
+        for rbuf in [list_rbuf, columnar_rbuf]:
+            for i in range(5):
+                rbuf.append(
+                    state=np.full(2, i, dtype=np.float32),
+                    action=i,
+                    # Rewards of two objectives
+                    reward=np.asarray([i, -i], dtype=np.float32),
+                    next_state=np.full(2, i + 1, dtype=np.float32),
+                    is_state_terminal=i == 4,
+                )
+            rbuf.stop_current_episode()
+        experiences = list(list_rbuf.memory)
+        expected_rewards = [
+            sum(gamma ** i * t["reward"] for i, t in enumerate(exp))
+            for exp in experiences
+        ]
+        for rbuf in [list_rbuf, columnar_rbuf]:
+            batch = replay_buffer.batch_experiences(
+                rbuf.sample(len(rbuf)) if rbuf is columnar_rbuf else experiences,
+                torch.device("cpu"),
+                lambda x: x,
+                gamma,
+            )
+            if rbuf is columnar_rbuf:
+                # Sampled in a random order
+                order = np.argsort(batch["state"][:, 0].numpy())
+            else:
+                order = np.arange(len(experiences))
+            assert batch["reward"].shape == (len(experiences), 2)
+            np.testing.assert_allclose(
+                batch["reward"].numpy()[order], expected_rewards, rtol=1e-6
+            )
+
+    @pytest.mark.gpu
+    def test_batch_experiences_pinned_shapes(self):
+        def make_experiences(n, size):
+            return [
+                [
+                    dict(
+                        state=np.full(size, i, dtype=np.float32),
+                        action=i,
+                        reward=1.0,
+                        next_state=np.full(size, i + 1, dtype=np.float32),
+                        is_state_terminal=False,
+                    )
+                ]
+                for i in range(n)
+            ]
+
+        # Batches of different shapes, e.g. of the two levels of HIRO, keep
+        # their own pinned buffers
+        device = torch.device("cuda")
+        n_buffers = None
+        for _ in range(3):
+            for n, size in [(5, 3), (2, 4)]:
+                batch = replay_buffer.batch_experiences(
+                    make_experiences(n, size), device, lambda x: x, 0.99
+                )
+                np.testing.assert_array_equal(
+                    batch["state"].cpu().numpy(), np.arange(n)[:, None] * [1] * size
+                )
+            if n_buffers is None:
+                n_buffers = len(replay_buffer._pinned_buffers.buffers)
+            assert len(replay_buffer._pinned_buffers.buffers) == n_buffers
+
+    @pytest.mark.gpu
+    def test_batch_experiences_pinned(self):
+        experiences = [
+            [
+                dict(
+                    state=np.full(3, i, dtype=np.float32),
+                    action=i,
+                    reward=1.0,
+                    next_state=np.full(3, i + 1, dtype=np.float32),
+                    next_action=None,
+                    is_state_terminal=False,
+                )
+            ]
+            for i in range(5)
+        ]
+        device = torch.device("cuda")
+        for _ in range(2):
+            batch = replay_buffer.batch_experiences(
+                experiences, device, lambda x: x, 0.99
+            )
+            assert batch["state"].device.type == "cuda"
+            np.testing.assert_array_equal(
+                batch["next_state"].cpu().numpy(), np.arange(1, 6)[:, None] * [1, 1, 1]
+            )
+
+    def test_batch_columnar_experiences(self):
+        num_steps = 3
+        list_rbuf = replay_buffers.ReplayBuffer(capacity=20, num_steps=num_steps)
+        columnar_rbuf = replay_buffers.ReplayBuffer(
+            capacity=20, num_steps=num_steps, columnar=True
+        )
+        for env_id in range(2):
+            for i in range(15):
+                trans = dict(
+                    state=np.full(2, i, dtype=np.float32),
+                    action=i % 3,
+                    reward=float(i),
+                    next_state=np.full(2, i + 1, dtype=np.float32),
+                    next_action=(i + 1) % 3,
+                    is_state_terminal=(i == 9),
+                    env_id=env_id,
+                )
+                list_rbuf.append(**trans)
+                columnar_rbuf.append(**trans)
+            list_rbuf.stop_current_episode(env_id=env_id)
+            columnar_rbuf.stop_current_episode(env_id=env_id)
+        assert len(columnar_rbuf) == len(list_rbuf)
+        for expected, actual in zip(list_rbuf.memory, columnar_rbuf.memory):
+            assert len(expected) == len(actual)
+            for t_expected, t_actual in zip(expected, actual):
+                assert t_expected.keys() == t_actual.keys()
+                for key in t_expected:
+                    np.testing.assert_array_equal(t_expected[key], t_actual[key])
+
+        sample = columnar_rbuf.sample(len(columnar_rbuf))
+        batch = replay_buffer.batch_experiences(
+            sample, torch.device("cpu"), lambda x: x, 0.99
+        )
+        expected_batch = replay_buffer.batch_experiences(
+            list(sample), torch.device("cpu"), lambda x: x, 0.99
+        )
+        assert batch.keys() == expected_batch.keys()
+        for key in batch:
+            assert batch[key].dtype == expected_batch[key].dtype
+            torch.testing.assert_close(batch[key], expected_batch[key])
+
+    def test_batch_columnar_hrl_experiences(self):
+        window = 4
+        list_rbufs = (
+            replay_buffers.LowerControllerReplayBuffer(capacity=20),
+            replay_buffers.HigherControllerReplayBuffer(capacity=20),
+        )
+        columnar_rbufs = (
+            replay_buffers.LowerControllerReplayBuffer(capacity=20, columnar=True),
+            replay_buffers.HigherControllerReplayBuffer(capacity=20, columnar=True),
+        )
+        for i in range(25):
+            # HRL agents append transitions of tensors
+            low_trans = dict(
+                state=torch.full((3,), float(i)),
+                goal=torch.full((2,), float(-i)),
+                action=np.full(2, i, dtype=np.float32),
+                reward=float(i),
+                next_state=torch.full((3,), float(i + 1)),
+                next_goal=torch.full((2,), float(-i - 1)),
+                next_action=None,
+                is_state_terminal=(i % 10 == 9),
+            )
+            high_trans = dict(
+                state=torch.full((3,), float(i)),
+                goal=torch.full((2,), float(-i)),
+                action=np.full(2, i, dtype=np.float32),
+                reward=np.float64(i),
+                next_state=torch.full((3,), float(i + 1)),
+                next_action=None,
+                is_state_terminal=(i % 10 == 9),
+                state_arr=torch.arange(window * 3, dtype=torch.float32).reshape(
+                    window, 3
+                )
+                + i,
+                action_arr=torch.full((window, 2), float(i)),
+            )
+            for rbufs in (list_rbufs, columnar_rbufs):
+                rbufs[0].append(**low_trans)
+                rbufs[1].append(**high_trans)
+
+        device = torch.device("cpu")
+        for batch_func, list_rbuf, columnar_rbuf in zip(
+            (
+                replay_buffer.batch_experiences_with_goal,
+                replay_buffer.high_level_batch_experiences_with_goal,
+            ),
+            list_rbufs,
+            columnar_rbufs,
+        ):
+            assert len(columnar_rbuf) == len(list_rbuf) == 20
+            for expected, actual in zip(list_rbuf.memory, columnar_rbuf.memory):
+                ((t_expected,), (t_actual,)) = expected, actual
+                assert t_expected.keys() == t_actual.keys()
+                for key in t_expected:
+                    np.testing.assert_array_equal(t_expected[key], t_actual[key])
+            sample = columnar_rbuf.sample(len(columnar_rbuf))
+            for phi in (lambda x: x, lambda x: x + 1):
+                batch = batch_func(sample, device, phi, 0.99)
+                expected_batch = batch_func(list(sample), device, phi, 0.99)
+                assert batch.keys() == expected_batch.keys()
+                for key in batch:
+                    assert batch[key].dtype == expected_batch[key].dtype
+                    torch.testing.assert_close(batch[key], expected_batch[key])
+        assert batch["state_arr"].shape == (20, window, 3)
+        assert batch["action_arr"].shape == (20, window, 2)
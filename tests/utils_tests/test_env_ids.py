@@ -0,0 +1,23 @@
+import pytest
+
+from pfrl.utils.env_ids import batch_env_ids
+from pfrl.utils.env_ids import update_at_env_ids
+
+
+def test_batch_env_ids():
+    assert list(batch_env_ids(None, 3)) == [0, 1, 2]
+    assert batch_env_ids([2, 0], 2) == [2, 0]
+    with pytest.raises(AssertionError):
+        batch_env_ids([2, 0], 3)
+
+
+def test_update_at_env_ids():
+    # All the envs
+    assert update_at_env_ids(["a", "b"], None, ("c", "d")) == ["c", "d"]
+    # Extended with None
+    values = update_at_env_ids(None, [2], ["c"])
+    assert values == [None, None, "c"]
+    new_values = update_at_env_ids(values, [0, 1], ["a", "b"])
+    assert new_values == ["a", "b", "c"]
+    # Not modified in place
+    assert values == [None, None, "c"]
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from pfrl.utils import RunningVariance
+
+
+@pytest.mark.parametrize("batch_sizes", [[1], [1, 1, 1], [5, 0, 3, 12]])
+def test_running_variance(batch_sizes):
+    values = np.random.normal(loc=3.0, scale=2.0, size=sum(batch_sizes))
+    running_variance = RunningVariance()
+    assert np.isnan(running_variance.variance)
+    for batch in np.split(values, np.cumsum(batch_sizes)[:-1]):
+        running_variance.update(batch)
+    assert running_variance.count == len(values)
+    np.testing.assert_allclose(running_variance.mean, np.mean(values))
+    np.testing.assert_allclose(running_variance.variance, np.var(values), atol=1e-12)
+
+    running_variance.reset()
+    assert running_variance.count == 0
+    assert np.isnan(running_variance.variance)
@@ -119,3 +119,172 @@ def test_vector_frame_stack(num_envs, k):
             )
         np.testing.assert_allclose(fs_r, vfs_r)
         np.testing.assert_allclose(fs_done, vfs_done)
+
+
+def _make_frame_env(idx, steps, done_prob=0.5):
+    # Env that returns atari-like uint8 frames
+    np_random = np.random.RandomState(idx)
+    env = mock.Mock()
+    env.reset.side_effect = [
+        np_random.randint(256, size=(1, 84, 84)).astype(np.uint8)
+        for _ in range(steps + 1)
+    ]
+    env.step.side_effect = [
+        (
+            np_random.randint(256, size=(1, 84, 84)).astype(np.uint8),
+            np_random.rand(),
+            bool(np_random.rand() < done_prob),
+            {},
+        )
+        for _ in range(steps)
+    ]
+    env.action_space = gym.spaces.Discrete(2)
+    env.observation_space = gym.spaces.Box(
+        low=0, high=255, shape=(1, 84, 84), dtype=np.uint8
+    )
+    return env
+
+
+@pytest.mark.parametrize("num_envs", [1, 3])
+@pytest.mark.parametrize("k", [2, 4])
+@pytest.mark.parametrize("shared_memory", [False, True])
+def test_vector_frame_stack_batch_array(num_envs, k, shared_memory):
+
+    steps = 10
+
+    def make_vec_env():
+        return pfrl.envs.MultiprocessVectorEnv(
+            [functools.partial(_make_frame_env, idx, steps) for idx in range(num_envs)],
+            shared_memory=shared_memory,
+        )
+
+    vfs_env = VectorFrameStack(make_vec_env(), k=k)
+    array_env = VectorFrameStack(make_vec_env(), k=k, batch_array=True)
+    assert vfs_env.observation_space == array_env.observation_space
+
+    vfs_obs = vfs_env.reset()
+    array_obs = array_env.reset()
+    batch_action = [0] * num_envs
+    for _ in range(steps):
+        assert isinstance(array_obs, np.ndarray)
+        assert array_obs.shape == (num_envs, k, 84, 84)
+        assert array_obs.dtype == np.uint8
+        np.testing.assert_array_equal(
+            array_obs, np.stack([np.asarray(ob) for ob in vfs_obs])
+        )
+        prev_array_obs = array_obs.copy()
+        vfs_obs, vfs_r, vfs_done, _ = vfs_env.step(batch_action)
+        array_obs, array_r, array_done, _ = array_env.step(batch_action)
+        # Returned arrays are not overwritten by later steps
+        np.testing.assert_array_equal(array_obs[:, :-1], prev_array_obs[:, 1:])
+        np.testing.assert_allclose(vfs_r, array_r)
+        np.testing.assert_allclose(vfs_done, array_done)
+        vfs_obs = vfs_env.reset(mask=np.logical_not(vfs_done))
+        array_obs = array_env.reset(mask=np.logical_not(array_done))
+    vfs_env.close()
+    array_env.close()
+
+
+@pytest.mark.parametrize("batch_array", [False, True])
+def test_vector_frame_stack_auto_reset(batch_array):
+
+    steps = 10
+    num_envs = 2
+    k = 3
+
+    vec_env = pfrl.envs.SerialVectorEnv(
+        [_make_frame_env(idx, steps) for idx in range(num_envs)], auto_reset=True
+    )
+    env = VectorFrameStack(vec_env, k=k, batch_array=batch_array)
+    obs = env.reset()
+    frames = [[np.asarray(ob)[-1:]] * k for ob in obs]
+    batch_action = [0] * num_envs
+    for _ in range(steps):
+        obs, _, dones, infos = env.step(batch_action)
+        for i in range(num_envs):
+            if dones[i]:
+                # The last frame of the episode is stacked on the previous ones
+                assert "terminal_observation" in infos[i]
+                frames[i] = frames[i][1:] + [
+                    np.asarray(infos[i]["terminal_observation"])[-1:]
+                ]
+                np.testing.assert_array_equal(
+                    np.asarray(infos[i]["terminal_observation"]),
+                    np.concatenate(frames[i]),
+                )
+                # The next episode starts with the first frame repeated
+                frames[i] = [np.asarray(obs[i])[-1:]] * k
+            else:
+                frames[i] = frames[i][1:] + [np.asarray(obs[i])[-1:]]
+            np.testing.assert_array_equal(np.asarray(obs[i]), np.concatenate(frames[i]))
+
+
+@pytest.mark.parametrize("batch_array", [False, True])
+def test_vector_frame_stack_step_async(batch_array):
+
+    steps = 6
+    num_envs = 3
+    k = 2
+
+    def make_vec_env():
+        return pfrl.envs.SerialVectorEnv(
+            [_make_frame_env(idx, steps, done_prob=0) for idx in range(num_envs)]
+        )
+
+    sync_env = VectorFrameStack(make_vec_env(), k=k, batch_array=batch_array)
+    async_env = VectorFrameStack(make_vec_env(), k=k, batch_array=batch_array)
+    sync_env.reset()
+    async_env.reset()
+    batch_action = [0] * num_envs
+    for _ in range(steps):
+        sync_obs, _, _, _ = sync_env.step(batch_action)
+        # Step envs in two batches
+        async_env.step_async(batch_action[:1], env_ids=[2])
+        async_env.step_async(batch_action[1:], env_ids=[0, 1])
+        env_ids, obs, _, _, _ = async_env.step_wait(batch_size=1)
+        assert list(env_ids) == [2]
+        np.testing.assert_array_equal(np.asarray(obs[0]), np.asarray(sync_obs[2]))
+        env_ids, obs, _, _, _ = async_env.step_wait()
+        assert list(env_ids) == [0, 1]
+        for i, ob in zip(env_ids, obs):
+            np.testing.assert_array_equal(np.asarray(ob), np.asarray(sync_obs[i]))
+
+
+def test_frame_stack_in_workers():
+    # Frames can be stacked inside subprocesses with the results written to
+    # shared memory as a single array
+
+    steps = 5
+    num_envs = 2
+    k = 4
+
+    worker_env = pfrl.envs.MultiprocessVectorEnv(
+        [
+            lambda idx=idx: FrameStack(
+                _make_frame_env(idx, steps), k=k, channel_order="chw"
+            )
+            for idx in range(num_envs)
+        ],
+        shared_memory=True,
+    )
+    vfs_env = VectorFrameStack(
+        pfrl.envs.MultiprocessVectorEnv(
+            [functools.partial(_make_frame_env, idx, steps) for idx in range(num_envs)]
+        ),
+        k=k,
+    )
+    assert worker_env.observation_space == vfs_env.observation_space
+    obs = worker_env.reset()
+    vfs_obs = vfs_env.reset()
+    batch_action = [0] * num_envs
+    for _ in range(steps):
+        assert isinstance(obs, np.ndarray)
+        assert obs.shape == (num_envs, k, 84, 84)
+        np.testing.assert_array_equal(obs, np.stack([np.asarray(ob) for ob in vfs_obs]))
+        obs, _, dones, _ = worker_env.step(batch_action)
+        vfs_obs, _, vfs_dones, _ = vfs_env.step(batch_action)
+        np.testing.assert_array_equal(dones, vfs_dones)
+        obs = worker_env.reset(mask=np.logical_not(dones))
+        vfs_obs = vfs_env.reset(mask=np.logical_not(vfs_dones))
+    worker_env.close()
+    vfs_env.close()
@@ -0,0 +1,111 @@
+"""Compare replay buffer codecs in terms of size on disk and save/load time.
+
+Transitions with Atari-like observations, i.e. 4 stacked 84x84 uint8 frames,
+and a low-dimensional float32 vector are appended to a
+`pfrl.replay_buffers.ReplayBuffer` for each codec configuration, which is then
+saved and loaded.
+
+Example:
+    python tools/benchmark_replay_codecs.py --size 10000 --codecs none zlib lz4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from pfrl import replay_buffers
+
+
+def make_transitions(size, seed):
+    random_state = np.random.RandomState(seed)
+    # Frames of Atari games have large uniform regions, which makes them
+    # compressible, unlike uniform noise.
+    frames = np.zeros((size + 4, 1, 84, 84), dtype=np.uint8)
+    for frame in frames:
+        y, x = random_state.randint(0, 84 - 16, size=2)
+        frame[0, y : y + 16, x : x + 16] = random_state.randint(0, 256)
+    for i in range(size):
+        yield dict(
+            state=np.concatenate(frames[i : i + 4]),
+            action=random_state.randint(18),
+            reward=float(random_state.rand()),
+            next_state=np.concatenate(frames[i + 1 : i + 5]),
+            is_state_terminal=False,
+            features=random_state.rand(16).astype(np.float32),
+        )
+
+
+def benchmark(codec, size, seed, dirname):
+    if codec == "none":
+        codecs = None
+    else:
+        codecs = {"state": codec, "next_state": codec}
+    rbuf = replay_buffers.ReplayBuffer(capacity=size, codecs=codecs)
+    start = time.perf_counter()
+    for transition in make_transitions(size, seed):
+        rbuf.append(**transition)
+    append_time = time.perf_counter() - start
+
+    filename = os.path.join(dirname, "{}.rbuf".format(codec))
+    start = time.perf_counter()
+    rbuf.save(filename)
+    save_time = time.perf_counter() - start
+
+    loaded_rbuf = replay_buffers.ReplayBuffer(capacity=size, codecs=codecs)
+    start = time.perf_counter()
+    loaded_rbuf.load(filename)
+    load_time = time.perf_counter() - start
+    assert len(loaded_rbuf) == len(rbuf)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        loaded_rbuf.sample(32)
+    sample_time = (time.perf_counter() - start) / 100
+
+    return dict(
+        codec=codec,
+        bytes=os.path.getsize(filename),
+        append=append_time,
+        save=save_time,
+        load=load_time,
+        sample32=sample_time,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--codecs",
+        type=str,
+        nargs="+",
+        default=["none", "zlib", "lz4"],
+        help="Codecs applied to state and next_state. 'none' disables them.",
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:>6} {:>14} {:>10} {:>10} {:>10} {:>12}".format(
+            "codec", "bytes", "append[s]", "save[s]", "load[s]", "sample32[ms]"
+        )
+    )
+    with tempfile.TemporaryDirectory() as dirname:
+        for codec in args.codecs:
+            try:
+                result = benchmark(codec, args.size, args.seed, dirname)
+            except RuntimeError as e:
+                print("{:>6} skipped: {}".format(codec, e))
+                continue
+            print(
+                "{codec:>6} {bytes:>14,d} {append:>10.3f} {save:>10.3f}"
+                " {load:>10.3f} {sample:>12.3f}".format(
+                    sample=result["sample32"] * 1000, **result
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()